@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+#
+# hdr: A Python API and CLI for creating HDR images.
+#
+# Copyright (C) 2017 Sean Marlow
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Benchmark response curve accuracy against calibration time.
+
+Synthetic brackets are rendered through a known gamma response so the
+recovered curves can be compared with the true curve. The error is the
+RMS difference of the log response over the well exposed values.
+
+    python benchmarks/calibration.py --size 4000x3000
+"""
+
+import time
+
+import click
+import cv2
+import numpy
+
+from hdr import calibration
+from synthetic import GAMMA, make_bracket
+
+
+def get_error(response):
+    """
+    Return the RMS log error of a response against the true curve.
+
+    Values the calibrator could not recover (NaN) are ignored.
+    """
+    values = numpy.arange(calibration.LDR_SIZE)
+    mask = (values > 10) & (values < 245)
+
+    truth = GAMMA * numpy.log(numpy.maximum(values, 1) / 255.0)
+    truth = truth - truth[calibration.LDR_SIZE // 2]
+
+    curve = numpy.log(numpy.maximum(response[:, 0, :], 1e-12))
+    curve = curve - curve[calibration.LDR_SIZE // 2]
+
+    return float(numpy.sqrt(
+        numpy.nanmean((curve[mask] - truth[mask, numpy.newaxis]) ** 2)
+    ))
+
+
+def run(name, calibrate, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        response = calibrate()
+        timings.append(time.perf_counter() - start)
+
+    click.echo('{0:<28}{1:>10.1f}{2:>12.4f}'.format(
+        name, min(timings) * 1000, get_error(response)
+    ))
+
+
+@click.command()
+@click.option(
+    '--size',
+    default='2000x1500',
+    help='Frame size as WIDTHxHEIGHT.'
+)
+@click.option(
+    '--samples',
+    default='64,256,1024,4096',
+    help='Comma separated sample budgets.'
+)
+@click.option(
+    '--downscale',
+    default='1,4',
+    help='Comma separated downscale factors.'
+)
+@click.option(
+    '--repeat',
+    default=3,
+    type=click.IntRange(min=1),
+    help='Runs per configuration, the fastest is reported.'
+)
+def main(size, samples, downscale, repeat):
+    width, height = (int(value) for value in size.lower().split('x'))
+    images, exposures = make_bracket(width, height)
+
+    click.echo('{0:<28}{1:>10}{2:>12}'.format('method', 'ms', 'rms error'))
+
+    run(
+        'opencv debevec',
+        lambda: cv2.createCalibrateDebevec().process(images, exposures),
+        repeat
+    )
+    run(
+        'opencv robertson',
+        lambda: cv2.createCalibrateRobertson().process(images, exposures),
+        1
+    )
+
+    for count in (int(value) for value in samples.split(',')):
+        for factor in (int(value) for value in downscale.split(',')):
+            run(
+                'sampled n={0} scale=1/{1}'.format(count, factor),
+                lambda: calibration.calibrate_sampled(
+                    images, exposures, count, factor
+                ),
+                repeat
+            )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+#
+# hdr: A Python API and CLI for creating HDR images.
+#
+# Copyright (C) 2017 Sean Marlow
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Benchmark the fast approximate Mertens fusion.
+
+A synthetic bracket, or the given images, is fused with
+cv2.MergeMertens and with FastMergeMertens at each weight scale. The
+time, speedup, PSNR and SSIM against cv2.MergeMertens are reported.
+Both results are clipped to [0, 1] before they are compared. Exits with
+status 1 if the PSNR at any scale falls below --min-psnr.
+
+    python benchmarks/fast_mertens.py --size 4000x3000 --scales 2,4,8
+    python benchmarks/fast_mertens.py img1.jpg img2.jpg img3.jpg
+"""
+
+import statistics
+import sys
+import time
+
+import click
+import cv2
+import numpy
+
+from hdr.api import read_images
+from hdr.fusion import FastMergeMertens
+from synthetic import make_bracket
+
+SSIM_C1 = 0.01 ** 2
+SSIM_C2 = 0.03 ** 2
+
+
+def get_psnr(result, reference):
+    error = float(numpy.mean((result - reference) ** 2))
+    if not error:
+        return float('inf')
+    return 10 * numpy.log10(1 / error)
+
+
+def get_ssim(result, reference):
+    """
+    Return the mean SSIM of the luminance, with the usual 11x11
+    Gaussian window.
+    """
+    def blur(image):
+        return cv2.GaussianBlur(image, (11, 11), 1.5)
+
+    x = cv2.cvtColor(result, cv2.COLOR_BGR2GRAY)
+    y = cv2.cvtColor(reference, cv2.COLOR_BGR2GRAY)
+    mu_x = blur(x)
+    mu_y = blur(y)
+    var_x = blur(x * x) - mu_x * mu_x
+    var_y = blur(y * y) - mu_y * mu_y
+    cov = blur(x * y) - mu_x * mu_y
+
+    ssim = (
+        (2 * mu_x * mu_y + SSIM_C1) * (2 * cov + SSIM_C2) /
+        ((mu_x * mu_x + mu_y * mu_y + SSIM_C1) * (var_x + var_y + SSIM_C2))
+    )
+    return float(ssim.mean())
+
+
+def time_run(func, repeat):
+    timings = []
+    result = None
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+
+    return result, statistics.median(timings)
+
+
+@click.command()
+@click.argument('images', nargs=-1, type=click.Path(exists=True))
+@click.option(
+    '--size',
+    default='2000x1500',
+    help='Synthetic bracket size as WIDTHxHEIGHT.'
+)
+@click.option(
+    '--frames',
+    default=3,
+    type=click.IntRange(min=2),
+    help='Frames in the synthetic bracket.'
+)
+@click.option(
+    '--scales',
+    default='2,4,8',
+    help='Comma separated weight scales to benchmark.'
+)
+@click.option(
+    '--repeat',
+    default=3,
+    type=click.IntRange(min=1),
+    help='Runs per measurement, the median is reported.'
+)
+@click.option(
+    '--threads',
+    type=click.IntRange(min=0),
+    help='Number of OpenCV threads.'
+)
+@click.option(
+    '--min-psnr',
+    default=30.0,
+    type=float,
+    help='Fail if the PSNR in dB at any scale is below this.'
+)
+def main(images, size, frames, scales, repeat, threads, min_psnr):
+    if threads is not None:
+        cv2.setNumThreads(threads)
+
+    if images:
+        bracket = read_images(images)
+    else:
+        width, height = (int(part) for part in size.lower().split('x'))
+        bracket = make_bracket(width, height, frames)[0]
+
+    reference, exact = time_run(
+        lambda: cv2.createMergeMertens().process(bracket), repeat
+    )
+    reference = numpy.clip(reference, 0, 1)
+    failed = False
+
+    click.echo('{0:<8}{1:>10}{2:>9}{3:>9}{4:>8}'.format(
+        'scale', 'ms', 'speedup', 'psnr', 'ssim'
+    ))
+    click.echo('{0:<8}{1:>10.1f}'.format('exact', exact * 1000))
+
+    for scale in (int(item) for item in scales.split(',')):
+        merger = FastMergeMertens(scale=scale)
+        result, elapsed = time_run(lambda: merger.process(bracket), repeat)
+        result = numpy.clip(result, 0, 1)
+
+        psnr = get_psnr(result, reference)
+        flag = ''
+        if psnr < min_psnr:
+            flag = 'LOW'
+            failed = True
+
+        click.echo(
+            '{0:<8}{1:>10.1f}{2:>9.2f}{3:>9.2f}{4:>8.4f}  {5}'.format(
+                scale, elapsed * 1000, exact / elapsed, psnr,
+                get_ssim(result, reference), flag
+            ).rstrip()
+        )
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
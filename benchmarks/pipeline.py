@@ -0,0 +1,303 @@
+# -*- coding: utf-8 -*-
+#
+# hdr: A Python API and CLI for creating HDR images.
+#
+# Copyright (C) 2017 Sean Marlow
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Time each stage of the HDR pipeline on synthetic brackets.
+
+Brackets are rendered from a known radiance map at every combination of
+size and frame count, written as JPEG files with EXIF exposure times
+and run through decode, EXIF, alignment, calibration, merge, every
+available tonemap and the final write. Results are JSON so runs from
+different builds or commits can be compared.
+
+    python benchmarks/pipeline.py run -o before.json
+    python benchmarks/pipeline.py run -o after.json
+    python benchmarks/pipeline.py compare before.json after.json
+"""
+
+import datetime
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+import click
+import cv2
+import numpy
+
+from hdr import api, calibration, exif, output
+from synthetic import make_radiance, render_bracket, write_bracket
+
+
+def time_stage(func, repeat, setup=None):
+    """
+    Run func repeat times, calling setup before each untimed.
+
+    :return: Returns a tuple of the last result and the timings in
+        seconds.
+    """
+    timings = []
+    result = None
+
+    for _ in range(repeat):
+        args = setup() if setup else ()
+        start = time.perf_counter()
+        result = func(*args)
+        timings.append(time.perf_counter() - start)
+
+    return result, timings
+
+
+def get_tonemaps():
+    """
+    Return the tonemap operators available in this OpenCV build.
+    """
+    return [
+        name for name, (factory, _) in sorted(api.TONEMAPS.items())
+        if hasattr(cv2, factory)
+    ]
+
+
+def bench_bracket(names, repeat, scratch_dir):
+    """
+    Time every pipeline stage for one bracket set.
+
+    :return: Returns a list of (stage, timings) tuples.
+    """
+    stages = []
+
+    def record(stage, func, setup=None):
+        result, timings = time_stage(func, repeat, setup)
+        stages.append((stage, timings))
+        return result
+
+    images = record('read_images', lambda: api.read_images(names))
+    exposures = record(
+        'get_exposures',
+        lambda: api.get_exposures(None, names),
+        lambda: exif.clear_cache() or ()
+    )
+    record(
+        'align_images',
+        api.align_images,
+        lambda: ([image.copy() for image in images],)
+    )
+    response = record(
+        'calibrate',
+        lambda: calibration.calibrate_response(images, exposures, 'debevec')
+    )
+    hdr_img = record(
+        'merge',
+        lambda: api.process_debevec(images, exposures, response)
+    )
+    record('mertens', lambda: api.process_mertens(images, 1.0, 1.0, 0.0))
+
+    ldr = None
+    for name in get_tonemaps():
+        tonemap = api.create_tonemap(name)
+        ldr = record(
+            'tonemap_' + name, lambda: tonemap.process(hdr_img)
+        )
+
+    out_name = os.path.join(scratch_dir, 'out.jpg')
+    record('write', lambda: output.write_ldr(ldr, out_name))
+
+    return stages
+
+
+def get_meta():
+    """
+    Return details of the environment the benchmark ran in.
+    """
+    return {
+        'date': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'opencv': cv2.__version__,
+        'opencv_threads': cv2.getNumThreads(),
+        'numpy': numpy.__version__
+    }
+
+
+def parse_list(value, parse=int):
+    return [parse(item) for item in value.split(',') if item.strip()]
+
+
+def parse_size(value):
+    width, height = (int(part) for part in value.lower().split('x'))
+    return width, height
+
+
+@click.group()
+def main():
+    """
+    HDR pipeline benchmarks.
+    """
+    pass
+
+
+@main.command()
+@click.option(
+    '--sizes',
+    default='640x480,2000x1500',
+    help='Comma separated frame sizes as WIDTHxHEIGHT.'
+)
+@click.option(
+    '--frames',
+    default='3,5',
+    help='Comma separated bracket frame counts.'
+)
+@click.option(
+    '--repeat',
+    default=3,
+    type=click.IntRange(min=1),
+    help='Runs per stage, the fastest and the median are reported.'
+)
+@click.option(
+    '--threads',
+    type=click.IntRange(min=0),
+    help='Number of OpenCV threads.'
+)
+@click.option(
+    '-o',
+    '--output',
+    'output_file',
+    type=click.Path(dir_okay=False),
+    help='File to write the JSON results to.'
+)
+def run(sizes, frames, repeat, threads, output_file):
+    """
+    Time each pipeline stage.
+    """
+    if threads is not None:
+        cv2.setNumThreads(threads)
+
+    results = []
+    click.echo('{0:<12}{1:>7}  {2:<20}{3:>10}{4:>10}'.format(
+        'size', 'frames', 'stage', 'min ms', 'median ms'
+    ))
+
+    for size in parse_list(sizes, parse_size):
+        radiance = make_radiance(*size)
+
+        for count in parse_list(frames):
+            images, exposures = render_bracket(radiance, count)
+
+            with tempfile.TemporaryDirectory() as scratch_dir:
+                names = write_bracket(images, exposures, scratch_dir)
+                stages = bench_bracket(names, repeat, scratch_dir)
+
+            for stage, timings in stages:
+                result = {
+                    'size': '{0}x{1}'.format(*size),
+                    'frames': count,
+                    'stage': stage,
+                    'min': min(timings),
+                    'median': statistics.median(timings),
+                    'runs': timings
+                }
+                results.append(result)
+
+                click.echo('{0:<12}{1:>7}  {2:<20}{3:>10.1f}{4:>10.1f}'.format(
+                    result['size'], count, stage,
+                    result['min'] * 1000, result['median'] * 1000
+                ))
+
+    if output_file:
+        with open(output_file, 'w') as results_file:
+            json.dump(
+                {'meta': get_meta(), 'results': results},
+                results_file,
+                indent=2
+            )
+
+
+def load_results(path):
+    with open(path) as results_file:
+        data = json.load(results_file)
+
+    return {
+        (result['size'], result['frames'], result['stage']): result
+        for result in data['results']
+    }
+
+
+@main.command()
+@click.option(
+    '--threshold',
+    default=0.1,
+    type=click.FloatRange(min=0),
+    help='Relative slowdown flagged as a regression, 0.1 is 10%.'
+)
+@click.option(
+    '--min-delta',
+    default=2.0,
+    type=click.FloatRange(min=0),
+    help='Ignore differences smaller than this many milliseconds.'
+)
+@click.argument('baseline', type=click.Path(exists=True, dir_okay=False))
+@click.argument('candidate', type=click.Path(exists=True, dir_okay=False))
+def compare(threshold, min_delta, baseline, candidate):
+    """
+    Compare two result files and flag regressions.
+
+    The fastest run of each stage is compared. Exits with status 1 if
+    any stage regressed.
+    """
+    base = load_results(baseline)
+    new = load_results(candidate)
+    regressions = 0
+
+    click.echo('{0:<12}{1:>7}  {2:<20}{3:>10}{4:>10}{5:>9}'.format(
+        'size', 'frames', 'stage', 'base ms', 'new ms', 'change'
+    ))
+
+    for key in sorted(set(base) & set(new)):
+        before = base[key]['min'] * 1000
+        after = new[key]['min'] * 1000
+        change = after / before - 1 if before else 0.0
+
+        flag = ''
+        if abs(after - before) >= min_delta:
+            if change > threshold:
+                flag = 'REGRESSION'
+                regressions += 1
+            elif change < -threshold:
+                flag = 'faster'
+
+        click.echo((
+            '{0:<12}{1:>7}  {2:<20}{3:>10.1f}{4:>10.1f}{5:>+8.0%}  '
+            '{6}'.format(key[0], key[1], key[2], before, after, change, flag)
+        ).rstrip())
+
+    for key in sorted(set(base) ^ set(new)):
+        click.echo('{0:<12}{1:>7}  {2:<20}only in {3}'.format(
+            key[0], key[1], key[2], baseline if key in base else candidate
+        ))
+
+    click.echo('{0} regressions.'.format(regressions))
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
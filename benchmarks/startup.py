@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+#
+# hdr: A Python API and CLI for creating HDR images.
+#
+# Copyright (C) 2017 Sean Marlow
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Benchmark CLI startup time.
+
+Commands that never touch an image, such as --help, --version and
+usage errors, must not import OpenCV, NumPy or Pillow. Each command
+runs in a fresh interpreter and the time above a bare interpreter
+start is reported. Exits with status 1 if a heavy module is imported
+at startup or a command exceeds --max-ms.
+
+    python benchmarks/startup.py --max-ms 150
+"""
+
+import json
+import statistics
+import subprocess
+import sys
+import time
+
+import click
+
+HEAVY_MODULES = ('cv2', 'numpy', 'PIL', 'asyncio')
+CLI = 'from hdr.cli import main; main()'
+COMMANDS = (
+    ('--help',),
+    ('--version',),
+    ('drago', '--help'),
+    ('tiled', '--help'),
+    ('drago', '--no-such-option')
+)
+
+
+def time_command(args, repeat):
+    """
+    Return the wall times in milliseconds of running a command.
+    """
+    timings = []
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(
+            args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        timings.append((time.perf_counter() - start) * 1000)
+
+    return timings
+
+
+def get_heavy_imports():
+    """
+    Return the heavy modules loaded by importing the CLI.
+    """
+    code = (
+        'import json, sys, hdr.cli; '
+        'print(json.dumps([m for m in {0!r} if m in sys.modules]))'
+    ).format(HEAVY_MODULES)
+    output = subprocess.check_output([sys.executable, '-c', code])
+    return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+
+@click.command()
+@click.option(
+    '--repeat',
+    default=10,
+    type=click.IntRange(min=1),
+    help='Runs per command, the median is reported.'
+)
+@click.option(
+    '--max-ms',
+    type=click.FloatRange(min=0),
+    help='Fail if a command takes longer than this above a bare '
+         'interpreter start.'
+)
+def main(repeat, max_ms):
+    failed = False
+
+    heavy = get_heavy_imports()
+    if heavy:
+        click.echo('Imported at startup: {0}'.format(', '.join(heavy)))
+        failed = True
+
+    base = statistics.median(
+        time_command([sys.executable, '-c', 'pass'], repeat)
+    )
+    click.echo('{0:<32}{1:>10.1f}'.format('python -c pass', base))
+    click.echo('{0:<32}{1:>10}{2:>10}'.format('command', 'ms', '+ms'))
+
+    for command in COMMANDS:
+        median = statistics.median(
+            time_command([sys.executable, '-c', CLI] + list(command), repeat)
+        )
+        overhead = median - base
+
+        flag = ''
+        if max_ms is not None and overhead > max_ms:
+            flag = 'SLOW'
+            failed = True
+
+        click.echo('{0:<32}{1:>10.1f}{2:>10.1f}  {3}'.format(
+            'hdr ' + ' '.join(command), median, overhead, flag
+        ).rstrip())
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
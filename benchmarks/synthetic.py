@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+#
+# hdr: A Python API and CLI for creating HDR images.
+#
+# Copyright (C) 2017 Sean Marlow
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Synthetic exposure brackets rendered from a known radiance map.
+
+Frames go through a gamma response so benchmarks can compare recovered
+curves and radiance with the truth.
+"""
+
+import os
+
+from fractions import Fraction
+
+import cv2
+import numpy
+
+from PIL import Image, TiffImagePlugin
+
+GAMMA = 2.2
+EXIF_IFD = 0x8769
+MAKE_TAG = 271
+MODEL_TAG = 272
+EXPOSURE_TIME_TAG = 33434
+ISO_TAG = 34855
+
+
+def make_radiance(width, height, seed=0):
+    """
+    Return a smooth, textured float32 radiance map spanning ~10 stops.
+    """
+    rng = numpy.random.RandomState(seed)
+    y, x = numpy.mgrid[0:height, 0:width].astype(numpy.float32)
+
+    radiance = numpy.exp(x / width * 6 - 3)
+    radiance = radiance * (1 + 0.3 * numpy.sin(y / 9.0))
+    texture = cv2.GaussianBlur(
+        rng.rand(height, width).astype(numpy.float32), (0, 0), 3
+    )
+    radiance = radiance * (0.5 + 2 * texture)
+    return radiance[..., numpy.newaxis] * numpy.array(
+        [0.6, 0.8, 1.0], dtype=numpy.float32
+    )
+
+
+def render_bracket(radiance, frames=3, stops=2):
+    """
+    Render the radiance map at exposures stops apart.
+
+    :return: Returns a tuple of the uint8 frames and exposure times.
+    """
+    exposures = numpy.array(
+        [1.0 / 2 ** (index * stops) for index in range(frames)],
+        dtype=numpy.float32
+    )
+    images = [
+        (numpy.clip(radiance * time_, 0, 1) ** (1 / GAMMA) * 255).astype(
+            numpy.uint8
+        )
+        for time_ in exposures
+    ]
+    return images, exposures
+
+
+def make_bracket(width, height, frames=3, stops=2, seed=0):
+    """
+    Render a bracket set of the synthetic scene.
+
+    :return: Returns a tuple of the uint8 frames and exposure times.
+    """
+    return render_bracket(make_radiance(width, height, seed), frames, stops)
+
+
+def write_bracket(images, exposures, directory, quality=95):
+    """
+    Write frames as JPEG files with EXIF exposure times.
+
+    The frames are RGB ordered as rendered, which does not matter for
+    benchmarking.
+
+    :return: Returns the list of file names.
+    """
+    names = []
+
+    for index, (image, time_) in enumerate(zip(images, exposures)):
+        fraction = Fraction(float(time_)).limit_denominator(100000)
+
+        exif = Image.Exif()
+        exif[MAKE_TAG] = 'hdr'
+        exif[MODEL_TAG] = 'synthetic'
+        exif.get_ifd(EXIF_IFD)[EXPOSURE_TIME_TAG] = (
+            TiffImagePlugin.IFDRational(
+                fraction.numerator, fraction.denominator
+            )
+        )
+        exif.get_ifd(EXIF_IFD)[ISO_TAG] = 100
+
+        name = os.path.join(directory, 'frame{0}.jpg'.format(index))
+        Image.fromarray(image).save(name, exif=exif, quality=quality)
+        names.append(name)
+
+    return names
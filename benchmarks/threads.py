@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+#
+# hdr: A Python API and CLI for creating HDR images.
+#
+# Copyright (C) 2017 Sean Marlow
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Benchmark batch throughput across splits of the thread budget.
+
+A synthetic bracket of each size is written once and a batch of jobs
+merges it repeatedly. Every split of the cores between worker processes
+and OpenCV threads per worker is timed, from one worker using every core
+to one worker per core with a single thread, along with the split the
+auto plan picks and the unbounded default of one full OpenCV pool per
+worker. Throughput is reported in jobs per second.
+
+    python benchmarks/threads.py --sizes 1000x750,4000x3000 --jobs 32
+"""
+
+import os
+import statistics
+import tempfile
+import time
+
+import click
+
+from hdr import batch, threads
+from synthetic import make_bracket, write_bracket
+
+
+def get_splits(cores):
+    """
+    Return (label, workers, threads) for each split of the cores.
+    """
+    splits = []
+    workers = 1
+    while workers <= cores:
+        splits.append(('split', workers, cores // workers))
+        workers *= 2
+
+    splits.append(('auto', None, None))
+    splits.append(('unbounded', cores, cores))
+    return splits
+
+
+def time_batch(jobs, workers, threads_, cores, repeat):
+    timings = []
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        results = batch.process_batch(
+            jobs, workers, threads_, cores=cores
+        )
+        timings.append(time.perf_counter() - start)
+
+        for result in results:
+            if result['error']:
+                raise click.ClickException(result['error'])
+
+    return statistics.median(timings)
+
+
+@click.command()
+@click.option(
+    '--sizes',
+    default='1000x750,3000x2000',
+    help='Comma separated bracket sizes as WIDTHxHEIGHT.'
+)
+@click.option(
+    '--jobs',
+    default=16,
+    type=click.IntRange(min=1),
+    help='Number of jobs in each batch.'
+)
+@click.option(
+    '--cores',
+    type=click.IntRange(min=1),
+    help='Core budget, defaults to all available cores.'
+)
+@click.option(
+    '--operator',
+    default='drago',
+    type=click.Choice(batch.OPERATORS),
+    help='Tonemap operator of the jobs.'
+)
+@click.option(
+    '--repeat',
+    default=1,
+    type=click.IntRange(min=1),
+    help='Runs per measurement, the median is reported.'
+)
+def main(sizes, jobs, cores, operator, repeat):
+    cores = threads.get_cores(cores)
+
+    click.echo('{0:<12}{1:<11}{2:>8}{3:>8}{4:>10}{5:>10}'.format(
+        'size', 'split', 'workers', 'threads', 'seconds', 'jobs/s'
+    ))
+
+    for size in sizes.split(','):
+        width, height = (int(part) for part in size.lower().split('x'))
+        images, exposures = make_bracket(width, height)
+
+        with tempfile.TemporaryDirectory() as scratch_dir:
+            names = write_bracket(images, exposures, scratch_dir)
+            batch_jobs = [
+                {
+                    'images': names,
+                    'operator': operator,
+                    'output': os.path.join(
+                        scratch_dir, 'out{0}.jpg'.format(index)
+                    )
+                }
+                for index in range(jobs)
+            ]
+
+            for label, workers, threads_ in get_splits(cores):
+                if workers is None:
+                    workers, threads_ = threads.plan_threads(
+                        jobs, width * height, cores=cores
+                    )
+
+                elapsed = time_batch(
+                    batch_jobs, workers, threads_, cores, repeat
+                )
+                click.echo(
+                    '{0:<12}{1:<11}{2:>8}{3:>8}{4:>10.2f}{5:>10.2f}'.format(
+                        size, label, workers, threads_, elapsed,
+                        jobs / elapsed
+                    )
+                )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+#
+# hdr: A Python API and CLI for creating HDR images.
+#
+# Copyright (C) 2017 Sean Marlow
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Benchmark the tile-parallel durand and mantiuk tonemaps.
+
+A synthetic radiance map is tonemapped in a single pass, with the
+OpenCV operator and with tonemap_parallel at each worker count. The
+speedup over the single pass and over OpenCV, the efficiency relative
+to the smallest worker count, the error against the single pass and
+the maximum error against OpenCV are reported. OpenCV builds without
+an operator, such as durand without the non-free modules, skip the
+OpenCV columns.
+
+Mantiuk tiles take their low frequencies from a solve on a proxy, which
+differs from the full resolution solve across the whole image. The seam
+error therefore measures the discontinuities the tiles add: how much
+more the step between neighbouring pixels across a seam differs from the
+single pass than it does across lines midway between seams. Exits with
+status 1 if it exceeds --max-seam-error.
+
+    python benchmarks/tonemap_parallel.py --size 4000x3000 --workers 1,8,32
+"""
+
+import os
+import statistics
+import sys
+import time
+
+import click
+import cv2
+import numpy
+
+from hdr import api, tonemap
+from synthetic import make_radiance
+
+
+def get_workers(value):
+    if value:
+        return [int(item) for item in value.split(',') if item.strip()]
+
+    workers = [1]
+    while workers[-1] * 2 <= (os.cpu_count() or 1):
+        workers.append(workers[-1] * 2)
+    return workers
+
+
+def time_run(func, repeat):
+    timings = []
+    result = None
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+
+    return result, statistics.median(timings)
+
+
+def time_opencv(operator, radiance, repeat):
+    """
+    Time the OpenCV operator on the radiance map.
+
+    :return: Returns a tuple of the result and seconds, or of None and
+        None if this build of OpenCV lacks the operator.
+    """
+    try:
+        tonemap_object = api.create_tonemap(operator)
+    except (AttributeError, cv2.error):
+        return None, None
+
+    return time_run(lambda: tonemap_object.process(radiance.copy()), repeat)
+
+
+@click.command()
+@click.option(
+    '--size',
+    default='2000x1500',
+    help='Radiance map size as WIDTHxHEIGHT.'
+)
+@click.option(
+    '--operators',
+    default='durand,mantiuk',
+    help='Comma separated operators to benchmark.'
+)
+@click.option(
+    '--workers',
+    help='Comma separated worker counts, defaults to powers of two up '
+         'to the number of cores.'
+)
+@click.option(
+    '--tile-size',
+    default=tonemap.PARALLEL_TILE_SIZE,
+    type=click.IntRange(min=64),
+    help='Tile edge length.'
+)
+@click.option(
+    '--repeat',
+    default=3,
+    type=click.IntRange(min=1),
+    help='Runs per measurement, the median is reported.'
+)
+@click.option(
+    '--threads',
+    type=click.IntRange(min=0),
+    help='Number of OpenCV threads.'
+)
+@click.option(
+    '--max-seam-error',
+    default=0.001,
+    type=click.FloatRange(min=0),
+    help='Fail if the seam error, in [0, 1] output units, exceeds this.'
+)
+def main(size, operators, workers, tile_size, repeat, threads,
+         max_seam_error):
+    if threads is not None:
+        cv2.setNumThreads(threads)
+
+    width, height = (int(part) for part in size.lower().split('x'))
+    radiance = make_radiance(width, height)
+    regions = [
+        target for _, _, target, _ in tonemap.get_blend_tiles(
+            height, width, tile_size
+        )
+    ]
+    failed = False
+
+    click.echo(
+        '{0:<10}{1:>8}{2:>10}{3:>9}{4:>8}{5:>7}{6:>10}{7:>10}{8:>10}'
+        '{9:>10}'.format(
+            'operator', 'workers', 'ms', 'speedup', 'vs cv2', 'eff',
+            'mean err', 'seam err', 'max err', 'cv2 err'
+        )
+    )
+
+    for operator in operators.split(','):
+        reference, single = time_run(
+            lambda: tonemap.tonemap(operator, radiance), repeat
+        )
+        click.echo('{0:<10}{1:>8}{2:>10.1f}'.format(
+            operator, 'single', single * 1000
+        ))
+
+        opencv, opencv_time = time_opencv(operator, radiance, repeat)
+        if opencv is not None:
+            click.echo('{0:<10}{1:>8}{2:>10.1f}'.format(
+                operator, 'opencv', opencv_time * 1000
+            ))
+
+        base = None
+        for count in get_workers(workers):
+            result, elapsed = time_run(
+                lambda: tonemap.tonemap_parallel(
+                    operator, radiance, count, tile_size
+                ),
+                repeat
+            )
+            base = base or elapsed * count
+
+            error = numpy.abs(result - reference)
+            seam_error = tonemap.get_seam_error(result, reference, regions)
+
+            flag = ''
+            if seam_error > max_seam_error:
+                flag = 'SEAMS'
+                failed = True
+
+            opencv_speedup = opencv_error = '-'
+            if opencv is not None:
+                opencv_speedup = '{0:.2f}'.format(opencv_time / elapsed)
+                opencv_error = '{0:.4f}'.format(
+                    float(numpy.nanmax(numpy.abs(result - opencv)))
+                )
+
+            click.echo(
+                '{0:<10}{1:>8}{2:>10.1f}{3:>9.2f}{4:>8}{5:>7.2f}{6:>10.4f}'
+                '{7:>10.4f}{8:>10.4f}{9:>10}  {10}'.format(
+                    operator, count, elapsed * 1000, single / elapsed,
+                    opencv_speedup, base / elapsed / count,
+                    float(error.mean()), seam_error, float(error.max()),
+                    opencv_error, flag
+                ).rstrip()
+            )
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
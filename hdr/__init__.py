@@ -18,5 +18,10 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
+import os
+
+# OpenCV only reads and writes OpenEXR radiance maps when enabled.
+os.environ.setdefault('OPENCV_IO_ENABLE_OPENEXR', '1')
+
 __author__ = """Sean Marlow"""
 __version__ = '0.0.1'
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+#
+# hdr: A Python API and CLI for creating HDR images.
+#
+# Copyright (C) 2017 Sean Marlow
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Per thread cache of OpenCV algorithm objects.
+
+Merge, calibration and alignment objects are built once per
+configuration and thread and reused by every later call, which keeps
+long running processes such as hdr serve and batch workers warm.
+Tonemap objects are not cached, see api.create_tonemap.
+"""
+
+import threading
+
+import cv2
+
+MAX_ALGORITHMS = 32
+
+_algorithms = threading.local()
+
+
+def get_algorithm(factory, *args):
+    """
+    Return an OpenCV algorithm object cached for the calling thread.
+
+    Objects are keyed by factory name and arguments so a long running
+    process builds each configuration once per thread. OpenCV
+    algorithms are not thread safe and are never shared across threads.
+
+    :param factory: Name of the cv2 factory, e.g. createMergeDebevec.
+    :param args: Positional arguments for the factory.
+    :return: Returns the algorithm object.
+    """
+    cache = getattr(_algorithms, 'cache', None)
+    if cache is None:
+        cache = _algorithms.cache = {}
+
+    key = (factory,) + args
+    algorithm = cache.get(key)
+
+    if algorithm is None:
+        if len(cache) >= MAX_ALGORITHMS:
+            cache.clear()
+        algorithm = cache[key] = getattr(cv2, factory)(*args)
+
+    return algorithm
@@ -0,0 +1,308 @@
+# -*- coding: utf-8 -*-
+#
+# hdr: A Python API and CLI for creating HDR images.
+#
+# Copyright (C) 2017 Sean Marlow
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Median threshold bitmap alignment with reusable shifts.
+
+Shifts are computed on a grayscale, optionally downscaled, proxy of
+each frame and can be stored in a JSON sidecar next to the middle
+exposure so re-rendering a bracket skips alignment entirely.
+"""
+
+import json
+import math
+import os
+
+import cv2
+
+from hdr.algorithms import get_algorithm
+from hdr.exceptions import HdrException
+
+ALIGN_OPTIONS = {
+    'max_bits': 6,
+    'exclude_range': 4,
+    'downscale': 1
+}
+SIDECAR_SUFFIX = '.align.json'
+WARM_START_BITS = 2
+
+
+def parse_align(spec):
+    """
+    Parse an alignment specification string.
+
+    The format is none or mtb[:name=value,...] for example
+    mtb:max-bits=4,downscale=4.
+
+    :return: Returns False when alignment is disabled, otherwise a
+        dictionary of alignment options.
+    """
+    method, _, options = spec.partition(':')
+
+    if method == 'none' and not options:
+        return False
+    elif method != 'mtb':
+        raise HdrException(
+            'The {0} alignment is not supported.'.format(method)
+        )
+
+    params = {}
+    for option in filter(None, options.split(',')):
+        name, sep, value = option.partition('=')
+        name = name.strip().replace('-', '_')
+
+        if not sep or name not in ALIGN_OPTIONS:
+            raise HdrException(
+                'Invalid alignment option {0}.'.format(option)
+            )
+
+        try:
+            params[name] = int(value)
+        except ValueError:
+            raise HdrException(
+                'Invalid value for alignment option {0}.'.format(name)
+            )
+
+    return params
+
+
+def get_options(align):
+    """
+    Return the full set of alignment options for an align argument.
+    """
+    options = dict(ALIGN_OPTIONS)
+
+    if isinstance(align, dict):
+        unknown = set(align) - set(ALIGN_OPTIONS)
+        if unknown:
+            raise HdrException(
+                'Invalid alignment options: {0}.'.format(
+                    ', '.join(sorted(unknown))
+                )
+            )
+        options.update(align)
+
+    return options
+
+
+def get_shifts(images,
+               max_bits=6,
+               exclude_range=4,
+               downscale=1,
+               scale=1,
+               initial=None):
+    """
+    Compute the MTB shift of each frame relative to the middle frame.
+
+    With downscale the bitmaps are built from a proxy shrunk by that
+    factor and the pyramid depth is reduced to match, so the largest
+    detectable shift stays 2 ** max_bits full resolution pixels.
+
+    :param scale: Factor the images were already shrunk by.
+    :param initial: Optional shifts of a similar bracket set, such as
+        the previous set of a sequence. Each frame is moved by its
+        initial shift first and only a residual of up to
+        2 ** WARM_START_BITS proxy pixels is searched.
+    :return: Returns a list of (dx, dy) shifts in full resolution
+        pixels.
+    """
+    grays = []
+    for image in images:
+        gray = image
+        if gray.ndim == 3:
+            gray = cv2.cvtColor(gray, cv2.COLOR_RGB2GRAY)
+
+        if downscale > 1:
+            gray = cv2.resize(
+                gray, None, fx=1.0 / downscale, fy=1.0 / downscale,
+                interpolation=cv2.INTER_AREA
+            )
+
+        grays.append(gray)
+
+    factor = downscale * scale
+    levels = max(max_bits - int(math.log2(max(factor, 1))), 0)
+    pivot = len(grays) // 2
+
+    if initial is None or len(initial) != len(grays):
+        initial = [(0, 0)] * len(grays)
+    else:
+        initial = [
+            (round(dx / factor), round(dy / factor)) for dx, dy in initial
+        ]
+        levels = min(levels, WARM_START_BITS)
+
+    align_mtb = get_algorithm('createAlignMTB', levels, exclude_range, False)
+
+    shifts = []
+    for index, gray in enumerate(grays):
+        if index == pivot:
+            shifts.append((0, 0))
+            continue
+
+        start = initial[index]
+        reference = grays[pivot]
+        if start != (0, 0):
+            reference, gray = crop_overlap(reference, gray, start)
+
+        dx, dy = align_mtb.calculateShift(reference, gray)
+        shifts.append((
+            (start[0] + int(dx)) * factor, (start[1] + int(dy)) * factor
+        ))
+
+    return shifts
+
+
+def crop_overlap(reference, image, shift):
+    """
+    Crop two frames to the area they share once image is moved by
+    shift, so no filled border takes part in the comparison.
+    """
+    dx, dy = shift
+    height, width = reference.shape[:2]
+
+    if abs(dx) >= width or abs(dy) >= height:
+        return reference, image
+
+    x0, x1 = max(dx, 0), width + min(dx, 0)
+    y0, y1 = max(dy, 0), height + min(dy, 0)
+    return (
+        reference[y0:y1, x0:x1],
+        image[y0 - dy:y1 - dy, x0 - dx:x1 - dx]
+    )
+
+
+def apply_shifts(images, shifts):
+    """
+    Shift the images in place by the given (dx, dy) offsets.
+    """
+    align_mtb = get_algorithm('createAlignMTB')
+
+    for index, shift in enumerate(shifts):
+        if tuple(shift) != (0, 0):
+            images[index] = align_mtb.shiftMat(images[index], tuple(shift))
+
+
+def get_sidecar_path(image_names):
+    """
+    Return the shift sidecar path for a bracket set.
+    """
+    return image_names[len(image_names) // 2] + SIDECAR_SUFFIX
+
+
+def get_sidecar_key(image_names, options):
+    """
+    Return the values a stored sidecar must match to be reused.
+    """
+    frames = []
+    for name in image_names:
+        stat = os.stat(name)
+        frames.append(
+            [os.path.basename(name), stat.st_mtime_ns, stat.st_size]
+        )
+
+    return {'frames': frames, 'options': options}
+
+
+def load_shifts(image_names, options):
+    """
+    Load cached shifts for a bracket set.
+
+    :return: Returns the list of shifts or None if no sidecar exists or
+        the images or options changed since it was written.
+    """
+    path = get_sidecar_path(image_names)
+
+    try:
+        with open(path) as sidecar:
+            data = json.load(sidecar)
+    except (OSError, ValueError):
+        return None
+
+    if data.get('key') != get_sidecar_key(image_names, options):
+        return None
+
+    return [tuple(shift) for shift in data['shifts']]
+
+
+def save_shifts(image_names, options, shifts):
+    """
+    Atomically write the shifts for a bracket set to its sidecar.
+
+    :return: Returns the path of the sidecar.
+    """
+    path = get_sidecar_path(image_names)
+    data = {
+        'key': get_sidecar_key(image_names, options),
+        'shifts': [list(shift) for shift in shifts]
+    }
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as sidecar:
+        json.dump(data, sidecar)
+    os.replace(tmp_path, path)
+
+    return path
+
+
+def get_bracket_shifts(images,
+                       image_names=None,
+                       align=True,
+                       cache_shifts=False,
+                       scale=1,
+                       initial=None):
+    """
+    Return the alignment shifts for a bracket set.
+
+    :param images: List of frames or downscaled proxies to align.
+    :param image_names: Image file names, required to cache shifts.
+    :param align: False to skip alignment, True for the default
+        options or a dictionary of options for get_shifts.
+    :param cache_shifts: Reuse shifts from the sidecar if present and
+        store newly computed shifts.
+    :param scale: Factor the images were already shrunk by.
+    :param initial: Optional shifts to search around, see get_shifts.
+    :return: Returns a list of (dx, dy) shifts in full resolution
+        pixels or None if alignment is disabled.
+    """
+    if align is False:
+        return None
+
+    options = get_options(align)
+    cache_shifts = cache_shifts and bool(image_names)
+
+    # Shifts from a proxy match a full resolution run that downscales
+    # by the same total factor, so both share the sidecar.
+    key = dict(options, downscale=options['downscale'] * scale)
+
+    if cache_shifts:
+        shifts = load_shifts(image_names, key)
+        if shifts is not None:
+            return shifts
+
+    shifts = get_shifts(images, scale=scale, initial=initial, **options)
+
+    if cache_shifts:
+        try:
+            save_shifts(image_names, key, shifts)
+        except OSError:
+            # A read only image directory only loses the cache.
+            pass
+
+    return shifts
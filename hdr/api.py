@@ -17,17 +17,163 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import hashlib
+import os
+
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+
 import cv2
-import PIL.Image
+import numpy
 
 from numpy import array, float32
 
+from hdr.algorithms import get_algorithm
+from hdr.align import apply_shifts, get_bracket_shifts
+from hdr.calibration import (
+    calibrate_response,
+    get_response,
+    get_response_key,
+    load_response,
+    read_response,
+    save_response,
+    write_response
+)
 from hdr.exceptions import HdrException
+from hdr.exif import read_exif, read_exif_batch, read_exif_bytes
+from hdr.fusion import FastMergeMertens
+from hdr.output import (
+    DTYPES,
+    ImageWriter,
+    encode_ldr,
+    to_ldr,
+    write_ldr
+)
+from hdr.profiling import profiled, stage
+from hdr.threads import get_threads
+from hdr.tonemap import PARALLEL_TONEMAPS, tonemap_parallel
+
+PREVIEW_FLAGS = {
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8
+}
+RADIANCE_EXTENSIONS = ('.exr', '.hdr', '.npy')
+MERGE_ALGORITHMS = ('debevec', 'mertens', 'robertson')
+MERTENS_PARAMS = (('contrast', 1.0), ('saturation', 1.0), ('exposure', 0.0))
+
+TONEMAPS = {
+    'drago': (
+        'createTonemapDrago',
+        (('gamma', 1.0), ('saturation', 1.0), ('bias', 0.85))
+    ),
+    'durand': (
+        'createTonemapDurand',
+        (
+            ('gamma', 1.0), ('contrast', 4.0), ('saturation', 1.0),
+            ('sigma_space', 2.0), ('sigma_color', 2.0)
+        )
+    ),
+    'linear': (
+        'createTonemap',
+        (('gamma', 2.2),)
+    ),
+    'mantiuk': (
+        'createTonemapMantiuk',
+        (('gamma', 2.2), ('scale', 0.7), ('saturation', 1.0))
+    ),
+    'reinhard': (
+        'createTonemapReinhard',
+        (
+            ('gamma', 1.0), ('intensity', 0.0), ('light_adapt', 1.0),
+            ('color_adapt', 0.0)
+        )
+    )
+}
 
 
-def align_images(images):
-    align_mtb = cv2.createAlignMTB()
-    align_mtb.process(images, images)
+@profiled('align')
+def align_images(images,
+                 image_names=None,
+                 align=True,
+                 cache_shifts=False,
+                 scale=None,
+                 initial=None):
+    """
+    Align the images in place to the middle exposure.
+
+    :param image_names: Image file names, required to cache shifts.
+    :param align: False to skip alignment, True for the default MTB
+        options or a dictionary with max_bits, exclude_range and
+        downscale.
+    :param cache_shifts: Reuse shifts stored in a sidecar next to the
+        images and store newly computed shifts.
+    :param scale: Factor the images were shrunk by when decoded.
+    :param initial: Optional shifts of a similar bracket set to search
+        around, such as the previous set of a sequence.
+    :return: Returns the shifts in full resolution pixels or None if
+        alignment is disabled.
+    """
+    scale = scale or 1
+    shifts = get_bracket_shifts(
+        images, image_names, align, cache_shifts, scale, initial
+    )
+
+    if shifts:
+        apply_shifts(images, [
+            (round(dx / scale), round(dy / scale)) for dx, dy in shifts
+        ])
+
+    return shifts
+
+
+def calibrate(image_names,
+              algo='debevec',
+              exposures=None,
+              output=None,
+              cache_dir=None,
+              samples=None,
+              downscale=1,
+              align=True,
+              cache_shifts=False):
+    """
+    Calibrate and pin the camera response curve for a bracket set.
+
+    The curve is stored in the response cache for the camera that
+    took the images so later merges skip calibration. If output is
+    provided the curve is also written to that .npy file.
+
+    :param image_names: List of images to calibrate from.
+    :param samples: Solve from this many stratified pixel samples
+        instead of using OpenCV's calibration.
+    :param downscale: Factor to shrink the frames by before sampling.
+    :param align: False to skip alignment or a dictionary of options.
+    :param cache_shifts: Reuse and store alignment shifts.
+    :return: Returns the path of the stored response curve.
+    """
+    images = read_images(image_names)
+    exposures = get_exposures(exposures, image_names)
+    align_images(images, image_names, align, cache_shifts)
+
+    response = calibrate_response(
+        images, exposures, algo, samples, downscale
+    )
+
+    path = None
+    key = get_response_key(image_names[0], algo)
+    if key:
+        path = save_response(key, response, cache_dir)
+
+    if output:
+        path = write_response(response, output)
+
+    if not path:
+        raise HdrException(
+            'Unable to identify the camera from EXIF data, '
+            'an output file is required to store the response curve.'
+        )
+
+    return path
 
 
 def drago_hdr(image_names,
@@ -36,20 +182,44 @@ def drago_hdr(image_names,
               gamma=1.0,
               saturation=1.0,
               bias=0.85,
-              output=None):
+              output=None,
+              response=None,
+              cache_response=False,
+              radiance_output=None,
+              align=True,
+              cache_shifts=False,
+              preview=None,
+              encoding=None,
+              writer=None,
+              result_cache=None):
     """
     Create an HDR image from the supplied images.
 
-    :param images: List of images to process.
+    :param images: List of images to process or a saved radiance map.
+    :param response: Optional response curve (array or .npy path).
+    :param cache_response: Reuse and store camera response curves.
+    :param radiance_output: Optional file to save the radiance map to.
+    :param align: False to skip alignment or a dictionary of options.
+    :param cache_shifts: Reuse and store alignment shifts.
+    :param preview: Decode the images at 1/2, 1/4 or 1/8 scale and
+        write a _preview image.
+    :param encoding: Optional dictionary of output depth (8 or 16),
+        quality (JPEG and WebP) and compression (PNG).
+    :param writer: Optional output.ImageWriter to encode the image on
+        a background thread.
+    :param result_cache: Optional cache.ResultCache, an unchanged result
+        is copied from the cache instead of being recomputed.
     :return: Returns name of new HDR image.
     """
-    hdr_img = process_image(image_names, exposures, algo)
-
-    tonemap_drago = cv2.createTonemapDrago(gamma, saturation, bias)
-    ldr_drago = tonemap_drago.process(hdr_img)
-
-    img_out = get_image_output(image_names[1], output)
-    cv2.imwrite(img_out, ldr_drago * 255)
+    pipeline = HdrPipeline(
+        'drago', {'gamma': gamma, 'saturation': saturation, 'bias': bias},
+        algo, response=response, cache_response=cache_response, align=align,
+        cache_shifts=cache_shifts, preview=preview, encoding=encoding,
+        result_cache=result_cache
+    )
+    return pipeline.process(
+        image_names, exposures, output, radiance_output, writer
+    )
 
 
 def durand_hdr(image_names,
@@ -60,22 +230,51 @@ def durand_hdr(image_names,
                saturation=1.0,
                sigma_space=2.0,
                sigma_color=2.0,
-               output=None):
+               output=None,
+               response=None,
+               cache_response=False,
+               radiance_output=None,
+               align=True,
+               cache_shifts=False,
+               preview=None,
+               encoding=None,
+               writer=None,
+               result_cache=None,
+               tile_workers=None):
     """
     Create an HDR image from the supplied images.
 
-    :param images: List of images to process.
+    :param images: List of images to process or a saved radiance map.
+    :param response: Optional response curve (array or .npy path).
+    :param cache_response: Reuse and store camera response curves.
+    :param radiance_output: Optional file to save the radiance map to.
+    :param align: False to skip alignment or a dictionary of options.
+    :param cache_shifts: Reuse and store alignment shifts.
+    :param preview: Decode the images at 1/2, 1/4 or 1/8 scale and
+        write a _preview image.
+    :param encoding: Optional dictionary of output depth (8 or 16),
+        quality (JPEG and WebP) and compression (PNG).
+    :param writer: Optional output.ImageWriter to encode the image on
+        a background thread.
+    :param result_cache: Optional cache.ResultCache, an unchanged result
+        is copied from the cache instead of being recomputed.
+    :param tile_workers: Tonemap in overlapping tiles on this many
+        threads.
     :return: Returns name of new HDR image.
     """
-    hdr_img = process_image(image_names, exposures, algo)
-
-    tonemap_durand = cv2.createTonemapDurand(
-        gamma, contrast, saturation, sigma_space, sigma_color
+    pipeline = HdrPipeline(
+        'durand',
+        {
+            'gamma': gamma, 'contrast': contrast, 'saturation': saturation,
+            'sigma_space': sigma_space, 'sigma_color': sigma_color
+        },
+        algo, response=response, cache_response=cache_response, align=align,
+        cache_shifts=cache_shifts, preview=preview, encoding=encoding,
+        result_cache=result_cache, tile_workers=tile_workers
+    )
+    return pipeline.process(
+        image_names, exposures, output, radiance_output, writer
     )
-    ldr_durand = tonemap_durand.process(hdr_img)
-
-    img_out = get_image_output(image_names[1], output)
-    cv2.imwrite(img_out, ldr_durand * 255)
 
 
 def mantiuk_hdr(image_names,
@@ -84,20 +283,47 @@ def mantiuk_hdr(image_names,
                 gamma=2.2,
                 scale=0.7,
                 saturation=1.0,
-                output=None):
+                output=None,
+                response=None,
+                cache_response=False,
+                radiance_output=None,
+                align=True,
+                cache_shifts=False,
+                preview=None,
+                encoding=None,
+                writer=None,
+                result_cache=None,
+                tile_workers=None):
     """
     Create an HDR image from the supplied images.
 
-    :param images: List of images to process.
+    :param images: List of images to process or a saved radiance map.
+    :param response: Optional response curve (array or .npy path).
+    :param cache_response: Reuse and store camera response curves.
+    :param radiance_output: Optional file to save the radiance map to.
+    :param align: False to skip alignment or a dictionary of options.
+    :param cache_shifts: Reuse and store alignment shifts.
+    :param preview: Decode the images at 1/2, 1/4 or 1/8 scale and
+        write a _preview image.
+    :param encoding: Optional dictionary of output depth (8 or 16),
+        quality (JPEG and WebP) and compression (PNG).
+    :param writer: Optional output.ImageWriter to encode the image on
+        a background thread.
+    :param result_cache: Optional cache.ResultCache, an unchanged result
+        is copied from the cache instead of being recomputed.
+    :param tile_workers: Tonemap in overlapping tiles on this many
+        threads.
     :return: Returns name of new HDR image.
     """
-    hdr_img = process_image(image_names, exposures, algo)
-
-    tonemap_mantiuk = cv2.createTonemapMantiuk(gamma, scale, saturation)
-    ldr_mantiuk = tonemap_mantiuk.process(hdr_img)
-
-    img_out = get_image_output(image_names[1], output)
-    cv2.imwrite(img_out, ldr_mantiuk * 255)
+    pipeline = HdrPipeline(
+        'mantiuk', {'gamma': gamma, 'scale': scale, 'saturation': saturation},
+        algo, response=response, cache_response=cache_response, align=align,
+        cache_shifts=cache_shifts, preview=preview, encoding=encoding,
+        result_cache=result_cache, tile_workers=tile_workers
+    )
+    return pipeline.process(
+        image_names, exposures, output, radiance_output, writer
+    )
 
 
 def mertens_hdr(image_names,
@@ -105,22 +331,124 @@ def mertens_hdr(image_names,
                 exposure=0.0,
                 gamma=2.2,
                 saturation=1.0,
-                output=None):
+                output=None,
+                radiance_output=None,
+                align=True,
+                cache_shifts=False,
+                preview=None,
+                encoding=None,
+                writer=None,
+                result_cache=None,
+                fast=False):
     """
     Create an HDR image from the supplied images.
 
-    :param images: List of images to process.
+    :param images: List of images to process or a saved fused image.
+    :param radiance_output: Optional file to save the fused image to.
+    :param align: False to skip alignment or a dictionary of options.
+    :param cache_shifts: Reuse and store alignment shifts.
+    :param preview: Decode the images at 1/2, 1/4 or 1/8 scale and
+        write a _preview image.
+    :param encoding: Optional dictionary of output depth (8 or 16),
+        quality (JPEG and WebP) and compression (PNG).
+    :param writer: Optional output.ImageWriter to encode the image on
+        a background thread.
+    :param result_cache: Optional cache.ResultCache, an unchanged result
+        is copied from the cache instead of being recomputed.
+    :param fast: Fuse with the approximate fusion.FastMergeMertens.
     :return: Returns name of new HDR image.
     """
-    images = read_images(image_names)
-    align_images(images)
-    mertens_img = process_mertens(images, contrast, saturation, exposure)
+    pipeline = HdrPipeline(
+        'linear', {'gamma': gamma}, 'mertens',
+        {'contrast': contrast, 'saturation': saturation, 'exposure': exposure},
+        align=align, cache_shifts=cache_shifts, preview=preview,
+        encoding=encoding,
+        result_cache=result_cache,
+        fast=fast
+    )
+    return pipeline.process(image_names, None, output, radiance_output, writer)
+
 
-    tonemap = cv2.createTonemap(gamma)
-    ldr_mertens = tonemap.process(mertens_img)
+def multi_hdr(image_names,
+              tonemaps,
+              algo='debevec',
+              exposures=None,
+              outputs=None,
+              response=None,
+              cache_response=False,
+              radiance_output=None,
+              align=True,
+              cache_shifts=False,
+              preview=None,
+              encoding=None,
+              writer=None):
+    """
+    Create several HDR images from one merge of the supplied images.
 
-    img_out = get_image_output(image_names[1], output)
-    cv2.imwrite(img_out, ldr_mertens * 255)
+    The images are read, aligned, calibrated and merged once and each
+    tonemap is applied to the same radiance map.
+
+    :param images: List of images to process or a saved radiance map.
+    :param tonemaps: List of (operator, params) tuples where params is a
+        dictionary of tonemap parameters.
+    :param outputs: Optional list of output names, one per tonemap.
+    :param response: Optional response curve (array or .npy path).
+    :param cache_response: Reuse and store camera response curves.
+    :param radiance_output: Optional file to save the radiance map to.
+    :param align: False to skip alignment or a dictionary of options.
+    :param cache_shifts: Reuse and store alignment shifts.
+    :param preview: Decode the images at 1/2, 1/4 or 1/8 scale and
+        write _preview images.
+    :param encoding: Optional dictionary of output depth (8 or 16),
+        quality (JPEG and WebP) and compression (PNG).
+    :param writer: Optional output.ImageWriter to encode the images
+        on, by default each image is encoded on a background thread
+        while the next tonemap runs.
+    :return: Returns list of names of new HDR images.
+    """
+    if outputs and len(outputs) != len(tonemaps):
+        raise HdrException('One output is required for each tonemap.')
+
+    tonemappers = [
+        create_tonemap(
+            operator, **get_preview_params(operator, params, preview)
+        )
+        for operator, params in tonemaps
+    ]
+
+    hdr_img = process_image(
+        image_names, exposures, algo, response, cache_response,
+        radiance_output=radiance_output, align=align,
+        cache_shifts=cache_shifts, preview=preview
+    )
+
+    img_outs = []
+    with ExitStack() as stack:
+        if writer is None:
+            writer = stack.enter_context(ImageWriter())
+
+        for index, tonemapper in enumerate(tonemappers):
+            with stage('tonemap'):
+                ldr = tonemapper.process(hdr_img)
+
+            if outputs:
+                img_out = get_image_output(
+                    None, outputs[index], preview=preview
+                )
+            else:
+                operator = tonemaps[index][0]
+                suffix = operator
+                if [name for name, _ in tonemaps].count(operator) > 1:
+                    suffix = '{0}-{1}'.format(operator, index + 1)
+                img_out = get_image_output(
+                    get_image_name(image_names), None, suffix + '_hdr',
+                    preview
+                )
+
+            write_ldr(ldr, img_out, encoding, writer)
+            img_outs.append(img_out)
+
+    return img_outs
 
 
 def reinhard_hdr(image_names,
@@ -130,100 +458,958 @@ def reinhard_hdr(image_names,
                  intensity=0.0,
                  light_adapt=1.0,
                  color_adapt=0.0,
-                 output=None):
+                 output=None,
+                 response=None,
+                 cache_response=False,
+                 radiance_output=None,
+                 align=True,
+                 cache_shifts=False,
+                 preview=None,
+                 encoding=None,
+                 writer=None,
+                 result_cache=None):
     """
     Create an HDR image from the supplied images.
 
-    :param images: List of images to process.
+    :param images: List of images to process or a saved radiance map.
+    :param response: Optional response curve (array or .npy path).
+    :param cache_response: Reuse and store camera response curves.
+    :param radiance_output: Optional file to save the radiance map to.
+    :param align: False to skip alignment or a dictionary of options.
+    :param cache_shifts: Reuse and store alignment shifts.
+    :param preview: Decode the images at 1/2, 1/4 or 1/8 scale and
+        write a _preview image.
+    :param encoding: Optional dictionary of output depth (8 or 16),
+        quality (JPEG and WebP) and compression (PNG).
+    :param writer: Optional output.ImageWriter to encode the image on
+        a background thread.
+    :param result_cache: Optional cache.ResultCache, an unchanged result
+        is copied from the cache instead of being recomputed.
     :return: Returns name of new HDR image.
     """
-    hdr_img = process_image(image_names, exposures, algo)
-
-    tonemap_reinhard = cv2.createTonemapReinhard(
-        gamma, intensity, light_adapt, color_adapt
+    pipeline = HdrPipeline(
+        'reinhard',
+        {
+            'gamma': gamma, 'intensity': intensity,
+            'light_adapt': light_adapt, 'color_adapt': color_adapt
+        },
+        algo, response=response, cache_response=cache_response, align=align,
+        cache_shifts=cache_shifts, preview=preview, encoding=encoding,
+        result_cache=result_cache
+    )
+    return pipeline.process(
+        image_names, exposures, output, radiance_output, writer
     )
-    ldr_reinhard = tonemap_reinhard.process(hdr_img)
 
-    img_out = get_image_output(image_names[1], output)
-    cv2.imwrite(img_out, ldr_reinhard * 255)
 
+def create_tonemap(operator, **params):
+    """
+    Create an OpenCV tonemap object for the named operator.
 
-def get_image_output(image, output):
-    if output:
+    Unlike other algorithm objects tonemaps are not cached: they are
+    cheap to create and TonemapReinhard.process replaces its intensity
+    with exp(-intensity), so a reused object drifts on every call.
+
+    :param operator: One of drago, durand, linear, mantiuk or reinhard.
+    :param params: Tonemap parameters, missing values use the defaults.
+    :return: Returns the tonemap object.
+    """
+    try:
+        factory, defaults = TONEMAPS[operator]
+    except KeyError:
+        raise HdrException(
+            'The {0} tonemap is not supported.'.format(operator)
+        )
+
+    names = [name for name, _ in defaults]
+    unknown = set(params) - set(names)
+    if unknown:
+        raise HdrException(
+            'Invalid {0} tonemap parameters: {1}. Valid parameters are '
+            '{2}.'.format(
+                operator, ', '.join(sorted(unknown)), ', '.join(names)
+            )
+        )
+
+    args = [params.get(name, default) for name, default in defaults]
+    return getattr(cv2, factory)(*args)
+
+
+def get_image_name(image_names):
+    """
+    Return the input image that output names are derived from.
+    """
+    return image_names[min(1, len(image_names) - 1)]
+
+
+def get_image_output(image, output, suffix='hdr', preview=None):
+    if output and preview:
+        root, ext = os.path.splitext(output)
+        return '{0}_preview{1}'.format(root, ext)
+    elif output:
         return output
     else:
-        return image.replace('.', '_hdr.')
+        if preview:
+            suffix += '_preview'
 
+        root, ext = os.path.splitext(image)
+        if ext.lower() in RADIANCE_EXTENSIONS:
+            ext = '.jpg'
+        return '{0}_{1}{2}'.format(root, suffix, ext)
 
-def get_exposure(image):
-    img = PIL.Image.open(image)
-    exposure = img._getexif()[33434]
-    return exposure[0] / exposure[1]
+
+def get_exposure(image, exif=None):
+    """
+    Return the exposure time of the image from the EXIF header.
+    """
+    exif = exif or read_exif(image)
+
+    if not exif['exposure']:
+        raise HdrException(
+            'No exposure time found in {0}, exposures must be '
+            'provided.'.format(image)
+        )
+
+    return exif['exposure']
 
 
+@profiled('exposures')
 def get_exposures(exposures, image_names):
-    if exposures:
-        try:
+    if exposures is not None and len(exposures):
+        if isinstance(exposures, str):
             exposures = exposures.split(',')
-        except Exception:
-            raise HdrException('Exposures must be a comma separated list.')
     else:
-        exposures = [get_exposure(image) for image in image_names]
+        exposures = [
+            get_exposure(image, exif) for image, exif in
+            zip(image_names, read_exif_batch(image_names))
+        ]
 
     return array(exposures, dtype=float32)
 
 
-def process_image(image_names, exposures, algo):
-    images = read_images(image_names)
-    exposures = get_exposures(exposures, image_names)
-    align_images(images)
+@profiled('exposures')
+def get_buffer_exposures(exposures, images):
+    """
+    Return the exposure times of a bracket set held in memory.
+
+    :param exposures: Optional exposure times as a sequence or comma
+        separated string, read from the EXIF data of encoded images by
+        default.
+    :param images: List of encoded image bytes or decoded arrays.
+    """
+    if exposures is not None and len(exposures):
+        return get_exposures(exposures, None)
+
+    times = []
+    for index, image in enumerate(images):
+        if isinstance(image, numpy.ndarray):
+            raise HdrException(
+                'Exposures must be provided for decoded images.'
+            )
+
+        times.append(get_exposure(
+            'image {0}'.format(index), read_exif_bytes(bytes(image))
+        ))
+
+    return array(times, dtype=float32)
+
+
+def get_preview_params(operator, params, preview=None):
+    """
+    Return tonemap parameters adjusted for a reduced resolution preview.
+
+    Parameters measured in pixels are scaled with the image so the
+    preview looks like the full resolution result.
+    """
+    if not preview or operator != 'durand':
+        return params
+
+    params = dict(params)
+    sigma_space = dict(TONEMAPS['durand'][1])['sigma_space']
+    params['sigma_space'] = params.get('sigma_space', sigma_space) / preview
+    return params
+
+
+def get_read_flag(preview=None):
+    """
+    Return the cv2.imread flag for a preview scale.
+
+    Reduced flags let libjpeg decode JPEGs at a fraction of the size
+    using DCT scaling, which is much faster than a full decode.
+    """
+    if not preview or preview == 1:
+        return cv2.IMREAD_COLOR
 
-    if algo == 'debevec':
-        hdr_img = process_debevec(images, exposures)
-    elif algo == 'robertson':
-        hdr_img = process_robertson(images, exposures)
+    try:
+        return PREVIEW_FLAGS[preview]
+    except KeyError:
+        raise HdrException(
+            'Preview scale must be one of 2, 4 or 8, not {0}.'.format(preview)
+        )
+
+
+def is_radiance(image_names):
+    """
+    Return True if the input is a single saved radiance map.
+    """
+    return len(image_names) == 1 and os.path.splitext(
+        image_names[0]
+    )[1].lower() in RADIANCE_EXTENSIONS
+
+
+@profiled('decode')
+def load_radiance(name, preview=None):
+    """
+    Load a radiance map saved with save_radiance.
+
+    .npy files are memory mapped so loading is close to free and only
+    the pages that are used get read.
+
+    :param preview: Optional factor to shrink the radiance map by.
+    :return: Returns the float32 radiance map.
+    """
+    ext = os.path.splitext(name)[1].lower()
+
+    if ext == '.npy':
+        try:
+            hdr_img = numpy.load(name, mmap_mode='r')
+        except Exception as error:
+            raise HdrException(
+                'Unable to read radiance map {0}: {1}'.format(name, error)
+            )
     else:
-        raise HdrException('The {0} algorithm is not supported.'.format(algo))
+        hdr_img = cv2.imread(name, cv2.IMREAD_ANYDEPTH | cv2.IMREAD_COLOR)
+
+    if hdr_img is None or hdr_img.ndim != 3 or hdr_img.shape[2] != 3:
+        raise HdrException('Unable to read radiance map {0}.'.format(name))
+
+    if hdr_img.dtype != float32:
+        hdr_img = hdr_img.astype(float32)
+
+    if preview and preview > 1:
+        get_read_flag(preview)
+        hdr_img = cv2.resize(
+            numpy.asarray(hdr_img), None, fx=1.0 / preview,
+            fy=1.0 / preview, interpolation=cv2.INTER_AREA
+        )
 
     return hdr_img
 
 
-def process_debevec(images, exposures):
-    calibrate_debevec = cv2.createCalibrateDebevec()
-    response_debevec = calibrateDebevec.process(images, times=exposures)
+def merge_hdr(image_names,
+              output=None,
+              algo='debevec',
+              exposures=None,
+              response=None,
+              cache_response=False,
+              samples=None,
+              downscale=1,
+              align=True,
+              cache_shifts=False):
+    """
+    Merge the supplied images and save the radiance map.
+
+    The format is chosen from the output extension: .hdr for Radiance
+    RGBE, .exr for half float OpenEXR or .npy for a memory mappable
+    float32 array. The saved file can be passed to the tonemap functions
+    in place of the images.
+
+    :param images: List of images to process.
+    :return: Returns name of the saved radiance map.
+    """
+    if not output:
+        root = os.path.splitext(get_image_name(image_names))[0]
+        output = root + '_hdr.hdr'
+
+    process_image(
+        image_names, exposures, algo, response, cache_response,
+        radiance_output=output, samples=samples, downscale=downscale,
+        align=align, cache_shifts=cache_shifts
+    )
+    return output
+
+
+def parse_tonemap(spec):
+    """
+    Parse a tonemap specification string.
+
+    The format is operator[:name=value,...] for example
+    reinhard:gamma=2.2,intensity=-1.
+
+    :return: Returns a tuple of operator and params dictionary.
+    """
+    operator, _, options = spec.partition(':')
+    params = {}
+
+    for option in filter(None, options.split(',')):
+        name, sep, value = option.partition('=')
+        if not sep:
+            raise HdrException(
+                'Invalid tonemap option {0}, expected name=value.'.format(
+                    option
+                )
+            )
+
+        try:
+            params[name.strip().replace('-', '_')] = float(value)
+        except ValueError:
+            raise HdrException(
+                'Tonemap option {0} must be a number.'.format(name)
+            )
+
+    return operator.strip(), params
+
+
+def process_image(image_names,
+                  exposures,
+                  algo,
+                  response=None,
+                  cache_response=False,
+                  cache_dir=None,
+                  radiance_output=None,
+                  samples=None,
+                  downscale=1,
+                  align=True,
+                  cache_shifts=False,
+                  preview=None):
+    """
+    Merge the images into a radiance map.
+
+    :param image_names: List of images or a saved radiance map.
+    :param algo: Merge algorithm, debevec, robertson or mertens.
+    :return: Returns the float32 radiance map.
+    """
+    pipeline = HdrPipeline(
+        algo=algo, response=response, cache_response=cache_response,
+        cache_dir=cache_dir, samples=samples, downscale=downscale,
+        align=align, cache_shifts=cache_shifts, preview=preview
+    )
+    return pipeline.merge(image_names, exposures, radiance_output)
+
+
+def process_buffers(images,
+                    exposures=None,
+                    tonemap='drago',
+                    params=None,
+                    algo='debevec',
+                    merge_params=None,
+                    response=None,
+                    align=True,
+                    preview=None,
+                    encoding=None,
+                    output_format=None):
+    """
+    Create an HDR image from a bracket set held in memory.
+
+    Nothing touches the disk, which suits servers and notebooks that
+    already hold the frames::
+
+        ldr = process_buffers([dark, mid, bright], [1, 0.25, 0.0625])
+        jpeg = process_buffers(jpeg_buffers, output_format='.jpg')
+
+    :param images: List of encoded image bytes or decoded 8 bit BGR
+        arrays.
+    :param exposures: Optional exposure times as a sequence or comma
+        separated string, read from the EXIF data of encoded images by
+        default. Not used by mertens.
+    :param tonemap: Tonemap operator name, linear for mertens.
+    :param params: Dictionary of tonemap parameters.
+    :param algo: Merge algorithm, debevec, robertson or mertens.
+    :param merge_params: Dictionary of mertens weights.
+    :param response: Optional response curve (array or .npy path).
+    :param align: False to skip alignment or a dictionary of options.
+    :param preview: Decode the images at 1/2, 1/4 or 1/8 scale.
+    :param encoding: Optional dictionary of output depth (8 or 16),
+        quality (JPEG and WebP) and compression (PNG).
+    :param output_format: Optional format extension such as .jpg or
+        png to return encoded bytes in.
+    :return: Returns the tonemapped 8 or 16 bit array or the encoded
+        bytes.
+    """
+    pipeline = HdrPipeline(
+        tonemap, params, algo, merge_params, response=response,
+        align=align, preview=preview, encoding=encoding
+    )
+    return pipeline.process_images(images, exposures, output_format)
+
 
-    merge_debevec = cv2.createMergeDebevec()
+@profiled('merge')
+def process_debevec(images, exposures, response=None):
+    if response is None:
+        calibrate_debevec = get_algorithm('createCalibrateDebevec')
+        response = calibrate_debevec.process(images, times=exposures)
+
+    merge_debevec = get_algorithm('createMergeDebevec')
     return merge_debevec.process(
         images,
         times=exposures,
-        response=response_debevec
+        response=response
     )
 
 
-def process_mertens(images, contrast, saturation, exposure):
-    merge_mertens = cv2.createMergeMertens(contrast, saturation, exposure)
+@profiled('merge')
+def process_mertens(images, contrast, saturation, exposure, fast=False):
+    if fast:
+        merge_mertens = FastMergeMertens(contrast, saturation, exposure)
+    else:
+        merge_mertens = get_algorithm(
+            'createMergeMertens', contrast, saturation, exposure
+        )
     return merge_mertens.process(images)
 
 
-def process_roberston(images, exposures):
-    calibrate_robertson = cv2.createCalibrateRobertson()
-    response_robertson = calibrateRobertson.process(images, times=exposures)
+@profiled('merge')
+def process_robertson(images, exposures, response=None):
+    if response is None:
+        calibrate_robertson = get_algorithm('createCalibrateRobertson')
+        response = calibrate_robertson.process(images, times=exposures)
 
-    merge_robertson = cv2.createMergeRoberston()
+    merge_robertson = get_algorithm('createMergeRobertson')
     return merge_robertson.process(
         images,
         times=exposures,
-        response=response_robertson
+        response=response
     )
 
 
-def read_images(image_names):
-    images = []
-    for image_name in image_names:
-        image = cv2.imread(image_name)
-        images.append(image)
+@profiled('decode')
+def read_images(image_names, preview=None, workers=None):
+    """
+    Decode the images concurrently.
+
+    cv2.imread releases the GIL so the frames of a bracket decode in
+    parallel on a thread pool.
+
+    :param preview: Optional 2, 4 or 8 to decode at reduced scale.
+    :param workers: Number of decode threads, defaults to one per
+        image up to the thread budget, see threads.get_threads.
+    :return: Returns the list of decoded images.
+    """
+    flag = get_read_flag(preview)
+    workers = workers or min(len(image_names), get_threads())
+
+    def read_image(image_name):
+        return cv2.imread(image_name, flag)
+
+    if workers > 1 and len(image_names) > 1:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            images = list(executor.map(read_image, image_names))
+    else:
+        images = [read_image(image_name) for image_name in image_names]
+
+    for image_name, image in zip(image_names, images):
+        if image is None:
+            raise HdrException('Unable to read image {0}.'.format(image_name))
+
+    check_images(images, image_names)
     return images
 
 
+def check_images(images, labels):
+    """
+    Raise HdrException unless the frames have the same size and type.
+
+    :param labels: Names of the frames for error messages.
+    """
+    for label, image in zip(labels, images):
+        if (image.shape, image.dtype) != (images[0].shape, images[0].dtype):
+            raise HdrException(
+                'All images must be the same size and type, {0} is {1} {2} '
+                'but {3} is {4} {5}.'.format(
+                    label, image.shape, image.dtype, labels[0],
+                    images[0].shape, images[0].dtype
+                )
+            )
+
+
+@profiled('decode')
+def decode_images(images, preview=None, workers=None):
+    """
+    Decode a bracket set held in memory.
+
+    Encoded buffers are decoded concurrently with cv2.imdecode, which
+    releases the GIL like cv2.imread. Arrays are used as they are, they
+    must be 8 bit BGR like cv2.imread returns.
+
+    :param images: List of encoded image bytes or decoded arrays.
+    :param preview: Optional 2, 4 or 8 to decode at reduced scale.
+    :param workers: Number of decode threads, defaults to one per
+        image up to the thread budget, see threads.get_threads.
+    :return: Returns a new list of decoded images.
+    """
+    flag = get_read_flag(preview)
+    workers = workers or min(len(images), get_threads())
+
+    def decode_image(image):
+        if isinstance(image, numpy.ndarray):
+            if preview and preview != 1:
+                image = cv2.resize(
+                    image, None, fx=1.0 / preview, fy=1.0 / preview,
+                    interpolation=cv2.INTER_AREA
+                )
+            return image
+
+        return cv2.imdecode(numpy.frombuffer(image, numpy.uint8), flag)
+
+    if workers > 1 and len(images) > 1:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            frames = list(executor.map(decode_image, images))
+    else:
+        frames = [decode_image(image) for image in images]
+
+    labels = ['image {0}'.format(index) for index in range(len(frames))]
+    for label, frame in zip(labels, frames):
+        if frame is None:
+            raise HdrException('Unable to decode {0}.'.format(label))
+
+        if frame.dtype != numpy.uint8 or frame.ndim != 3 or \
+                frame.shape[2] != 3:
+            raise HdrException(
+                'Decoded images must be 8 bit BGR, {0} is {1} {2}.'.format(
+                    label, frame.shape, frame.dtype
+                )
+            )
+
+    check_images(frames, labels)
+    return frames
+
+
+@profiled('save_radiance')
+def save_radiance(hdr_img, name):
+    """
+    Save a float32 radiance map.
+
+    The format is chosen from the extension, .hdr (Radiance RGBE),
+    .exr (half float OpenEXR) or .npy (memory mappable float32).
+    """
+    ext = os.path.splitext(name)[1].lower()
+
+    if ext == '.npy':
+        numpy.save(name, hdr_img)
+        return name
+    elif ext == '.exr':
+        params = [cv2.IMWRITE_EXR_TYPE, cv2.IMWRITE_EXR_TYPE_HALF]
+    elif ext == '.hdr':
+        params = []
+    else:
+        raise HdrException(
+            'Radiance maps must be saved as {0}.'.format(
+                ', '.join(RADIANCE_EXTENSIONS)
+            )
+        )
+
+    try:
+        written = cv2.imwrite(name, hdr_img, params)
+    except cv2.error as error:
+        raise HdrException(
+            'Unable to write radiance map {0}: {1}'.format(name, error)
+        )
+
+    if not written:
+        raise HdrException('Unable to write radiance map {0}.'.format(name))
+
+    return name
+
+
 def write_image(image, name):
     cv2.imwrite(name, image)
+
+
+class HdrPipeline(object):
+    """
+    Merge and tonemap many bracket sets with one configuration.
+
+    The merge, calibration and alignment objects are built once and
+    reused for every bracket set, as are the radiance and tonemap
+    buffers while consecutive sets have the same size. A pipeline is
+    not thread safe, use one per thread.
+
+    :param tonemap: Tonemap operator name, None to only merge.
+    :param params: Dictionary of tonemap parameters.
+    :param algo: Merge algorithm, debevec, robertson or mertens.
+    :param merge_params: Dictionary of mertens contrast, saturation and
+        exposure weights.
+    :param response: Optional response curve (array or .npy path).
+    :param cache_response: Reuse and store camera response curves.
+    :param cache_dir: Directory of the response curve cache.
+    :param samples: Calibrate from this many stratified pixel samples.
+    :param downscale: Factor to shrink the frames by before sampling.
+    :param align: False to skip alignment or a dictionary of options.
+    :param cache_shifts: Reuse and store alignment shifts.
+    :param preview: Decode the images at 1/2, 1/4 or 1/8 scale and
+        write _preview images.
+    :param encoding: Optional dictionary of output depth (8 or 16),
+        quality (JPEG and WebP) and compression (PNG).
+    :param result_cache: Optional cache.ResultCache to reuse unchanged
+        results from.
+    :param tile_workers: Tonemap durand or mantiuk in overlapping tiles
+        on this many threads, see tonemap.tonemap_parallel.
+    :param fast: Fuse mertens brackets with the approximate
+        fusion.FastMergeMertens, which computes the weights at reduced
+        resolution.
+    """
+
+    def __init__(self,
+                 tonemap=None,
+                 params=None,
+                 algo='debevec',
+                 merge_params=None,
+                 response=None,
+                 cache_response=False,
+                 cache_dir=None,
+                 samples=None,
+                 downscale=1,
+                 align=True,
+                 cache_shifts=False,
+                 preview=None,
+                 encoding=None,
+                 result_cache=None,
+                 tile_workers=None,
+                 fast=False):
+        if algo not in MERGE_ALGORITHMS:
+            raise HdrException(
+                'The {0} algorithm is not supported.'.format(algo)
+            )
+
+        get_read_flag(preview)
+
+        if tile_workers and tonemap not in PARALLEL_TONEMAPS:
+            raise HdrException(
+                'Tile workers are only supported for the {0} '
+                'tonemaps.'.format(' and '.join(PARALLEL_TONEMAPS))
+            )
+
+        if fast and algo != 'mertens':
+            raise HdrException('Fast fusion requires the mertens algorithm.')
+
+        self.algo = algo
+        self.fast = fast
+        self.cache_response = cache_response
+        self.cache_dir = cache_dir
+        self.samples = samples
+        self.downscale = downscale
+        self.align = align
+        self.cache_shifts = cache_shifts
+        self.preview = preview
+        self.encoding = encoding
+        self.result_cache = result_cache
+        self.tile_workers = tile_workers
+        self.operator = tonemap
+        self.params = get_preview_params(tonemap, params or {}, preview)
+        self.merge_params = None
+
+        if tonemap and not tile_workers:
+            # Fail early on an unknown operator or parameter.
+            create_tonemap(tonemap, **self.params)
+
+        if algo == 'mertens':
+            weights = dict(MERTENS_PARAMS)
+            unknown = set(merge_params or {}) - set(weights)
+            if unknown:
+                raise HdrException(
+                    'Invalid mertens parameters: {0}.'.format(
+                        ', '.join(sorted(unknown))
+                    )
+                )
+
+            weights.update(merge_params or {})
+            self.merge_params = weights
+            if fast:
+                self.merger = FastMergeMertens(
+                    *[weights[name] for name, _ in MERTENS_PARAMS]
+                )
+            else:
+                self.merger = get_algorithm(
+                    'createMergeMertens',
+                    *[weights[name] for name, _ in MERTENS_PARAMS]
+                )
+        elif algo == 'debevec':
+            self.merger = get_algorithm('createMergeDebevec')
+        else:
+            self.merger = get_algorithm('createMergeRobertson')
+
+        if isinstance(response, str):
+            response = read_response(response)
+        self.response = response
+
+        self._radiance = None
+        self._ldr = None
+
+    def _get_buffer(self, name, shape):
+        buffer = getattr(self, name)
+
+        if buffer is None or buffer.shape != shape:
+            buffer = numpy.empty(shape, numpy.float32)
+            setattr(self, name, buffer)
+
+        return buffer
+
+    def get_cache_config(self, image_names, exposures=None):
+        """
+        Return the parameters that affect the radiance map, for
+        cache keys.
+
+        The response curve the merge will use is resolved first and
+        hashed, so recalibrating a camera invalidates its results.
+        """
+        response = None
+        if self.algo != 'mertens' and not is_radiance(image_names):
+            response = self.response
+            if response is None and self.cache_response:
+                key = get_response_key(image_names[0], self.algo)
+                if key:
+                    response = load_response(key, self.cache_dir)
+
+        if response is not None:
+            response = hashlib.sha1(
+                numpy.ascontiguousarray(response).tobytes()
+            ).hexdigest()
+
+        return {
+            'algo': self.algo,
+            'merge_params': self.merge_params,
+            'fast': self.fast,
+            'exposures': exposures,
+            'response': response,
+            'samples': self.samples,
+            'downscale': self.downscale,
+            'align': self.align,
+            'preview': self.preview
+        }
+
+    def get_response(self, image_names, images, exposures):
+        """
+        Return the response curve to merge a bracket set with.
+        """
+        if self.response is not None:
+            return self.response
+
+        return get_response(
+            image_names, images, exposures, self.algo,
+            cache_dir=self.cache_dir, use_cache=self.cache_response,
+            samples=self.samples, downscale=self.downscale
+        )
+
+    def align_images(self, images, image_names):
+        """
+        Align the decoded frames of a bracket set in place.
+        """
+        align_images(
+            images, image_names, self.align, self.cache_shifts, self.preview
+        )
+
+    def merge(self, image_names, exposures=None, radiance_output=None):
+        """
+        Merge a bracket set into a radiance map.
+
+        :param image_names: List of images or a saved radiance map.
+        :param exposures: Optional comma separated exposure times, read
+            from EXIF by default.
+        :param radiance_output: Optional file to save the radiance map to.
+        :return: Returns the float32 radiance map.
+        """
+        return self._merge(image_names, exposures, radiance_output)
+
+    def _merge(self,
+               image_names,
+               exposures=None,
+               radiance_output=None,
+               reuse=False):
+        if is_radiance(image_names):
+            return load_radiance(image_names[0], self.preview)
+
+        key = None
+        if self.result_cache is not None and self.result_cache.cache_radiance:
+            key = self.result_cache.get_key(
+                'radiance', image_names,
+                self.get_cache_config(image_names, exposures)
+            )
+            hdr_img = self.result_cache.load_array(key)
+
+            if hdr_img is not None:
+                if radiance_output:
+                    save_radiance(hdr_img, radiance_output)
+                return hdr_img
+
+        images = read_images(image_names, self.preview)
+
+        times = None
+        if self.algo != 'mertens':
+            times = get_exposures(exposures, image_names)
+
+        hdr_img = self._merge_frames(images, times, image_names, reuse)
+
+        if radiance_output:
+            save_radiance(hdr_img, radiance_output)
+
+        if key:
+            self.result_cache.save_array(key, hdr_img)
+
+        return hdr_img
+
+    def _merge_frames(self, images, times, image_names=None, reuse=False):
+        out = None
+        if reuse:
+            out = self._get_buffer('_radiance', images[0].shape[:2] + (3,))
+
+        self.align_images(images, image_names)
+
+        if self.algo == 'mertens':
+            with stage('merge'):
+                return self.merger.process(images, dst=out)
+
+        response = self.get_response(image_names, images, times)
+
+        with stage('merge'):
+            return self.merger.process(
+                images, times=times, response=response, dst=out
+            )
+
+    def merge_images(self, images, exposures=None):
+        """
+        Merge a bracket set held in memory into a radiance map.
+
+        Nothing is read from or written to disk, so response curves and
+        alignment shifts are not cached.
+
+        :param images: List of encoded image bytes or decoded 8 bit BGR
+            arrays, the arrays are not modified.
+        :param exposures: Optional exposure times as a sequence or comma
+            separated string, read from the EXIF data of encoded images
+            by default.
+        :return: Returns the float32 radiance map.
+        """
+        return self._merge_images(images, exposures)
+
+    def _merge_images(self, images, exposures=None, reuse=False):
+        frames = decode_images(images, self.preview)
+
+        times = None
+        if self.algo != 'mertens':
+            times = get_buffer_exposures(exposures, images)
+
+        return self._merge_frames(frames, times, None, reuse)
+
+    def render_images(self, images, exposures=None):
+        """
+        Merge and tonemap a bracket set held in memory.
+
+        The result is a buffer owned by the pipeline like render.
+
+        :return: Returns the float32 image in [0, 1].
+        """
+        if self.operator is None:
+            raise HdrException('The pipeline has no tonemap operator.')
+
+        radiance = self._merge_images(images, exposures, True)
+        return self.tonemap(
+            radiance, self._get_buffer('_ldr', radiance.shape)
+        )
+
+    def process_images(self, images, exposures=None, output_format=None):
+        """
+        Merge and tonemap a bracket set held in memory.
+
+        :param images: List of encoded image bytes or decoded arrays.
+        :param exposures: Optional exposure times, see merge_images.
+        :param output_format: Optional format extension such as .jpg or
+            png to encode the result to.
+        :return: Returns the tonemapped image as a new 8 or 16 bit array,
+            per the encoding depth, or the encoded bytes.
+        """
+        ldr = self.render_images(images, exposures)
+
+        if output_format:
+            return encode_ldr(ldr, output_format, self.encoding)
+
+        depth = (self.encoding or {}).get('depth') or 8
+        if depth not in DTYPES:
+            raise HdrException('Output depth must be 8 or 16.')
+
+        return to_ldr(ldr, depth, out=numpy.empty(ldr.shape, DTYPES[depth]))
+
+    def tonemap(self, radiance, out=None):
+        """
+        Tonemap a radiance map.
+
+        :param out: Optional float32 array to write the result to.
+        :return: Returns the float32 image in [0, 1].
+        """
+        if self.operator is None:
+            raise HdrException('The pipeline has no tonemap operator.')
+
+        with stage('tonemap'):
+            if self.tile_workers:
+                return tonemap_parallel(
+                    self.operator, radiance, self.tile_workers, out=out,
+                    **self.params
+                )
+
+            return create_tonemap(self.operator, **self.params).process(
+                radiance, dst=out
+            )
+
+    def render(self, image_names, exposures=None, radiance_output=None):
+        """
+        Merge and tonemap one bracket set without writing it.
+
+        The result is a buffer owned by the pipeline, it is overwritten
+        by the next bracket set of the same size.
+
+        :return: Returns the float32 image in [0, 1].
+        """
+        if self.operator is None:
+            raise HdrException('The pipeline has no tonemap operator.')
+
+        radiance = self._merge(image_names, exposures, radiance_output, True)
+        return self.tonemap(
+            radiance, self._get_buffer('_ldr', radiance.shape)
+        )
+
+    def process(self,
+                image_names,
+                exposures=None,
+                output=None,
+                radiance_output=None,
+                writer=None):
+        """
+        Merge, tonemap and write one bracket set.
+
+        :param image_names: List of images or a saved radiance map.
+        :param exposures: Optional comma separated exposure times.
+        :param output: Optional output file name.
+        :param radiance_output: Optional file to save the radiance map to.
+        :param writer: Optional output.ImageWriter to encode the image on
+            a background thread.
+        :return: Returns name of new HDR image.
+        """
+        img_out = get_image_output(
+            get_image_name(image_names), output, preview=self.preview
+        )
+
+        key = None
+        if self.result_cache is not None:
+            ext = os.path.splitext(img_out)[1].lower()
+            config = self.get_cache_config(image_names, exposures)
+            config.update(
+                tonemap=self.operator, params=self.params,
+                encoding=self.encoding, ext=ext,
+                tiled=bool(self.tile_workers)
+            )
+            key = self.result_cache.get_key('result', image_names, config)
+
+            if self.result_cache.load_file(key, ext, img_out):
+                if radiance_output:
+                    self._merge(image_names, exposures, radiance_output)
+                return img_out
+
+        ldr = self.render(image_names, exposures, radiance_output)
+
+        if key:
+            # The file must exist before it can be stored.
+            write_ldr(ldr, img_out, self.encoding)
+            self.result_cache.save_file(key, ext, img_out)
+        else:
+            write_ldr(ldr, img_out, self.encoding, writer)
+
+        return img_out
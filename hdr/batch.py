@@ -0,0 +1,414 @@
+# -*- coding: utf-8 -*-
+#
+# hdr: A Python API and CLI for creating HDR images.
+#
+# Copyright (C) 2017 Sean Marlow
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import inspect
+import json
+import os
+import shlex
+import threading
+
+from contextlib import contextmanager
+
+from hdr.exceptions import HdrException
+from hdr.profiling import Profiler
+from hdr.threads import get_image_pixels, plan_threads, set_threads
+
+OPERATORS = ('drago', 'durand', 'mantiuk', 'mertens', 'reinhard')
+SET_OPTIONS = ('exposures', 'output', 'radiance_output')
+
+_pipelines = threading.local()
+
+
+def get_operator(name):
+    """
+    Return the api function for the named tonemap operator.
+    """
+    if name not in OPERATORS:
+        raise HdrException('The {0} operator is not supported.'.format(name))
+
+    # Imported on use so reading a manifest does not load OpenCV.
+    from hdr import api
+
+    return getattr(api, name + '_hdr')
+
+
+def split_options(operator, options):
+    """
+    Split operator keyword arguments into pipeline arguments.
+
+    :param operator: Name of the tonemap operator.
+    :param options: Operator keyword arguments other than the images,
+        exposures and output names.
+    :return: Returns a tuple of the tonemap name, tonemap parameters and
+        the remaining HdrPipeline keyword arguments.
+    """
+    func = get_operator(operator)
+    params = inspect.signature(func).parameters
+
+    unknown = set(options) - set(params)
+    unknown.update(
+        set(options) & {'image_names', 'writer', 'result_cache'}
+    )
+    if unknown:
+        raise HdrException(
+            'Invalid {0} options: {1}.'.format(
+                operator, ', '.join(sorted(unknown))
+            )
+        )
+
+    from hdr import api
+
+    options = dict(options)
+    tonemap = 'linear' if operator == 'mertens' else operator
+    tonemap_params = {
+        name: options.pop(name)
+        for name, _ in api.TONEMAPS[tonemap][1] if name in options
+    }
+
+    if operator == 'mertens':
+        options['algo'] = 'mertens'
+        options['merge_params'] = {
+            name: options.pop(name)
+            for name, _ in api.MERTENS_PARAMS if name in options
+        }
+
+    return tonemap, tonemap_params, options
+
+
+def create_pipeline(operator, options):
+    """
+    Return an api.HdrPipeline configured like the operator function.
+
+    :param operator: Name of the tonemap operator.
+    :param options: Operator keyword arguments other than the images,
+        exposures and output names.
+    :return: Returns the pipeline.
+    """
+    from hdr import api
+
+    tonemap, tonemap_params, options = split_options(operator, options)
+    return api.HdrPipeline(tonemap, tonemap_params, **options)
+
+
+def run_tiled(operator, options, images, memory_limit, exposures=None,
+              output=None, radiance_output=None):
+    """
+    Run a job with tiles.tiled_hdr instead of a pipeline.
+
+    :param memory_limit: Memory budget in bytes for a tile.
+    :return: Returns name of new HDR image.
+    """
+    from hdr import tiles
+
+    tonemap, params, options = split_options(operator, options)
+    return tiles.tiled_hdr(
+        images, tonemap, params, options.get('algo', 'debevec'),
+        exposures, output, options.get('response'),
+        options.get('cache_response', False), memory_limit,
+        merge_params=options.get('merge_params'),
+        radiance_output=radiance_output,
+        align=options.get('align', True),
+        cache_shifts=options.get('cache_shifts', False),
+        preview=options.get('preview'),
+        encoding=options.get('encoding')
+    )
+
+
+def get_pipeline(operator, options):
+    """
+    Return a pipeline for the options, reusing this thread's last one.
+
+    Consecutive jobs with the same configuration share one pipeline and
+    so its algorithm objects and buffers. Only the last pipeline is
+    kept to bound the memory held by each worker.
+    """
+    try:
+        key = json.dumps([operator, options], sort_keys=True)
+    except TypeError:
+        # Options such as a response curve array are not compared.
+        return create_pipeline(operator, options)
+
+    if getattr(_pipelines, 'key', None) != key:
+        _pipelines.pipeline = create_pipeline(operator, options)
+        _pipelines.key = key
+
+    return _pipelines.pipeline
+
+
+def read_manifest(manifest, operator='drago'):
+    """
+    Read a batch manifest and return a list of jobs.
+
+    The manifest is either a JSON list of jobs, an index written by
+    hdr scan or a text file with one bracket set per line as whitespace
+    separated image names. Each JSON job is an object with an images
+    list and optional operator, output and operator keyword arguments
+    such as gamma or algo::
+
+        [{"images": ["a1.jpg", "a2.jpg"], "operator": "durand",
+          "gamma": 2.2, "output": "a.jpg"}]
+
+    Relative image paths are resolved against the manifest directory.
+
+    :param manifest: Path to the manifest file.
+    :param operator: Default operator for jobs that do not name one.
+    :return: Returns a list of job dictionaries.
+    """
+    base = os.path.dirname(os.path.abspath(manifest))
+
+    with open(manifest) as manifest_file:
+        data = manifest_file.read()
+
+    if data.lstrip().startswith(('[', '{')):
+        try:
+            entries = json.loads(data)
+        except ValueError as error:
+            raise HdrException(
+                'Invalid JSON manifest {0}: {1}'.format(manifest, error)
+            )
+
+        if isinstance(entries, dict):
+            base = os.path.normpath(
+                os.path.join(base, entries.get('root', ''))
+            )
+            entries = entries.get('sets', [])
+    else:
+        entries = [
+            {'images': shlex.split(line)}
+            for line in data.splitlines()
+            if line.strip() and not line.lstrip().startswith('#')
+        ]
+
+    jobs = []
+    for entry in entries:
+        if not isinstance(entry, dict) or not entry.get('images'):
+            raise HdrException(
+                'Each manifest job requires a list of images.'
+            )
+
+        job = dict(entry)
+        job.setdefault('operator', operator)
+        job['images'] = [
+            os.path.join(base, image) for image in job['images']
+        ]
+        if job.get('output'):
+            job['output'] = os.path.join(base, job['output'])
+
+        jobs.append(job)
+
+    return jobs
+
+
+def check_images(images):
+    """
+    Raise an HdrException for a bracket set without images.
+    """
+    if not images:
+        raise HdrException('A bracket set requires at least one image.')
+
+
+@contextmanager
+def _no_profiler():
+    # contextlib.nullcontext needs Python 3.7.
+    yield
+
+
+def run_job(job, threads=None, profile=False, result_cache=None):
+    """
+    Run a single batch job.
+
+    Errors are caught and returned so one bad bracket set never aborts
+    the rest of the batch.
+
+    :param job: Job dictionary from read_manifest. Jobs with a tiled
+        key run tiled with that tile memory budget, see memory.fit_job.
+    :param threads: Number of OpenCV and decode threads to use in this
+        process, see threads.set_threads.
+    :param profile: Add a profile key with the time and peak memory of
+        each pipeline stage, see profiling.Profiler.to_dict.
+    :param result_cache: Optional cache.ResultCache to reuse unchanged
+        outputs from.
+    :return: Returns a result dictionary with images, output and error.
+    """
+    result = {'images': job['images'], 'output': None, 'error': None}
+    profiler = Profiler() if profile else None
+
+    try:
+        set_threads(threads)
+
+        options = dict(job)
+        images = options.pop('images')
+        check_images(images)
+        operator = options.pop('operator')
+        tiled = options.pop('tiled', None)
+        kwargs = {
+            name: options.pop(name) for name in SET_OPTIONS if name in options
+        }
+
+        with profiler or _no_profiler():
+            if tiled:
+                result['output'] = run_tiled(
+                    operator, options, images, tiled, **kwargs
+                )
+            else:
+                pipeline = get_pipeline(operator, options)
+                pipeline.result_cache = result_cache
+                result['output'] = pipeline.process(images, **kwargs)
+    except Exception as error:
+        result['error'] = str(error) or error.__class__.__name__
+
+    if profiler:
+        result['profile'] = profiler.to_dict()
+
+    return result
+
+
+def process_batch(jobs,
+                  workers=None,
+                  threads=None,
+                  callback=None,
+                  profile=False,
+                  result_cache=None,
+                  cores=None,
+                  memory_limit=None):
+    """
+    Process many bracket sets in parallel across a process pool.
+
+    Workers and threads not given split the core budget between them,
+    picked from the size of the images of the first job that has any,
+    see threads.plan_threads. Jobs without images fail on their own.
+
+    With a memory limit, jobs are started in order while the estimated
+    peak memory of the running jobs fits in what the worker processes
+    leave of the limit, see memory.estimate_job. A job that does not
+    fit on its own runs tiled or at reduced scale and its result has a
+    fallback key describing how, see memory.fit_job.
+
+    :param jobs: List of job dictionaries.
+    :param workers: Number of worker processes.
+    :param threads: OpenCV threads per worker.
+    :param callback: Optional function called with each result as it
+        completes.
+    :param profile: Add a per stage profile to each result.
+    :param result_cache: Optional cache.ResultCache, jobs whose inputs
+        and options are unchanged copy the cached output.
+    :param cores: Core budget, defaults to threads.get_cores.
+    :param memory_limit: Optional memory budget in bytes for the whole
+        batch, including the worker processes.
+    :return: Returns the list of results in job order.
+    """
+    from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+    pixels = None
+    if workers is None or threads is None:
+        image = next((job['images'][0] for job in jobs if job['images']), None)
+        if image:
+            pixels = get_image_pixels(image)
+
+    if memory_limit and workers is None:
+        from hdr import memory
+
+        # Leave at least half the limit to the jobs themselves.
+        workers = min(
+            plan_threads(len(jobs), pixels, None, threads, cores)[0],
+            max(1, memory_limit // 2 // memory.PROCESS_BYTES)
+        )
+
+    workers, threads = plan_threads(
+        len(jobs), pixels, workers, threads, cores
+    )
+    results = [None] * len(jobs)
+
+    def finish(index, result):
+        results[index] = result
+
+        if callback:
+            callback(result)
+
+    def fail(index, message):
+        finish(index, {
+            'images': jobs[index]['images'],
+            'output': None,
+            'error': message
+        })
+
+    plans = [(job, 0, None) for job in jobs]
+    available = None
+
+    if memory_limit:
+        from hdr import memory
+
+        available = memory_limit - workers * memory.PROCESS_BYTES
+        if available <= 0:
+            raise HdrException(
+                'The memory limit of {0} MB does not cover {1} worker '
+                'processes.'.format(memory_limit // memory.MB, workers)
+            )
+
+        for index, job in enumerate(jobs):
+            try:
+                check_images(job['images'])
+                plans[index] = memory.fit_job(job, available)
+            except Exception as error:
+                plans[index] = None
+                fail(index, str(error) or error.__class__.__name__)
+
+    pending = [index for index, plan in enumerate(plans) if plan]
+    running = {}
+    used = 0
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        while pending or running:
+            # Start waiting jobs in order while they fit the budget. The
+            # first job always fits once nothing else is running.
+            for index in list(pending):
+                if len(running) >= workers:
+                    break
+
+                job, estimate, _ = plans[index]
+                if available is not None and used + estimate > available:
+                    continue
+
+                pending.remove(index)
+                used += estimate
+                future = executor.submit(
+                    run_job, job, threads, profile, result_cache
+                )
+                running[future] = index
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                index = running.pop(future)
+                _, estimate, fallback = plans[index]
+                used -= estimate
+
+                try:
+                    result = future.result()
+                except Exception as error:
+                    fail(index, 'Worker failed: {0}'.format(
+                        str(error) or error.__class__.__name__
+                    ))
+                    continue
+
+                if fallback:
+                    result['fallback'] = fallback
+                finish(index, result)
+
+    return results
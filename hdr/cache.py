@@ -0,0 +1,300 @@
+# -*- coding: utf-8 -*-
+#
+# hdr: A Python API and CLI for creating HDR images.
+#
+# Copyright (C) 2017 Sean Marlow
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Content addressed cache of pipeline results.
+
+Entries are files named by a hash of the input images, every parameter
+that affects the result and the hdr version, so a job is only skipped
+when rerunning it would produce the same bytes. Final images and,
+optionally, merged radiance maps are cached. Input files are identified
+by path, size and modification time, or by a hash of their content so
+renamed or touched files still match.
+
+The cache is opt-in and shared safely by concurrent processes: entries
+are written atomically and the least recently used entries are evicted
+once the cache grows past its size limit.
+"""
+
+import filecmp
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy
+
+from hdr import __version__
+
+DEFAULT_MAX_BYTES = 2 * 1024 * 1024 * 1024
+HASH_CHUNK = 1024 * 1024
+
+# A store that takes the cache past its limit prunes it to this fraction
+# of the limit, so a full cache is not walked on every store.
+PRUNE_FRACTION = 0.9
+TMP_PREFIX = '.tmp'
+
+
+def get_cache_dir(cache_dir=None):
+    """
+    Return the directory used to store cached results.
+
+    Defaults to $XDG_CACHE_HOME/hdr/results.
+    """
+    if cache_dir:
+        return cache_dir
+
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(
+        os.path.expanduser('~'), '.cache'
+    )
+    return os.path.join(base, 'hdr', 'results')
+
+
+def hash_file(name):
+    """
+    Return the SHA-256 hex digest of a file.
+    """
+    digest = hashlib.sha256()
+
+    with open(name, 'rb') as stream:
+        for chunk in iter(lambda: stream.read(HASH_CHUNK), b''):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+class ResultCache(object):
+    """
+    Size bounded cache of pipeline results on disk.
+
+    Instances hold settings and a running total of the cache size, so
+    they can be passed to worker processes. The total is counted on the
+    first store and the cache is only walked and pruned again once it
+    passes max_bytes, entries stored by other processes are counted
+    then.
+
+    :param cache_dir: Cache directory, see get_cache_dir.
+    :param max_bytes: Size limit of the cache. A store that takes the
+        cache past it prunes it to PRUNE_FRACTION of the limit.
+    :param hash_content: Identify input files by a hash of their content
+        instead of their path, size and modification time.
+    :param cache_radiance: Also cache merged radiance maps, so a job
+        that only changes the tonemap skips decoding and merging. Maps
+        are large, 12 bytes per pixel.
+    """
+
+    def __init__(self,
+                 cache_dir=None,
+                 max_bytes=DEFAULT_MAX_BYTES,
+                 hash_content=False,
+                 cache_radiance=False):
+        self.cache_dir = get_cache_dir(cache_dir)
+        self.max_bytes = max_bytes
+        self.hash_content = hash_content
+        self.cache_radiance = cache_radiance
+        self._size = None
+
+    def fingerprint(self, name):
+        """
+        Return the values identifying an input file.
+        """
+        if self.hash_content:
+            return hash_file(name)
+
+        stat = os.stat(name)
+        return [os.path.abspath(name), stat.st_size, stat.st_mtime_ns]
+
+    def get_key(self, kind, image_names, config):
+        """
+        Return the cache key of a result.
+
+        :param kind: Kind of artifact, such as result or radiance.
+        :param image_names: Input files of the result.
+        :param config: JSON serializable dictionary of every parameter
+            that affects the result.
+        """
+        data = json.dumps(
+            [
+                __version__,
+                kind,
+                [self.fingerprint(name) for name in image_names],
+                config
+            ],
+            sort_keys=True
+        )
+        return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+    def get_path(self, key, ext):
+        return os.path.join(self.cache_dir, key[:2], key + ext)
+
+    def _lookup(self, key, ext):
+        path = self.get_path(key, ext)
+
+        try:
+            # Mark the entry as recently used for eviction.
+            os.utime(path)
+        except OSError:
+            return None
+
+        return path
+
+    def _store(self, key, ext, write):
+        path = self.get_path(key, ext)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+
+        handle, tmp_path = tempfile.mkstemp(
+            suffix=ext, prefix=TMP_PREFIX, dir=directory
+        )
+        os.close(handle)
+
+        try:
+            write(tmp_path)
+            size = os.path.getsize(tmp_path)
+            replaced = os.path.getsize(path) if os.path.isfile(path) else 0
+            os.replace(tmp_path, path)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+
+        if self._size is None:
+            self._size = self.get_size()
+        else:
+            self._size += size - replaced
+
+        if self._size > self.max_bytes:
+            self.prune(int(self.max_bytes * PRUNE_FRACTION))
+
+        return path
+
+    def load_file(self, key, ext, output):
+        """
+        Copy a cached file to output.
+
+        The copy is skipped when output already has the same content.
+
+        :return: Returns True if the entry exists.
+        """
+        path = self._lookup(key, ext)
+        if path is None:
+            return False
+
+        if not (os.path.isfile(output) and
+                filecmp.cmp(path, output, shallow=False)):
+            shutil.copyfile(path, output)
+
+        return True
+
+    def save_file(self, key, ext, name):
+        """
+        Store a copy of a file.
+        """
+        return self._store(
+            key, ext, lambda path: shutil.copyfile(name, path)
+        )
+
+    def load_array(self, key):
+        """
+        Return a cached array or None.
+        """
+        path = self._lookup(key, '.npy')
+        if path is None:
+            return None
+
+        try:
+            return numpy.load(path)
+        except (OSError, ValueError):
+            return None
+
+    def save_array(self, key, array):
+        """
+        Store an array as .npy.
+        """
+        return self._store(key, '.npy', lambda path: numpy.save(path, array))
+
+    def get_entries(self):
+        """
+        Return (mtime, size, path) of every entry, oldest first.
+        """
+        entries = []
+
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if name.startswith(TMP_PREFIX):
+                    continue
+
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+        return sorted(entries)
+
+    def get_size(self):
+        """
+        Return the total size of the entries in bytes.
+        """
+        return sum(size for _, size, _ in self.get_entries())
+
+    def prune(self, max_bytes=None):
+        """
+        Remove the least recently used entries until the cache fits in
+        max_bytes, defaulting to the cache limit.
+
+        :return: Returns the number of bytes removed.
+        """
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        entries = self.get_entries()
+        total = sum(size for _, size, _ in entries)
+        excess = total - max_bytes
+        removed = 0
+
+        for _, size, path in entries:
+            if removed >= excess:
+                break
+
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            removed += size
+
+        self._size = total - removed
+        return removed
+
+    def clear(self):
+        """
+        Remove every entry.
+        """
+        return self.prune(0)
+
+    def get_info(self):
+        """
+        Return the cache directory, entry count and size.
+        """
+        entries = self.get_entries()
+        return {
+            'cache_dir': self.cache_dir,
+            'entries': len(entries),
+            'size': sum(size for _, size, _ in entries),
+            'max_size': self.max_bytes
+        }
@@ -0,0 +1,433 @@
+# -*- coding: utf-8 -*-
+#
+# hdr: A Python API and CLI for creating HDR images.
+#
+# Copyright (C) 2017 Sean Marlow
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import re
+import tempfile
+import threading
+
+import cv2
+import numpy
+
+from hdr.algorithms import get_algorithm
+from hdr.exceptions import HdrException
+from hdr.exif import read_exif
+from hdr.profiling import profiled
+
+LDR_SIZE = 256
+SAMPLE_STRATA = 32
+SAMPLE_CANDIDATES = 16
+SMOOTHNESS = 10.0
+MAX_CACHED_RESPONSES = 64
+
+_responses = {}
+_responses_lock = threading.Lock()
+
+
+@profiled('calibrate')
+def calibrate_response(images, exposures, algo, samples=None, downscale=1):
+    """
+    Calibrate the camera response curve for a set of images.
+
+    When samples is provided the Debevec curve is solved with NumPy
+    least squares from a fixed number of stratified pixel samples, so
+    the cost of the solve does not grow with the image size.
+
+    :param images: List of aligned images.
+    :param exposures: Array of exposure times for the images.
+    :param algo: The calibration algorithm, debevec or robertson.
+    :param samples: Optional number of pixels to sample.
+    :param downscale: Factor to shrink the frames by before sampling.
+    :return: Returns the response curve as a 256x1x3 float32 array.
+    """
+    if samples:
+        if algo != 'debevec':
+            raise HdrException(
+                'Sampled calibration is only supported with debevec.'
+            )
+
+        return calibrate_sampled(images, exposures, samples, downscale)
+
+    if algo == 'debevec':
+        calibrate = get_algorithm('createCalibrateDebevec')
+    elif algo == 'robertson':
+        calibrate = get_algorithm('createCalibrateRobertson')
+    else:
+        raise HdrException('The {0} algorithm is not supported.'.format(algo))
+
+    return calibrate.process(images, times=exposures)
+
+
+def calibrate_sampled(images,
+                      exposures,
+                      samples,
+                      downscale=1,
+                      smoothness=SMOOTHNESS):
+    """
+    Solve the Debevec response curve from a stratified pixel sample.
+
+    :return: Returns the response curve as a 256x1x3 float32 array in
+        the same form as cv2.createCalibrateDebevec.
+    """
+    exposures = numpy.asarray(exposures, dtype=numpy.float64).ravel()
+
+    if len(images) != len(exposures):
+        raise HdrException(
+            'The number of images and exposure times must match.'
+        )
+
+    if downscale > 1:
+        images = [
+            cv2.resize(
+                image, None, fx=1.0 / downscale, fy=1.0 / downscale,
+                interpolation=cv2.INTER_AREA
+            )
+            for image in images
+        ]
+
+    values = sample_pixels(images, exposures, samples)
+    response = numpy.empty((LDR_SIZE, 1, 3), dtype=numpy.float32)
+
+    for channel in range(3):
+        curve = solve_response(
+            values[:, :, channel], numpy.log(exposures), smoothness
+        )
+        response[:, 0, channel] = numpy.exp(curve)
+
+    return response
+
+
+def get_weights():
+    """
+    Return the triangle weights used by OpenCV for each pixel value.
+    """
+    values = numpy.arange(LDR_SIZE, dtype=numpy.float64)
+    return numpy.where(
+        values < LDR_SIZE // 2, values + 1.0, LDR_SIZE - values
+    )
+
+
+def sample_pixels(images, exposures, samples, seed=0):
+    """
+    Pick a stratified sample of pixel locations from the frames.
+
+    Candidate pixels are drawn at random and bucketed by the
+    brightness of the middle exposure, then samples are spread evenly
+    across the buckets so dark and bright values are both represented
+    no matter how much of the scene each covers.
+
+    :return: Returns a uint8 array of shape (frames, samples, 3).
+    """
+    height, width = images[0].shape[:2]
+    pixels = height * width
+    rng = numpy.random.RandomState(seed)
+
+    if pixels <= samples * SAMPLE_CANDIDATES:
+        candidates = rng.permutation(pixels)
+    else:
+        candidates = numpy.unique(
+            rng.randint(0, pixels, samples * SAMPLE_CANDIDATES)
+        )
+        rng.shuffle(candidates)
+
+    middle = images[numpy.argsort(exposures)[len(exposures) // 2]]
+    brightness = middle.reshape(-1, middle.shape[-1])[candidates].mean(axis=1)
+    strata = numpy.minimum(
+        (brightness * SAMPLE_STRATA / LDR_SIZE).astype(numpy.intp),
+        SAMPLE_STRATA - 1
+    )
+
+    order = numpy.argsort(strata, kind='stable')
+    counts = numpy.bincount(strata, minlength=SAMPLE_STRATA)
+    starts = numpy.concatenate(([0], numpy.cumsum(counts)[:-1]))
+    quota = get_quota(counts, min(samples, len(candidates)))
+
+    ranks = numpy.arange(len(order)) - starts[strata[order]]
+    chosen = candidates[order[ranks < quota[strata[order]]]]
+
+    return numpy.stack([
+        image.reshape(-1, image.shape[-1])[chosen] for image in images
+    ])
+
+
+def get_quota(counts, samples):
+    """
+    Split samples evenly across strata without exceeding their counts.
+    """
+    quota = numpy.zeros_like(counts)
+    remaining = samples
+
+    while remaining > 0:
+        open_strata = numpy.flatnonzero(quota < counts)
+        if not len(open_strata):
+            break
+
+        share = max(1, remaining // len(open_strata))
+        for stratum in open_strata:
+            take = min(share, counts[stratum] - quota[stratum], remaining)
+            quota[stratum] += take
+            remaining -= take
+
+            if not remaining:
+                break
+
+    return quota
+
+
+def solve_response(values, log_exposures, smoothness=SMOOTHNESS):
+    """
+    Solve the log response curve for one channel.
+
+    Uses the Debevec and Malik system of weighted data equations, a
+    g(128) = 0 constraint and second derivative smoothness terms. The
+    log radiance unknown of each sample only couples to the curve, so
+    those unknowns are eliminated from the normal equations and the
+    solve is a 256x256 system regardless of the sample count.
+
+    :param values: uint8 array of shape (frames, samples).
+    :param log_exposures: Log exposure time of each frame.
+    :return: Returns the log response for each pixel value.
+    """
+    frames, samples = values.shape
+    weights = get_weights()
+
+    values = values.astype(numpy.intp)
+    weight = weights[values] ** 2
+    weighted = weight * log_exposures[:, numpy.newaxis]
+
+    # Normal equations for the curve with the per sample radiance
+    # unknowns eliminated: each sample only links the pixel values it
+    # was observed at, so the update is a sum over pairs of frames.
+    radiance = weight.sum(axis=0)
+    radiance_target = -weighted.sum(axis=0) / radiance
+
+    system = numpy.zeros((LDR_SIZE, LDR_SIZE))
+    numpy.add.at(system, (values, values), weight)
+    for first in range(frames):
+        for second in range(frames):
+            numpy.add.at(
+                system,
+                (values[first], values[second]),
+                -weight[first] * weight[second] / radiance
+            )
+
+    target = numpy.bincount(
+        values.ravel(),
+        (weighted + weight * radiance_target).ravel(),
+        minlength=LDR_SIZE
+    )
+
+    system[LDR_SIZE // 2, LDR_SIZE // 2] += 1.0
+
+    stencil = numpy.array([1.0, -2.0, 1.0])
+    for value in range(1, LDR_SIZE - 1):
+        row = smoothness * weights[value] * stencil
+        system[value - 1:value + 2, value - 1:value + 2] += numpy.outer(
+            row, row
+        )
+
+    return numpy.linalg.lstsq(system, target, rcond=None)[0]
+
+
+def get_cache_dir(cache_dir=None):
+    """
+    Return the directory used to store calibrated response curves.
+
+    Defaults to $XDG_CACHE_HOME/hdr/responses.
+    """
+    if cache_dir:
+        return cache_dir
+
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(
+        os.path.expanduser('~'), '.cache'
+    )
+    return os.path.join(base, 'hdr', 'responses')
+
+
+def get_camera_info(image_name):
+    """
+    Return the camera make, model and ISO from the image EXIF data.
+
+    Values that are not present in the image are returned as None.
+    """
+    try:
+        exif = read_exif(image_name)
+    except OSError:
+        return {'make': None, 'model': None, 'iso': None}
+
+    return {
+        'make': exif['make'],
+        'model': exif['model'],
+        'iso': exif['iso']
+    }
+
+
+def get_response_key(image_name, algo):
+    """
+    Return the cache key for the camera that took the image.
+
+    The key is built from the camera make, model and ISO plus the
+    calibration algorithm. If the camera cannot be identified None
+    is returned and the response should not be cached.
+    """
+    info = get_camera_info(image_name)
+
+    if not info['make'] and not info['model']:
+        return None
+
+    parts = [
+        info['make'] or 'unknown',
+        info['model'] or 'unknown',
+        'iso{0}'.format(info['iso'] or 'unknown'),
+        algo
+    ]
+    key = '_'.join(str(part).strip() for part in parts)
+    return re.sub(r'[^A-Za-z0-9_.-]+', '-', key).lower()
+
+
+def load_response(key, cache_dir=None):
+    """
+    Load a cached response curve.
+
+    :return: Returns the response curve or None if it is not cached.
+    """
+    path = os.path.join(get_cache_dir(cache_dir), key + '.npy')
+
+    if not os.path.isfile(path):
+        return None
+
+    return read_response(path)
+
+
+def read_response(path):
+    """
+    Read a response curve from a .npy file.
+
+    Curves are kept in memory keyed by path, modification time and size
+    so a long running process only reads each file once. The returned
+    array is shared and must not be modified.
+    """
+    name = os.path.abspath(path)
+
+    try:
+        stat = os.stat(name)
+    except OSError as error:
+        raise HdrException(
+            'Unable to read response curve {0}: {1}'.format(path, error)
+        )
+
+    key = (stat.st_mtime_ns, stat.st_size)
+
+    with _responses_lock:
+        cached = _responses.get(name)
+
+    if cached and cached[0] == key:
+        return cached[1]
+
+    try:
+        response = numpy.load(path)
+    except Exception as error:
+        raise HdrException(
+            'Unable to read response curve {0}: {1}'.format(path, error)
+        )
+
+    if response.shape != (256, 1, 3):
+        raise HdrException(
+            'Response curve {0} has an invalid shape {1}.'.format(
+                path, response.shape
+            )
+        )
+
+    response = response.astype(numpy.float32, copy=False)
+
+    with _responses_lock:
+        if len(_responses) >= MAX_CACHED_RESPONSES:
+            _responses.pop(next(iter(_responses)))
+        _responses[name] = (key, response)
+
+    return response
+
+
+def save_response(key, response, cache_dir=None):
+    """
+    Save a response curve to the cache.
+
+    The file is written atomically so concurrent jobs never read
+    a partially written curve.
+
+    :return: Returns the path of the cached curve.
+    """
+    cache_dir = get_cache_dir(cache_dir)
+    os.makedirs(cache_dir, exist_ok=True)
+    return write_response(
+        response, os.path.join(cache_dir, key + '.npy')
+    )
+
+
+def write_response(response, path):
+    """
+    Atomically write a response curve to a .npy file.
+
+    :return: Returns the path of the written curve.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(suffix='.npy', dir=directory)
+
+    try:
+        with os.fdopen(fd, 'wb') as tmp_file:
+            numpy.save(tmp_file, response)
+        os.replace(tmp_path, path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+
+    return path
+
+
+def get_response(image_names,
+                 images,
+                 exposures,
+                 algo,
+                 cache_dir=None,
+                 use_cache=True,
+                 samples=None,
+                 downscale=1):
+    """
+    Return the response curve for the camera that took the images.
+
+    If use_cache is True a stored curve for the camera is reused and
+    a freshly calibrated curve is stored for later merges.
+    """
+    key = None
+    if use_cache and image_names:
+        key = get_response_key(image_names[0], algo)
+
+    if key:
+        response = load_response(key, cache_dir)
+        if response is not None:
+            return response
+
+    response = calibrate_response(
+        images, exposures, algo, samples, downscale
+    )
+
+    if key:
+        save_response(key, response, cache_dir)
+
+    return response
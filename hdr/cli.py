@@ -17,11 +17,300 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import contextlib
+import shlex
+
 import click
 
-from hdr import api
+from hdr import __version__
+from hdr import batch as hdr_batch
+from hdr import profiling
+from hdr import scan as hdr_scan
 from hdr import utils
 
+# Modules that import OpenCV and NumPy load when a command runs.
+api = utils.lazy_import('hdr.api')
+hdr_align = utils.lazy_import('hdr.align')
+hdr_cache = utils.lazy_import('hdr.cache')
+hdr_sequence = utils.lazy_import('hdr.sequence')
+hdr_service = utils.lazy_import('hdr.service')
+hdr_sweep = utils.lazy_import('hdr.sweep')
+tiles = utils.lazy_import('hdr.tiles')
+
+
+def get_encoding(quality, compression, depth):
+    """
+    Return the output encoding options for the CLI values.
+    """
+    return {
+        'quality': quality,
+        'compression': compression,
+        'depth': int(depth)
+    }
+
+
+def get_result_cache(enabled, cache_hash='stat', cache_radiance=False,
+                     cache_max_size=None):
+    """
+    Return the result cache when enabled on the command line.
+
+    :param cache_max_size: Cache size limit in MiB, defaults to the
+        ResultCache limit.
+    """
+    if not enabled:
+        return None
+
+    return hdr_cache.ResultCache(
+        max_bytes=(
+            hdr_cache.DEFAULT_MAX_BYTES if cache_max_size is None
+            else cache_max_size * 1024 * 1024
+        ),
+        hash_content=cache_hash == 'content',
+        cache_radiance=cache_radiance
+    )
+
+
+def get_preview_scales(preview, full):
+    """
+    Return the scales to render at for the preview options.
+    """
+    if not preview:
+        return [None]
+    elif full:
+        return [int(preview), None]
+    else:
+        return [int(preview)]
+
+
+@contextlib.contextmanager
+def profile_job(profile, command, images):
+    """
+    Profile the pipeline stages run in the block.
+
+    When profile is an open file a JSON line with the command, images,
+    output, error and the time and peak memory of each stage is
+    appended to it. The block stores its result in record['output'].
+    """
+    record = {
+        'command': command,
+        'images': list(images),
+        'output': None,
+        'error': None
+    }
+
+    if not profile:
+        yield record
+        return
+
+    profiler = profiling.Profiler()
+    try:
+        with profiler:
+            yield record
+    except Exception as error:
+        record['error'] = str(error) or error.__class__.__name__
+        raise
+    finally:
+        record.update(profiler.to_dict())
+        profiling.write_profile(profile, record)
+
+
+def option_group(*options):
+    """
+    Return a decorator adding the options in the order given, so a
+    group of options can be shared by several commands.
+    """
+    def decorator(func):
+        for option in reversed(options):
+            func = option(func)
+        return func
+    return decorator
+
+
+no_color_option = click.option(
+    '--no-color',
+    is_flag=True,
+    help='Remove ANSI color and styling from output.'
+)
+
+
+EXPOSURES_HELP = 'Comma separated list of image exposure times.'
+PREVIEW_HELP = (
+    'Decode the images at 1/2, 1/4 or 1/8 scale for a fast preview '
+    'written with a _preview suffix.'
+)
+PROFILE_HELP = (
+    'Append a JSON line with the time and peak memory of each pipeline '
+    'stage to this file, - for stdout.'
+)
+RESPONSE_HELP = 'Response curve (.npy) to merge with instead of calibrating.'
+
+
+def exposures_option(help=EXPOSURES_HELP):
+    return click.option('-e', '--exposures', help=help)
+
+
+def merge_options(algorithms=('debevec', 'robertson'),
+                  exposures_help=EXPOSURES_HELP,
+                  response_help=RESPONSE_HELP):
+    """
+    Return the merge algorithm, exposure and response curve options.
+    """
+    return option_group(
+        click.option(
+            '-a',
+            '--algorithm',
+            default='debevec',
+            type=click.Choice(list(algorithms)),
+            help='The HDR algorithm to use for merging images.'
+        ),
+        exposures_option(exposures_help),
+        click.option(
+            '-r',
+            '--response',
+            type=click.Path(exists=True, dir_okay=False),
+            help=response_help
+        ),
+        click.option(
+            '--cache-response',
+            is_flag=True,
+            help='Reuse the cached response curve for the camera, '
+                 'calibrating and caching a new curve if none exists.'
+        )
+    )
+
+
+def preview_option(help=PREVIEW_HELP):
+    return click.option(
+        '-p',
+        '--preview',
+        type=click.Choice(['2', '4', '8']),
+        help=help
+    )
+
+
+def profile_option(help=PROFILE_HELP):
+    return click.option('--profile', type=click.File('a'), help=help)
+
+
+align_option = click.option(
+    '--align',
+    default='mtb',
+    help='Alignment as mtb[:name=value,...] or none for tripod shots. '
+         'Options are max-bits, exclude-range and downscale, for example '
+         'mtb:max-bits=4,downscale=4.'
+)
+
+align_options = option_group(
+    align_option,
+    click.option(
+        '--cache-shifts',
+        is_flag=True,
+        help='Reuse alignment shifts stored in a sidecar next to the '
+             'images, computing and storing them if none exist.'
+    )
+)
+
+# Options of the commands that merge and tonemap one bracket set.
+pipeline_options = option_group(
+    click.option(
+        '--save-radiance',
+        help='Filename to save the merged radiance map to. Use .hdr, .exr '
+             'or .npy, the file can be passed back in place of the images.'
+    ),
+    align_options,
+    preview_option(),
+    click.option(
+        '--full',
+        is_flag=True,
+        help='After the preview re-run at full resolution with the same '
+             'parameters.'
+    )
+)
+
+output_options = option_group(
+    click.option(
+        '-q',
+        '--quality',
+        type=click.IntRange(0, 100),
+        help='Output quality for JPEG and WebP images.'
+    ),
+    click.option(
+        '--compression',
+        type=click.IntRange(0, 9),
+        help='Output compression level for PNG images.'
+    ),
+    click.option(
+        '--depth',
+        default='8',
+        type=click.Choice(['8', '16']),
+        help='Output bit depth. 16 bit requires PNG or TIFF output.'
+    )
+)
+
+result_cache_options = option_group(
+    click.option(
+        '--result-cache',
+        is_flag=True,
+        help='Copy the output from the result cache when the images and '
+             'options are unchanged, caching new outputs.'
+    ),
+    click.option(
+        '--cache-hash',
+        default='stat',
+        type=click.Choice(['stat', 'content']),
+        help='Identify input images in the result cache by path, size and '
+             'modification time, or by a hash of their content so renamed '
+             'or touched files still match.'
+    ),
+    click.option(
+        '--cache-radiance',
+        is_flag=True,
+        help='Also cache merged radiance maps with --result-cache, so '
+             'changing only the tonemap skips the merge. Maps take 12 '
+             'bytes per pixel.'
+    ),
+    click.option(
+        '--cache-max-size',
+        type=click.IntRange(min=0),
+        help='Size in MiB the result cache is pruned to, defaults to '
+             '2048.'
+    )
+)
+
+tile_workers_option = click.option(
+    '--tile-workers',
+    type=click.IntRange(min=1),
+    help='Tonemap in overlapping tiles on this many threads. Durand '
+         'matches a single pass to within 1e-5, mantiuk closely '
+         'approximates it.'
+)
+
+gamma_option = click.option(
+    '-g',
+    '--gamma',
+    default=2.2,
+    help='Positive gamma value to use in tonemap. Gamma value of 1.0 implies '
+         'no correction, gamma equal to 2.2 is suitable for most displays.'
+         ' Generally gamma > 1 brightens the image and gamma < 1 darkens it.'
+)
+
+saturation_option = click.option(
+    '-s',
+    '--saturation',
+    default=1.0,
+    help='Positive aturation value to use in tonemap. Value of 1.0 preserves '
+         'saturation, values greater than 1 increase saturation and '
+         'values less than 1 decrease it.'
+)
+
+output_option = click.option(
+    '-o',
+    '--output',
+    help='Filename for HDR jpeg output.'
+)
+
+images_argument = click.argument('images', nargs=-1)
+
 
 def print_license(ctx, param, value):
     """
@@ -40,7 +329,7 @@ def print_license(ctx, param, value):
 
 
 @click.group()
-@click.version_option()
+@click.version_option(version=__version__)
 @click.option(
     '--license',
     expose_value=False,
@@ -53,377 +342,1207 @@ def main():
     """
     Create HDR images in your terminal.
 
-    Leverages OpenCV.
+    Leverages OpenCV.
+    """
+    pass
+
+
+@click.command()
+@no_color_option
+@click.option(
+    '-t',
+    '--operator',
+    default='drago',
+    type=click.Choice(hdr_batch.OPERATORS),
+    help='Tonemap operator for jobs that do not specify one.'
+)
+@click.option(
+    '-s',
+    '--set',
+    'bracket_sets',
+    multiple=True,
+    help='Space separated list of images in a bracket set. '
+         'May be repeated.'
+)
+@click.option(
+    '-w',
+    '--workers',
+    type=click.IntRange(min=1),
+    help='Number of worker processes. Defaults to an automatic split of '
+         'the cores between workers and threads based on image size.'
+)
+@click.option(
+    '--threads',
+    type=click.IntRange(min=0),
+    help='Number of OpenCV threads per worker. 0 disables threading.'
+)
+@click.option(
+    '--cores',
+    type=click.IntRange(min=1),
+    help='Number of cores shared by the workers and their threads, '
+         'defaults to $HDR_CORES or all available cores.'
+)
+@click.option(
+    '-m',
+    '--memory-limit',
+    type=click.IntRange(min=1),
+    help='Memory budget in MB for the whole batch. Jobs start only while '
+         'their estimated memory fits, jobs too large on their own run '
+         'tiled or at reduced scale.'
+)
+@result_cache_options
+@profile_option(
+    'Append a JSON line with the time and peak memory of each pipeline '
+    'stage of every job to this file, - for stdout.'
+)
+@click.argument('manifest', required=False, type=click.Path(exists=True))
+def batch(
+    no_color, operator, bracket_sets, workers, threads, cores,
+    memory_limit, result_cache, cache_hash, cache_radiance, cache_max_size,
+    profile, manifest
+):
+    """
+    Create HDR images from many bracket sets in parallel.
+
+    The manifest is a JSON list of jobs or a text file with one
+    bracket set per line. Each set reports success or failure
+    without stopping the rest of the batch.
+
+    Examples:
+        hdr batch --workers 4 --threads 2 manifest.txt
+
+        hdr batch --cores 8 --memory-limit 4096 manifest.txt
+
+        hdr batch -s "a1.jpg a2.jpg a3.jpg" -s "b1.jpg b2.jpg b3.jpg"
+    """
+    try:
+        jobs = hdr_batch.read_manifest(manifest, operator) if manifest else []
+    except Exception as e:
+        utils.echo_style(str(e), no_color, fg='red')
+        return
+
+    for bracket_set in bracket_sets:
+        jobs.append({'images': shlex.split(bracket_set), 'operator': operator})
+
+    def report(result):
+        if profile:
+            record = {'command': 'batch'}
+            record.update(result)
+            record.update(record.pop('profile'))
+            profiling.write_profile(profile, record)
+
+        if result['error']:
+            utils.echo_style(
+                'Failed {0}: {1}'.format(
+                    ' '.join(result['images']) or 'empty set',
+                    result['error']
+                ),
+                no_color,
+                fg='red'
+            )
+        elif result.get('fallback'):
+            utils.echo_style(
+                '{0} ({1})'.format(result['output'], result['fallback']),
+                no_color
+            )
+        else:
+            utils.echo_style(result['output'], no_color)
+
+    try:
+        results = hdr_batch.process_batch(
+            jobs, workers, threads, report, bool(profile),
+            get_result_cache(
+                result_cache, cache_hash, cache_radiance, cache_max_size
+            ),
+            cores,
+            memory_limit * 1024 * 1024 if memory_limit else None
+        )
+    except Exception as e:
+        utils.echo_style(str(e), no_color, fg='red')
+        return
+
+    failed = len([result for result in results if result['error']])
+
+    utils.echo_style(
+        '{0} succeeded, {1} failed.'.format(len(results) - failed, failed),
+        no_color,
+        fg='red' if failed else 'green'
+    )
+
+
+@click.command()
+@no_color_option
+@click.option(
+    '--clear',
+    is_flag=True,
+    help='Remove every cached result.'
+)
+@click.option(
+    '--max-size',
+    type=click.IntRange(min=0),
+    help='Remove the least recently used results until the cache is at '
+         'most this many MiB.'
+)
+def cache(no_color, clear, max_size):
+    """
+    Show, prune or clear the result cache.
+
+    The result cache is used by --result-cache. Results are keyed by
+    the input files and every option, so changed inputs are never
+    served from it. Clearing it is only needed to reclaim space.
+
+    Examples:
+        hdr cache
+
+        hdr cache --max-size 512
+
+        hdr cache --clear
+    """
+    try:
+        result_cache = hdr_cache.ResultCache()
+
+        if clear:
+            removed = result_cache.clear()
+        elif max_size is not None:
+            removed = result_cache.prune(max_size * 1024 * 1024)
+        else:
+            removed = None
+
+        info = result_cache.get_info()
+    except Exception as e:
+        utils.echo_style(str(e), no_color, fg='red')
+        return
+
+    if removed is not None:
+        utils.echo_style(
+            'Removed {0:.1f} MiB.'.format(removed / 1024.0 / 1024), no_color
+        )
+
+    utils.echo_style(
+        '{0}: {1} results, {2:.1f} MiB of {3:.0f} MiB.'.format(
+            info['cache_dir'], info['entries'],
+            info['size'] / 1024.0 / 1024, info['max_size'] / 1024.0 / 1024
+        ),
+        no_color
+    )
+
+
+@click.command()
+@no_color_option
+@click.option(
+    '-a',
+    '--algorithm',
+    default='debevec',
+    type=click.Choice(['debevec', 'robertson']),
+    help='The HDR algorithm to calibrate the response curve for.'
+)
+@exposures_option()
+@click.option(
+    '--cache-dir',
+    type=click.Path(file_okay=False),
+    help='Directory for cached response curves.'
+)
+@click.option(
+    '-s',
+    '--samples',
+    type=click.IntRange(min=16),
+    help='Solve the response curve from this many stratified pixel '
+         'samples with NumPy least squares. Debevec only.'
+)
+@click.option(
+    '--downscale',
+    default=1,
+    type=click.IntRange(min=1),
+    help='Shrink the frames by this factor before sampling.'
+)
+@align_options
+@profile_option()
+@click.option(
+    '-o',
+    '--output',
+    help='Filename for response curve (.npy) output.'
+)
+@images_argument
+def calibrate(
+    no_color, algorithm, exposures, cache_dir, samples, downscale, align,
+    cache_shifts, profile, output, images
+):
+    """
+    Calibrate and pin the camera response curve from a set of images.
+
+    The curve is stored in the response cache keyed by the camera
+    make, model and ISO. Merges using --cache-response reuse it
+    instead of calibrating.
+
+    Examples:
+        hdr calibrate image1.jpg image2.jpg image3.jpg
+
+        hdr calibrate --samples 1024 --downscale 4 image1.jpg image2.jpg
+    """
+    try:
+        with profile_job(profile, 'calibrate', images) as job:
+            response = job['output'] = api.calibrate(
+                images, algorithm, exposures, output, cache_dir, samples,
+                downscale, align=hdr_align.parse_align(align),
+                cache_shifts=cache_shifts
+            )
+    except Exception as e:
+        utils.echo_style(str(e), no_color, fg='red')
+    else:
+        utils.echo_style(response, no_color)
+
+
+@click.command()
+@no_color_option
+@merge_options()
+@gamma_option
+@saturation_option
+@click.option(
+    '-b',
+    '--bias',
+    default=0.85,
+    help='Value for bias function in [0, 1] range. Values from 0.7 to '
+         '0.9 usually give best results, default value is 0.85.'
+)
+@pipeline_options
+@output_options
+@result_cache_options
+@profile_option()
+@output_option
+@images_argument
+def drago(
+    no_color, algorithm, exposures, gamma, saturation, bias, response,
+    cache_response, save_radiance, align, cache_shifts, preview, full,
+    quality, compression, depth, result_cache, cache_hash, cache_radiance,
+    cache_max_size, profile, output, images
+):
+    """
+    Create HDR image from a set of images using drago tonemap.
+
+    Adaptive logarithmic mapping is a fast global tonemapping
+    algorithm that scales the image in logarithmic domain.
+
+    Since it’s a global operator the same function is applied to
+    all the pixels, it is controlled by the bias parameter.
+
+    Examples:
+        hdr drago image1.jpg image2.jpg image3.jpg
+
+        hdr drago --preview 8 --full image1.jpg image2.jpg image3.jpg
+
+        hdr drago --depth 16 -o image_hdr.tif image1.jpg image2.jpg
+
+        hdr drago image_hdr.hdr
+    """
+    try:
+        for preview_scale in get_preview_scales(preview, full):
+            with profile_job(profile, 'drago', images) as job:
+                result = job['output'] = api.drago_hdr(
+                    images, algorithm, exposures, gamma, saturation, bias,
+                    output, response, cache_response, save_radiance,
+                    align=hdr_align.parse_align(align),
+                    cache_shifts=cache_shifts,
+                    preview=preview_scale,
+                    encoding=get_encoding(quality, compression, depth),
+                    result_cache=get_result_cache(
+                        result_cache, cache_hash, cache_radiance,
+                        cache_max_size
+                    )
+                )
+            utils.echo_style(result, no_color)
+    except Exception as e:
+        utils.echo_style(str(e), no_color, fg='red')
+
+
+@click.command()
+@no_color_option
+@merge_options()
+@gamma_option
+@click.option(
+    '-c',
+    '--contrast',
+    default=4.0,
+    help='Maximum and minimum luminance values of the resulting image.'
+)
+@saturation_option
+@click.option(
+    '--sigma-space',
+    default=2.0,
+    help='Bilateral filter sigma in color space.'
+)
+@click.option(
+    '--sigma-color',
+    default=2.0,
+    help='Bilateral filter sigma in coordinate space.'
+)
+@pipeline_options
+@output_options
+@tile_workers_option
+@result_cache_options
+@profile_option()
+@output_option
+@images_argument
+def durand(
+    no_color, algorithm, exposures, gamma, contrast, saturation,
+    sigma_space, sigma_color, response, cache_response, save_radiance,
+    align, cache_shifts, preview, full, quality, compression, depth,
+    tile_workers, result_cache, cache_hash, cache_radiance, cache_max_size,
+    profile, output, images
+):
+    """
+    Create HDR image from a set of images using durand tonemap.
+
+    This algorithm decomposes image into two layers: base layer
+    and detail layer using bilateral filter and compresses contrast
+    of the base layer thus preserving all the details.
+
+    Examples:
+        hdr durand image1.jpg image2.jpg image3.jpg
+
+        hdr durand image_hdr.hdr
+    """
+    try:
+        for preview_scale in get_preview_scales(preview, full):
+            with profile_job(profile, 'durand', images) as job:
+                result = job['output'] = api.durand_hdr(
+                    images, algorithm, exposures, gamma, contrast, saturation,
+                    sigma_space, sigma_color, output, response,
+                    cache_response, save_radiance,
+                    align=hdr_align.parse_align(align),
+                    cache_shifts=cache_shifts,
+                    preview=preview_scale,
+                    encoding=get_encoding(quality, compression, depth),
+                    result_cache=get_result_cache(
+                        result_cache, cache_hash, cache_radiance,
+                        cache_max_size
+                    ),
+                    tile_workers=tile_workers
+                )
+            utils.echo_style(result, no_color)
+    except Exception as e:
+        utils.echo_style(str(e), no_color, fg='red')
+
+
+@click.command()
+@no_color_option
+@merge_options()
+@gamma_option
+@click.option(
+    '--scale',
+    default=0.7,
+    help='Contrast scale factor. HVS response is multiplied by this '
+         'parameter, thus compressing dynamic range. Values from 0.6 '
+         'to 0.9 produce best results.'
+)
+@saturation_option
+@pipeline_options
+@output_options
+@tile_workers_option
+@result_cache_options
+@profile_option()
+@output_option
+@images_argument
+def mantiuk(
+    no_color, algorithm, exposures, gamma, scale, saturation, response,
+    cache_response, save_radiance, align, cache_shifts, preview, full,
+    quality, compression, depth, tile_workers, result_cache, cache_hash,
+    cache_radiance, cache_max_size, profile, output, images
+):
+    """
+    Create HDR image from a set of images using mantiuk tonemap.
+
+    This algorithm transforms image to contrast using gradients on all
+    levels of gaussian pyramid, transforms contrast values to HVS response
+    and scales the response. After this the image is reconstructed from
+    new contrast values.
+
+    Examples:
+        hdr mantiuk image1.jpg image2.jpg image3.jpg
+
+        hdr mantiuk image_hdr.hdr
+    """
+    try:
+        for preview_scale in get_preview_scales(preview, full):
+            with profile_job(profile, 'mantiuk', images) as job:
+                result = job['output'] = api.mantiuk_hdr(
+                    images, algorithm, exposures, gamma, scale, saturation,
+                    output, response, cache_response, save_radiance,
+                    align=hdr_align.parse_align(align),
+                    cache_shifts=cache_shifts,
+                    preview=preview_scale,
+                    encoding=get_encoding(quality, compression, depth),
+                    result_cache=get_result_cache(
+                        result_cache, cache_hash, cache_radiance,
+                        cache_max_size
+                    ),
+                    tile_workers=tile_workers
+                )
+            utils.echo_style(result, no_color)
+    except Exception as e:
+        utils.echo_style(str(e), no_color, fg='red')
+
+
+@click.command()
+@no_color_option
+@merge_options(('debevec', 'robertson', 'mertens'))
+@click.option(
+    '-s',
+    '--samples',
+    type=click.IntRange(min=16),
+    help='Solve the response curve from this many stratified pixel '
+         'samples with NumPy least squares. Debevec only.'
+)
+@click.option(
+    '--downscale',
+    default=1,
+    type=click.IntRange(min=1),
+    help='Shrink the frames by this factor before sampling.'
+)
+@align_options
+@profile_option()
+@click.option(
+    '-o',
+    '--output',
+    help='Filename for the radiance map. The extension selects the '
+         'format: .hdr (Radiance RGBE), .exr (half float OpenEXR) or '
+         '.npy (memory mappable float32).'
+)
+@images_argument
+def merge(
+    no_color, algorithm, exposures, response, cache_response, samples,
+    downscale, align, cache_shifts, profile, output, images
+):
+    """
+    Merge a set of images into a radiance map without tonemapping.
+
+    The saved radiance map can be passed to any tonemap command in
+    place of the images to re-render without merging again.
+
+    Examples:
+        hdr merge -o image_hdr.npy image1.jpg image2.jpg image3.jpg
+
+        hdr reinhard image_hdr.npy
+    """
+    try:
+        with profile_job(profile, 'merge', images) as job:
+            response = job['output'] = api.merge_hdr(
+                images, output, algorithm, exposures, response,
+                cache_response, samples, downscale,
+                align=hdr_align.parse_align(align), cache_shifts=cache_shifts
+            )
+    except Exception as e:
+        utils.echo_style(str(e), no_color, fg='red')
+    else:
+        utils.echo_style(response, no_color)
+
+
+@click.command()
+@no_color_option
+@click.option(
+    '-c',
+    '--contrast',
+    default=1.0,
+    help='Contrast measure weight.'
+)
+@click.option(
+    '-e',
+    '--exposure',
+    default=0.0,
+    help='Well-exposedness measure weight.'
+)
+@gamma_option
+@click.option(
+    '-s',
+    '--saturation',
+    default=1.0,
+    help='Saturation measure weight.'
+)
+@click.option(
+    '--fast',
+    is_flag=True,
+    help='Compute the weights at 1/4 scale and blend fewer levels at '
+         'full resolution. Faster and lighter, close to the exact result.'
+)
+@pipeline_options
+@output_options
+@result_cache_options
+@profile_option()
+@output_option
+@images_argument
+def mertens(
+    no_color, contrast, exposure, gamma, saturation, fast, save_radiance,
+    align, cache_shifts, preview, full, quality, compression, depth,
+    result_cache, cache_hash, cache_radiance, cache_max_size, profile,
+    output, images
+):
+    """
+    Create HDR image from a set of images using mertens algorithm.
+
+    Pixels are weighted using contrast, saturation and well-exposedness
+    measures, than images are combined using laplacian pyramids.
+
+    The resulting image weight is constructed as weighted average of contrast,
+    saturation and well-exposedness measures.
+
+    The resulting image doesn’t require tonemapping and can be converted to
+    8-bit image by multiplying by 255, but it’s recommended to apply gamma
+    correction and/or linear tonemapping.
+
+    Examples:
+        hdr mertens image1.jpg image2.jpg image3.jpg
+
+        hdr mertens --fast image1.jpg image2.jpg image3.jpg
+
+        hdr mertens image_hdr.hdr
+    """
+    try:
+        for preview_scale in get_preview_scales(preview, full):
+            with profile_job(profile, 'mertens', images) as job:
+                result = job['output'] = api.mertens_hdr(
+                    images, contrast, exposure, gamma, saturation, output,
+                    save_radiance,
+                    align=hdr_align.parse_align(align),
+                    cache_shifts=cache_shifts,
+                    preview=preview_scale,
+                    encoding=get_encoding(quality, compression, depth),
+                    result_cache=get_result_cache(
+                        result_cache, cache_hash, cache_radiance,
+                        cache_max_size
+                    ),
+                    fast=fast
+                )
+            utils.echo_style(result, no_color)
+    except Exception as e:
+        utils.echo_style(str(e), no_color, fg='red')
+
+
+@click.command()
+@no_color_option
+@merge_options()
+@click.option(
+    '-t',
+    '--tonemap',
+    'tonemaps',
+    multiple=True,
+    required=True,
+    help='Tonemap to apply as operator[:name=value,...], for example '
+         'reinhard:gamma=2.2,intensity=-1. May be repeated. Operators are '
+         'drago, durand, linear, mantiuk and reinhard.'
+)
+@pipeline_options
+@output_options
+@profile_option()
+@click.option(
+    '-o',
+    '--output',
+    'outputs',
+    multiple=True,
+    help='Filename for HDR jpeg output. Repeat once per tonemap.'
+)
+@images_argument
+def multi(
+    no_color, algorithm, exposures, tonemaps, response, cache_response,
+    save_radiance, align, cache_shifts, preview, full, quality,
+    compression, depth, profile, outputs, images
+):
+    """
+    Create HDR images using several tonemaps from one merge.
+
+    The images are merged once and every tonemap is applied to
+    the same radiance map, writing one image per tonemap.
+
+    Examples:
+        hdr multi -t drago -t reinhard:gamma=2.2 image1.jpg image2.jpg
+
+        hdr multi -t drago -t linear image_hdr.npy
+    """
+    try:
+        for preview_scale in get_preview_scales(preview, full):
+            with profile_job(profile, 'multi', images) as job:
+                result = job['output'] = api.multi_hdr(
+                    images, [api.parse_tonemap(spec) for spec in tonemaps],
+                    algorithm, exposures, outputs, response, cache_response,
+                    save_radiance,
+                    align=hdr_align.parse_align(align),
+                    cache_shifts=cache_shifts,
+                    preview=preview_scale,
+                    encoding=get_encoding(quality, compression, depth)
+                )
+            utils.echo_style('\n'.join(result), no_color)
+    except Exception as e:
+        utils.echo_style(str(e), no_color, fg='red')
+
+
+@click.command()
+@no_color_option
+@merge_options()
+@gamma_option
+@click.option(
+    '-i',
+    '--intensity',
+    default=0.0,
+    help='Result intensity in [-8, 8] range. Greater intensity produces '
+         'brighter results.'
+)
+@click.option(
+    '-l',
+    '--light-adapt',
+    default=1.0,
+    help='Light adaptation in [0, 1] range. If 1 adaptation is based only'
+         ' on pixel value, if 0 it’s global, otherwise it’s a weighted mean '
+         'of this two cases.'
+)
+@click.option(
+    '-c',
+    '--color-adapt',
+    default=0.0,
+    help='chromatic adaptation in [0, 1] range. If 1 channels are treated '
+         'independently, if 0 adaptation level is the same for each channel.'
+)
+@pipeline_options
+@output_options
+@result_cache_options
+@profile_option()
+@output_option
+@images_argument
+def reinhard(
+    no_color, algorithm, exposures, gamma, intensity, light_adapt,
+    color_adapt, response, cache_response, save_radiance, align,
+    cache_shifts, preview, full, quality, compression, depth, result_cache,
+    cache_hash, cache_radiance, cache_max_size, profile, output, images
+):
+    """
+    Create HDR image from a set of images using reinhard tonemap.
+
+    This is a global tonemapping operator that models human visual system.
+
+    Mapping function is controlled by adaptation parameter, that is
+    computed using light adaptation and color adaptation.
+
+    Examples:
+        hdr reinhard image1.jpg image2.jpg image3.jpg
+
+        hdr reinhard image_hdr.hdr
     """
-    pass
+    try:
+        for preview_scale in get_preview_scales(preview, full):
+            with profile_job(profile, 'reinhard', images) as job:
+                result = job['output'] = api.reinhard_hdr(
+                    images, algorithm, exposures, gamma, intensity,
+                    light_adapt, color_adapt, output, response, cache_response,
+                    save_radiance,
+                    align=hdr_align.parse_align(align),
+                    cache_shifts=cache_shifts,
+                    preview=preview_scale,
+                    encoding=get_encoding(quality, compression, depth),
+                    result_cache=get_result_cache(
+                        result_cache, cache_hash, cache_radiance,
+                        cache_max_size
+                    )
+                )
+            utils.echo_style(result, no_color)
+    except Exception as e:
+        utils.echo_style(str(e), no_color, fg='red')
 
 
 @click.command()
+@no_color_option
 @click.option(
-    '--no-color',
-    is_flag=True,
-    help='Remove ANSI color and styling from output.'
-)
-@click.option(
-    '-a',
-    '--algorithm',
-    default='debevec',
-    type=click.choice(['debevec', 'robertson']),
-    help='The HDR algorithm to use for merging images.'
-)
-@click.option(
-    '-e',
-    '--exposures',
-    help='Comma separated list of image exposure times.'
+    '-i',
+    '--index',
+    type=click.Path(dir_okay=False),
+    help='Path of the index file, defaults to .hdr_index.json in the '
+         'directory.'
 )
 @click.option(
     '-g',
-    '--gamma',
-    default=2.2,
-    help='Positive gamma value to use in tonemap. Gamma value of 1.0 implies '
-         'no correction, gamma equal to 2.2 is suitable for most displays.'
-         ' Generally gamma > 1 brightens the image and gamma < 1 darkens it.'
+    '--max-gap',
+    default=hdr_scan.DEFAULT_MAX_GAP,
+    type=click.FloatRange(min=0),
+    help='Maximum seconds between frames in one bracket set.'
 )
 @click.option(
-    '-s',
-    '--saturation',
-    default=1.0,
-    help='Positive aturation value to use in tonemap. Value of 1.0 preserves '
-         'saturation, values greater than 1 increase saturation and '
-         'values less than 1 decrease it.'
+    '-r',
+    '--recursive',
+    is_flag=True,
+    help='Also scan sub directories.'
 )
 @click.option(
-    '-b',
-    '--bias',
-    default=0.85,
-    help='Value for bias function in [0, 1] range. Values from 0.7 to '
-         '0.9 usually give best results, default value is 0.85.'
+    '-w',
+    '--workers',
+    type=click.IntRange(min=1),
+    help='Number of threads used to read EXIF data.'
 )
-@click.option(
-    '-o',
-    '--output',
-    help='Filename for HDR jpeg output.'
+@click.argument(
+    'directory',
+    type=click.Path(exists=True, file_okay=False)
 )
-@click.argument('images', nargs=-1)
-def drago(
-    no_color, algorithm, exposures, gamma, saturation, bias, output, images
-):
+def scan(no_color, index, max_gap, recursive, workers, directory):
     """
-    Create HDR image from a set of images using drago tonemap.
+    Group a directory of images into bracket sets.
 
-    Adaptive logarithmic mapping is a fast global tonemapping
-    algorithm that scales the image in logarithmic domain.
+    Frames are grouped by camera, capture time and exposure sequence.
+    The result is saved to an index that hdr batch accepts as a
+    manifest. Rescanning only reads new or modified files.
 
-    Since it’s a global operator the same function is applied to
-    all the pixels, it is controlled by the bias parameter.
+    Examples:
+        hdr scan shoot/
 
-    Example:
-        hdr drago image1.jpg image2.jpg image3.jpg
+        hdr batch -t durand shoot/.hdr_index.json
     """
     try:
-        response = api.drago_hdr(
-            images, algorithm, exposures, gamma, saturation, bias, output
-        )
+        result = hdr_scan.scan(directory, index, max_gap, recursive, workers)
     except Exception as e:
         utils.echo_style(str(e), no_color, fg='red')
-    else:
-        utils.echo_style(response, no_color)
+        return
+
+    for bracket in result['sets']:
+        utils.echo_style(
+            ' '.join(shlex.quote(image) for image in bracket['images']),
+            no_color
+        )
+
+    utils.echo_style(
+        '{0} bracket sets from {1} files, {2} new.'.format(
+            len(result['sets']), len(result['files']), result['new']
+        ),
+        no_color,
+        fg='green'
+    )
 
 
 @click.command()
-@click.option(
-    '--no-color',
-    is_flag=True,
-    help='Remove ANSI color and styling from output.'
+@no_color_option
+@merge_options(
+    exposures_help='Comma separated list of image exposure times, used '
+                   'for every bracket set.',
+    response_help='Response curve (.npy) to merge with instead of '
+                  'calibrating on the first set.'
 )
 @click.option(
-    '-a',
-    '--algorithm',
-    default='debevec',
-    type=click.choice(['debevec', 'robertson']),
-    help='The HDR algorithm to use for merging images.'
+    '-t',
+    '--tonemap',
+    default='drago',
+    help='Tonemap to apply as operator[:name=value,...], for example '
+         'reinhard:gamma=2.2,intensity=-1. Operators are drago, durand, '
+         'linear, mantiuk and reinhard.'
 )
 @click.option(
-    '-e',
-    '--exposures',
-    help='Comma separated list of image exposure times.'
+    '-b',
+    '--bracket',
+    default=3,
+    type=click.IntRange(min=1),
+    help='Number of images per bracket set when images are given as '
+         'arguments.'
 )
 @click.option(
-    '-g',
-    '--gamma',
-    default=2.2,
-    help='Positive gamma value to use in tonemap. Gamma value of 1.0 implies '
-         'no correction, gamma equal to 2.2 is suitable for most displays.'
-         ' Generally gamma > 1 brightens the image and gamma < 1 darkens it.'
+    '-l',
+    '--list',
+    'set_list',
+    type=click.File('r'),
+    help='File with one bracket set per line as whitespace separated '
+         'images, - for stdin. Read as the sequence is processed.'
 )
 @click.option(
-    '-c',
-    '--contrast',
-    default=4.0,
-    help='Maximum and minimum luminance values of the resulting image.'
+    '--smoothing',
+    default=0.9,
+    type=click.FloatRange(0, 1, max_open=True),
+    help='Weight of previous frames in the smoothed output brightness, '
+         'higher removes more flicker. 0 disables.'
 )
 @click.option(
-    '-s',
-    '--saturation',
-    default=1.0,
-    help='Positive aturation value to use in tonemap. Value of 1.0 preserves '
-         'saturation, values greater than 1 increase saturation and '
-         'values less than 1 decrease it.'
+    '--no-warm-start',
+    is_flag=True,
+    help='Align every bracket set from scratch instead of searching '
+         'around the shifts of the previous set.'
 )
-@click.option(
-    '--sigma-space',
-    default=2.0,
-    help='Bilateral filter sigma in color space.'
+@align_option
+@preview_option(
+    'Decode the images at 1/2, 1/4 or 1/8 scale for a fast preview.'
 )
+@output_options
 @click.option(
-    '--sigma-color',
-    default=2.0,
-    help='Bilateral filter sigma in coordinate space.'
+    '--pipe',
+    help='Encoder command to pipe raw BGR24 frames to instead of writing '
+         'images. {width} and {height} are replaced with the frame size.'
 )
+@profile_option()
 @click.option(
     '-o',
     '--output',
-    help='Filename for HDR jpeg output.'
+    help='Frame filename pattern with a frame number field, for example '
+         'frames/frame_{0:05d}.jpg.'
 )
-@click.argument('images', nargs=-1)
-def durand(
-    no_color, algorithm, exposures, gamma, contrast, saturation,
-    sigma_space, sigma_color, output, images
+@images_argument
+def sequence(
+    no_color, algorithm, exposures, tonemap, bracket, set_list, smoothing,
+    no_warm_start, response, cache_response, align, preview, quality,
+    compression, depth, pipe, profile, output, images
 ):
     """
-    Create HDR image from a set of images using durand tonemap.
+    Create HDR frames from a sequence of bracket sets.
 
-    This algorithm decomposes image into two layers: base layer
-    and detail layer using bilateral filter and compresses contrast
-    of the base layer thus preserving all the details.
+    Sets are processed one at a time in order, so memory use does
+    not grow with the length of the sequence. The response curve is
+    calibrated once, alignment starts from the previous set and the
+    tonemap is smoothed over time to avoid flicker.
 
     Examples:
-        hdr durand image1.jpg image2.jpg image3.jpg
+        hdr sequence -b 3 -o frames/frame_{0:05d}.jpg IMG_*.jpg
+
+        hdr sequence -l sets.txt --pipe "ffmpeg -f rawvideo
+        -pix_fmt bgr24 -s {width}x{height} -r 24 -i - timelapse.mp4"
     """
-    try:
-        response = api.durand_hdr(
-            images, algorithm, exposures, gamma, contrast, saturation,
-            sigma_space, sigma_color, output
+    def report(frame, image_names, name):
+        utils.echo_style(
+            name or 'Frame {0}: {1}'.format(frame, ' '.join(image_names)),
+            no_color
         )
+
+    try:
+        if set_list:
+            bracket_sets = hdr_sequence.read_sets(set_list)
+        else:
+            bracket_sets = hdr_sequence.group_images(images, bracket)
+
+        operator, params = api.parse_tonemap(tonemap)
+        with profile_job(profile, 'sequence', images) as job:
+            frames = hdr_sequence.process_sequence(
+                bracket_sets, operator, params, algorithm, exposures, output,
+                pipe, smoothing,
+                warm_start=not no_warm_start,
+                response=response,
+                cache_response=cache_response,
+                align=hdr_align.parse_align(align),
+                preview=int(preview) if preview else None,
+                encoding=get_encoding(quality, compression, depth),
+                callback=report
+            )
+            job['output'] = output or pipe
+            job['frames'] = frames
     except Exception as e:
         utils.echo_style(str(e), no_color, fg='red')
-    else:
-        utils.echo_style(response, no_color)
+        return
+
+    utils.echo_style(
+        '{0} frames.'.format(frames), no_color, fg='green'
+    )
 
 
 @click.command()
+@no_color_option
 @click.option(
-    '--no-color',
-    is_flag=True,
-    help='Remove ANSI color and styling from output.'
+    '--host',
+    help='Address to listen on, defaults to the loopback address.'
 )
 @click.option(
-    '-a',
-    '--algorithm',
-    default='debevec',
-    type=click.choice(['debevec', 'robertson']),
-    help='The HDR algorithm to use for merging images.'
+    '--port',
+    type=click.IntRange(min=0, max=65535),
+    help='TCP port to listen on, defaults to 8765.'
 )
 @click.option(
-    '-e',
-    '--exposures',
-    help='Comma separated list of image exposure times.'
+    '--socket',
+    type=click.Path(dir_okay=False),
+    help='Listen on a Unix socket instead of a TCP port.'
 )
 @click.option(
-    '-g',
-    '--gamma',
-    default=2.2,
-    help='Positive gamma value to use in tonemap. Gamma value of 1.0 implies '
-         'no correction, gamma equal to 2.2 is suitable for most displays.'
-         ' Generally gamma > 1 brightens the image and gamma < 1 darkens it.'
+    '-t',
+    '--operator',
+    default='drago',
+    type=click.Choice(hdr_batch.OPERATORS),
+    help='Tonemap operator for jobs that do not specify one.'
 )
 @click.option(
-    '--scale',
-    default=0.7,
-    help='Contrast scale factor. HVS response is multiplied by this '
-         'parameter, thus compressing dynamic range. Values from 0.6 '
-         'to 0.9 produce best results.'
+    '-w',
+    '--workers',
+    default=1,
+    type=click.IntRange(min=1),
+    help='Number of jobs processed concurrently.'
 )
 @click.option(
-    '-s',
-    '--saturation',
-    default=1.0,
-    help='Positive aturation value to use in tonemap. Value of 1.0 preserves '
-         'saturation, values greater than 1 increase saturation and '
-         'values less than 1 decrease it.'
+    '--threads',
+    type=click.IntRange(min=0),
+    help='Number of OpenCV threads, one pool shared by all workers. '
+         'Defaults to the number of cores, 0 disables threading.'
 )
 @click.option(
-    '-o',
-    '--output',
-    help='Filename for HDR jpeg output.'
+    '--cores',
+    type=click.IntRange(min=1),
+    help='Number of cores used for the default thread count, defaults '
+         'to $HDR_CORES or all available cores.'
 )
-@click.argument('images', nargs=-1)
-def mantiuk(
-    no_color, algorithm, exposures, gamma, scale, saturation, output, images
-):
+@click.option(
+    '-m',
+    '--memory-limit',
+    type=click.IntRange(min=1),
+    help='Memory budget in MB for the service. Jobs start only while '
+         'their estimated memory fits, jobs too large on their own run '
+         'tiled or at reduced scale.'
+)
+@click.option(
+    '--queue-size',
+    type=click.IntRange(min=1),
+    help='Maximum number of queued jobs, further jobs are rejected '
+         'with 503 until the queue drains. Defaults to 16.'
+)
+@click.option(
+    '--root',
+    type=click.Path(exists=True, file_okay=False),
+    help='Directory job paths are resolved against, paths outside it '
+         'are rejected. Defaults to the current directory.'
+)
+@click.option(
+    '--no-cache-response',
+    is_flag=True,
+    help='Calibrate every job instead of reusing cached response curves.'
+)
+def serve(no_color, host, port, socket, operator, workers, threads,
+          cores, memory_limit, queue_size, root, no_cache_response):
     """
-    Create HDR image from a set of images using mantiuk tonemap.
+    Run a local HDR job service.
 
-    This algorithm transforms image to contrast using gradients on all
-    levels of gaussian pyramid, transforms contrast values to HVS response
-    and scales the response. After this the image is reconstructed from
-    new contrast values.
+    Jobs are submitted as JSON to POST /jobs using the batch manifest
+    job format and polled with GET /jobs/<id>. State such as response
+    curves stays loaded between jobs.
 
     Examples:
-        hdr mantiuk image1.jpg image2.jpg image3.jpg
+        hdr serve --workers 2 --socket /tmp/hdr.sock
+
+        curl -d '{"images": ["a1.jpg", "a2.jpg"]}' localhost:8765/jobs
     """
+    def ready(address):
+        utils.echo_style(
+            'Listening on {0}.'.format(address), no_color, fg='green'
+        )
+
     try:
-        response = api.mantiuk_hdr(
-            images, algorithm, exposures, gamma, scale, saturation, output
+        service = hdr_service.HdrService(
+            workers, queue_size or hdr_service.DEFAULT_QUEUE_SIZE, threads,
+            operator, root, not no_cache_response, cores=cores,
+            memory_limit=memory_limit * 1024 * 1024 if memory_limit else None
         )
+        hdr_service.run(
+            service,
+            host or hdr_service.DEFAULT_HOST,
+            hdr_service.DEFAULT_PORT if port is None else port,
+            socket,
+            ready
+        )
+    except KeyboardInterrupt:
+        pass
     except Exception as e:
         utils.echo_style(str(e), no_color, fg='red')
-    else:
-        utils.echo_style(response, no_color)
 
 
 @click.command()
+@no_color_option
+@merge_options()
 @click.option(
-    '--no-color',
-    is_flag=True,
-    help='Remove ANSI color and styling from output.'
+    '-t',
+    '--operator',
+    default='drago',
+    type=click.Choice(['drago', 'durand', 'linear', 'mantiuk', 'reinhard']),
+    help='Tonemap operator to sweep.'
 )
 @click.option(
-    '-c',
-    '--contrast',
-    default=1.0,
-    help='Contrast measure weight.'
+    '-P',
+    '--param',
+    'params',
+    multiple=True,
+    help='Parameter values as name=v1,v2,... or name=start:stop:step, '
+         'for example gamma=0.8:1.4:0.2. May be repeated, every '
+         'combination is rendered.'
 )
 @click.option(
-    '-e',
-    '--exposure',
-    default=0.0,
-    help='Well-exposedness measure weight.'
+    '-s',
+    '--set',
+    'bracket_sets',
+    multiple=True,
+    help='Space separated list of images in a bracket set. May be '
+         'repeated.'
+)
+@align_option
+@preview_option(
+    'Decode the images at 1/2, 1/4 or 1/8 scale for a fast sweep.'
 )
 @click.option(
-    '-g',
-    '--gamma',
-    default=2.2,
-    help='Positive gamma value to use in tonemap. Gamma value of 1.0 implies '
-         'no correction, gamma equal to 2.2 is suitable for most displays.'
-         ' Generally gamma > 1 brightens the image and gamma < 1 darkens it.'
+    '-w',
+    '--workers',
+    default=1,
+    type=click.IntRange(min=1),
+    help='Number of combinations rendered in parallel.'
 )
 @click.option(
-    '-s',
-    '--saturation',
-    default=1.0,
-    help='Saturation measure weight.'
+    '--cache-size',
+    default=1024,
+    type=click.IntRange(min=0),
+    help='Size of the radiance map cache in MiB.'
 )
 @click.option(
-    '-o',
-    '--output',
-    help='Filename for HDR jpeg output.'
+    '--no-images',
+    is_flag=True,
+    help='Only write the contact sheet.'
 )
-@click.argument('images', nargs=-1)
-def mertens(
-    no_color, contrast, exposure, gamma, saturation, output, images
+@click.option(
+    '--no-sheet',
+    is_flag=True,
+    help='Do not write a contact sheet.'
+)
+@click.option(
+    '--thumb-width',
+    default=320,
+    type=click.IntRange(min=16),
+    help='Width of the contact sheet thumbnails in pixels.'
+)
+@output_options
+@click.option(
+    '-d',
+    '--output-dir',
+    type=click.Path(file_okay=False),
+    help='Directory to write the images to, defaults to the directory '
+         'of each bracket set.'
+)
+@profile_option()
+@images_argument
+def sweep(
+    no_color, algorithm, exposures, operator, params, bracket_sets,
+    response, cache_response, align, preview, workers, cache_size,
+    no_images, no_sheet, thumb_width, quality, compression, depth,
+    output_dir, profile, images
 ):
     """
-    Create HDR image from a set of images using mertens algorithm.
-
-    Pixels are weighted using contrast, saturation and well-exposedness
-    measures, than images are combined using laplacian pyramids.
-
-    The resulting image weight is constructed as weighted average of contrast,
-    saturation and well-exposedness measures.
+    Render a grid of tonemap parameters from one merge.
 
-    The resulting image doesn’t require tonemapping and can be converted to
-    8-bit image by multiplying by 255, but it’s recommended to apply gamma
-    correction and/or linear tonemapping.
+    Each bracket set is merged once, every combination of the
+    parameter values is rendered from the cached radiance map and
+    a labelled contact sheet is written per set.
 
     Examples:
-        hdr mertens image1.jpg image2.jpg image3.jpg
+        hdr sweep -P gamma=0.8:1.4:0.2 -P saturation=0.5,1 *.jpg
+
+        hdr sweep -t reinhard -P intensity=-2:2:1 -s "a1.jpg a2.jpg"
+        -s "b1.jpg b2.jpg"
     """
+    image_sets = [shlex.split(bracket_set) for bracket_set in bracket_sets]
+    if images:
+        image_sets.insert(0, list(images))
+
+    def report(name):
+        utils.echo_style(name, no_color)
+
     try:
-        response = api.mertens_hdr(
-            images, contrast, exposure, gamma, saturation, output
-        )
+        with profile_job(
+                profile, 'sweep',
+                [image for image_set in image_sets for image in image_set]
+        ) as job:
+            job['output'] = hdr_sweep.sweep(
+                image_sets, operator,
+                [hdr_sweep.parse_param(param) for param in params],
+                algorithm, exposures, response, cache_response,
+                align=hdr_align.parse_align(align),
+                preview=int(preview) if preview else None,
+                output_dir=output_dir,
+                images=not no_images,
+                contact_sheet=not no_sheet,
+                thumb_width=thumb_width,
+                workers=workers,
+                encoding=get_encoding(quality, compression, depth),
+                cache=hdr_sweep.RadianceCache(cache_size * 1024 * 1024),
+                callback=report
+            )
     except Exception as e:
         utils.echo_style(str(e), no_color, fg='red')
-    else:
-        utils.echo_style(response, no_color)
 
 
 @click.command()
+@no_color_option
+@merge_options(('debevec', 'robertson', 'mertens'))
 @click.option(
-    '--no-color',
-    is_flag=True,
-    help='Remove ANSI color and styling from output.'
-)
-@click.option(
-    '-a',
-    '--algorithm',
-    default='debevec',
-    type=click.choice(['debevec', 'robertson']),
-    help='The HDR algorithm to use for merging images.'
-)
-@click.option(
-    '-e',
-    '--exposures',
-    help='Comma separated list of image exposure times.'
-)
-@click.option(
-    '-g',
-    '--gamma',
-    default=2.2,
-    help='Positive gamma value to use in tonemap. Gamma value of 1.0 implies '
-         'no correction, gamma equal to 2.2 is suitable for most displays.'
-         ' Generally gamma > 1 brightens the image and gamma < 1 darkens it.'
+    '-t',
+    '--tonemap',
+    default='drago',
+    help='Tonemap to apply as operator[:name=value,...], for example '
+         'reinhard:gamma=2.2,intensity=-1. Operators are drago, durand, '
+         'linear, mantiuk and reinhard.'
 )
 @click.option(
-    '-l',
-    '--light-adapt',
-    default=1.0,
-    help='Light adaptation in [0, 1] range. If 1 adaptation is based only'
-         ' on pixel value, if 0 it’s global, otherwise it’s a weighted mean '
-         'of this two cases.'
+    '-m',
+    '--memory-limit',
+    type=click.IntRange(min=1),
+    help='Memory budget in MB used to size the tiles, defaults to 512. '
+         'Encoding the output and .hdr or .exr radiance maps are not '
+         'tiled and need memory for the whole image.'
 )
 @click.option(
-    '-c',
-    '--color-adapt',
-    default=0.0,
-    help='chromatic adaptation in [0, 1] range. If 1 channels are treated '
-         'independently, if 0 adaptation level is the same for each channel.'
+    '--tile-size',
+    type=click.IntRange(min=1),
+    help='Tile edge length in pixels, overrides the memory limit.'
 )
 @click.option(
-    '-o',
-    '--output',
-    help='Filename for HDR jpeg output.'
+    '--scratch-dir',
+    type=click.Path(file_okay=False, exists=True),
+    help='Directory for temporary memory mapped files.'
 )
-@click.argument('images', nargs=-1)
-def reinhard(
-    no_color, algorithm, exposures, gamma, intensity,
-    light_adapt, color_adapt, output, images
+@pipeline_options
+@output_options
+@profile_option()
+@output_option
+@images_argument
+def tiled(
+    no_color, algorithm, exposures, tonemap, response, cache_response,
+    memory_limit, tile_size, scratch_dir, save_radiance, align,
+    cache_shifts, preview, full, quality, compression, depth, profile,
+    output, images
 ):
     """
-    Create HDR image from a set of images using reinhard tonemap.
-
-    This is a global tonemapping operator that models human visual system.
+    Create HDR image from a set of very large images in tiles.
 
-    Mapping function is controlled by adaptation parameter, that is
-    computed using light adaptation and color adaptation.
+    The merge and tonemap run one tile at a time from memory mapped
+    scratch files so memory use is bounded by the memory limit
+    instead of the image size. Encoding the output image and reading
+    or writing .hdr and .exr radiance maps still use the whole image,
+    use .npy radiance maps to keep those within the limit.
 
     Examples:
-        hdr reinhard image1.jpg image2.jpg image3.jpg
+        hdr tiled -t durand -m 256 image1.jpg image2.jpg image3.jpg
+
+        hdr tiled -t durand image_hdr.npy
     """
     try:
-        response = api.reinhard_hdr(
-            images, algorithm, exposures, gamma, intensity,
-            light_adapt, color_adapt, output
-        )
+        if memory_limit:
+            memory_limit *= 1024 * 1024
+        else:
+            memory_limit = tiles.DEFAULT_MEMORY_LIMIT
+
+        for preview_scale in get_preview_scales(preview, full):
+            operator, params = api.parse_tonemap(tonemap)
+            with profile_job(profile, 'tiled', images) as job:
+                result = job['output'] = tiles.tiled_hdr(
+                    images, operator, params, algorithm, exposures, output,
+                    response, cache_response, memory_limit, tile_size,
+                    scratch_dir, None, save_radiance,
+                    align=hdr_align.parse_align(align),
+                    cache_shifts=cache_shifts,
+                    preview=preview_scale,
+                    encoding=get_encoding(quality, compression, depth)
+                )
+            utils.echo_style(result, no_color)
     except Exception as e:
         utils.echo_style(str(e), no_color, fg='red')
-    else:
-        utils.echo_style(response, no_color)
 
 
+main.add_command(batch)
+main.add_command(cache)
+main.add_command(calibrate)
 main.add_command(drago)
 main.add_command(durand)
 main.add_command(mantiuk)
+main.add_command(merge)
 main.add_command(mertens)
+main.add_command(multi)
 main.add_command(reinhard)
+main.add_command(scan)
+main.add_command(sequence)
+main.add_command(serve)
+main.add_command(sweep)
+main.add_command(tiled)
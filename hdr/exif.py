@@ -0,0 +1,352 @@
+# -*- coding: utf-8 -*-
+#
+# hdr: A Python API and CLI for creating HDR images.
+#
+# Copyright (C) 2017 Sean Marlow
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Fast EXIF reader for JPEG and TIFF files.
+
+Only the bytes holding the EXIF header are read, the image data is
+never decoded. Results are cached by path, modification time and size
+so repeated runs over the same files skip the reads entirely.
+"""
+
+import calendar
+import io
+import json
+import os
+import struct
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+IMAGE_WIDTH_TAG = 256
+IMAGE_LENGTH_TAG = 257
+MAKE_TAG = 271
+MODEL_TAG = 272
+EXIF_IFD_TAG = 34665
+EXPOSURE_TIME_TAG = 33434
+FNUMBER_TAG = 33437
+ISO_TAG = 34855
+DATETIME_ORIGINAL_TAG = 36867
+SUBSEC_ORIGINAL_TAG = 37521
+EXPOSURE_BIAS_TAG = 37380
+SERIAL_TAG = 42033
+
+# Tag type: (struct format, size in bytes)
+TYPES = {
+    1: ('B', 1),
+    2: ('s', 1),
+    3: ('H', 2),
+    4: ('L', 4),
+    5: ('LL', 8),
+    7: ('B', 1),
+    9: ('l', 4),
+    10: ('ll', 8)
+}
+
+DEFAULT_WORKERS = 8
+MAX_CACHE_ENTRIES = 65536
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def clear_cache():
+    """
+    Remove all cached EXIF results.
+    """
+    with _cache_lock:
+        _cache.clear()
+
+
+def load_cache(path):
+    """
+    Load cached EXIF results from a JSON file written by save_cache.
+    """
+    try:
+        with open(path) as cache_file:
+            entries = json.load(cache_file)
+    except (OSError, ValueError):
+        return
+
+    with _cache_lock:
+        for name, entry in entries.items():
+            _cache[name] = (tuple(entry['stat']), entry['exif'])
+
+
+def save_cache(path):
+    """
+    Save cached EXIF results to a JSON file.
+    """
+    with _cache_lock:
+        entries = {
+            name: {'stat': list(stat), 'exif': exif}
+            for name, (stat, exif) in _cache.items()
+        }
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as cache_file:
+        json.dump(entries, cache_file)
+    os.replace(tmp_path, path)
+
+
+def empty_exif():
+    return {
+        'make': None,
+        'model': None,
+        'serial': None,
+        'exposure': None,
+        'aperture': None,
+        'iso': None,
+        'bias': None,
+        'datetime': None,
+        'timestamp': None
+    }
+
+
+def read_exif(image_name):
+    """
+    Read the EXIF values used for HDR processing from an image.
+
+    :param image_name: Path to a JPEG or TIFF image.
+    :return: Returns a dictionary with make, model, serial, exposure
+        (seconds), aperture (f-number), iso, bias (EV), datetime and
+        timestamp (seconds since the epoch, camera local time). Missing
+        values are None.
+    """
+    name = os.path.abspath(image_name)
+    stat = os.stat(name)
+    key = (stat.st_mtime_ns, stat.st_size)
+
+    with _cache_lock:
+        cached = _cache.get(name)
+
+    if cached and cached[0] == key:
+        return dict(cached[1])
+
+    exif = empty_exif()
+    with open(name, 'rb') as image_file:
+        tags = read_tags(image_file)
+
+    exif.update(get_values(tags))
+
+    with _cache_lock:
+        if len(_cache) >= MAX_CACHE_ENTRIES:
+            _cache.pop(next(iter(_cache)))
+        _cache[name] = (key, exif)
+
+    return dict(exif)
+
+
+def read_exif_bytes(data):
+    """
+    Read the EXIF values from an encoded JPEG or TIFF image in memory.
+
+    :param data: The image file contents as bytes.
+    :return: Returns a dictionary like read_exif.
+    """
+    exif = empty_exif()
+    exif.update(get_values(read_tags(io.BytesIO(data))))
+    return exif
+
+
+def read_exif_batch(image_names, workers=DEFAULT_WORKERS):
+    """
+    Read EXIF values for many images concurrently.
+
+    Reads are I/O bound so a thread pool hides file system latency,
+    which matters most on network file systems.
+
+    :return: Returns a list of EXIF dictionaries in input order.
+    """
+    if workers <= 1 or len(image_names) <= 1:
+        return [read_exif(name) for name in image_names]
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(read_exif, image_names))
+
+
+def read_tags(image_file):
+    """
+    Read the IFD0 and EXIF IFD tags from an open JPEG or TIFF file.
+
+    :return: Returns a dictionary of tag number to value.
+    """
+    start = image_file.read(4)
+
+    if start[:2] == b'\xff\xd8':
+        image_file.seek(2)
+        data = read_jpeg_exif(image_file)
+        if data is None:
+            return {}
+        tiff_file = io.BytesIO(data)
+    elif start in (b'II*\x00', b'MM\x00*'):
+        image_file.seek(0)
+        tiff_file = image_file
+    else:
+        return {}
+
+    try:
+        return read_tiff_tags(tiff_file)
+    except (struct.error, ValueError, OSError):
+        return {}
+
+
+def read_jpeg_exif(image_file):
+    """
+    Return the TIFF structured payload of the JPEG APP1 EXIF segment.
+
+    Markers are skipped by length so only segment headers are read
+    until the EXIF segment is found.
+    """
+    while True:
+        marker = image_file.read(2)
+        if len(marker) < 2 or marker[0] != 0xff:
+            return None
+
+        # Start of scan or end of image, no EXIF segment present.
+        if marker[1] in (0xda, 0xd9):
+            return None
+
+        # Standalone markers without a length.
+        if marker[1] == 0x01 or 0xd0 <= marker[1] <= 0xd7:
+            continue
+
+        length = image_file.read(2)
+        if len(length) < 2:
+            return None
+        length = struct.unpack('>H', length)[0]
+
+        if marker[1] == 0xe1:
+            data = image_file.read(length - 2)
+            if data[:6] == b'Exif\x00\x00':
+                return data[6:]
+        else:
+            image_file.seek(length - 2, io.SEEK_CUR)
+
+
+def read_tiff_tags(tiff_file):
+    """
+    Read the IFD0 and EXIF IFD tags from a TIFF structured file.
+    """
+    base = tiff_file.tell()
+    header = tiff_file.read(8)
+    order = '<' if header[:2] == b'II' else '>'
+    offset = struct.unpack(order + 'L', header[4:8])[0]
+
+    tags = read_ifd(tiff_file, base, offset, order)
+    exif_offset = tags.pop(EXIF_IFD_TAG, None)
+
+    if exif_offset:
+        tags.update(read_ifd(tiff_file, base, exif_offset, order))
+
+    return tags
+
+
+def read_ifd(tiff_file, base, offset, order, wanted=None):
+    wanted = wanted or (
+        MAKE_TAG, MODEL_TAG, EXIF_IFD_TAG, EXPOSURE_TIME_TAG, FNUMBER_TAG,
+        ISO_TAG, DATETIME_ORIGINAL_TAG, SUBSEC_ORIGINAL_TAG,
+        EXPOSURE_BIAS_TAG, SERIAL_TAG
+    )
+
+    # Counts are checked against the size of the TIFF data, a corrupt
+    # count would otherwise build a huge unpack format.
+    size = tiff_file.seek(0, io.SEEK_END) - base
+
+    tiff_file.seek(base + offset)
+    count = struct.unpack(order + 'H', tiff_file.read(2))[0]
+    entries = tiff_file.read(count * 12)
+
+    tags = {}
+    for index in range(count):
+        entry = entries[index * 12:index * 12 + 12]
+        tag, tag_type, values = struct.unpack(order + 'HHL', entry[:8])
+
+        if tag not in wanted or tag_type not in TYPES:
+            continue
+
+        length = TYPES[tag_type][1] * values
+        if length > size:
+            continue
+
+        if length <= 4:
+            data = entry[8:8 + length]
+        else:
+            value_offset = struct.unpack(order + 'L', entry[8:12])[0]
+            tiff_file.seek(base + value_offset)
+            data = tiff_file.read(length)
+
+        if len(data) != length:
+            continue
+
+        tags[tag] = decode_value(data, tag_type, values, order)
+
+    return tags
+
+
+def decode_value(data, tag_type, values, order):
+    if tag_type == 2:
+        return data.split(b'\x00', 1)[0].decode('ascii', 'replace').strip()
+
+    fmt = TYPES[tag_type][0]
+    items = struct.unpack(order + fmt * values, data)
+
+    if tag_type in (5, 10):
+        items = [
+            num / den if den else None
+            for num, den in zip(items[0::2], items[1::2])
+        ]
+
+    return items[0] if values == 1 else list(items)
+
+
+def get_values(tags):
+    """
+    Convert raw tags to the named EXIF values.
+    """
+    values = {
+        'make': tags.get(MAKE_TAG) or None,
+        'model': tags.get(MODEL_TAG) or None,
+        'serial': tags.get(SERIAL_TAG) or None,
+        'exposure': tags.get(EXPOSURE_TIME_TAG),
+        'aperture': tags.get(FNUMBER_TAG),
+        'iso': tags.get(ISO_TAG),
+        'bias': tags.get(EXPOSURE_BIAS_TAG),
+        'datetime': tags.get(DATETIME_ORIGINAL_TAG) or None
+    }
+
+    if isinstance(values['iso'], list):
+        values['iso'] = values['iso'][0] if values['iso'] else None
+
+    if values['datetime']:
+        try:
+            timestamp = calendar.timegm(
+                time.strptime(values['datetime'], '%Y:%m:%d %H:%M:%S')
+            )
+        except ValueError:
+            timestamp = None
+
+        subsec = str(tags.get(SUBSEC_ORIGINAL_TAG) or '').strip()
+        if timestamp is not None and subsec.isdigit():
+            timestamp += float('0.' + subsec)
+
+        values['timestamp'] = timestamp
+
+    return values
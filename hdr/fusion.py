@@ -0,0 +1,346 @@
+# -*- coding: utf-8 -*-
+#
+# hdr: A Python API and CLI for creating HDR images.
+#
+# Copyright (C) 2017 Sean Marlow
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Fast approximate Mertens exposure fusion.
+
+cv2.MergeMertens computes contrast, saturation and well-exposedness
+weights at full resolution for every frame and blends full depth
+Laplacian pyramids. FastMergeMertens instead:
+
+- computes the weights on frames shrunk by a scale factor and
+  upsamples them with a guided filter steered by each frame's
+  luminance, so weight edges follow image edges;
+- blends fewer pyramid levels;
+- builds the pyramids of one frame at a time and accumulates them, so
+  only a single frame's pyramids are alive at once.
+
+Each level of the blend is normalized by the sum of the upsampled
+weights at that level, which keeps the result an exact weighted
+average even where the upsampled weights do not sum to one.
+"""
+
+import math
+
+import cv2
+import numpy
+
+from hdr.exceptions import HdrException
+
+WEIGHT_SCALE = 4
+GUIDE_RADIUS = 2
+GUIDE_EPS = 1e-2
+
+# As cv2.MergeMertens.
+WELL_EXPOSED_SIGMA = 0.2
+WEIGHT_EPS = 1e-12
+
+
+def to_float(image):
+    """
+    Return an 8 bit image as float32 in [0, 1].
+    """
+    if image.dtype == numpy.uint8:
+        return numpy.multiply(image, 1 / 255.0, dtype=numpy.float32)
+
+    return image.astype(numpy.float32, copy=False)
+
+
+def get_laplacian(image):
+    """
+    Return the absolute Laplacian of the luminance of an image in
+    [0, 1] units, the contrast measure of cv2.MergeMertens.
+    """
+    gray = cv2.cvtColor(to_float(image), cv2.COLOR_BGR2GRAY)
+    return numpy.abs(cv2.Laplacian(gray, cv2.CV_32F))
+
+
+def get_weights(image,
+                contrast=1.0,
+                saturation=1.0,
+                exposure=0.0,
+                laplacian=None):
+    """
+    Return the Mertens weight map of a float BGR image in [0, 1],
+    computed like cv2.MergeMertens.
+
+    :param laplacian: Optional contrast measure, see get_laplacian,
+        computed from the image by default.
+    """
+    weights = get_laplacian(image) if laplacian is None else laplacian
+    if contrast != 1:
+        cv2.pow(weights, contrast, weights)
+
+    mean = image.mean(axis=2, dtype=numpy.float32)
+    deviation = numpy.square(image - mean[..., None]).sum(axis=2)
+    sat = numpy.sqrt(deviation, out=deviation)
+    if saturation != 1:
+        cv2.pow(sat, saturation, sat)
+    weights *= sat
+
+    if exposure:
+        well = numpy.square(image - 0.5)
+        well *= -1 / (2 * WELL_EXPOSED_SIGMA ** 2)
+        well = numpy.exp(well.sum(axis=2), dtype=numpy.float32)
+        cv2.pow(well, exposure, well)
+        weights *= well
+
+    weights += WEIGHT_EPS
+    return weights
+
+
+def guided_upsample(guide_small, src_small, guide, radius=GUIDE_RADIUS,
+                    eps=GUIDE_EPS):
+    """
+    Upsample src_small to the size of guide with a fast guided filter.
+
+    The linear coefficients of the filter are fitted at low resolution,
+    upsampled and applied to the full resolution guide, so edges in the
+    result follow edges in the guide.
+
+    :param guide_small: Guide at the resolution of src_small.
+    :param src_small: Single channel float32 map to upsample.
+    :param guide: Full resolution single channel float32 guide.
+    :return: Returns the upsampled map.
+    """
+    size = (2 * radius + 1, 2 * radius + 1)
+
+    def box(image):
+        return cv2.boxFilter(image, -1, size, borderType=cv2.BORDER_REFLECT)
+
+    mean_guide = box(guide_small)
+    mean_src = box(src_small)
+    variance = box(guide_small * guide_small) - mean_guide * mean_guide
+    covariance = box(guide_small * src_small) - mean_guide * mean_src
+
+    scale = covariance / (variance + eps)
+    offset = mean_src - scale * mean_guide
+
+    height, width = guide.shape[:2]
+    scale = cv2.resize(
+        box(scale), (width, height), interpolation=cv2.INTER_LINEAR
+    )
+    offset = cv2.resize(
+        box(offset), (width, height), interpolation=cv2.INTER_LINEAR
+    )
+
+    scale *= guide
+    scale += offset
+    return scale
+
+
+def build_pyramid(image, levels):
+    """
+    Return the Gaussian pyramid of an image with levels + 1 images.
+    """
+    pyramid = [image]
+    for _ in range(levels):
+        pyramid.append(cv2.pyrDown(pyramid[-1]))
+    return pyramid
+
+
+def blend_pyramids(pairs, levels):
+    """
+    Blend the Laplacian pyramids of images by their weights.
+
+    Pairs are consumed one at a time so only one image's pyramids are
+    alive at once. Each level is normalized by the sum of the weights
+    at that level.
+
+    :param pairs: Iterable of float32 BGR images and weight maps.
+    :param levels: Number of pyramid levels.
+    :return: Returns the blended Laplacian pyramid.
+    """
+    result = None
+    totals = None
+
+    for image, weight in pairs:
+        image_pyramid = build_pyramid(image, levels)
+        weight_pyramid = build_pyramid(weight, levels)
+        del image, weight
+
+        if result is None:
+            result = [
+                numpy.zeros(level.shape, numpy.float32)
+                for level in image_pyramid
+            ]
+            totals = [
+                numpy.zeros(level.shape, numpy.float32)
+                for level in weight_pyramid
+            ]
+
+        for level in range(levels + 1):
+            band = image_pyramid[level]
+            weight = weight_pyramid[level]
+            if level < levels:
+                cv2.subtract(band, cv2.pyrUp(
+                    image_pyramid[level + 1], dstsize=band.shape[1::-1]
+                ), dst=band)
+
+            cv2.multiply(
+                band, cv2.cvtColor(weight, cv2.COLOR_GRAY2BGR), dst=band
+            )
+            cv2.add(result[level], band, dst=result[level])
+            cv2.add(totals[level], weight, dst=totals[level])
+
+        del image_pyramid, weight_pyramid
+
+    for level in range(levels + 1):
+        totals[level] += WEIGHT_EPS
+        cv2.divide(
+            result[level], cv2.cvtColor(totals[level], cv2.COLOR_GRAY2BGR),
+            dst=result[level]
+        )
+
+    return result
+
+
+def collapse_pyramid(pyramid):
+    """
+    Return the image a Laplacian pyramid represents.
+    """
+    for level in range(len(pyramid) - 1, 0, -1):
+        pyramid[level - 1] += cv2.pyrUp(
+            pyramid[level], dstsize=pyramid[level - 1].shape[1::-1]
+        )
+
+    return pyramid[0]
+
+
+def get_levels(height, width):
+    """
+    Return the pyramid depth cv2.MergeMertens uses for an image size.
+    """
+    return max(0, int(math.log2(max(1, min(height, width)))))
+
+
+class FastMergeMertens(object):
+    """
+    Approximate Mertens exposure fusion with low resolution weights.
+
+    Used like the object cv2.createMergeMertens returns. The frames are
+    shrunk by scale with pyrDown, which gives the same images as the
+    pyramid level at that scale. Weights are computed there, except
+    for the contrast measure which is taken at full resolution and
+    shrunk, as fine texture is what it responds to. Every pyramid level
+    from that scale down is blended at low resolution and only the
+    log2(scale) finest levels at full resolution, with the weights
+    upsampled by a guided filter.
+
+    :param contrast: Contrast weight exponent.
+    :param saturation: Saturation weight exponent.
+    :param exposure: Well-exposedness weight exponent.
+    :param scale: Factor the frames are shrunk by to compute weights,
+        a power of two. 1 fuses like cv2.MergeMertens.
+    :param radius: Guided filter radius in low resolution pixels.
+    :param eps: Guided filter regularization, larger values smooth
+        the weights across weaker edges.
+    """
+
+    def __init__(self,
+                 contrast=1.0,
+                 saturation=1.0,
+                 exposure=0.0,
+                 scale=WEIGHT_SCALE,
+                 radius=GUIDE_RADIUS,
+                 eps=GUIDE_EPS):
+        if scale < 1 or scale & (scale - 1):
+            raise HdrException('The weight scale must be a power of two.')
+
+        self.contrast = contrast
+        self.saturation = saturation
+        self.exposure = exposure
+        self.scale = scale
+        self.radius = radius
+        self.eps = eps
+
+    def process(self, src, times=None, response=None, dst=None):
+        """
+        Fuse a bracket of 8 bit BGR frames.
+
+        :param src: List of frames of the same size.
+        :param times: Ignored, as for cv2.MergeMertens.
+        :param response: Ignored, as for cv2.MergeMertens.
+        :param dst: Optional float32 output buffer.
+        :return: Returns the fused float32 image.
+        """
+        if not len(src):
+            raise HdrException('No images to fuse.')
+
+        height, width = src[0].shape[:2]
+        levels = min(
+            int(math.log2(self.scale)), get_levels(height, width)
+        )
+
+        small_frames = []
+        small_weights = []
+        for image in src:
+            small = to_float(build_pyramid(image, levels)[-1])
+            small_frames.append(small)
+            weight = get_weights(
+                small, self.contrast, self.saturation, self.exposure,
+                build_pyramid(get_laplacian(image), levels)[-1]
+            )
+
+            # Scale by the share of pixels that are not black, which
+            # have no weight at full resolution.
+            black = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) == 0
+            if black.any():
+                weight *= 1 - build_pyramid(
+                    black.astype(numpy.float32), levels
+                )[-1]
+            small_weights.append(weight + WEIGHT_EPS)
+
+        total = sum(small_weights)
+        for weight in small_weights:
+            weight /= total
+
+        # Coarse levels, blended from the shrunk frames.
+        coarse = collapse_pyramid(blend_pyramids(
+            zip(small_frames, small_weights),
+            get_levels(*small_frames[0].shape[:2])
+        ))
+
+        if levels:
+            def pairs():
+                for image, small, weight in zip(
+                        src, small_frames, small_weights):
+                    image = to_float(image)
+                    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+                    weight = guided_upsample(
+                        cv2.cvtColor(small, cv2.COLOR_BGR2GRAY), weight,
+                        gray, self.radius, self.eps
+                    )
+                    numpy.maximum(weight, 0, out=weight)
+
+                    # Black pixels, such as the borders alignment
+                    # shifts in, have no saturation and so no weight.
+                    weight[gray == 0] = 0
+                    yield image, weight
+
+            # Fine levels at full resolution on top of the coarse blend.
+            pyramid = blend_pyramids(pairs(), levels)
+            pyramid[levels] = coarse
+            coarse = collapse_pyramid(pyramid)
+
+        if dst is None:
+            return coarse
+
+        numpy.copyto(dst, coarse)
+        return dst
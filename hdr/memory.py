@@ -0,0 +1,336 @@
+# -*- coding: utf-8 -*-
+#
+# hdr: A Python API and CLI for creating HDR images.
+#
+# Copyright (C) 2017 Sean Marlow
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Memory estimates and admission control for HDR jobs.
+
+The peak memory of a job is estimated from its pipeline configuration
+and the image size, which is read from the file header without
+decoding. The bytes per pixel below were measured as the peak resident
+memory of each configuration merging 8 bit JPEG brackets.
+
+Schedulers admit a job only while the estimates of the running jobs fit
+a memory budget. A job that does not fit the budget on its own is run
+tiled or decoded at reduced scale instead, see fit_job.
+"""
+
+import os
+import struct
+
+import cv2
+
+from hdr import exif
+from hdr.api import is_radiance
+from hdr.exceptions import HdrException
+from hdr.tiles import DEFAULT_MEMORY_LIMIT
+
+MB = 1024 * 1024
+
+# Python, NumPy and OpenCV loaded in a worker process.
+PROCESS_BYTES = 96 * MB
+
+# Peak bytes per pixel of each frame, decoded and aligned, during the
+# merge.
+FRAME_BYTES_PER_PIXEL = {'debevec': 6, 'robertson': 6, 'mertens': 24}
+
+# Peak bytes per pixel of the radiance, tonemap and output buffers.
+WORKING_BYTES_PER_PIXEL = {'debevec': 60, 'robertson': 66, 'mertens': 36}
+TONEMAP_BYTES_PER_PIXEL = {'mantiuk': 16}
+
+# A saved .hdr or .exr radiance map is loaded whole as float32, .npy
+# maps are memory mapped.
+RADIANCE_BYTES_PER_PIXEL = 12
+
+# Tiled jobs hold one decoded frame and the copy being written to its
+# scratch file besides the tile budget. Memory mapped scratch pages are
+# not counted, the kernel can write them back under pressure.
+TILED_BYTES_PER_PIXEL = 6
+MIN_TILE_MEMORY = 16 * MB
+
+PREVIEW_SCALES = (2, 4, 8)
+REDUCED_SCALE = 8
+
+
+def read_jpeg_size(image_file):
+    """
+    Return the size from the start of frame segment of a JPEG file.
+    """
+    image_file.seek(2)
+
+    while True:
+        marker = image_file.read(2)
+        if len(marker) < 2 or marker[0] != 0xff:
+            return None
+
+        if marker[1] in (0xda, 0xd9):
+            return None
+
+        if marker[1] == 0x01 or 0xd0 <= marker[1] <= 0xd7:
+            continue
+
+        length = image_file.read(2)
+        if len(length) < 2:
+            return None
+        length = struct.unpack('>H', length)[0]
+
+        # Start of frame markers, other than DHT, JPG and DAC.
+        if 0xc0 <= marker[1] <= 0xcf and marker[1] not in (0xc4, 0xc8, 0xcc):
+            height, width = struct.unpack('>HH', image_file.read(5)[1:])
+            return width, height
+
+        image_file.seek(length - 2, os.SEEK_CUR)
+
+
+def read_webp_size(header):
+    """
+    Return the size from the first chunk header of a WebP file.
+    """
+    chunk = header[12:16]
+
+    if chunk == b'VP8X':
+        width = int.from_bytes(header[24:27], 'little') + 1
+        height = int.from_bytes(header[27:30], 'little') + 1
+        return width, height
+
+    if chunk == b'VP8L':
+        bits = int.from_bytes(header[21:25], 'little')
+        return (bits & 0x3fff) + 1, ((bits >> 14) & 0x3fff) + 1
+
+    if chunk == b'VP8 ':
+        width, height = struct.unpack('<HH', header[26:30])
+        return width & 0x3fff, height & 0x3fff
+
+    return None
+
+
+def read_radiance_size(image_file):
+    """
+    Return the size from the resolution line of a Radiance .hdr file.
+    """
+    image_file.seek(0)
+
+    for _ in range(64):
+        line = image_file.readline(256).split()
+        if len(line) == 4 and line[0] in (b'-Y', b'+Y'):
+            return int(line[3]), int(line[1])
+
+    return None
+
+
+def read_image_size(image_name):
+    """
+    Return the width and height of an image read from its header.
+
+    JPEG, PNG, TIFF, WebP, Radiance .hdr and .npy files are supported.
+
+    :return: Returns a tuple of width and height, or None for other
+        formats.
+    """
+    with open(image_name, 'rb') as image_file:
+        header = image_file.read(32)
+
+        try:
+            if header[:2] == b'\xff\xd8':
+                return read_jpeg_size(image_file)
+
+            if header[:8] == b'\x89PNG\r\n\x1a\n':
+                return struct.unpack('>II', header[16:24])
+
+            if header[:4] in (b'II*\x00', b'MM\x00*'):
+                order = '<' if header[:2] == b'II' else '>'
+                offset = struct.unpack(order + 'L', header[4:8])[0]
+                tags = exif.read_ifd(
+                    image_file, 0, offset, order,
+                    (exif.IMAGE_WIDTH_TAG, exif.IMAGE_LENGTH_TAG)
+                )
+                return (
+                    tags[exif.IMAGE_WIDTH_TAG], tags[exif.IMAGE_LENGTH_TAG]
+                )
+
+            if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+                return read_webp_size(header)
+
+            if header.startswith(b'#?'):
+                return read_radiance_size(image_file)
+
+            if header.startswith(b'\x93NUMPY'):
+                import numpy
+
+                image_file.seek(0)
+                if numpy.lib.format.read_magic(image_file) == (1, 0):
+                    read_header = numpy.lib.format.read_array_header_1_0
+                else:
+                    read_header = numpy.lib.format.read_array_header_2_0
+                shape = read_header(image_file)[0]
+                return shape[1], shape[0]
+        except (struct.error, KeyError, IndexError, ValueError):
+            return None
+
+    return None
+
+
+def get_image_size(image_name):
+    """
+    Return the width and height of an image.
+
+    Formats without a header reader are decoded at 1/8 scale.
+    """
+    try:
+        size = read_image_size(image_name)
+    except OSError:
+        raise HdrException('Unable to read image {0}.'.format(image_name))
+
+    if size:
+        return size
+
+    image = cv2.imread(image_name, cv2.IMREAD_REDUCED_GRAYSCALE_8)
+    if image is None:
+        raise HdrException('Unable to read image {0}.'.format(image_name))
+
+    return image.shape[1] * REDUCED_SCALE, image.shape[0] * REDUCED_SCALE
+
+
+def estimate_memory(width,
+                    height,
+                    frames,
+                    algo='debevec',
+                    tonemap=None,
+                    preview=None,
+                    tiled=None,
+                    radiance_ext=None):
+    """
+    Return the estimated peak memory in bytes of one job.
+
+    The memory of the process itself, PROCESS_BYTES, is not included.
+
+    :param width: Image width.
+    :param height: Image height.
+    :param frames: Number of frames merged, 0 for a saved radiance map.
+    :param algo: Merge algorithm, debevec, robertson or mertens.
+    :param tonemap: Tonemap operator name.
+    :param preview: Optional 2, 4 or 8 to decode at reduced scale.
+    :param tiled: Tile memory budget when run with tiles.tiled_hdr.
+    :param radiance_ext: Extension of a saved radiance map.
+    """
+    if algo not in FRAME_BYTES_PER_PIXEL:
+        raise HdrException('The {0} algorithm is not supported.'.format(algo))
+
+    scale = int(preview or 1)
+    pixels = -(-width // scale) * -(-height // scale)
+    loaded = 0
+
+    if not frames and radiance_ext != '.npy':
+        # Maps are loaded at full size before being shrunk.
+        loaded = width * height * RADIANCE_BYTES_PER_PIXEL
+
+    if tiled:
+        return loaded + pixels * TILED_BYTES_PER_PIXEL + tiled
+
+    return loaded + pixels * (
+        frames * FRAME_BYTES_PER_PIXEL[algo] +
+        WORKING_BYTES_PER_PIXEL[algo] +
+        TONEMAP_BYTES_PER_PIXEL.get(tonemap, 0)
+    )
+
+
+def get_job_config(job):
+    """
+    Return the merge algorithm and tonemap of a batch job.
+    """
+    if job['operator'] == 'mertens':
+        return 'mertens', 'linear'
+
+    return job.get('algo', 'debevec'), job['operator']
+
+
+def estimate_job(job, size=None):
+    """
+    Return the estimated peak memory in bytes of a batch job.
+
+    :param job: Job dictionary, see batch.read_manifest.
+    :param size: Image width and height, read from the first image by
+        default.
+    """
+    images = job['images']
+    width, height = size or get_image_size(images[0])
+    algo, tonemap = get_job_config(job)
+
+    radiance_ext = None
+    frames = len(images)
+    if is_radiance(images):
+        radiance_ext = os.path.splitext(images[0])[1].lower()
+        frames = 0
+
+    return estimate_memory(
+        width, height, frames, algo, tonemap, job.get('preview'),
+        job.get('tiled'), radiance_ext
+    )
+
+
+def fit_job(job, memory_limit):
+    """
+    Return the job adapted to fit a memory budget.
+
+    A job that fits runs as it is. Otherwise it runs tiled, at full
+    resolution if possible and else at 1/2, 1/4 or 1/8 scale, in memory
+    or tiled, whichever fits first. Reduced scale jobs write a _preview
+    image like the preview option.
+
+    :param job: Job dictionary, see batch.read_manifest. A tiled key
+        holding the tile memory budget is added to tiled jobs.
+    :param memory_limit: Memory budget in bytes for the job.
+    :return: Returns a tuple of the job, its estimated peak memory and
+        a description of the fallback or None.
+    """
+    size = get_image_size(job['images'][0])
+    preview = int(job.get('preview') or 1)
+    scales = [preview] + [scale for scale in PREVIEW_SCALES if scale > preview]
+
+    for scale in scales:
+        candidate = dict(job)
+        if scale > 1:
+            candidate['preview'] = scale
+
+        fallback = None
+        if scale != preview:
+            fallback = 'preview 1/{0}'.format(scale)
+
+        estimate = estimate_job(candidate, size)
+        if estimate <= memory_limit:
+            return candidate, estimate, fallback
+
+        # Tiles get the memory left over by the frame being decoded.
+        candidate['tiled'] = MIN_TILE_MEMORY
+        spare = memory_limit - estimate_job(candidate, size)
+        if spare >= 0:
+            candidate['tiled'] = min(
+                DEFAULT_MEMORY_LIMIT, MIN_TILE_MEMORY + spare
+            )
+            return (
+                candidate,
+                estimate_job(candidate, size),
+                ' '.join(['tiled'] + ([fallback] if fallback else []))
+            )
+
+    raise HdrException(
+        'The {0}x{1} job needs more memory than the limit of {2} MB even '
+        'at 1/{3} scale.'.format(
+            size[0], size[1], memory_limit // MB, scales[-1]
+        )
+    )
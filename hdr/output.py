@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+#
+# hdr: A Python API and CLI for creating HDR images.
+#
+# Copyright (C) 2017 Sean Marlow
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Conversion of tonemapped images to 8 or 16 bit output files.
+
+The float result of a tonemap is scaled, clipped and rounded in one
+pass into a reused integer buffer, so writing an image does not
+allocate another full size float array. Encoding can run on a
+background thread while the next image is processed.
+"""
+
+import os
+import queue
+import threading
+
+from concurrent.futures import Future
+
+import cv2
+import numpy
+
+from hdr.exceptions import HdrException
+from hdr.profiling import profiled
+
+# Extension: (format name, supported bit depths)
+FORMATS = {
+    '.jpeg': ('jpeg', (8,)),
+    '.jpg': ('jpeg', (8,)),
+    '.png': ('png', (8, 16)),
+    '.tif': ('tiff', (8, 16)),
+    '.tiff': ('tiff', (8, 16)),
+    '.webp': ('webp', (8,))
+}
+CV_TYPES = {8: cv2.CV_8U, 16: cv2.CV_16U}
+DTYPES = {8: numpy.uint8, 16: numpy.uint16}
+MAX_PENDING = 2
+MAX_POOLED = 4
+
+_buffers = {}
+_buffers_lock = threading.Lock()
+
+
+def get_encoding(name, encoding=None):
+    """
+    Return the bit depth and cv2.imwrite params for an output file.
+
+    :param name: Output file name, the extension selects the format.
+    :param encoding: Optional dictionary with depth (8 or 16), quality
+        (JPEG and WebP, 0-100) and compression (PNG, 0-9).
+    :return: Returns a tuple of depth and imwrite params list.
+    """
+    encoding = dict(encoding or {})
+    ext = os.path.splitext(name)[1].lower()
+    file_format, depths = FORMATS.get(ext, (None, (8,)))
+
+    depth = encoding.pop('depth', None) or 8
+    quality = encoding.pop('quality', None)
+    compression = encoding.pop('compression', None)
+
+    if encoding:
+        raise HdrException(
+            'Invalid encoding options: {0}.'.format(
+                ', '.join(sorted(encoding))
+            )
+        )
+
+    if depth not in depths:
+        raise HdrException(
+            '{0} bit output is not supported for {1} files.'.format(
+                depth, ext or name
+            )
+        )
+
+    params = []
+    if quality is not None:
+        if file_format == 'jpeg':
+            params += [cv2.IMWRITE_JPEG_QUALITY, int(quality)]
+        elif file_format == 'webp':
+            params += [cv2.IMWRITE_WEBP_QUALITY, max(int(quality), 1)]
+        else:
+            raise HdrException(
+                'Quality is only supported for JPEG and WebP output.'
+            )
+
+    if compression is not None:
+        if file_format != 'png':
+            raise HdrException('Compression is only supported for PNG output.')
+        params += [cv2.IMWRITE_PNG_COMPRESSION, int(compression)]
+
+    return depth, params
+
+
+def get_buffer(shape, dtype):
+    """
+    Return an output buffer from the pool or a new one.
+    """
+    key = (tuple(shape), numpy.dtype(dtype).str)
+
+    with _buffers_lock:
+        pooled = _buffers.get(key)
+        if pooled:
+            return pooled.pop()
+
+    return numpy.empty(shape, dtype)
+
+
+def release_buffer(buffer):
+    """
+    Return an output buffer to the pool for reuse.
+    """
+    key = (buffer.shape, buffer.dtype.str)
+
+    with _buffers_lock:
+        pooled = _buffers.setdefault(key, [])
+        if len(pooled) < MAX_POOLED:
+            pooled.append(buffer)
+
+
+def to_ldr(image, depth=8, out=None):
+    """
+    Convert a tonemapped float image in [0, 1] to 8 or 16 bit.
+
+    Scaling, rounding and clipping happen in a single pass straight
+    into out or a pooled buffer, the float image is left untouched.
+    NaN values become 0.
+
+    :return: Returns the integer image.
+    """
+    dtype = DTYPES[depth]
+    maximum = float(numpy.iinfo(dtype).max)
+
+    if out is None:
+        out = get_buffer(image.shape, dtype)
+
+    cv2.addWeighted(
+        image, maximum, image, 0.0, 0.0, dst=out, dtype=CV_TYPES[depth]
+    )
+    return out
+
+
+def encode(image, name, params):
+    """
+    Write an integer image and return the buffer to the pool.
+    """
+    try:
+        if not cv2.imwrite(name, image, params):
+            raise HdrException('Unable to write image {0}.'.format(name))
+    except cv2.error as error:
+        raise HdrException(
+            'Unable to write image {0}: {1}'.format(name, error)
+        )
+    finally:
+        release_buffer(image)
+
+    return name
+
+
+@profiled('write')
+def write_ldr(image, name, encoding=None, writer=None):
+    """
+    Convert a tonemapped float image and write it to a file.
+
+    :param image: Float image in [0, 1].
+    :param name: Output file name.
+    :param encoding: Optional dictionary of depth, quality and
+        compression, see get_encoding.
+    :param writer: Optional ImageWriter to encode in the background.
+    :return: Returns the name of the file, or a Future resolving to it
+        when a writer is used.
+    """
+    depth, params = get_encoding(name, encoding)
+    ldr = to_ldr(image, depth)
+
+    if writer:
+        return writer.write(ldr, name, params)
+
+    return encode(ldr, name, params)
+
+
+@profiled('write')
+def encode_ldr(image, ext, encoding=None):
+    """
+    Convert a tonemapped float image and encode it in memory.
+
+    :param image: Float image in [0, 1].
+    :param ext: Format extension such as .jpg or png.
+    :param encoding: Optional dictionary of depth, quality and
+        compression, see get_encoding.
+    :return: Returns the encoded image as bytes.
+    """
+    if not ext.startswith('.'):
+        ext = '.' + ext
+
+    # A bare extension has no extension to splitext, name a file.
+    depth, params = get_encoding('image' + ext, encoding)
+    ldr = to_ldr(image, depth)
+
+    try:
+        success, data = cv2.imencode(ext, ldr, params)
+    except cv2.error as error:
+        raise HdrException(
+            'Unable to encode {0} image: {1}'.format(ext, error)
+        )
+    finally:
+        release_buffer(ldr)
+
+    if not success:
+        raise HdrException('Unable to encode {0} image.'.format(ext))
+
+    return data.tobytes()
+
+
+class ImageWriter(object):
+    """
+    Encode and write images on a background thread.
+
+    At most max_pending images wait for the encoder, further writes
+    block so memory stays bounded when encoding is the bottleneck.
+    Use as a context manager, leaving it waits for pending writes and
+    raises the first write error.
+    """
+
+    def __init__(self, max_pending=MAX_PENDING):
+        self.errors = []
+        self._queue = queue.Queue(max_pending)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+
+            image, name, params, future = item
+            try:
+                future.set_result(encode(image, name, params))
+            except Exception as error:
+                self.errors.append(error)
+                future.set_exception(error)
+
+    def write(self, image, name, params=()):
+        """
+        Queue an integer image to be written.
+
+        :return: Returns a Future resolving to the file name.
+        """
+        future = Future()
+        self._queue.put((image, name, list(params), future))
+        return future
+
+    def close(self):
+        """
+        Wait for pending writes and stop the writer thread.
+
+        Raises the first error of any failed write.
+        """
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+
+        if self.errors:
+            raise self.errors[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            # Keep the original error, write errors are secondary and
+            # may still be raised by writes that finish while closing.
+            try:
+                self.close()
+            except Exception:
+                pass
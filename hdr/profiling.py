@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+#
+# hdr: A Python API and CLI for creating HDR images.
+#
+# Copyright (C) 2017 Sean Marlow
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Per stage timing and peak memory of the HDR pipeline.
+
+Pipeline functions wrap their work in named stages such as decode,
+align, calibrate, merge, tonemap and write. Nothing is measured unless
+a Profiler is active in the calling thread or a hook is registered::
+
+    with Profiler() as profiler:
+        api.drago_hdr(images)
+
+    print(profiler.to_dict())
+
+Work handed to a thread pool is profiled when it is wrapped with
+bind in the submitting thread.
+
+Peak memory is measured with tracemalloc. It counts NumPy arrays,
+including OpenCV results, but not OpenCV's internal scratch buffers.
+tracemalloc is process wide, so jobs profiled concurrently in several
+threads see each other's allocations.
+"""
+
+import functools
+import json
+import threading
+import time
+import tracemalloc
+
+from contextlib import contextmanager
+
+_local = threading.local()
+_hooks = []
+_tracing_lock = threading.Lock()
+_tracing_users = 0
+
+
+def add_hook(hook):
+    """
+    Register a function called after every pipeline stage.
+
+    The hook is called as hook(name, seconds, peak_memory) in any
+    thread. peak_memory is None unless a Profiler with memory enabled
+    is active.
+    """
+    _hooks.append(hook)
+
+
+def remove_hook(hook):
+    """
+    Unregister a hook added with add_hook.
+    """
+    _hooks.remove(hook)
+
+
+def start_tracing():
+    global _tracing_users
+
+    with _tracing_lock:
+        if _tracing_users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _tracing_users = 1
+        elif _tracing_users:
+            _tracing_users += 1
+
+
+def stop_tracing():
+    global _tracing_users
+
+    with _tracing_lock:
+        if _tracing_users:
+            _tracing_users -= 1
+            if _tracing_users == 0:
+                tracemalloc.stop()
+
+
+def get_active():
+    """
+    Return the Profiler active in the calling thread, or None.
+    """
+    return getattr(_local, 'profiler', None)
+
+
+def set_active(profiler):
+    """
+    Make a Profiler, or None, active in the calling thread.
+
+    :return: Returns the previously active Profiler.
+    """
+    previous = get_active()
+    _local.profiler = profiler
+    return previous
+
+
+def bind(func):
+    """
+    Wrap a function to run with the calling thread's Profiler active.
+
+    Use it for work submitted to a thread pool, which otherwise runs
+    unprofiled on the pool threads.
+    """
+    profiler = get_active()
+
+    if profiler is None:
+        return func
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        previous = set_active(profiler)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            set_active(previous)
+    return wrapper
+
+
+@contextmanager
+def stage(name):
+    """
+    Measure a pipeline stage.
+    """
+    profiler = get_active()
+
+    if profiler is None and not _hooks:
+        yield
+        return
+
+    frame = profiler.enter(name) if profiler else None
+    start = time.perf_counter()
+
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        peak_memory = profiler.exit(frame, seconds) if profiler else None
+
+        for hook in list(_hooks):
+            hook(name, seconds, peak_memory)
+
+
+def profiled(name):
+    """
+    Decorator measuring every call of a function as a stage.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def write_profile(stream, record):
+    """
+    Write a profile record to a stream as one line of JSON.
+    """
+    stream.write(json.dumps(record) + '\n')
+    stream.flush()
+
+
+class Profiler(object):
+    """
+    Collect the stages run in the current thread.
+
+    Stages are listed in the order they started, nested stages such as
+    a calibration inside a merge have a larger depth. peak_memory is
+    the traced peak, in bytes, reached by the end of the stage above
+    the level at its start. The peak is not reset between stages, so a
+    stage that follows a larger one reports at most that larger peak.
+
+    :param memory: Also measure peak memory.
+    :param callback: Optional function called as
+        callback(name, seconds, peak_memory) after each stage.
+    """
+
+    def __init__(self, memory=True, callback=None):
+        self.memory = memory
+        self.callback = callback
+        self.stages = []
+        self.seconds = None
+        self.peak_memory = None
+        self._stack = []
+        self._previous = None
+        self._start = None
+
+    def _open_frame(self):
+        frame = {'start': 0}
+
+        if self.memory:
+            frame['start'] = tracemalloc.get_traced_memory()[0]
+
+        self._stack.append(frame)
+        return frame
+
+    def _close_frame(self, frame):
+        self._stack.remove(frame)
+
+        if not self.memory:
+            return None
+
+        # tracemalloc.reset_peak needs Python 3.9, the peak since
+        # tracing started is used instead.
+        return max(tracemalloc.get_traced_memory()[1] - frame['start'], 0)
+
+    def enter(self, name):
+        frame = self._open_frame()
+        frame['stage'] = {
+            'name': name,
+            'depth': len(self._stack) - 2,
+            'seconds': None,
+            'peak_memory': None
+        }
+        self.stages.append(frame['stage'])
+        return frame
+
+    def exit(self, frame, seconds):
+        peak_memory = self._close_frame(frame)
+        frame['stage']['seconds'] = seconds
+        frame['stage']['peak_memory'] = peak_memory
+
+        if self.callback:
+            self.callback(frame['stage']['name'], seconds, peak_memory)
+
+        return peak_memory
+
+    def to_dict(self):
+        """
+        Return the profile as a JSON serializable dictionary.
+        """
+        return {
+            'seconds': self.seconds,
+            'peak_memory': self.peak_memory,
+            'stages': [dict(item) for item in self.stages]
+        }
+
+    def __enter__(self):
+        if self.memory:
+            start_tracing()
+
+        self._open_frame()
+        self._previous = set_active(self)
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.seconds = time.perf_counter() - self._start
+        set_active(self._previous)
+        self.peak_memory = self._close_frame(self._stack[0])
+
+        if self.memory:
+            stop_tracing()
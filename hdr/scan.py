@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+#
+# hdr: A Python API and CLI for creating HDR images.
+#
+# Copyright (C) 2017 Sean Marlow
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Group a directory of shots into bracket sets.
+
+The index is a JSON file stored with the images. It records the EXIF
+values of every file seen so far keyed by relative path, modification
+time and size, so a rescan only reads files that are new or changed.
+"""
+
+import json
+import os
+
+from hdr.exceptions import HdrException
+from hdr.exif import read_exif_batch
+
+DEFAULT_MAX_GAP = 2.0
+IMAGE_EXTENSIONS = ('.jpeg', '.jpg', '.tif', '.tiff')
+INDEX_NAME = '.hdr_index.json'
+INDEX_VERSION = 1
+
+
+def get_index_path(directory, index=None):
+    """
+    Return the path of the index file for the directory.
+    """
+    return index or os.path.join(directory, INDEX_NAME)
+
+
+def find_images(directory, recursive=False):
+    """
+    Return the relative paths of all images in the directory, sorted.
+    """
+    names = []
+
+    for root, dirs, files in os.walk(directory):
+        dirs[:] = sorted(d for d in dirs if not d.startswith('.'))
+
+        for name in files:
+            if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS:
+                names.append(
+                    os.path.relpath(os.path.join(root, name), directory)
+                )
+
+        if not recursive:
+            break
+
+    return sorted(names)
+
+
+def read_index(path):
+    """
+    Read an index file.
+
+    :return: Returns the index dictionary, or an empty index if the
+        file does not exist.
+    """
+    if not os.path.isfile(path):
+        return {'version': INDEX_VERSION, 'files': {}, 'sets': []}
+
+    try:
+        with open(path) as index_file:
+            index = json.load(index_file)
+    except ValueError as error:
+        raise HdrException('Invalid index {0}: {1}'.format(path, error))
+
+    if index.get('version') != INDEX_VERSION:
+        return {'version': INDEX_VERSION, 'files': {}, 'sets': []}
+
+    return index
+
+
+def write_index(index, path):
+    """
+    Atomically write an index file.
+    """
+    tmp_path = path + '.tmp'
+
+    with open(tmp_path, 'w') as index_file:
+        json.dump(index, index_file, indent=1, sort_keys=True)
+
+    os.replace(tmp_path, path)
+    return path
+
+
+def get_camera(exif):
+    """
+    Return a value identifying the camera body that took a frame.
+    """
+    return (
+        exif.get('serial') or '',
+        exif.get('make') or '',
+        exif.get('model') or ''
+    )
+
+
+def group_brackets(entries, max_gap=DEFAULT_MAX_GAP):
+    """
+    Group frames into bracket sets.
+
+    Frames are ordered by camera and capture time. A new set starts
+    when the camera changes, when the time since the previous frame
+    is larger than max_gap seconds or when an exposure time repeats,
+    which marks the start of the next bracket sequence. Frames
+    without an exposure time cannot be merged and are skipped.
+
+    :param entries: Dictionary of relative path to EXIF values.
+    :param max_gap: Maximum seconds between frames in one set.
+    :return: Returns a list of sets, each a list of relative paths.
+    """
+    frames = sorted(
+        (
+            get_camera(exif),
+            exif.get('timestamp') or 0,
+            name,
+            exif['exposure']
+        )
+        for name, exif in entries.items()
+        if exif.get('exposure')
+    )
+
+    sets = []
+    current = []
+    previous = None
+
+    for camera, timestamp, name, exposure in frames:
+        if previous is not None:
+            new_set = (
+                camera != previous[0] or
+                timestamp - previous[1] > max_gap or
+                exposure in [frame[3] for frame in current]
+            )
+
+            if new_set:
+                sets.append(current)
+                current = []
+
+        current.append((camera, timestamp, name, exposure))
+        previous = (camera, timestamp)
+
+    if current:
+        sets.append(current)
+
+    # A single frame is not a bracket.
+    return [
+        [frame[2] for frame in bracket]
+        for bracket in sets
+        if len(bracket) > 1
+    ]
+
+
+def scan(directory,
+         index=None,
+         max_gap=DEFAULT_MAX_GAP,
+         recursive=False,
+         workers=None):
+    """
+    Scan a directory and group the images into bracket sets.
+
+    The index is updated incrementally. Files already in the index
+    with an unchanged modification time and size are not read again
+    and files that no longer exist are dropped.
+
+    :param directory: Directory holding the images.
+    :param index: Path of the index file, defaults to .hdr_index.json
+        in the directory.
+    :param max_gap: Maximum seconds between frames in one set.
+    :param recursive: Also scan sub directories.
+    :param workers: Number of threads used to read EXIF data.
+    :return: Returns the updated index dictionary. The sets key holds
+        a list of {'images': [...]} jobs with paths relative to the
+        directory.
+    """
+    if not os.path.isdir(directory):
+        raise HdrException('{0} is not a directory.'.format(directory))
+
+    index_path = get_index_path(directory, index)
+    data = read_index(index_path)
+    known = data['files']
+
+    files = {}
+    pending = []
+
+    for name in find_images(directory, recursive):
+        stat = os.stat(os.path.join(directory, name))
+        entry = known.get(name)
+
+        if (entry and entry['mtime'] == stat.st_mtime_ns and
+                entry['size'] == stat.st_size):
+            files[name] = entry
+        else:
+            pending.append((name, stat))
+
+    kwargs = {'workers': workers} if workers else {}
+    values = read_exif_batch(
+        [os.path.join(directory, name) for name, stat in pending],
+        **kwargs
+    )
+
+    for (name, stat), exif in zip(pending, values):
+        files[name] = {
+            'mtime': stat.st_mtime_ns,
+            'size': stat.st_size,
+            'exif': exif
+        }
+
+    sets = group_brackets(
+        {name: entry['exif'] for name, entry in files.items()},
+        max_gap
+    )
+
+    # Image paths in the index are relative to root, which is itself
+    # relative to the index file so the tree can be moved as a whole.
+    data = {
+        'version': INDEX_VERSION,
+        'root': os.path.relpath(
+            directory, os.path.dirname(os.path.abspath(index_path))
+        ),
+        'max_gap': max_gap,
+        'files': files,
+        'sets': [{'images': images} for images in sets]
+    }
+
+    write_index(data, index_path)
+
+    data['new'] = len(pending)
+    return data
@@ -0,0 +1,332 @@
+# -*- coding: utf-8 -*-
+#
+# hdr: A Python API and CLI for creating HDR images.
+#
+# Copyright (C) 2017 Sean Marlow
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Streaming HDR sequences such as bracketed timelapses.
+
+Bracket sets are consumed one at a time from any iterable and every
+frame is written before the next set is read, so memory stays constant
+however long the sequence is. State is carried from one set to the
+next instead of being rebuilt:
+
+- the response curve is calibrated once, on the first set;
+- alignment searches around the shifts of the previous set;
+- the brightness of the tonemapped frames is smoothed over time to
+  suppress exposure flicker.
+
+Frames are written as numbered images or piped as raw BGR24 video to
+an encoder such as ffmpeg.
+"""
+
+import shlex
+import subprocess
+
+import cv2
+import numpy
+
+from hdr.api import HdrPipeline, align_images, get_image_output
+from hdr.exceptions import HdrException
+from hdr.output import ImageWriter, release_buffer, to_ldr, write_ldr
+
+SMOOTHING = 0.9
+STATS_SIZE = 256
+
+
+def group_images(image_names, bracket):
+    """
+    Split a sorted list of images into consecutive bracket sets.
+    """
+    if len(image_names) % bracket:
+        raise HdrException(
+            '{0} images do not split into sets of {1}.'.format(
+                len(image_names), bracket
+            )
+        )
+
+    for index in range(0, len(image_names), bracket):
+        yield list(image_names[index:index + bracket])
+
+
+def read_sets(stream):
+    """
+    Lazily read bracket sets, one per line of whitespace separated image
+    names. Blank lines and lines starting with # are skipped.
+    """
+    for line in stream:
+        if line.strip() and not line.lstrip().startswith('#'):
+            yield shlex.split(line)
+
+
+def get_frame_output(pattern, frame, image_names, preview=None):
+    """
+    Return the output name of a frame.
+
+    :param pattern: Optional pattern formatted with the frame number,
+        for example frames/frame_{0:05d}.jpg. Without a pattern the
+        frame is named after its bracket set like other commands.
+    """
+    if not pattern:
+        return get_image_output(
+            image_names[min(1, len(image_names) - 1)], None, preview=preview
+        )
+
+    try:
+        output = pattern.format(frame)
+    except (IndexError, KeyError, ValueError):
+        raise HdrException(
+            'Invalid output pattern {0}, use a field such as '
+            '{{0:05d}} for the frame number.'.format(pattern)
+        )
+
+    if output == pattern:
+        raise HdrException(
+            'The output pattern {0} has no frame number field.'.format(
+                pattern
+            )
+        )
+
+    return get_image_output(None, output, preview=preview)
+
+
+class SequencePipeline(HdrPipeline):
+    """
+    HdrPipeline that carries state from one bracket set to the next.
+
+    Takes the HdrPipeline arguments and:
+
+    :param smoothing: Weight of the previous frames in the moving
+        average of the output brightness, 0 tonemaps every frame
+        independently.
+    :param warm_start: Search for alignment shifts around those of the
+        previous set, only small residual motion is detected.
+    """
+
+    def __init__(self, *args, smoothing=SMOOTHING, warm_start=True,
+                 **kwargs):
+        super(SequencePipeline, self).__init__(*args, **kwargs)
+
+        if not 0 <= smoothing < 1:
+            raise HdrException('Smoothing must be in the [0, 1) range.')
+
+        self.smoothing = smoothing
+        self.warm_start = warm_start
+        self.shifts = None
+        self.brightness = None
+
+    def get_response(self, image_names, images, exposures):
+        """
+        Return the response curve, calibrated from the first set only.
+        """
+        if self.response is None:
+            self.response = super(SequencePipeline, self).get_response(
+                image_names, images, exposures
+            )
+
+        return self.response
+
+    def align_images(self, images, image_names):
+        shifts = align_images(
+            images, image_names, self.align, self.cache_shifts,
+            self.preview, self.shifts if self.warm_start else None
+        )
+        self.shifts = shifts
+
+    def get_brightness(self, image):
+        """
+        Return the mean luminance of a tonemapped image, measured on a
+        small proxy.
+        """
+        height, width = image.shape[:2]
+        factor = min(1.0, float(STATS_SIZE) / max(height, width))
+        if factor < 1:
+            image = cv2.resize(
+                image, None, fx=factor, fy=factor,
+                interpolation=cv2.INTER_AREA
+            )
+
+        return float(cv2.cvtColor(image, cv2.COLOR_BGR2GRAY).mean())
+
+    def tonemap(self, radiance, out=None):
+        """
+        Tonemap a frame and scale it to the smoothed brightness.
+
+        The OpenCV tonemaps adapt to every frame on its own, so small
+        exposure differences between sets become visible flicker. The
+        brightness is pulled towards its moving average, which removes
+        frame to frame jumps while slow changes such as a sunset still
+        come through.
+        """
+        ldr = super(SequencePipeline, self).tonemap(radiance, out)
+
+        if not self.smoothing:
+            return ldr
+
+        brightness = self.get_brightness(ldr)
+        if self.brightness is None:
+            self.brightness = brightness
+        else:
+            self.brightness = (
+                self.smoothing * self.brightness +
+                (1 - self.smoothing) * brightness
+            )
+
+        if brightness > 0:
+            numpy.multiply(ldr, self.brightness / brightness, out=ldr)
+
+        return ldr
+
+
+def open_pipe(command, width, height):
+    """
+    Start an encoder reading raw BGR24 frames on stdin.
+
+    The command is formatted with width and height, for example
+    ffmpeg -f rawvideo -pix_fmt bgr24 -s {width}x{height} -i - out.mp4
+    """
+    try:
+        args = shlex.split(command.format(width=width, height=height))
+        return subprocess.Popen(args, stdin=subprocess.PIPE)
+    except (KeyError, IndexError, ValueError, OSError) as error:
+        raise HdrException(
+            'Unable to start encoder {0}: {1}'.format(command, error)
+        )
+
+
+def close_pipe(process):
+    """
+    Close the encoder input and wait for it to finish.
+    """
+    try:
+        process.stdin.close()
+    except BrokenPipeError:
+        pass
+
+    if process.wait():
+        raise HdrException(
+            'The encoder exited with status {0}.'.format(process.returncode)
+        )
+
+
+def process_sequence(bracket_sets,
+                     tonemap='drago',
+                     params=None,
+                     algo='debevec',
+                     exposures=None,
+                     output=None,
+                     pipe=None,
+                     smoothing=SMOOTHING,
+                     warm_start=True,
+                     response=None,
+                     cache_response=False,
+                     align=True,
+                     preview=None,
+                     encoding=None,
+                     callback=None):
+    """
+    Merge and tonemap a sequence of bracket sets into frames.
+
+    :param bracket_sets: Iterable of image name lists, read one set at
+        a time so it may be a generator.
+    :param tonemap: Tonemap operator name.
+    :param params: Dictionary of tonemap parameters.
+    :param algo: Merge algorithm, debevec or robertson.
+    :param exposures: Optional comma separated exposure times used for
+        every set, read from EXIF by default.
+    :param output: Optional frame name pattern, see get_frame_output.
+    :param pipe: Optional encoder command to pipe raw BGR24 frames to
+        instead of writing images, see open_pipe.
+    :param smoothing: Weight of the previous frames in the smoothed
+        brightness, 0 disables smoothing.
+    :param warm_start: Search for alignment shifts around those of the
+        previous set.
+    :param response: Optional response curve (array or .npy path),
+        calibrated from the first set by default.
+    :param cache_response: Reuse and store camera response curves.
+    :param align: False to skip alignment or a dictionary of options.
+    :param preview: Decode the images at 1/2, 1/4 or 1/8 scale.
+    :param encoding: Optional dictionary of output depth (8 or 16),
+        quality (JPEG and WebP) and compression (PNG).
+    :param callback: Optional function called as
+        callback(frame, image_names, output) after each frame, output
+        is None when piping.
+    :return: Returns the number of frames.
+    """
+    if algo not in ('debevec', 'robertson'):
+        raise HdrException(
+            'The {0} algorithm is not supported for sequences.'.format(algo)
+        )
+
+    pipeline = SequencePipeline(
+        tonemap, params, algo, response=response,
+        cache_response=cache_response, align=align, preview=preview,
+        smoothing=smoothing, warm_start=warm_start
+    )
+
+    frames = 0
+    process = None
+    finished = False
+
+    try:
+        with ImageWriter() as writer:
+            for image_names in bracket_sets:
+                ldr = pipeline.render(image_names, exposures)
+
+                if pipe:
+                    if process is None:
+                        height, width = ldr.shape[:2]
+                        process = open_pipe(pipe, width, height)
+                    elif ldr.shape[:2] != (height, width):
+                        raise HdrException(
+                            'Frame {0} is {1}x{2}, piped frames must all '
+                            'be {3}x{4}.'.format(
+                                frames, ldr.shape[1], ldr.shape[0],
+                                width, height
+                            )
+                        )
+
+                    frame = to_ldr(ldr)
+                    try:
+                        process.stdin.write(frame.data)
+                    except BrokenPipeError:
+                        raise HdrException('The encoder closed its input.')
+                    finally:
+                        release_buffer(frame)
+                    name = None
+                else:
+                    name = get_frame_output(
+                        output, frames, image_names, preview
+                    )
+                    write_ldr(ldr, name, encoding, writer)
+
+                if callback:
+                    callback(frames, image_names, name)
+                frames += 1
+
+        finished = True
+    finally:
+        if process is not None:
+            try:
+                close_pipe(process)
+            except HdrException:
+                # An encoder failing after an earlier error is a
+                # consequence of it, report the original error instead.
+                if finished:
+                    raise
+
+    return frames
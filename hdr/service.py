@@ -0,0 +1,572 @@
+# -*- coding: utf-8 -*-
+#
+# hdr: A Python API and CLI for creating HDR images.
+#
+# Copyright (C) 2017 Sean Marlow
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Local HDR job service.
+
+A small HTTP/1.1 JSON API served over TCP or a Unix socket. Jobs are
+queued and run on a bounded pool of worker threads in one long running
+process, so response curves, EXIF data and OpenCV algorithm objects
+stay warm between jobs instead of being rebuilt by every invocation.
+
+    POST /jobs        submit a job, 202 with the job or 503 when full
+    GET  /jobs        list known jobs
+    GET  /jobs/<id>   poll a job for its status, output and error
+    GET  /status      queue and worker statistics
+
+A job uses the same format as a batch manifest entry::
+
+    {"images": ["a1.jpg", "a2.jpg"], "operator": "durand", "gamma": 2.2}
+
+Add "profile": true to include the time and peak memory of each
+pipeline stage in the job record.
+"""
+
+import asyncio
+import collections
+import inspect
+import json
+import os
+import stat
+import time
+import uuid
+
+from concurrent.futures import ThreadPoolExecutor
+
+from hdr import batch, memory
+from hdr.align import parse_align
+from hdr.exceptions import HdrException
+from hdr.threads import get_cores, set_threads
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+DEFAULT_QUEUE_SIZE = 16
+MAX_BODY = 1024 * 1024
+MAX_JOBS = 1000
+RETRY_AFTER = 1
+
+# Job options naming files to read or write.
+PATH_OPTIONS = ('output', 'radiance_output', 'response')
+
+REASONS = {
+    200: 'OK',
+    202: 'Accepted',
+    400: 'Bad Request',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    413: 'Payload Too Large',
+    500: 'Internal Server Error',
+    503: 'Service Unavailable'
+}
+
+
+class HttpError(Exception):
+    def __init__(self, status, message, headers=None):
+        super(HttpError, self).__init__(message)
+        self.status = status
+        self.headers = headers or {}
+
+
+class HdrService(object):
+    """
+    Queue of HDR jobs processed by a bounded worker pool.
+
+    At most queue_size jobs wait for a worker, further submissions are
+    rejected so clients back off instead of growing server memory.
+    Finished jobs are kept for polling until max_jobs is exceeded, then
+    the oldest finished jobs are dropped.
+
+    With a memory limit a worker starts its job only once the estimated
+    memory of the running jobs leaves room for it. Jobs too large for
+    the limit on their own run tiled or at reduced scale, see
+    memory.fit_job, and jobs that fit in no way are rejected.
+
+    :param workers: Number of jobs processed concurrently.
+    :param queue_size: Maximum number of queued jobs.
+    :param threads: Number of OpenCV and decode threads, defaults to
+        the core budget. OpenCV has one thread pool per process, so it
+        is set once for the service and shared by all workers rather
+        than divided between them.
+    :param operator: Tonemap operator for jobs that do not name one.
+    :param root: Directory job paths are resolved against, paths
+        outside it are rejected.
+    :param cache_response: Default cache_response for jobs that merge.
+    :param max_jobs: Maximum number of job records kept.
+    :param cores: Core budget, defaults to threads.get_cores.
+    :param memory_limit: Optional memory budget in bytes for the
+        service, including the process itself.
+    """
+
+    def __init__(self,
+                 workers=1,
+                 queue_size=DEFAULT_QUEUE_SIZE,
+                 threads=None,
+                 operator='drago',
+                 root=None,
+                 cache_response=True,
+                 max_jobs=MAX_JOBS,
+                 cores=None,
+                 memory_limit=None):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.threads = get_cores(cores) if threads is None else threads
+        self.operator = operator
+        self.root = os.path.realpath(root or os.getcwd())
+        self.cache_response = cache_response
+        self.max_jobs = max_jobs
+        self.memory_limit = memory_limit
+        self.memory_used = 0
+        self.jobs = collections.OrderedDict()
+        self.queue = None
+        self._pending = {}
+        self._tasks = []
+        self._executor = None
+        self._memory = None
+
+        self.available = None
+        if memory_limit:
+            self.available = memory_limit - memory.PROCESS_BYTES
+            if self.available <= 0:
+                raise HdrException(
+                    'The memory limit of {0} MB does not cover the '
+                    'service process.'.format(memory_limit // memory.MB)
+                )
+
+    def resolve_path(self, name):
+        """
+        Resolve a job path against the root.
+
+        Symbolic links and .. segments are resolved first, so a path
+        that leads outside the root in any way is rejected.
+        """
+        path = os.path.realpath(os.path.join(self.root, name))
+        if os.path.commonpath([path, self.root]) != self.root:
+            raise HdrException(
+                'The path {0} is outside the service root.'.format(name)
+            )
+
+        return path
+
+    def prepare_job(self, data):
+        """
+        Validate a submitted job and resolve its paths.
+
+        :return: Returns the job dictionary for batch.run_job.
+        """
+        if not isinstance(data, dict) or not data.get('images'):
+            raise HdrException('A job requires a list of images.')
+
+        images = data['images']
+        if not isinstance(images, list) or not all(
+                isinstance(image, str) for image in images):
+            raise HdrException('Job images must be a list of file names.')
+
+        job = dict(data)
+        job.pop('profile', None)
+        job.setdefault('operator', self.operator)
+        operator = batch.get_operator(job['operator'])
+
+        job['images'] = [self.resolve_path(image) for image in images]
+        for name in PATH_OPTIONS:
+            if isinstance(job.get(name), str):
+                job[name] = self.resolve_path(job[name])
+
+        if isinstance(job.get('align'), str):
+            job['align'] = parse_align(job['align'])
+
+        params = inspect.signature(operator).parameters
+        unknown = set(job) - set(params) - {'images', 'operator'}
+        if unknown:
+            raise HdrException(
+                'Invalid {0} job options: {1}.'.format(
+                    job['operator'], ', '.join(sorted(unknown))
+                )
+            )
+
+        if 'cache_response' in params:
+            job.setdefault('cache_response', self.cache_response)
+
+        return job
+
+    def fit_job(self, job):
+        """
+        Fit a job into the memory limit.
+
+        :return: Returns a tuple of the job to run, its estimated memory
+            and a description of the fallback or None.
+        """
+        if self.available is None:
+            return job, 0, None
+
+        return memory.fit_job(job, self.available)
+
+    def check_queue(self):
+        if self.queue.full():
+            raise HttpError(
+                503,
+                'The job queue is full, retry later.',
+                {'Retry-After': str(RETRY_AFTER)}
+            )
+
+    async def submit(self, data):
+        """
+        Queue a job.
+
+        A full queue is reported before the images are inspected, and
+        the memory fit, which reads image headers, runs off the event
+        loop.
+
+        :return: Returns the job record.
+        """
+        self.check_queue()
+        job = self.prepare_job(data)
+
+        loop = asyncio.get_event_loop()
+        job, estimate, fallback = await loop.run_in_executor(
+            None, self.fit_job, job
+        )
+
+        # The queue may have filled while the job was fitted.
+        self.check_queue()
+
+        job_id = uuid.uuid4().hex
+        record = {
+            'id': job_id,
+            'status': 'queued',
+            'operator': job['operator'],
+            'images': job['images'],
+            'output': None,
+            'error': None,
+            'submitted': time.time(),
+            'started': None,
+            'finished': None
+        }
+
+        if data.get('profile'):
+            record['profile'] = None
+
+        if fallback:
+            record['fallback'] = fallback
+
+        self.jobs[job_id] = record
+        self._pending[job_id] = (job, estimate)
+        self.queue.put_nowait(job_id)
+        self.prune()
+        return record
+
+    def prune(self):
+        """
+        Drop the oldest finished job records above max_jobs.
+        """
+        excess = len(self.jobs) - self.max_jobs
+        if excess <= 0:
+            return
+
+        finished = [
+            job_id for job_id, record in self.jobs.items()
+            if record['status'] in ('done', 'failed')
+        ]
+        for job_id in finished[:excess]:
+            del self.jobs[job_id]
+
+    def get_status(self):
+        """
+        Return queue and worker statistics.
+        """
+        counts = collections.Counter(
+            record['status'] for record in self.jobs.values()
+        )
+        return {
+            'workers': self.workers,
+            'threads': self.threads,
+            'memory_limit': self.memory_limit,
+            'memory_used': self.memory_used,
+            'queue_size': self.queue_size,
+            'queued': counts['queued'],
+            'running': counts['running'],
+            'done': counts['done'],
+            'failed': counts['failed']
+        }
+
+    async def work(self):
+        """
+        Process queued jobs until cancelled.
+        """
+        loop = asyncio.get_event_loop()
+
+        while True:
+            job_id = await self.queue.get()
+            record = self.jobs[job_id]
+            job, estimate = self._pending.pop(job_id)
+
+            async with self._memory:
+                await self._memory.wait_for(
+                    lambda: self.available is None or
+                    self.memory_used + estimate <= self.available
+                )
+                self.memory_used += estimate
+
+            record['status'] = 'running'
+            record['started'] = time.time()
+
+            try:
+                result = await loop.run_in_executor(
+                    self._executor, batch.run_job, job, None,
+                    'profile' in record
+                )
+            except Exception as error:
+                result = {
+                    'output': None,
+                    'error': str(error) or error.__class__.__name__
+                }
+            finally:
+                async with self._memory:
+                    self.memory_used -= estimate
+                    self._memory.notify_all()
+
+            record['output'] = result['output']
+            record['error'] = result['error']
+            if 'profile' in result:
+                record['profile'] = result['profile']
+            record['status'] = 'failed' if result['error'] else 'done'
+            record['finished'] = time.time()
+            self.queue.task_done()
+
+    async def route(self, method, path, body):
+        """
+        Dispatch a request.
+
+        :return: Returns a tuple of HTTP status and JSON payload.
+        """
+        parts = [part for part in path.split('?')[0].split('/') if part]
+
+        if parts == ['status']:
+            if method != 'GET':
+                raise HttpError(405, 'Use GET for /status.')
+            return 200, self.get_status()
+
+        if parts == ['jobs']:
+            if method == 'GET':
+                return 200, {'jobs': list(self.jobs.values())}
+            elif method == 'POST':
+                try:
+                    data = json.loads(body.decode('utf-8') or 'null')
+                except ValueError as error:
+                    raise HttpError(400, 'Invalid JSON: {0}'.format(error))
+
+                try:
+                    return 202, await self.submit(data)
+                except HdrException as error:
+                    raise HttpError(400, str(error))
+            else:
+                raise HttpError(405, 'Use GET or POST for /jobs.')
+
+        if len(parts) == 2 and parts[0] == 'jobs':
+            if method != 'GET':
+                raise HttpError(405, 'Use GET for /jobs/<id>.')
+
+            record = self.jobs.get(parts[1])
+            if record is None:
+                raise HttpError(404, 'Unknown job {0}.'.format(parts[1]))
+            return 200, record
+
+        raise HttpError(404, 'Not found.')
+
+    async def handle(self, reader, writer):
+        """
+        Serve one HTTP request on a connection.
+        """
+        headers = {}
+
+        try:
+            try:
+                method, path, body = await read_request(reader)
+                status, payload = await self.route(method, path, body)
+            except HttpError as error:
+                status = error.status
+                payload = {'error': str(error)}
+                headers = error.headers
+            except Exception as error:
+                status = 500
+                payload = {'error': str(error) or error.__class__.__name__}
+
+            writer.write(format_response(status, payload, headers))
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, host=DEFAULT_HOST, port=DEFAULT_PORT, socket=None):
+        """
+        Start the workers and listen on a TCP port or a Unix socket.
+
+        :return: Returns the asyncio server.
+        """
+        set_threads(self.threads)
+
+        self.queue = asyncio.Queue(self.queue_size)
+        self._memory = asyncio.Condition()
+        self._executor = ThreadPoolExecutor(max_workers=self.workers)
+        self._tasks = [
+            asyncio.ensure_future(self.work()) for _ in range(self.workers)
+        ]
+
+        if socket:
+            remove_stale_socket(socket)
+            return await asyncio.start_unix_server(self.handle, path=socket)
+
+        return await asyncio.start_server(self.handle, host, port)
+
+    async def stop(self):
+        """
+        Stop the workers, running jobs are allowed to finish.
+        """
+        for task in self._tasks:
+            task.cancel()
+
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+        if self._executor:
+            self._executor.shutdown(wait=True)
+
+
+async def read_request(reader):
+    """
+    Read an HTTP request line, headers and body.
+
+    :return: Returns a tuple of method, path and body bytes.
+    """
+    line = await reader.readline()
+
+    try:
+        method, path, _ = line.decode('latin-1').split(' ', 2)
+    except ValueError:
+        raise HttpError(400, 'Invalid request line.')
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    try:
+        length = int(headers.get('content-length', 0))
+    except ValueError:
+        raise HttpError(400, 'Invalid Content-Length.')
+
+    if length > MAX_BODY:
+        raise HttpError(413, 'The request body is too large.')
+
+    body = await reader.readexactly(length) if length > 0 else b''
+    return method.upper(), path, body
+
+
+def format_response(status, payload, headers=None):
+    """
+    Return the bytes of a JSON HTTP response.
+    """
+    body = json.dumps(payload).encode('utf-8')
+    lines = [
+        'HTTP/1.1 {0} {1}'.format(status, REASONS.get(status, '')),
+        'Content-Type: application/json',
+        'Content-Length: {0}'.format(len(body)),
+        'Connection: close'
+    ]
+    lines += [
+        '{0}: {1}'.format(name, value)
+        for name, value in (headers or {}).items()
+    ]
+    return '\r\n'.join(lines).encode('latin-1') + b'\r\n\r\n' + body
+
+
+def remove_stale_socket(path):
+    """
+    Remove a Unix socket left behind by a previous server.
+    """
+    try:
+        mode = os.stat(path).st_mode
+    except FileNotFoundError:
+        return
+
+    if not stat.S_ISSOCK(mode):
+        raise HdrException('{0} exists and is not a socket.'.format(path))
+
+    os.remove(path)
+
+
+async def serve(service, host=DEFAULT_HOST, port=DEFAULT_PORT, socket=None,
+                callback=None):
+    """
+    Run the service until cancelled.
+
+    :param callback: Optional function called with the listening
+        address once the server accepts connections.
+    """
+    server = await service.start(host, port, socket)
+
+    try:
+        if callback:
+            if socket:
+                callback(socket)
+            else:
+                # Report the bound port, port 0 picks a free one.
+                callback('{0}:{1}'.format(
+                    *server.sockets[0].getsockname()[:2]
+                ))
+
+        # Server.serve_forever needs Python 3.7, wait on a future that
+        # only completes when cancelled instead.
+        await asyncio.get_event_loop().create_future()
+    finally:
+        server.close()
+        await server.wait_closed()
+        await service.stop()
+
+        if socket and os.path.exists(socket):
+            os.remove(socket)
+
+
+def run(service, host=DEFAULT_HOST, port=DEFAULT_PORT, socket=None,
+        callback=None):
+    """
+    Run the service on a new event loop until interrupted.
+
+    A KeyboardInterrupt cancels serve, so the workers are stopped and
+    the socket removed, and is then raised again.
+    """
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    task = loop.create_task(serve(service, host, port, socket, callback))
+
+    try:
+        loop.run_until_complete(task)
+    except KeyboardInterrupt:
+        task.cancel()
+        try:
+            loop.run_until_complete(task)
+        except asyncio.CancelledError:
+            pass
+        raise
+    finally:
+        loop.close()
+        asyncio.set_event_loop(None)
@@ -0,0 +1,447 @@
+# -*- coding: utf-8 -*-
+#
+# hdr: A Python API and CLI for creating HDR images.
+#
+# Copyright (C) 2017 Sean Marlow
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Tonemap parameter sweeps over merged radiance maps.
+
+Each bracket set is merged once and every combination of a parameter
+grid is rendered from the same radiance map. Radiance maps are kept in
+a size bounded LRU cache, which can also be used directly when tuning
+interactively::
+
+    from hdr import sweep
+
+    radiance = sweep.merge_cached(['a1.jpg', 'a2.jpg', 'a3.jpg'])
+    # A second call with the same images returns the cached map.
+"""
+
+import collections
+import hashlib
+import itertools
+import json
+import math
+import os
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy
+
+from hdr.api import (
+    RADIANCE_EXTENSIONS,
+    TONEMAPS,
+    HdrPipeline,
+    create_tonemap,
+    get_image_name,
+    get_preview_params
+)
+from hdr.exceptions import HdrException
+from hdr.output import to_ldr, write_ldr
+from hdr.profiling import bind, stage
+from hdr.threads import limit_threads, plan_threads
+
+DEFAULT_CACHE_SIZE = 1024 * 1024 * 1024
+MAX_COMBINATIONS = 1000
+THUMB_WIDTH = 320
+LABEL_HEIGHT = 20
+
+
+class RadianceCache(object):
+    """
+    Least recently used cache of radiance maps bounded by size.
+
+    Cached maps are read only, copy one before changing it. Safe to
+    share between threads.
+
+    :param max_bytes: Maximum total size of the cached maps.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_CACHE_SIZE):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._items = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Return the cached radiance map for key or None.
+        """
+        with self._lock:
+            radiance = self._items.get(key)
+
+            if radiance is None:
+                self.misses += 1
+            else:
+                self._items.move_to_end(key)
+                self.hits += 1
+
+            return radiance
+
+    def put(self, key, radiance):
+        """
+        Cache a radiance map, evicting the least recently used maps to
+        stay within max_bytes. Maps larger than the cache are skipped.
+        """
+        radiance.flags.writeable = False
+
+        with self._lock:
+            if key in self._items:
+                self.nbytes -= self._items.pop(key).nbytes
+
+            if radiance.nbytes > self.max_bytes:
+                return
+
+            while self._items and self.nbytes + radiance.nbytes > \
+                    self.max_bytes:
+                self.nbytes -= self._items.popitem(last=False)[1].nbytes
+
+            self._items[key] = radiance
+            self.nbytes += radiance.nbytes
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.nbytes = 0
+
+    def __len__(self):
+        return len(self._items)
+
+
+_cache = RadianceCache()
+
+
+def get_cache():
+    """
+    Return the module wide radiance cache.
+    """
+    return _cache
+
+
+def get_cache_key(image_names, exposures, algo, response, align, preview):
+    """
+    Return the cache key of a merge.
+
+    Images are identified by path, modification time and size so an
+    edited file is merged again.
+    """
+    frames = []
+    for name in image_names:
+        stat = os.stat(name)
+        frames.append(
+            [os.path.abspath(name), stat.st_mtime_ns, stat.st_size]
+        )
+
+    if response is not None and not isinstance(response, str):
+        response = hashlib.sha1(
+            numpy.ascontiguousarray(response).tobytes()
+        ).hexdigest()
+
+    return json.dumps(
+        [frames, exposures, algo, response, align, preview], sort_keys=True
+    )
+
+
+def merge_cached(image_names,
+                 exposures=None,
+                 algo='debevec',
+                 response=None,
+                 cache_response=False,
+                 align=True,
+                 preview=None,
+                 cache=None):
+    """
+    Merge the images into a radiance map through the radiance cache.
+
+    Takes the process_image arguments and:
+
+    :param cache: RadianceCache to use, defaults to the module wide
+        cache.
+    :return: Returns the read only float32 radiance map.
+    """
+    if cache is None:
+        cache = _cache
+
+    key = get_cache_key(image_names, exposures, algo, response, align,
+                        preview)
+
+    radiance = cache.get(key)
+    if radiance is None:
+        pipeline = HdrPipeline(
+            algo=algo, response=response, cache_response=cache_response,
+            align=align, preview=preview
+        )
+        radiance = pipeline.merge(image_names, exposures)
+        cache.put(key, radiance)
+
+    return radiance
+
+
+def parse_param(spec):
+    """
+    Parse a sweep parameter as name=v1,v2,... or name=start:stop:step.
+
+    Ranges include stop when it falls on a step.
+
+    :return: Returns a tuple of name and list of values.
+    """
+    name, sep, values = spec.partition('=')
+    name = name.strip().replace('-', '_')
+
+    try:
+        if not sep or not name:
+            raise ValueError
+
+        if ':' in values:
+            start, stop, step = (float(value) for value in values.split(':'))
+            if step <= 0 or stop < start:
+                raise ValueError
+
+            count = int(math.floor((stop - start) / step + 1e-9)) + 1
+            return name, [round(start + index * step, 9)
+                          for index in range(count)]
+
+        return name, [float(value) for value in values.split(',')]
+    except ValueError:
+        raise HdrException(
+            'Invalid sweep parameter {0}, expected name=v1,v2,... or '
+            'name=start:stop:step.'.format(spec)
+        )
+
+
+def expand_grid(operator, params):
+    """
+    Return every combination of the parameter values.
+
+    :param params: List of (name, values) tuples.
+    :return: Returns a list of parameter dictionaries.
+    """
+    if operator not in TONEMAPS:
+        raise HdrException(
+            'The {0} tonemap is not supported.'.format(operator)
+        )
+
+    names = [name for name, _ in TONEMAPS[operator][1]]
+    for name, _ in params:
+        if name not in names:
+            raise HdrException(
+                'Invalid {0} tonemap parameter {1}. Valid parameters are '
+                '{2}.'.format(operator, name, ', '.join(names))
+            )
+
+    count = 1
+    for _, values in params:
+        count *= len(values)
+
+    if count > MAX_COMBINATIONS:
+        raise HdrException(
+            'The sweep has {0} combinations, the limit is {1}.'.format(
+                count, MAX_COMBINATIONS
+            )
+        )
+
+    return [
+        dict(zip([name for name, _ in params], values))
+        for values in itertools.product(*[values for _, values in params])
+    ]
+
+
+def format_params(params, separator=' '):
+    return separator.join(
+        '{0}={1:g}'.format(name, value) for name, value in params.items()
+    )
+
+
+def get_sweep_output(image_names, output_dir, operator, params):
+    """
+    Return the output name of one combination.
+    """
+    image = get_image_name(image_names)
+    root, ext = os.path.splitext(os.path.basename(image))
+    if ext.lower() in RADIANCE_EXTENSIONS:
+        ext = '.jpg'
+
+    name = '{0}_{1}_{2}{3}'.format(
+        root, operator, format_params(params, '_').replace('=', ''), ext
+    )
+    return os.path.join(output_dir or os.path.dirname(image), name)
+
+
+def get_sheet_output(image_names, output_dir, operator):
+    """
+    Return the contact sheet name of a bracket set.
+    """
+    image = get_image_name(image_names)
+    root = os.path.splitext(os.path.basename(image))[0]
+    name = '{0}_{1}_sweep.jpg'.format(root, operator)
+    return os.path.join(output_dir or os.path.dirname(image), name)
+
+
+def make_thumbnail(image, width=THUMB_WIDTH):
+    """
+    Return an 8 bit thumbnail of a tonemapped float image.
+    """
+    height = max(1, round(image.shape[0] * width / image.shape[1]))
+    thumb = cv2.resize(image, (width, height), interpolation=cv2.INTER_AREA)
+    return to_ldr(thumb, out=numpy.empty(thumb.shape, numpy.uint8))
+
+
+def make_contact_sheet(thumbs, labels, columns):
+    """
+    Arrange labelled thumbnails of the same size in a grid.
+
+    :return: Returns the 8 bit contact sheet.
+    """
+    height, width = thumbs[0].shape[:2]
+    rows = int(math.ceil(len(thumbs) / float(columns)))
+    cell = height + LABEL_HEIGHT
+    sheet = numpy.zeros((rows * cell, columns * width, 3), numpy.uint8)
+
+    for index, (thumb, label) in enumerate(zip(thumbs, labels)):
+        y = (index // columns) * cell
+        x = (index % columns) * width
+        sheet[y:y + height, x:x + width] = thumb
+        cv2.putText(
+            sheet, label, (x + 4, y + height + LABEL_HEIGHT - 6),
+            cv2.FONT_HERSHEY_SIMPLEX, 0.4, (255, 255, 255), 1, cv2.LINE_AA
+        )
+
+    return sheet
+
+
+def get_columns(params):
+    """
+    Return the contact sheet columns, one per value of the last
+    parameter when several parameters are swept.
+    """
+    if len(params) > 1:
+        return len(params[-1][1])
+
+    count = len(params[0][1]) if params else 1
+    return int(math.ceil(math.sqrt(count)))
+
+
+def sweep(image_sets,
+          operator,
+          params,
+          algo='debevec',
+          exposures=None,
+          response=None,
+          cache_response=False,
+          align=True,
+          preview=None,
+          output_dir=None,
+          images=True,
+          contact_sheet=True,
+          thumb_width=THUMB_WIDTH,
+          workers=None,
+          encoding=None,
+          cache=None,
+          callback=None):
+    """
+    Render every combination of tonemap parameters for bracket sets.
+
+    :param image_sets: List of bracket sets, each a list of images or a
+        saved radiance map.
+    :param operator: Tonemap operator name.
+    :param params: List of (name, values) tuples, see parse_param.
+    :param algo: Merge algorithm, debevec or robertson.
+    :param output_dir: Directory for the outputs, defaults to the
+        directory of each bracket set.
+    :param images: Write an image for every combination.
+    :param contact_sheet: Write a labelled contact sheet per set.
+    :param thumb_width: Width of the contact sheet thumbnails.
+    :param workers: Number of combinations rendered in parallel, the
+        OpenCV threads are divided between them.
+    :param cache: RadianceCache to use, defaults to the module wide
+        cache.
+    :param callback: Optional function called with each written file.
+    :return: Returns the list of written files.
+    """
+    grid = expand_grid(operator, params)
+    if not images and not contact_sheet:
+        raise HdrException('Nothing to write, enable images or the sheet.')
+
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+
+    written = []
+
+    def report(name):
+        written.append(name)
+        if callback:
+            callback(name)
+
+    workers = workers or 1
+    threads = None
+    if workers > 1:
+        threads = plan_threads(len(grid), None, workers)[1]
+
+    with ThreadPoolExecutor(max_workers=workers) as executor, \
+            limit_threads(threads):
+        for image_names in image_sets:
+            radiance = merge_cached(
+                image_names, exposures, algo, response, cache_response,
+                align, preview, cache
+            )
+
+            def render(values):
+                tonemap = create_tonemap(
+                    operator, **get_preview_params(operator, values, preview)
+                )
+                with stage('tonemap'):
+                    ldr = tonemap.process(radiance)
+
+                name = None
+                if images:
+                    name = get_sweep_output(
+                        image_names, output_dir, operator, values
+                    )
+                    write_ldr(ldr, name, encoding)
+
+                thumb = None
+                if contact_sheet:
+                    thumb = make_thumbnail(ldr, thumb_width)
+
+                return name, thumb
+
+            # Bind an active profiler to the pool threads, so it records
+            # the stages of each render too. Stages of concurrent renders
+            # overlap and may be listed as nested in one another.
+            results = list(executor.map(bind(render), grid))
+            for name, _ in results:
+                if name:
+                    report(name)
+
+            if contact_sheet:
+                sheet = make_contact_sheet(
+                    [thumb for _, thumb in results],
+                    [format_params(values) for values in grid],
+                    get_columns(params)
+                )
+                name = get_sheet_output(image_names, output_dir, operator)
+                if not cv2.imwrite(name, sheet):
+                    raise HdrException(
+                        'Unable to write image {0}.'.format(name)
+                    )
+                report(name)
+
+    return written
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+#
+# hdr: A Python API and CLI for creating HDR images.
+#
+# Copyright (C) 2017 Sean Marlow
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Thread budget shared by concurrent jobs and pipeline stages.
+
+OpenCV sizes its thread pool to every core of the machine in each
+process, so running several jobs side by side starts jobs times cores
+threads that compete for the same cores. A budget of cores is instead
+split between job level parallelism, the number of jobs run at once,
+and intra-op parallelism, the OpenCV and decode threads of each job::
+
+    workers, threads = plan_threads(len(jobs), get_image_pixels(name))
+
+Small images gain little from intra-op threads, so the auto plan runs
+one job per core with a single thread each. Large images get more
+threads per job and fewer concurrent jobs, bounding the number of
+images in memory at once.
+
+The budget defaults to the cores this process may run on and can be
+lowered for every hdr process with the HDR_CORES environment variable,
+for example when several commands share a machine.
+"""
+
+import os
+import threading
+
+from contextlib import contextmanager
+
+from hdr.exceptions import HdrException
+
+CORES_ENV = 'HDR_CORES'
+PIXELS_PER_THREAD = 2 * 1024 * 1024
+
+_threads = None
+_lock = threading.Lock()
+
+
+def get_cores(cores=None):
+    """
+    Return the number of cores in the budget.
+
+    :param cores: Explicit budget, defaults to $HDR_CORES or the cores
+        this process may run on.
+    """
+    if cores is None:
+        value = os.environ.get(CORES_ENV)
+        if value:
+            try:
+                cores = int(value)
+            except ValueError:
+                raise HdrException(
+                    'Invalid {0} value {1}, expected a number of '
+                    'cores.'.format(CORES_ENV, value)
+                )
+        else:
+            try:
+                cores = len(os.sched_getaffinity(0))
+            except AttributeError:
+                cores = os.cpu_count() or 1
+
+    if cores < 1:
+        raise HdrException('The thread budget requires at least one core.')
+
+    return cores
+
+
+def get_image_pixels(image_name):
+    """
+    Return the pixel count of an image, or None if it cannot be read.
+
+    The size is read from the file header, see memory.read_image_size,
+    so nothing is decoded to size a batch before it starts.
+    """
+    from hdr.memory import read_image_size
+
+    try:
+        size = read_image_size(image_name)
+    except OSError:
+        return None
+
+    if not size:
+        return None
+
+    return size[0] * size[1]
+
+
+def plan_threads(jobs, pixels=None, workers=None, threads=None, cores=None):
+    """
+    Split the core budget between concurrent jobs and threads per job.
+
+    A given workers or threads value is kept and the other fills the
+    remaining cores. With neither, the number of threads per job grows
+    with the image size, one thread per PIXELS_PER_THREAD pixels, and
+    the remaining cores run jobs concurrently.
+
+    :param jobs: Number of jobs to run.
+    :param pixels: Pixel count of the images, used by the auto plan.
+    :param workers: Number of concurrent jobs, defaults to auto.
+    :param threads: Threads per job, defaults to auto. 0 disables
+        OpenCV threading and counts as one thread.
+    :param cores: Core budget, see get_cores.
+    :return: Returns a tuple of workers and threads.
+    """
+    cores = get_cores(cores)
+    jobs = max(1, jobs)
+
+    if workers is None:
+        wanted = threads
+        if wanted is None:
+            wanted = min(cores, max(1, (pixels or 0) // PIXELS_PER_THREAD))
+        workers = min(jobs, max(1, cores // max(1, wanted)))
+
+    if threads is None:
+        # Cores left over by fewer jobs than workers go to each job.
+        threads = max(1, cores // min(workers, jobs))
+
+    return workers, threads
+
+
+def set_threads(threads):
+    """
+    Set the thread budget of this process.
+
+    Configures the OpenCV thread pool and the decode pools sized by
+    get_threads. None keeps OpenCV's choice. The OpenCV pool is process
+    wide, so jobs running on threads of one process share a single
+    budget; only jobs in separate processes, as in batch, get one each.
+    """
+    global _threads
+
+    if threads is None:
+        return
+
+    import cv2
+
+    with _lock:
+        cv2.setNumThreads(threads)
+        _threads = threads
+
+
+def get_threads():
+    """
+    Return the threads available to one job in this process, the value
+    of set_threads or the whole core budget.
+    """
+    if _threads is None:
+        return get_cores()
+
+    return max(1, _threads)
+
+
+@contextmanager
+def limit_threads(threads):
+    """
+    Set the thread budget for the duration of a block, restoring the
+    previous OpenCV setting afterwards. None leaves the budget as is.
+    """
+    global _threads
+
+    if threads is None:
+        yield
+        return
+
+    import cv2
+
+    with _lock:
+        previous = (cv2.getNumThreads(), _threads)
+
+    set_threads(threads)
+
+    try:
+        yield
+    finally:
+        with _lock:
+            cv2.setNumThreads(previous[0])
+            _threads = previous[1]
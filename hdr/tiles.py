@@ -0,0 +1,426 @@
+# -*- coding: utf-8 -*-
+#
+# hdr: A Python API and CLI for creating HDR images.
+#
+# Copyright (C) 2017 Sean Marlow
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Memory bounded tiled merge and tonemap for very large images.
+
+Each exposure is decoded once into a memory mapped scratch file. The
+radiance map is merged tile by tile into another memory mapped file
+and tonemapped tile by tile with global statistics shared between
+tiles. Peak memory is one decoded exposure plus the working set of a
+single tile, which is sized from the memory limit.
+
+Two steps are not tiled and fall outside the limit: OpenCV encodes the
+output image in one call from the memory mapped result, and .hdr and
+.exr radiance maps are loaded and saved whole. Use .npy radiance maps,
+which are memory mapped and written tile by tile, to stay within it.
+"""
+
+import math
+import os
+import tempfile
+
+import cv2
+import numpy
+
+from hdr import api
+from hdr import tonemap as hdr_tonemap
+from hdr.algorithms import get_algorithm
+from hdr.align import get_bracket_shifts
+from hdr.calibration import get_response, read_response
+from hdr.exceptions import HdrException
+from hdr.output import DTYPES, get_encoding, to_ldr
+from hdr.profiling import profiled
+
+DEFAULT_MEMORY_LIMIT = 512 * 1024 * 1024
+MERTENS_HALO = 64
+MIN_TILE_SIZE = 64
+PROXY_PIXELS = 1024 * 1024
+
+# Approximate working bytes per tile pixel for each stage.
+MERGE_BYTES_PER_PIXEL = 64
+TONEMAP_BYTES_PER_PIXEL = 128
+
+
+def get_tile_size(memory_limit, frames, halo=0):
+    """
+    Return the tile edge length that fits the memory limit.
+
+    :param memory_limit: Memory budget in bytes for one tile.
+    :param frames: Number of exposures merged per tile.
+    :param halo: Extra pixels read on each side of the tile.
+    """
+    bytes_per_pixel = max(
+        frames * 3 + MERGE_BYTES_PER_PIXEL, TONEMAP_BYTES_PER_PIXEL
+    )
+    size = int(math.sqrt(memory_limit / bytes_per_pixel)) - 2 * halo
+    return max(size, MIN_TILE_SIZE)
+
+
+def iter_tiles(height, width, tile_size, halo=0):
+    """
+    Yield the tiles covering an image.
+
+    :return: Yields (outer, core, target) tuples of slice pairs. Outer
+        selects the tile including the halo from the image, core selects
+        the tile without the halo from the outer region and target
+        selects the same pixels from the image.
+    """
+    for top in range(0, height, tile_size):
+        bottom = min(top + tile_size, height)
+        outer_top = max(top - halo, 0)
+        outer_bottom = min(bottom + halo, height)
+
+        for left in range(0, width, tile_size):
+            right = min(left + tile_size, width)
+            outer_left = max(left - halo, 0)
+            outer_right = min(right + halo, width)
+
+            yield (
+                (slice(outer_top, outer_bottom),
+                 slice(outer_left, outer_right)),
+                (slice(top - outer_top, bottom - outer_top),
+                 slice(left - outer_left, right - outer_left)),
+                (slice(top, bottom), slice(left, right))
+            )
+
+
+def read_region(image, region, shift=(0, 0)):
+    """
+    Read a region of an image translated by shift.
+
+    Pixels shifted in from outside the image are zero, matching the
+    OpenCV MTB alignment.
+    """
+    rows, cols = region
+    dx, dy = shift
+    region_img = numpy.zeros(
+        (rows.stop - rows.start, cols.stop - cols.start) + image.shape[2:],
+        dtype=image.dtype
+    )
+
+    src_top = max(rows.start - dy, 0)
+    src_bottom = min(rows.stop - dy, image.shape[0])
+    src_left = max(cols.start - dx, 0)
+    src_right = min(cols.stop - dx, image.shape[1])
+
+    if src_top < src_bottom and src_left < src_right:
+        region_img[
+            src_top + dy - rows.start:src_bottom + dy - rows.start,
+            src_left + dx - cols.start:src_right + dx - cols.start
+        ] = image[src_top:src_bottom, src_left:src_right]
+
+    return region_img
+
+
+@profiled('decode')
+def stage_images(image_names, scratch_dir, preview=None):
+    """
+    Decode each image once into a memory mapped scratch file.
+
+    Only one decoded image is held in memory at a time.
+
+    :param preview: Optional 2, 4 or 8 to decode at reduced scale.
+
+    :return: Returns the list of read only memory mapped images.
+    """
+    flag = api.get_read_flag(preview)
+    frames = []
+    shape = None
+
+    for index, image_name in enumerate(image_names):
+        image = cv2.imread(image_name, flag)
+        if image is None:
+            raise HdrException('Unable to read image {0}.'.format(image_name))
+
+        if shape and image.shape != shape:
+            raise HdrException('All images must be the same size.')
+        shape = image.shape
+
+        path = os.path.join(scratch_dir, 'frame{0}.npy'.format(index))
+        frame = numpy.lib.format.open_memmap(
+            path, mode='w+', dtype=image.dtype, shape=image.shape
+        )
+        frame[:] = image
+        frame.flush()
+        del frame, image
+
+        frames.append(numpy.load(path, mmap_mode='r'))
+
+    return frames
+
+
+def get_proxies(frames):
+    """
+    Return downscaled copies of the frames and the scale factor.
+    """
+    height, width = frames[0].shape[:2]
+    factor = hdr_tonemap.get_proxy_factor(height, width, PROXY_PIXELS)
+    size = (max(width // factor, 1), max(height // factor, 1))
+
+    proxies = [
+        cv2.resize(numpy.asarray(frame), size, interpolation=cv2.INTER_AREA)
+        for frame in frames
+    ]
+    return proxies, factor
+
+
+@profiled('merge')
+def merge_tiles(image_names,
+                radiance_path,
+                algo='debevec',
+                exposures=None,
+                response=None,
+                cache_response=False,
+                memory_limit=DEFAULT_MEMORY_LIMIT,
+                tile_size=None,
+                scratch_dir=None,
+                merge_params=None,
+                align=True,
+                cache_shifts=False,
+                preview=None):
+    """
+    Merge the supplied images tile by tile into a .npy radiance map.
+
+    Alignment and response calibration are computed on downscaled
+    proxies.
+
+    :return: Returns the read only memory mapped radiance map.
+    """
+    merge_params = merge_params or {}
+
+    if algo not in ('debevec', 'robertson', 'mertens'):
+        raise HdrException('The {0} algorithm is not supported.'.format(algo))
+
+    with tempfile.TemporaryDirectory(dir=scratch_dir) as tmp_dir:
+        frames = stage_images(image_names, tmp_dir, preview)
+        proxies, factor = get_proxies(frames)
+        scale = preview or 1
+        shifts = get_bracket_shifts(
+            proxies, image_names, align, cache_shifts, factor * scale
+        ) or [(0, 0)] * len(frames)
+        shifts = [
+            (round(dx / scale), round(dy / scale)) for dx, dy in shifts
+        ]
+
+        height, width = frames[0].shape[:2]
+        radiance = numpy.lib.format.open_memmap(
+            radiance_path,
+            mode='w+',
+            dtype=numpy.float32,
+            shape=(height, width, 3)
+        )
+
+        align_mtb = get_algorithm('createAlignMTB')
+        aligned = [
+            align_mtb.shiftMat(
+                proxy, (round(dx / factor), round(dy / factor))
+            )
+            for proxy, (dx, dy) in zip(proxies, shifts)
+        ]
+
+        if algo == 'mertens':
+            halo = max(MERTENS_HALO, 3 * factor + 1)
+            merge = get_algorithm(
+                'createMergeMertens',
+                merge_params.get('contrast', 1.0),
+                merge_params.get('saturation', 1.0),
+                merge_params.get('exposure', 0.0)
+            )
+            proxy_fused = merge.process(aligned)
+
+            def merge_tile(images, region):
+                # Pyramid blending is global at coarse levels, take
+                # those from the fused proxy.
+                return hdr_tonemap.blend_proxy(
+                    merge.process(images), proxy_fused, region, factor
+                )
+        else:
+            halo = 0
+            times = api.get_exposures(exposures, image_names)
+
+            if isinstance(response, str):
+                response = read_response(response)
+            elif response is None:
+                response = get_response(
+                    image_names, aligned, times, algo,
+                    use_cache=cache_response
+                )
+
+            if algo == 'debevec':
+                merge = get_algorithm('createMergeDebevec')
+            else:
+                merge = get_algorithm('createMergeRobertson')
+
+            def merge_tile(images, region):
+                return merge.process(images, times=times, response=response)
+
+        del aligned, proxies
+
+        size = tile_size or get_tile_size(memory_limit, len(frames), halo)
+
+        for outer, core, target in iter_tiles(height, width, size, halo):
+            images = [
+                read_region(frame, outer, shift)
+                for frame, shift in zip(frames, shifts)
+            ]
+            radiance[target] = merge_tile(images, outer)[core]
+
+        radiance.flush()
+        del radiance, frames
+
+    return numpy.load(radiance_path, mmap_mode='r')
+
+
+@profiled('tonemap')
+def tonemap_tiles(radiance,
+                  output,
+                  tonemap='drago',
+                  params=None,
+                  memory_limit=DEFAULT_MEMORY_LIMIT,
+                  tile_size=None,
+                  scratch_dir=None,
+                  encoding=None):
+    """
+    Tonemap a radiance map tile by tile and write the result.
+
+    :param radiance: Radiance map, usually a memory mapped .npy file.
+    :param output: Filename for the tonemapped image.
+    :param encoding: Optional dictionary of output depth, quality and
+        compression, see output.get_encoding.
+    """
+    depth, write_params = get_encoding(output, encoding)
+    params = params or {}
+    halo = hdr_tonemap.get_halo(tonemap, **params)
+    size = tile_size or get_tile_size(memory_limit, 0, halo)
+    height, width = radiance.shape[:2]
+
+    def tiles():
+        for outer, core, _ in iter_tiles(height, width, size, halo):
+            yield numpy.array(radiance[outer], numpy.float32), core, outer
+
+    stats = hdr_tonemap.get_stats(tonemap, tiles, **params)
+
+    with tempfile.TemporaryDirectory(dir=scratch_dir) as tmp_dir:
+        ldr = numpy.lib.format.open_memmap(
+            os.path.join(tmp_dir, 'output.npy'),
+            mode='w+',
+            dtype=DTYPES[depth],
+            shape=(height, width, 3)
+        )
+
+        for outer, core, target in iter_tiles(height, width, size, halo):
+            tile = hdr_tonemap.tonemap_tile(
+                tonemap,
+                numpy.array(radiance[outer], numpy.float32),
+                stats,
+                outer,
+                **params
+            )[core]
+            to_ldr(tile, depth, ldr[target])
+
+        # OpenCV encodes the whole image at once, so the encoder's
+        # buffers are outside the memory limit.
+        if not cv2.imwrite(output, ldr, write_params):
+            raise HdrException('Unable to write image {0}.'.format(output))
+
+        del ldr
+
+    return output
+
+
+def tiled_hdr(image_names,
+              tonemap='drago',
+              params=None,
+              algo='debevec',
+              exposures=None,
+              output=None,
+              response=None,
+              cache_response=False,
+              memory_limit=DEFAULT_MEMORY_LIMIT,
+              tile_size=None,
+              scratch_dir=None,
+              merge_params=None,
+              radiance_output=None,
+              align=True,
+              cache_shifts=False,
+              preview=None,
+              encoding=None):
+    """
+    Create an HDR image from the supplied images in tiles.
+
+    The merge and tonemap run tile by tile so their peak memory is
+    bounded by memory_limit rather than by the image size. Encoding the
+    output and loading or saving .hdr and .exr radiance maps work on the
+    whole image and are not bounded by it.
+
+    :param images: List of images to process or a saved radiance map.
+    :param tonemap: Tonemap operator name.
+    :param params: Dictionary of tonemap parameters.
+    :param algo: Merge algorithm, debevec, robertson or mertens.
+    :param memory_limit: Memory budget in bytes for a tile.
+    :param tile_size: Tile edge length, computed from memory_limit by
+        default.
+    :param scratch_dir: Directory for temporary memory mapped files.
+    :param merge_params: Dictionary of mertens contrast, saturation and
+        exposure weights.
+    :param radiance_output: Optional file to save the radiance map to.
+        A .npy radiance map is written tile by tile.
+    :param align: False to skip alignment or a dictionary of options.
+    :param cache_shifts: Reuse and store alignment shifts.
+    :param preview: Decode the images at 1/2, 1/4 or 1/8 scale and
+        write a _preview image.
+    :param encoding: Optional dictionary of output depth (8 or 16),
+        quality (JPEG and WebP) and compression (PNG).
+    :return: Returns name of new HDR image.
+    """
+    img_out = api.get_image_output(
+        api.get_image_name(image_names), output, preview=preview
+    )
+    params = api.get_preview_params(tonemap, params or {}, preview)
+
+    if api.is_radiance(image_names):
+        radiance = api.load_radiance(image_names[0], preview)
+        return tonemap_tiles(
+            radiance, img_out, tonemap, params, memory_limit, tile_size,
+            scratch_dir, encoding
+        )
+
+    with tempfile.TemporaryDirectory(dir=scratch_dir) as tmp_dir:
+        if radiance_output and radiance_output.lower().endswith('.npy'):
+            radiance_path = radiance_output
+        else:
+            radiance_path = os.path.join(tmp_dir, 'radiance.npy')
+
+        radiance = merge_tiles(
+            image_names, radiance_path, algo, exposures, response,
+            cache_response, memory_limit, tile_size, scratch_dir,
+            merge_params, align, cache_shifts, preview
+        )
+
+        if radiance_output and radiance_path != radiance_output:
+            api.save_radiance(radiance, radiance_output)
+
+        tonemap_tiles(
+            radiance, img_out, tonemap, params, memory_limit, tile_size,
+            scratch_dir, encoding
+        )
+        del radiance
+
+    return img_out
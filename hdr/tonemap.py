@@ -0,0 +1,742 @@
+# -*- coding: utf-8 -*-
+#
+# hdr: A Python API and CLI for creating HDR images.
+#
+# Copyright (C) 2017 Sean Marlow
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Tonemap operators that can be applied to an image in tiles.
+
+The operators follow the OpenCV implementations but split each one
+into a statistics step and a mapping step. Statistics are gathered
+over every tile of the image first and then each tile is mapped with
+the shared global values, so tiled output has no seams. Drago, linear
+and reinhard tiles match a single pass exactly. Operators with
+neighbourhood filters (durand and mantiuk) need a halo of extra pixels
+around each tile. cv2.bilateralFilter builds its range table from the
+values of each tile, so durand tiles match a single pass to within
+1e-5 of the [0, 1] output rather than exactly. Mantiuk solves
+for luminance over the whole image, so tiles take their low frequencies
+from a solve on a downscaled proxy of the image.
+
+tonemap_parallel maps the tiles of an in-memory radiance map on a
+thread pool for the slow neighbourhood operators.
+"""
+
+import math
+
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy
+
+from hdr.exceptions import HdrException
+
+TONEMAP_PARAMS = {
+    'drago': (('gamma', 1.0), ('saturation', 1.0), ('bias', 0.85)),
+    'durand': (
+        ('gamma', 1.0), ('contrast', 4.0), ('saturation', 1.0),
+        ('sigma_space', 2.0), ('sigma_color', 2.0)
+    ),
+    'linear': (('gamma', 2.2),),
+    'mantiuk': (('gamma', 2.2), ('scale', 0.7), ('saturation', 1.0)),
+    'reinhard': (
+        ('gamma', 1.0), ('intensity', 0.0), ('light_adapt', 1.0),
+        ('color_adapt', 0.0)
+    )
+}
+
+MANTIUK_HALO = 64
+PROXY_PIXELS = 512 * 512
+
+# Slow neighbourhood operators worth tiling across cores.
+PARALLEL_TONEMAPS = ('durand', 'mantiuk')
+PARALLEL_TILE_SIZE = 256
+MANTIUK_BLEND = 16
+
+
+def get_params(operator, params):
+    """
+    Return the full parameter dictionary for the operator.
+
+    Missing parameters are filled in with the operator defaults.
+    """
+    try:
+        defaults = TONEMAP_PARAMS[operator]
+    except KeyError:
+        raise HdrException(
+            'The {0} tonemap is not supported.'.format(operator)
+        )
+
+    names = [name for name, _ in defaults]
+    unknown = set(params) - set(names)
+    if unknown:
+        raise HdrException(
+            'Invalid {0} tonemap parameters: {1}.'.format(
+                operator, ', '.join(sorted(unknown))
+            )
+        )
+
+    return {
+        name: float(params.get(name, default)) for name, default in defaults
+    }
+
+
+def get_halo(operator, **params):
+    """
+    Return the number of extra pixels needed around each tile.
+    """
+    params = get_params(operator, params)
+
+    if operator == 'durand':
+        # bilateralFilter with d=-1 uses a radius of 1.5 * sigma_space.
+        return int(math.ceil(params['sigma_space'] * 1.5)) + 1
+    elif operator == 'mantiuk':
+        return MANTIUK_HALO
+
+    return 0
+
+
+def get_stats(operator, tiles, **params):
+    """
+    Compute the global statistics for an operator.
+
+    :param operator: The tonemap operator name.
+    :param tiles: Callable returning an iterable of (tile, core, region)
+        tuples. The tile is a float32 radiance region including any halo,
+        core is the tuple of slices selecting the pixels owned by the
+        tile and region is the tuple of slices locating the tile in the
+        image. The callable is invoked once per statistics pass.
+    :return: Returns a dictionary of statistics.
+    """
+    params = get_params(operator, params)
+    stats = {'height': 0, 'width': 0}
+
+    low = math.inf
+    high = -math.inf
+    count = 0
+    for tile, core, region in tiles():
+        low, high = _update_range(low, high, tile[core])
+        stats['height'] = max(stats['height'], region[0].stop)
+        stats['width'] = max(stats['width'], region[1].stop)
+        count += 1
+
+    stats['tiled'] = count > 1
+    stats['min'] = low
+    stats['max'] = high
+
+    if operator == 'drago':
+        stats.update(_drago_stats(tiles, stats))
+    elif operator == 'durand':
+        stats.update(_durand_stats(tiles, stats, params))
+    elif operator == 'mantiuk':
+        stats.update(_mantiuk_stats(tiles, stats, params))
+    elif operator == 'reinhard':
+        stats.update(_reinhard_stats(tiles, stats))
+
+    if operator in ('drago', 'mantiuk', 'reinhard'):
+        low = math.inf
+        high = -math.inf
+        for tile, core, region in tiles():
+            img = _map_tile(operator, tile, stats, params, region)
+            low, high = _update_range(low, high, img[core])
+
+        stats['out_min'] = low
+        stats['out_max'] = high
+
+    return stats
+
+
+def tonemap_tile(operator, tile, stats, region=None, **params):
+    """
+    Tonemap a tile of radiance using precomputed global statistics.
+
+    :param region: Tuple of slices locating the tile in the image,
+        defaults to the whole image.
+    :return: Returns the float32 tonemapped tile including the halo.
+    """
+    params = get_params(operator, params)
+    img = _map_tile(operator, tile, stats, params, region)
+
+    if operator in ('drago', 'mantiuk', 'reinhard'):
+        img = normalize(
+            img, stats['out_min'], stats['out_max'], params['gamma']
+        )
+
+    return img
+
+
+def tonemap(operator, img, **params):
+    """
+    Tonemap a full radiance map in a single pass.
+    """
+    region = (slice(0, img.shape[0]), slice(0, img.shape[1]))
+    stats = get_stats(operator, lambda: [(img, region, region)], **params)
+    return tonemap_tile(operator, img, stats, region, **params)
+
+
+def tonemap_parallel(operator, img, workers=None, tile_size=None, out=None,
+                     **params):
+    """
+    Tonemap a radiance map in overlapping tiles on a thread pool.
+
+    Global statistics are computed once and shared by every tile. The
+    durand halo covers the whole bilateral filter, so the result matches
+    a single pass to within 1e-5, the bilateral range table depending on
+    each tile's values. Mantiuk tiles take their low frequencies from a proxy
+    solve and are feathered into their neighbours over an overlap to
+    hide the remaining seams. OpenCV and NumPy release the GIL for the
+    heavy work, so threads scale with cores without copying the image.
+
+    :param operator: durand or mantiuk.
+    :param workers: Number of threads, defaults to the number of cores.
+    :param tile_size: Tile edge length. The result depends on it, so it
+        does not change with the number of workers.
+    :param out: Optional float32 array to write the result to.
+    :return: Returns the float32 tonemapped image.
+    """
+    if operator not in PARALLEL_TONEMAPS:
+        raise HdrException(
+            'The {0} tonemap does not support parallel tiles, use one of '
+            '{1}.'.format(operator, ', '.join(PARALLEL_TONEMAPS))
+        )
+
+    params = get_params(operator, params)
+    halo = get_halo(operator, **params)
+    blend = MANTIUK_BLEND if operator == 'mantiuk' else 0
+    size = max(tile_size or PARALLEL_TILE_SIZE, 2 * blend + 1)
+    height, width = img.shape[:2]
+    tiles = get_blend_tiles(height, width, size, halo, blend)
+
+    if out is None:
+        out = numpy.empty(img.shape, numpy.float32)
+
+    def tile_range(image):
+        return lambda tile: _update_range(math.inf, -math.inf, image[tile[2]])
+
+    stats = {'height': height, 'width': width, 'tiled': len(tiles) > 1}
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        stats['min'], stats['max'] = _reduce_range(
+            executor.map(tile_range(img), tiles)
+        )
+
+        if operator == 'durand':
+            # Keep the base layer so the bilateral filter runs once.
+            base = numpy.empty((height, width), numpy.float32)
+
+            def filter_tile(tile):
+                outer, core, target, _ = tile
+                base[target] = _bilateral(
+                    _prepare(img[outer], stats)[1], params
+                )[core]
+
+            list(executor.map(filter_tile, tiles))
+            stats['base_min'], stats['base_max'] = _reduce_range(
+                executor.map(tile_range(base), tiles)
+            )
+
+            def map_tile(tile):
+                target = tile[2]
+                out[target] = _durand_map(
+                    img[target], stats, params, base[target]
+                )
+
+            list(executor.map(map_tile, tiles))
+            return out
+
+        # Build the proxy from the grid cells like get_stats, so each
+        # cell shrinks by exactly the proxy factor.
+        cells = get_blend_tiles(height, width, size)
+        stats.update(_mantiuk_stats(
+            lambda: [(img[cell[0]], cell[1], cell[0]) for cell in cells],
+            stats, params
+        ))
+
+        def map_tile(tile):
+            outer, core, target, weights = tile
+            return target, weights * _mantiuk_map(
+                img[outer], stats, params, outer
+            )[core]
+
+        out[:] = 0
+        # Tiles overlap, so they are accumulated on this thread only.
+        for target, mapped in executor.map(map_tile, tiles):
+            out[target] += mapped
+
+        low, high = _reduce_range(executor.map(tile_range(out), tiles))
+
+        def normalize_tile(tile):
+            target = tile[2]
+            out[target] = normalize(out[target], low, high, params['gamma'])
+
+        # Normalize the disjoint cells, not the overlapping tiles.
+        list(executor.map(normalize_tile, cells))
+
+    return out
+
+
+def get_blend_tiles(height, width, tile_size, halo=0, blend=0):
+    """
+    Return the tiles covering an image, overlapping by 2 * blend.
+
+    The image is split into cells of at most tile_size, evenly so no
+    thin cell is left at the edges. Each tile covers its cell extended
+    by blend pixels into the neighbouring cells and reads a further
+    halo around that. Weights ramp across the overlaps and sum to one
+    at every pixel.
+
+    :return: Returns a list of (outer, core, target, weights) tuples.
+        Outer selects the tile including the halo from the image, core
+        selects the blended pixels from the outer region, target
+        selects the same pixels from the image and weights is the
+        float32 array to multiply them by.
+    """
+    def get_spans(length):
+        spans = []
+        count = int(math.ceil(float(length) / tile_size))
+
+        for index in range(count):
+            start = length * index // count
+            stop = length * (index + 1) // count
+            first = max(start - blend, 0)
+            last = min(stop + blend, length)
+
+            position = numpy.arange(first, last, dtype=numpy.float32) + 0.5
+            weights = numpy.ones(last - first, numpy.float32)
+            if blend and start > 0:
+                weights *= numpy.clip(
+                    (position - start + blend) / (2 * blend), 0, 1
+                )
+            if blend and stop < length:
+                weights *= numpy.clip(
+                    (stop + blend - position) / (2 * blend), 0, 1
+                )
+
+            outer = slice(max(first - halo, 0), min(last + halo, length))
+            spans.append((
+                outer,
+                slice(first - outer.start, last - outer.start),
+                slice(first, last),
+                weights
+            ))
+
+        return spans
+
+    return [
+        (
+            (row_outer, col_outer),
+            (row_core, col_core),
+            (row_target, col_target),
+            numpy.outer(row_weights, col_weights)[..., None]
+        )
+        for row_outer, row_core, row_target, row_weights in get_spans(height)
+        for col_outer, col_core, col_target, col_weights in get_spans(width)
+    ]
+
+
+def get_seam_error(result, reference, regions):
+    """
+    Measure the discontinuities tiles add to a tonemapped image.
+
+    The step between neighbouring pixels is compared with a reference
+    across the edges between tiles and across the lines midway through
+    them, so differences that do not change at the seams cancel out.
+
+    :param regions: Iterable of the (rows, columns) slice pairs of the
+        tiles in the image.
+    :return: Returns the mean step error across the seams less that
+        across the midway lines, in output units, 0 for a single tile.
+    """
+    error = result - reference
+    rows = set()
+    cols = set()
+    for row, col in regions:
+        if row.start:
+            rows.add((row.start, (row.start + row.stop) // 2))
+        if col.start:
+            cols.add((col.start, (col.start + col.stop) // 2))
+
+    total = []
+    for axis, lines in ((0, sorted(rows)), (1, sorted(cols))):
+        if not lines:
+            continue
+
+        steps = numpy.abs(numpy.diff(error, axis=axis))
+        seams = numpy.take(steps, [seam - 1 for seam, _ in lines], axis)
+        middles = numpy.take(steps, [mid - 1 for _, mid in lines], axis)
+        total.append(seams.mean() - middles.mean())
+
+    return float(numpy.mean(total)) if total else 0.0
+
+
+def get_proxy_factor(height, width, pixels=PROXY_PIXELS):
+    """
+    Return the downscale factor for a proxy of at most pixels.
+    """
+    return max(1, int(math.ceil(math.sqrt(height * width / pixels))))
+
+
+def sample_proxy(proxy, region, factor):
+    """
+    Resample the part of a proxy covering region to full resolution.
+    """
+    rows, cols = region
+    map_x = (numpy.arange(cols.start, cols.stop, dtype=numpy.float32) +
+             0.5) / factor - 0.5
+    map_y = (numpy.arange(rows.start, rows.stop, dtype=numpy.float32) +
+             0.5) / factor - 0.5
+    map_x, map_y = numpy.meshgrid(map_x, map_y)
+
+    return cv2.remap(
+        proxy, map_x, map_y, cv2.INTER_LINEAR,
+        borderMode=cv2.BORDER_REPLICATE
+    )
+
+
+def blend_proxy(tile, proxy, region, factor):
+    """
+    Replace the low frequencies of a tile with those of a proxy.
+
+    Frequencies below the proxy resolution come from the proxy, which
+    was processed as a whole, and finer detail comes from the tile.
+    """
+    sigma = float(factor)
+    low = cv2.GaussianBlur(tile, (0, 0), sigma)
+    proxy_low = cv2.GaussianBlur(
+        sample_proxy(proxy, region, factor), (0, 0), sigma
+    )
+    return tile - low + proxy_low
+
+
+def normalize(img, low, high, gamma=1.0):
+    """
+    Scale img from the [low, high] range to [0, 1] and apply gamma.
+    """
+    if high - low > numpy.finfo(numpy.float64).eps:
+        img = (img - numpy.float32(low)) / numpy.float32(high - low)
+    else:
+        img = img.copy()
+
+    if gamma != 1.0:
+        numpy.power(img, numpy.float32(1.0 / gamma), out=img)
+
+    return img
+
+
+def log_(img):
+    return numpy.log(numpy.maximum(img, numpy.float32(1e-4)))
+
+
+def map_luminance(img, lum, new_lum, saturation):
+    """
+    Replace the luminance of img with new_lum.
+    """
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        img = img / lum[..., None]
+
+    if saturation != 1.0:
+        numpy.power(img, numpy.float32(saturation), out=img)
+
+    img *= new_lum[..., None]
+    return img
+
+
+def _update_range(low, high, value):
+    if value.size:
+        low = min(low, float(numpy.nanmin(value)))
+        high = max(high, float(numpy.nanmax(value)))
+
+    return low, high
+
+
+def _reduce_range(ranges):
+    low = math.inf
+    high = -math.inf
+    for tile_low, tile_high in ranges:
+        low = min(low, tile_low)
+        high = max(high, tile_high)
+
+    return low, high
+
+
+def _is_whole(region, stats):
+    return region is None or (
+        region[0].start == 0 and region[1].start == 0 and
+        region[0].stop == stats['height'] and
+        region[1].stop == stats['width']
+    )
+
+
+def _prepare(tile, stats):
+    img = normalize(tile, stats['min'], stats['max'])
+    gray = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)
+    return img, gray
+
+
+def _map_tile(operator, tile, stats, params, region=None):
+    if operator == 'linear':
+        return normalize(tile, stats['min'], stats['max'], params['gamma'])
+    elif operator == 'drago':
+        return _drago_map(tile, stats, params)
+    elif operator == 'durand':
+        return _durand_map(tile, stats, params)
+    elif operator == 'mantiuk':
+        return _mantiuk_map(tile, stats, params, region)
+    else:
+        return _reinhard_map(tile, stats, params)
+
+
+def _drago_stats(tiles, stats):
+    log_sum = 0.0
+    count = 0
+    gray_max = -math.inf
+
+    for tile, core, _ in tiles():
+        img, gray = _prepare(tile[core], stats)
+        log_sum += float(log_(gray).sum(dtype=numpy.float64))
+        count += gray.size
+        if gray.size:
+            gray_max = max(gray_max, float(gray.max()))
+
+    mean = math.exp(log_sum / count)
+    return {'log_mean': mean, 'gray_max': gray_max / mean}
+
+
+def _drago_map(tile, stats, params):
+    img, gray = _prepare(tile, stats)
+    gray /= numpy.float32(stats['log_mean'])
+
+    new_lum = numpy.log(gray + 1.0)
+    div = numpy.power(
+        gray / numpy.float32(stats['gray_max']),
+        numpy.float32(math.log(params['bias']) / math.log(0.5))
+    )
+    new_lum /= numpy.log(2.0 + 8.0 * div)
+
+    return map_luminance(img, gray, new_lum, params['saturation'])
+
+
+def _bilateral(gray, params):
+    return cv2.bilateralFilter(
+        log_(gray), -1, params['sigma_color'], params['sigma_space']
+    )
+
+
+def _durand_stats(tiles, stats, params):
+    low = math.inf
+    high = -math.inf
+    for tile, core, _ in tiles():
+        base = _bilateral(_prepare(tile, stats)[1], params)
+        low, high = _update_range(low, high, base[core])
+
+    return {'base_min': low, 'base_max': high}
+
+
+def _durand_map(tile, stats, params, base=None):
+    img, gray = _prepare(tile, stats)
+    log_img = log_(gray)
+    if base is None:
+        base = _bilateral(gray, params)
+
+    scale = params['contrast'] / (stats['base_max'] - stats['base_min'])
+    new_lum = numpy.exp(base * numpy.float32(scale - 1.0) + log_img)
+
+    img = map_luminance(img, gray, new_lum, params['saturation'])
+    numpy.power(img, numpy.float32(1.0 / params['gamma']), out=img)
+    return img
+
+
+def _reinhard_stats(tiles, stats):
+    log_sum = 0.0
+    log_min = math.inf
+    log_max = -math.inf
+    gray_sum = 0.0
+    chan_sum = numpy.zeros(3)
+    count = 0
+
+    for tile, core, _ in tiles():
+        img, gray = _prepare(tile[core], stats)
+        if not gray.size:
+            continue
+
+        log_img = log_(gray)
+        log_sum += float(log_img.sum(dtype=numpy.float64))
+        log_min = min(log_min, float(log_img.min()))
+        log_max = max(log_max, float(log_img.max()))
+        gray_sum += float(gray.sum(dtype=numpy.float64))
+        chan_sum += img.reshape(-1, 3).sum(axis=0, dtype=numpy.float64)
+        count += gray.size
+
+    return {
+        'log_mean': log_sum / count,
+        'log_min': log_min,
+        'log_max': log_max,
+        'gray_mean': gray_sum / count,
+        'chan_mean_0': chan_sum[0] / count,
+        'chan_mean_1': chan_sum[1] / count,
+        'chan_mean_2': chan_sum[2] / count
+    }
+
+
+def _reinhard_map(tile, stats, params):
+    img, gray = _prepare(tile, stats)
+
+    key = (stats['log_max'] - stats['log_mean']) / (
+        stats['log_max'] - stats['log_min']
+    )
+    map_key = numpy.float32(0.3 + 0.7 * math.pow(key, 1.4))
+    intensity = numpy.float32(math.exp(-params['intensity']))
+    color_adapt = numpy.float32(params['color_adapt'])
+    light_adapt = numpy.float32(params['light_adapt'])
+
+    for channel in range(3):
+        value = img[..., channel]
+        global_adapt = color_adapt * stats['chan_mean_{0}'.format(channel)] \
+            + (1.0 - color_adapt) * stats['gray_mean']
+        adapt = color_adapt * value + (1.0 - color_adapt) * gray
+        adapt = light_adapt * adapt + \
+            numpy.float32((1.0 - light_adapt) * global_adapt)
+        adapt = numpy.power(intensity * adapt, map_key)
+        img[..., channel] = value / (adapt + value)
+
+    return img
+
+
+def _signed_pow(img, power):
+    return numpy.sign(img) * numpy.power(numpy.abs(img), power)
+
+
+def _gradient(img, pos):
+    grad = numpy.zeros_like(img)
+    grad[:, pos:img.shape[1] + pos - 1] = img[:, 1:] - img[:, :-1]
+    if pos == 1:
+        grad[:, 0] = img[:, 0]
+    return grad
+
+
+def _contrast(img):
+    levels = int(math.log(min(img.shape[:2])) / math.log(2.0))
+    x_contrast = []
+    y_contrast = []
+
+    layer = img
+    for _ in range(levels):
+        x_contrast.append(_gradient(layer, 0))
+        y_contrast.append(_gradient(numpy.ascontiguousarray(layer.T), 0))
+        layer = cv2.resize(
+            layer, (layer.shape[1] // 2, layer.shape[0] // 2)
+        )
+
+    return x_contrast, y_contrast
+
+
+def _contrast_sum(x_contrast, y_contrast):
+    total = numpy.zeros_like(x_contrast[-1])
+
+    for x_level, y_level in zip(reversed(x_contrast), reversed(y_contrast)):
+        total = cv2.resize(total, (x_level.shape[1], x_level.shape[0]))
+        total += _gradient(x_level, 1) + _gradient(y_level, 1).T
+
+    return total
+
+
+def _contrast_product(img):
+    return _contrast_sum(*_contrast(img))
+
+
+def _mantiuk_solve(log_img, params):
+    response_power = 0.4185
+    x_contrast, y_contrast = _contrast(log_img)
+    for levels in (x_contrast, y_contrast):
+        for index, level in enumerate(levels):
+            level = _signed_pow(level, response_power) * params['scale']
+            levels[index] = _signed_pow(level, 1.0 / response_power)
+
+    right = _contrast_sum(x_contrast, y_contrast)
+
+    # Solve for the new log luminance with conjugate gradients.
+    x = log_img.copy()
+    r = right - _contrast_product(x)
+    p = r.copy()
+    target_norm = float(numpy.vdot(right, right)) * 1e-6
+    rr = float(numpy.vdot(r, r))
+
+    for _ in range(100):
+        product = _contrast_product(p)
+        alpha = numpy.float32(rr / float(numpy.vdot(p, product)))
+        r -= alpha * product
+        x += alpha * p
+        new_rr = float(numpy.vdot(r, r))
+        p = r + numpy.float32(new_rr / rr) * p
+        rr = new_rr
+
+        if rr < target_norm:
+            break
+
+    return x
+
+
+def _mantiuk_stats(tiles, stats, params):
+    if not stats['tiled']:
+        return {}
+
+    factor = get_proxy_factor(stats['height'], stats['width'])
+
+    proxy = numpy.zeros(
+        (
+            max(stats['height'] // factor, 1),
+            max(stats['width'] // factor, 1),
+            3
+        ),
+        dtype=numpy.float32
+    )
+
+    for tile, core, region in tiles():
+        rows = slice(
+            (region[0].start + core[0].start) // factor,
+            min((region[0].start + core[0].stop) // factor, proxy.shape[0])
+        )
+        cols = slice(
+            (region[1].start + core[1].start) // factor,
+            min((region[1].start + core[1].stop) // factor, proxy.shape[1])
+        )
+        if rows.stop > rows.start and cols.stop > cols.start:
+            proxy[rows, cols] = cv2.resize(
+                tile[core],
+                (cols.stop - cols.start, rows.stop - rows.start),
+                interpolation=cv2.INTER_AREA
+            )
+
+    log_img = log_(_prepare(proxy, stats)[1])
+    return {
+        'proxy_factor': factor,
+        'proxy_gain': _mantiuk_solve(log_img, params) - log_img
+    }
+
+
+def _mantiuk_map(tile, stats, params, region=None):
+    img, gray = _prepare(tile, stats)
+    log_img = log_(gray)
+    x = _mantiuk_solve(log_img, params)
+
+    if not _is_whole(region, stats):
+        gain = blend_proxy(
+            x - log_img, stats['proxy_gain'], region, stats['proxy_factor']
+        )
+        x = log_img + gain
+
+    return map_luminance(img, gray, numpy.exp(x), params['saturation'])
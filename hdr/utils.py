@@ -17,9 +17,23 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import importlib
+
 import click
 
 
+class LazyModule(object):
+    """
+    Module proxy that imports the module on first attribute access.
+    """
+
+    def __init__(self, name):
+        self._name = name
+
+    def __getattr__(self, attr):
+        return getattr(importlib.import_module(self._name), attr)
+
+
 def echo_style(message, no_color, fg='yellow'):
     """
     Echo string with style if no_color is False.
@@ -47,3 +61,16 @@ def style_string(message, no_color, fg='yellow'):
         return message
     else:
         return click.style(message, fg=fg)
+
+
+def lazy_import(name):
+    """
+    Return a proxy for a module that is imported when first used.
+
+    The CLI imports the pipeline modules this way so --help, --version
+    and usage errors do not pay for importing OpenCV and NumPy.
+
+    :param name: Full module name, e.g. hdr.api.
+    :return: Returns the module proxy.
+    """
+    return LazyModule(name)
@@ -28,11 +28,17 @@ with open('CHANGES.adoc') as changes_file:
 
 requirements = [
     'Click',
-    'opencv-contrib-python',
-    'Pillow'
+    'opencv-contrib-python'
 ]
 
 test_requirements = [
+    'flake8',
+    'pytest',
+    'pytest-cov'
+]
+
+benchmark_requirements = [
+    'Pillow'
 ]
 
 setup(
@@ -55,6 +61,7 @@ setup(
     install_requires=requirements,
     extras_require={
         'test': test_requirements,
+        'benchmark': benchmark_requirements,
     },
     license='GPLv3+',
     zip_safe=False,
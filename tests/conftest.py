@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+#
+# hdr: A Python API and CLI for creating HDR images.
+#
+# Copyright (C) 2017 Sean Marlow
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import os
+
+import cv2
+import numpy
+import pytest
+
+from click.testing import CliRunner
+
+from hdr import cli
+
+GAMMA = 2.2
+EXPOSURES = (1.0, 0.25, 0.0625)
+EXPOSURES_OPTION = ','.join(str(time_) for time_ in EXPOSURES)
+
+
+def make_scene(width, height, seed=0):
+    """
+    Return a smooth, textured float32 radiance map spanning ~10 stops.
+    """
+    rng = numpy.random.RandomState(seed)
+    y, x = numpy.mgrid[0:height, 0:width].astype(numpy.float32)
+
+    radiance = numpy.exp(x / width * 6 - 3) * (1 + 0.3 * numpy.sin(y / 9.0))
+    texture = cv2.GaussianBlur(
+        rng.rand(height, width).astype(numpy.float32), (0, 0), 3
+    )
+    radiance *= 0.5 + 2 * texture
+    return radiance[..., numpy.newaxis] * numpy.array(
+        [0.6, 0.8, 1.0], dtype=numpy.float32
+    )
+
+
+def render_frames(radiance, exposures=EXPOSURES):
+    """
+    Render uint8 frames of a radiance map through a gamma response.
+    """
+    return [
+        (numpy.clip(radiance * time_, 0, 1) ** (1 / GAMMA) * 255).astype(
+            numpy.uint8
+        )
+        for time_ in exposures
+    ]
+
+
+def run_cli(*args):
+    """
+    Run the hdr command line and return its output.
+    """
+    result = CliRunner().invoke(
+        cli.main, [str(arg) for arg in args], catch_exceptions=False
+    )
+    assert result.exit_code == 0, result.output
+    return result.output
+
+
+@pytest.fixture
+def bracket(tmp_path):
+    """
+    Write a small synthetic bracket set as PNG files.
+
+    :return: Returns the list of file names, exposures are EXPOSURES.
+    """
+    names = []
+
+    for index, image in enumerate(render_frames(make_scene(128, 96))):
+        name = os.path.join(str(tmp_path), 'frame{0}.png'.format(index))
+        cv2.imwrite(name, image)
+        names.append(name)
+
+    return names
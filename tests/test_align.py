@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+#
+# hdr: A Python API and CLI for creating HDR images.
+#
+# Copyright (C) 2017 Sean Marlow
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+
+import cv2
+import numpy
+import pytest
+
+from hdr import align
+from hdr.api import align_images
+from hdr.exceptions import HdrException
+
+from conftest import EXPOSURES, EXPOSURES_OPTION, render_frames, run_cli
+
+# Offset of each frame from the middle one. The MTB shift moves a
+# frame back onto the middle frame.
+OFFSETS = [(6, -4), (0, 0), (-8, 2)]
+SHIFTS = [(-dx, -dy) for dx, dy in OFFSETS]
+MARGIN = 16
+
+# The default 6 pyramid levels shrink these small frames to a few
+# pixels, so the tests search up to 16 pixels.
+OPTIONS = {'max_bits': 4}
+
+
+def make_blocks(width, height, seed=0):
+    """
+    Return a radiance map of random blocks, which have the strong
+    edges median threshold bitmaps need.
+    """
+    rng = numpy.random.RandomState(seed)
+    blocks = numpy.exp(rng.rand(height // 8, width // 8) * 6 - 4)
+    radiance = cv2.GaussianBlur(
+        cv2.resize(
+            blocks.astype(numpy.float32), (width, height),
+            interpolation=cv2.INTER_NEAREST
+        ),
+        (0, 0), 1.5
+    )
+    return numpy.repeat(radiance[..., numpy.newaxis], 3, axis=2)
+
+
+@pytest.fixture(scope='module')
+def frames():
+    """
+    Return a bracket set where each frame is offset by OFFSETS.
+    """
+    radiance = make_blocks(256 + 2 * MARGIN, 192 + 2 * MARGIN)
+    return [
+        render_frames(
+            radiance[MARGIN - dy:MARGIN - dy + 192,
+                     MARGIN - dx:MARGIN - dx + 256],
+            [time_]
+        )[0]
+        for (dx, dy), time_ in zip(OFFSETS, EXPOSURES)
+    ]
+
+
+@pytest.fixture
+def frame_names(frames, tmp_path):
+    names = []
+
+    for index, frame in enumerate(frames):
+        name = os.path.join(str(tmp_path), 'frame{0}.png'.format(index))
+        cv2.imwrite(name, frame)
+        names.append(name)
+
+    return names
+
+
+@pytest.mark.parametrize('spec, expected', [
+    ('none', False),
+    ('mtb', {}),
+    ('mtb:max-bits=4,downscale=2', {'max_bits': 4, 'downscale': 2}),
+    ('mtb:exclude_range=8,', {'exclude_range': 8})
+])
+def test_parse_align(spec, expected):
+    assert align.parse_align(spec) == expected
+
+
+@pytest.mark.parametrize('spec', [
+    'ecc',
+    'none:downscale=2',
+    'mtb:levels=4',
+    'mtb:downscale',
+    'mtb:max-bits=x'
+])
+def test_parse_align_errors(spec):
+    with pytest.raises(HdrException):
+        align.parse_align(spec)
+
+
+def test_get_options():
+    assert align.get_options(True) == align.ALIGN_OPTIONS
+    assert align.get_options({'downscale': 4})['downscale'] == 4
+
+    with pytest.raises(HdrException):
+        align.get_options({'levels': 4})
+
+
+@pytest.mark.parametrize('options', [
+    OPTIONS,
+    {'max_bits': 5, 'downscale': 2},
+    dict(OPTIONS, exclude_range=8)
+])
+def test_get_shifts(frames, options):
+    assert align.get_shifts(frames, **options) == SHIFTS
+
+
+def test_get_shifts_proxy(frames):
+    proxies = [
+        cv2.resize(frame, None, fx=0.5, fy=0.5, interpolation=cv2.INTER_AREA)
+        for frame in frames
+    ]
+    assert align.get_shifts(proxies, scale=2, **OPTIONS) == SHIFTS
+
+
+def test_get_shifts_initial(frames):
+    # A nearby starting point only needs a small residual search.
+    initial = [(dx + 2, dy - 1) for dx, dy in SHIFTS]
+    assert align.get_shifts(frames, initial=initial, **OPTIONS) == SHIFTS
+
+
+def test_align_images(frames):
+    images = list(frames)
+    assert align_images(images, align=OPTIONS) == SHIFTS
+
+    # Away from the filled border every frame shows the same scene,
+    # so the brightness order of the exposures holds per pixel.
+    inner = (slice(MARGIN, -MARGIN), slice(MARGIN, -MARGIN))
+    first, middle, last = [image[inner].astype(int) for image in images]
+    assert (first >= middle).all() and (middle >= last).all()
+
+    assert align_images(list(frames), align=False) is None
+
+
+def test_sidecar(frames, frame_names, monkeypatch):
+    shifts = align.get_bracket_shifts(frames, frame_names, OPTIONS, True)
+    sidecar = frame_names[1] + align.SIDECAR_SUFFIX
+    assert shifts == SHIFTS
+    assert os.path.isfile(sidecar)
+
+    calls = []
+    get_shifts = align.get_shifts
+
+    def count(*args, **kwargs):
+        calls.append(kwargs)
+        return get_shifts(*args, **kwargs)
+
+    monkeypatch.setattr(align, 'get_shifts', count)
+
+    # Reused as long as the frames and options are unchanged.
+    assert align.get_bracket_shifts(
+        frames, frame_names, OPTIONS, True
+    ) == SHIFTS
+    assert calls == []
+
+    # A preview shrunk by 2 shares the sidecar of a full resolution
+    # run that downscales by 2.
+    options = dict(OPTIONS, downscale=2)
+    align.get_bracket_shifts(frames, frame_names, options, True)
+    assert len(calls) == 1
+    align.get_bracket_shifts(frames, frame_names, OPTIONS, True, scale=2)
+    assert len(calls) == 1
+
+    # Changed options or frames invalidate the sidecar.
+    align.get_bracket_shifts(frames, frame_names, OPTIONS, True)
+    assert len(calls) == 2
+
+    cv2.imwrite(frame_names[0], frames[1])
+    align.get_bracket_shifts(frames, frame_names, OPTIONS, True)
+    assert len(calls) == 3
+
+    with open(sidecar, 'w') as sidecar_file:
+        sidecar_file.write('{')
+    assert align.load_shifts(frame_names, OPTIONS) is None
+
+
+def test_align_cli(frame_names, tmp_path):
+    output = str(tmp_path / 'result.jpg')
+    run_cli(
+        'reinhard', '-e', EXPOSURES_OPTION, '--align', 'mtb:max-bits=4',
+        '--cache-shifts', '-o', output, *frame_names
+    )
+
+    assert os.path.isfile(output)
+    assert os.path.isfile(frame_names[1] + align.SIDECAR_SUFFIX)
+
+    assert 'not supported' in run_cli(
+        'reinhard', '-e', EXPOSURES_OPTION, '--align', 'ecc', *frame_names
+    )
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+#
+# hdr: A Python API and CLI for creating HDR images.
+#
+# Copyright (C) 2017 Sean Marlow
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import json
+import os
+
+import pytest
+
+from hdr import batch
+from hdr.exceptions import HdrException
+
+from conftest import run_cli
+
+
+def test_read_manifest_json(tmp_path):
+    manifest = tmp_path / 'manifest.json'
+    manifest.write_text(json.dumps([
+        {'images': ['a1.jpg', 'a2.jpg'], 'output': 'a.jpg', 'gamma': 2.2},
+        {'images': ['/b1.jpg'], 'operator': 'durand'}
+    ]))
+
+    jobs = batch.read_manifest(str(manifest), 'mantiuk')
+
+    assert jobs == [
+        {
+            'images': [str(tmp_path / 'a1.jpg'), str(tmp_path / 'a2.jpg')],
+            'output': str(tmp_path / 'a.jpg'),
+            'gamma': 2.2,
+            'operator': 'mantiuk'
+        },
+        {'images': ['/b1.jpg'], 'operator': 'durand'}
+    ]
+
+
+def test_read_manifest_index(tmp_path):
+    manifest = tmp_path / 'index.json'
+    manifest.write_text(json.dumps({
+        'root': 'photos', 'sets': [{'images': ['a1.jpg']}]
+    }))
+
+    jobs = batch.read_manifest(str(manifest))
+
+    assert jobs == [{
+        'images': [str(tmp_path / 'photos' / 'a1.jpg')], 'operator': 'drago'
+    }]
+
+
+def test_read_manifest_text(tmp_path):
+    manifest = tmp_path / 'sets.txt'
+    manifest.write_text(
+        '# bracket sets\na1.jpg a2.jpg\n\n"b 1.jpg" b2.jpg\n'
+    )
+
+    jobs = batch.read_manifest(str(manifest))
+
+    assert [job['images'] for job in jobs] == [
+        [str(tmp_path / 'a1.jpg'), str(tmp_path / 'a2.jpg')],
+        [str(tmp_path / 'b 1.jpg'), str(tmp_path / 'b2.jpg')]
+    ]
+
+
+@pytest.mark.parametrize('data', ['[{"images": []}]', '[1]', '[{"images"'])
+def test_read_manifest_invalid(tmp_path, data):
+    manifest = tmp_path / 'manifest.json'
+    manifest.write_text(data)
+
+    with pytest.raises(HdrException):
+        batch.read_manifest(str(manifest))
+
+
+@pytest.mark.parametrize('memory_limit', [None, 2 ** 31])
+def test_process_batch_failures(tmp_path, bracket, memory_limit):
+    jobs = [
+        {'images': [], 'operator': 'mertens'},
+        {'images': bracket, 'operator': 'mertens'},
+        {'images': [str(tmp_path / 'missing.png')], 'operator': 'mertens'}
+    ]
+    completed = []
+
+    results = batch.process_batch(
+        jobs, callback=completed.append, memory_limit=memory_limit
+    )
+
+    assert len(completed) == 3
+    assert [result['images'] for result in results] == [
+        job['images'] for job in jobs
+    ]
+    assert results[0]['error'] == 'A bracket set requires at least one image.'
+    assert results[1]['error'] is None
+    assert os.path.isfile(results[1]['output'])
+    assert results[2]['error'] and results[2]['output'] is None
+
+
+def test_run_job_profile(bracket):
+    result = batch.run_job(
+        {'images': bracket, 'operator': 'mertens'}, profile=True
+    )
+
+    assert result['error'] is None
+    assert [item['name'] for item in result['profile']['stages']][-1] == (
+        'write'
+    )
+
+
+def test_batch_cli(tmp_path, bracket):
+    manifest = tmp_path / 'manifest.json'
+    manifest.write_text(json.dumps([
+        {'images': bracket, 'operator': 'mertens', 'output': 'fused.jpg'},
+        {'images': ['missing.png'], 'operator': 'mertens'}
+    ]))
+    profile = str(tmp_path / 'profile.jsonl')
+
+    output = run_cli(
+        'batch', '-w', 1, '--threads', 1, '-s', '', '--profile', profile,
+        manifest
+    )
+
+    assert str(tmp_path / 'fused.jpg') in output
+    assert 'Failed empty set:' in output
+    assert '1 succeeded, 2 failed.' in output
+    with open(profile) as profile_file:
+        records = [json.loads(line) for line in profile_file]
+    assert [record['command'] for record in records] == ['batch'] * 3
+
+    manifest.write_text('[{"images"')
+    assert 'Invalid JSON manifest' in run_cli('batch', manifest)
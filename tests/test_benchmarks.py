@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+#
+# hdr: A Python API and CLI for creating HDR images.
+#
+# Copyright (C) 2017 Sean Marlow
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import os
+
+import pytest
+
+from click.testing import CliRunner
+
+from hdr import exif
+
+pytest.importorskip('PIL')
+
+BENCHMARKS = os.path.join(os.path.dirname(__file__), os.pardir, 'benchmarks')
+
+
+@pytest.fixture
+def pipeline(monkeypatch):
+    """
+    Import the pipeline benchmark, which imports its siblings as top
+    level modules.
+    """
+    monkeypatch.syspath_prepend(BENCHMARKS)
+    import pipeline
+    return pipeline
+
+
+def test_write_bracket(pipeline, tmp_path):
+    import synthetic
+
+    images, exposures = synthetic.make_bracket(128, 96, frames=3, stops=2)
+    assert list(exposures) == [1.0, 0.25, 0.0625]
+
+    names = synthetic.write_bracket(images, exposures, str(tmp_path))
+    for name, time_ in zip(names, exposures):
+        values = exif.read_exif(name)
+        assert values['exposure'] == pytest.approx(time_)
+        assert (values['make'], values['model']) == ('hdr', 'synthetic')
+        assert values['iso'] == 100
+
+
+def test_run(pipeline, tmp_path):
+    output = str(tmp_path / 'results.json')
+    result = CliRunner().invoke(pipeline.main, [
+        'run', '--sizes', '128x96', '--frames', '3', '--repeat', '1',
+        '-o', output
+    ], catch_exceptions=False)
+    assert result.exit_code == 0, result.output
+
+    with open(output) as results_file:
+        stages = [row['stage'] for row in json.load(results_file)['results']]
+
+    for stage in ('read_images', 'get_exposures', 'align_images',
+                  'calibrate', 'merge', 'mertens', 'write'):
+        assert stage in stages
+
+
+def write_results(path, timings):
+    with open(path, 'w') as results_file:
+        json.dump({'results': [
+            {'size': '640x480', 'frames': 3, 'stage': stage, 'min': value}
+            for stage, value in timings.items()
+        ]}, results_file)
+    return path
+
+
+def test_compare(pipeline, tmp_path):
+    baseline = write_results(str(tmp_path / 'baseline.json'), {
+        'merge': 0.1, 'calibrate': 0.1, 'write': 0.001, 'mertens': 0.1
+    })
+    candidate = write_results(str(tmp_path / 'candidate.json'), {
+        'merge': 0.2, 'calibrate': 0.05, 'write': 0.0015, 'align': 0.1
+    })
+
+    result = CliRunner().invoke(
+        pipeline.main, ['compare', baseline, candidate]
+    )
+    lines = result.output.splitlines()
+
+    assert result.exit_code == 1
+    assert [line for line in lines if 'merge' in line][0].endswith(
+        'REGRESSION'
+    )
+    assert [line for line in lines if 'calibrate' in line][0].endswith(
+        'faster'
+    )
+    # Half a millisecond slower is below --min-delta.
+    assert [line for line in lines if 'write' in line][0].endswith('+50%')
+    assert 'only in' in [line for line in lines if 'mertens' in line][0]
+    assert lines[-1] == '1 regressions.'
+
+    result = CliRunner().invoke(
+        pipeline.main, ['compare', baseline, baseline]
+    )
+    assert result.exit_code == 0
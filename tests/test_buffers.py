@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+#
+# hdr: A Python API and CLI for creating HDR images.
+#
+# Copyright (C) 2017 Sean Marlow
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import struct
+
+import cv2
+import numpy
+import pytest
+
+from hdr import api, exif
+from hdr.exceptions import HdrException
+
+from conftest import EXPOSURES, EXPOSURES_OPTION
+from test_exif import make_tiff
+
+
+def read_frames(names):
+    return [cv2.imread(name) for name in names]
+
+
+def read_buffers(names):
+    buffers = []
+
+    for name in names:
+        with open(name, 'rb') as image_file:
+            buffers.append(image_file.read())
+
+    return buffers
+
+
+def add_exposure(jpeg, time_):
+    """
+    Insert an EXIF APP1 segment with the exposure time into a JPEG.
+    """
+    tiff = make_tiff(
+        '<', [], [(exif.EXPOSURE_TIME_TAG, 5, [(1, int(round(1 / time_)))])]
+    )
+    app1 = b'Exif\x00\x00' + tiff
+    return (
+        jpeg[:2] + b'\xff\xe1' + struct.pack('>H', len(app1) + 2) + app1 +
+        jpeg[2:]
+    )
+
+
+@pytest.fixture
+def expected(bracket):
+    """
+    Return the result of the file based pipeline for the bracket.
+    """
+    return cv2.imread(api.HdrPipeline('reinhard', align=False).process(
+        bracket, EXPOSURES_OPTION
+    ))
+
+
+def test_process_buffers(bracket, expected):
+    frames = read_frames(bracket)
+    originals = [frame.copy() for frame in frames]
+
+    for images in (frames, read_buffers(bracket)):
+        result = api.process_buffers(
+            images, EXPOSURES, 'reinhard', align=False
+        )
+        assert result.dtype == numpy.uint8
+        numpy.testing.assert_array_equal(result, expected)
+
+    # Alignment shifts copies, the caller's arrays are not modified.
+    api.process_buffers(frames, EXPOSURES, 'reinhard')
+    for frame, original in zip(frames, originals):
+        numpy.testing.assert_array_equal(frame, original)
+
+
+def test_process_buffers_exif(bracket):
+    jpegs = [
+        add_exposure(cv2.imencode('.jpg', frame)[1].tobytes(), time_)
+        for frame, time_ in zip(read_frames(bracket), EXPOSURES)
+    ]
+
+    numpy.testing.assert_array_equal(
+        api.get_buffer_exposures(None, jpegs), EXPOSURES
+    )
+    numpy.testing.assert_array_equal(
+        api.process_buffers(jpegs, tonemap='reinhard', align=False),
+        api.process_buffers(
+            jpegs, EXPOSURES, tonemap='reinhard', align=False
+        )
+    )
+
+    with pytest.raises(HdrException, match='No exposure time'):
+        api.process_buffers(read_buffers(bracket))
+
+    with pytest.raises(HdrException, match='must be provided'):
+        api.process_buffers(read_frames(bracket))
+
+
+@pytest.mark.parametrize('output_format, depth', [
+    ('.png', 8), ('png', 16), ('.tif', 16)
+])
+def test_process_buffers_encoded(bracket, output_format, depth):
+    data = api.process_buffers(
+        read_frames(bracket), EXPOSURES, 'reinhard', align=False,
+        encoding={'depth': depth}, output_format=output_format
+    )
+    decoded = cv2.imdecode(
+        numpy.frombuffer(data, numpy.uint8), cv2.IMREAD_UNCHANGED
+    )
+    array = api.process_buffers(
+        read_frames(bracket), EXPOSURES, 'reinhard', align=False,
+        encoding={'depth': depth}
+    )
+
+    assert decoded.dtype == numpy.dtype('uint{0}'.format(depth))
+    numpy.testing.assert_array_equal(decoded, array)
+
+
+def test_pipeline_images(bracket, expected):
+    pipeline = api.HdrPipeline('reinhard', align=False)
+    frames = read_frames(bracket)
+
+    radiance = pipeline.merge_images(frames, EXPOSURES)
+    assert radiance.shape == (96, 128, 3)
+    assert radiance.dtype == numpy.float32
+
+    # Results are new arrays, not the pipeline's reused buffers.
+    first = pipeline.process_images(frames, EXPOSURES)
+    second = pipeline.process_images(frames, EXPOSURES)
+    assert first is not second
+    numpy.testing.assert_array_equal(first, expected)
+    numpy.testing.assert_array_equal(second, expected)
+
+    mertens = api.HdrPipeline('linear', algo='mertens', align=False)
+    assert mertens.process_images(frames).shape == (96, 128, 3)
+
+    with pytest.raises(HdrException):
+        api.HdrPipeline(algo='debevec').render_images(frames, EXPOSURES)
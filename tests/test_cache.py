@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+#
+# hdr: A Python API and CLI for creating HDR images.
+#
+# Copyright (C) 2017 Sean Marlow
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import os
+import shutil
+
+import numpy
+import pytest
+
+from hdr import batch
+from hdr.cache import ResultCache
+
+from conftest import EXPOSURES_OPTION, run_cli
+
+
+@pytest.fixture
+def image(tmp_path):
+    name = str(tmp_path / 'a.jpg')
+    with open(name, 'wb') as stream:
+        stream.write(b'image')
+    return name
+
+
+def touch(name, seconds):
+    stat = os.stat(name)
+    os.utime(name, (stat.st_atime + seconds, stat.st_mtime + seconds))
+
+
+def store(result_cache, key, size):
+    return result_cache.save_array(key, numpy.zeros(size, numpy.uint8))
+
+
+def test_key_stat(tmp_path, image):
+    result_cache = ResultCache(str(tmp_path / 'cache'))
+    key = result_cache.get_key('result', [image], {'gamma': 1.0})
+
+    assert key == result_cache.get_key('result', [image], {'gamma': 1.0})
+    assert key != result_cache.get_key('result', [image], {'gamma': 2.0})
+    assert key != result_cache.get_key('radiance', [image], {'gamma': 1.0})
+
+    touch(image, 10)
+    assert key != result_cache.get_key('result', [image], {'gamma': 1.0})
+
+
+def test_key_content(tmp_path, image):
+    result_cache = ResultCache(str(tmp_path / 'cache'), hash_content=True)
+    key = result_cache.get_key('result', [image], {})
+
+    touch(image, 10)
+    renamed = str(tmp_path / 'b.jpg')
+    shutil.move(image, renamed)
+    assert key == result_cache.get_key('result', [renamed], {})
+
+    with open(renamed, 'ab') as stream:
+        stream.write(b'changed')
+    assert key != result_cache.get_key('result', [renamed], {})
+
+
+def test_files(tmp_path, image):
+    result_cache = ResultCache(str(tmp_path / 'cache'))
+    output = str(tmp_path / 'out.jpg')
+
+    assert not result_cache.load_file('key', '.jpg', output)
+    result_cache.save_file('key', '.jpg', image)
+    assert result_cache.load_file('key', '.jpg', output)
+
+    with open(output, 'rb') as stream:
+        assert stream.read() == b'image'
+
+
+def test_eviction(tmp_path):
+    result_cache = ResultCache(str(tmp_path / 'cache'))
+    paths = [store(result_cache, key, 1000) for key in ('aa', 'bb', 'cc')]
+    size = os.path.getsize(paths[0])
+    result_cache.max_bytes = int(3.5 * size)
+
+    for age, path in enumerate(paths):
+        touch(path, -100 * (3 - age))
+
+    # Using the oldest entry makes the second oldest the one evicted.
+    assert result_cache.load_array('aa') is not None
+    store(result_cache, 'dd', 1000)
+
+    assert result_cache.load_array('bb') is None
+    for key in ('aa', 'cc', 'dd'):
+        assert result_cache.load_array(key) is not None
+    assert result_cache.get_size() == 3 * size
+
+
+def test_store_walks(tmp_path, monkeypatch):
+    result_cache = ResultCache(str(tmp_path / 'cache'))
+    size = os.path.getsize(store(result_cache, 'first', 1000))
+    result_cache.clear()
+    result_cache.max_bytes = 10 * size
+    walks = []
+    get_entries = result_cache.get_entries
+
+    def count_entries():
+        walks.append(1)
+        return get_entries()
+
+    monkeypatch.setattr(result_cache, 'get_entries', count_entries)
+
+    for index in range(10):
+        store(result_cache, 'a{0}'.format(index), 1000)
+    assert len(walks) == 0
+
+    # Passing the limit prunes below it, so the next store fits.
+    store(result_cache, 'b0', 1000)
+    assert len(walks) == 1
+    assert result_cache.get_size() <= 9 * size
+    store(result_cache, 'b1', 1000)
+    assert len(walks) == 2
+
+
+def test_clear(tmp_path):
+    result_cache = ResultCache(str(tmp_path / 'cache'))
+    store(result_cache, 'aa', 1000)
+
+    assert result_cache.clear() > 1000
+    assert result_cache.get_info()['entries'] == 0
+
+
+def test_run_job(tmp_path, bracket):
+    result_cache = ResultCache(str(tmp_path / 'cache'), cache_radiance=True)
+    job = {
+        'images': bracket,
+        'operator': 'drago',
+        'exposures': [1.0, 0.25, 0.0625],
+        'output': str(tmp_path / 'out.jpg')
+    }
+
+    def get_stages(**options):
+        result = batch.run_job(
+            dict(job, **options), profile=True, result_cache=result_cache
+        )
+        assert result['error'] is None
+        return [item['name'] for item in result['profile']['stages']]
+
+    assert 'merge' in get_stages()
+    # An unchanged job is copied from the cache.
+    assert 'tonemap' not in get_stages()
+    # A new tonemap reuses the cached radiance map.
+    stages = get_stages(gamma=2.0)
+    assert 'tonemap' in stages and 'merge' not in stages
+
+
+def test_cache_cli(tmp_path, bracket, monkeypatch):
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'xdg'))
+    output = str(tmp_path / 'out.jpg')
+    args = [
+        'reinhard', '-e', EXPOSURES_OPTION, '--result-cache',
+        '--cache-radiance', '--cache-hash', 'content', '--cache-max-size', 64,
+        '-o', output
+    ] + bracket
+
+    run_cli(*args)
+    info = ResultCache().get_info()
+    assert info['entries'] == 2
+    assert info['cache_dir'].startswith(str(tmp_path / 'xdg'))
+
+    # A cached result is copied to the output.
+    os.remove(output)
+    run_cli(*args)
+    assert os.path.isfile(output)
+
+    assert '2 results' in run_cli('cache')
+    assert 'Removed' in run_cli('cache', '--max-size', 0)
+    assert '0 results' in run_cli('cache', '--clear')
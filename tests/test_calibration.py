@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+#
+# hdr: A Python API and CLI for creating HDR images.
+#
+# Copyright (C) 2017 Sean Marlow
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+
+import numpy
+import pytest
+
+from hdr import calibration
+from hdr.exceptions import HdrException
+
+from conftest import (
+    EXPOSURES,
+    EXPOSURES_OPTION,
+    GAMMA,
+    make_scene,
+    render_frames,
+    run_cli
+)
+
+# The scene has few values near 0 and 255 in some channels, so only
+# the middle of the curve is compared. Log response error.
+VALUES = slice(32, 224)
+TOLERANCE = 0.02
+
+
+def get_expected():
+    """
+    Return the response of render_frames normalised to 1 at 128.
+
+    Frames are truncated to integers, so each value stands for the
+    middle of its bin.
+    """
+    values = numpy.arange(calibration.LDR_SIZE) + 0.5
+    return (values / values[calibration.LDR_SIZE // 2]) ** GAMMA
+
+
+@pytest.fixture(scope='module')
+def frames():
+    return render_frames(make_scene(256, 192))
+
+
+def test_solve_response(frames):
+    values = calibration.sample_pixels(frames, numpy.array(EXPOSURES), 2048)
+    curve = calibration.solve_response(
+        values[:, :, 1], numpy.log(EXPOSURES)
+    )
+
+    assert curve[calibration.LDR_SIZE // 2] == pytest.approx(0, abs=1e-6)
+    error = numpy.abs(curve - numpy.log(get_expected()))[VALUES]
+    assert error.max() < TOLERANCE
+
+
+def test_calibrate_sampled(frames):
+    response = calibration.calibrate_response(
+        frames, EXPOSURES, 'debevec', samples=2048
+    )
+
+    assert response.shape == (256, 1, 3)
+    assert response.dtype == numpy.float32
+    error = numpy.abs(
+        numpy.log(response[:, 0, :]) -
+        numpy.log(get_expected())[:, numpy.newaxis]
+    )[VALUES]
+    assert error.max() < TOLERANCE
+
+
+def test_calibrate_errors(frames):
+    with pytest.raises(HdrException):
+        calibration.calibrate_response(
+            frames, EXPOSURES, 'robertson', samples=256
+        )
+
+    with pytest.raises(HdrException):
+        calibration.calibrate_response(frames, EXPOSURES, 'unknown')
+
+    with pytest.raises(HdrException):
+        calibration.calibrate_sampled(frames, EXPOSURES[:2], 256)
+
+
+def test_sample_pixels(frames):
+    values = calibration.sample_pixels(frames, numpy.array(EXPOSURES), 512)
+    assert values.shape == (len(frames), 512, 3)
+
+    # Every brightness present in the middle frame is sampled, however
+    # little of the scene it covers.
+    middle = frames[1].reshape(-1, 3).mean(axis=1)
+    strata = numpy.unique(
+        (middle * calibration.SAMPLE_STRATA / 256).astype(int)
+    )
+    sampled = numpy.unique(
+        (values[1].mean(axis=1) * calibration.SAMPLE_STRATA / 256).astype(
+            int
+        )
+    )
+    assert set(sampled) == set(strata)
+
+
+def test_get_quota():
+    counts = numpy.array([0, 2, 50, 50])
+    quota = calibration.get_quota(counts, 40)
+
+    assert list(quota) == [0, 2, 19, 19]
+    assert list(calibration.get_quota(counts, 500)) == list(counts)
+
+
+def test_response_cache(frames, tmp_path, monkeypatch):
+    camera = {'make': 'Canon', 'model': 'EOS 5D', 'iso': 100}
+    monkeypatch.setattr(
+        calibration, 'get_camera_info', lambda image_name: camera
+    )
+    key = calibration.get_response_key('frame.jpg', 'debevec')
+    assert key == 'canon_eos-5d_iso100_debevec'
+
+    cache_dir = str(tmp_path)
+    response = calibration.get_response(
+        ['frame.jpg'], frames, EXPOSURES, 'debevec', cache_dir,
+        samples=512
+    )
+    assert os.path.isfile(os.path.join(cache_dir, key + '.npy'))
+
+    # The stored curve is reused instead of calibrating again.
+    def fail(*args, **kwargs):
+        raise AssertionError('calibrated')
+
+    monkeypatch.setattr(calibration, 'calibrate_response', fail)
+    cached = calibration.get_response(
+        ['frame.jpg'], frames, EXPOSURES, 'debevec', cache_dir
+    )
+    numpy.testing.assert_array_equal(cached, response)
+
+    camera = {'make': None, 'model': None, 'iso': None}
+    assert calibration.get_response_key('frame.jpg', 'debevec') is None
+
+
+def test_read_response_errors(tmp_path):
+    with pytest.raises(HdrException):
+        calibration.read_response(str(tmp_path / 'missing.npy'))
+
+    path = str(tmp_path / 'flat.npy')
+    numpy.save(path, numpy.ones(256))
+    with pytest.raises(HdrException):
+        calibration.read_response(path)
+
+    path = str(tmp_path / 'text.npy')
+    with open(path, 'w') as response_file:
+        response_file.write('not a curve')
+    with pytest.raises(HdrException):
+        calibration.read_response(path)
+
+
+def test_calibrate_cli(bracket, tmp_path):
+    output = str(tmp_path / 'response.npy')
+    assert run_cli(
+        'calibrate', '-e', EXPOSURES_OPTION, '-s', 1024, '-o', output,
+        *bracket
+    ).strip() == output
+
+    merged = str(tmp_path / 'merged.npy')
+    run_cli(
+        'merge', '-e', EXPOSURES_OPTION, '-r', output, '-o', merged,
+        *bracket
+    )
+    assert numpy.load(merged).shape == (96, 128, 3)
+
+    # Without EXIF the camera is unknown, so an output is required.
+    assert 'output file is required' in run_cli(
+        'calibrate', '-e', EXPOSURES_OPTION, *bracket
+    )
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+#
+# hdr: A Python API and CLI for creating HDR images.
+#
+# Copyright (C) 2017 Sean Marlow
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+
+import cv2
+import numpy
+import pytest
+
+from hdr import api
+from hdr.exceptions import HdrException
+
+
+@pytest.fixture
+def encoded(bracket):
+    """
+    Return the bracket frames as PNG bytes.
+    """
+    frames = []
+
+    for name in bracket:
+        with open(name, 'rb') as image_file:
+            frames.append(image_file.read())
+
+    return frames
+
+
+def test_read_images(bracket, monkeypatch):
+    expected = [cv2.imread(name) for name in bracket]
+    threads = set()
+    imread = cv2.imread
+
+    def record(*args):
+        threads.add(threading.current_thread().name)
+        return imread(*args)
+
+    monkeypatch.setattr(cv2, 'imread', record)
+
+    for workers in (1, 3):
+        images = api.read_images(bracket, workers=workers)
+        for image, reference in zip(images, expected):
+            numpy.testing.assert_array_equal(image, reference)
+
+    # One worker decodes on the calling thread, more use a pool.
+    assert threading.current_thread().name in threads
+    assert len(threads) > 1
+
+
+def test_read_images_errors(bracket, tmp_path):
+    with pytest.raises(HdrException, match='Unable to read'):
+        api.read_images(bracket + [str(tmp_path / 'missing.png')])
+
+    small = str(tmp_path / 'small.png')
+    cv2.imwrite(small, numpy.zeros((10, 10, 3), numpy.uint8))
+    with pytest.raises(HdrException, match='same size'):
+        api.read_images(bracket + [small])
+
+
+def test_decode_images(bracket, encoded):
+    expected = [cv2.imread(name) for name in bracket]
+
+    for workers in (1, 3):
+        frames = api.decode_images(encoded, workers=workers)
+        for frame, reference in zip(frames, expected):
+            numpy.testing.assert_array_equal(frame, reference)
+
+    # Arrays are used as they are and may be mixed with buffers.
+    mixed = [expected[0], bytearray(encoded[1]), memoryview(encoded[2])]
+    frames = api.decode_images(mixed)
+    assert frames[0] is expected[0]
+    numpy.testing.assert_array_equal(frames[2], expected[2])
+
+    reduced = api.decode_images(expected, preview=2)
+    assert [frame.shape for frame in reduced] == [(48, 64, 3)] * 3
+
+
+@pytest.mark.parametrize('bad', [
+    b'not an image',
+    numpy.zeros((96, 128), numpy.uint8),
+    numpy.zeros((96, 128, 3), numpy.float32),
+    numpy.zeros((48, 64, 3), numpy.uint8)
+])
+def test_decode_images_errors(encoded, bad):
+    with pytest.raises(HdrException):
+        api.decode_images(encoded[:2] + [bad])
@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+#
+# hdr: A Python API and CLI for creating HDR images.
+#
+# Copyright (C) 2017 Sean Marlow
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import struct
+
+import pytest
+
+from hdr import exif
+
+DATETIME_TAG = 36867
+SUBSEC_TAG = 37521
+
+
+def pack_value(order, tag_type, value):
+    """
+    Return the count and bytes of a tag value.
+    """
+    if tag_type == 2:
+        data = value.encode('ascii') + b'\x00'
+        return len(data), data
+
+    fmt = exif.TYPES[tag_type][0]
+    values = [item for pair in value for item in pair] if len(fmt) == 2 \
+        else list(value)
+    return len(value), struct.pack(order + fmt * len(value), *values)
+
+
+def make_tiff(order, ifd0, exif_ifd=(), corrupt=None):
+    """
+    Build TIFF bytes with an IFD0 and an optional EXIF IFD.
+
+    :param ifd0: List of (tag, type, value) entries. ASCII values are
+        strings, rationals lists of (numerator, denominator) pairs and
+        other values lists of numbers.
+    :param corrupt: Optional tag whose count is replaced by 0xFFFFFFFF.
+    """
+    def layout(entries, offset):
+        data_offset = offset + 2 + 12 * len(entries) + 4
+        head = struct.pack(order + 'H', len(entries))
+        data = b''
+
+        for tag, tag_type, value in entries:
+            count, payload = pack_value(order, tag_type, value)
+            if tag == corrupt:
+                count = 0xFFFFFFFF
+
+            if len(payload) <= 4:
+                head += struct.pack(order + 'HHL', tag, tag_type, count)
+                head += payload.ljust(4, b'\x00')
+            else:
+                head += struct.pack(
+                    order + 'HHLL', tag, tag_type, count,
+                    data_offset + len(data)
+                )
+                data += payload
+
+        return head + b'\x00' * 4 + data
+
+    header = (b'II*\x00' if order == '<' else b'MM\x00*') + struct.pack(
+        order + 'L', 8
+    )
+    entries = list(ifd0)
+    if exif_ifd:
+        entries.append((exif.EXIF_IFD_TAG, 4, [0]))
+        first = layout(entries, 8)
+        entries[-1] = (exif.EXIF_IFD_TAG, 4, [8 + len(first)])
+
+    first = layout(entries, 8)
+    second = layout(list(exif_ifd), 8 + len(first)) if exif_ifd else b''
+    return header + first + second
+
+
+def make_jpeg(tiff):
+    """
+    Wrap TIFF bytes in a JPEG APP1 segment after an APP0 segment.
+    """
+    app0 = b'JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00'
+    app1 = b'Exif\x00\x00' + tiff
+    return (
+        b'\xff\xd8' +
+        b'\xff\xe0' + struct.pack('>H', len(app0) + 2) + app0 +
+        b'\xff\xe1' + struct.pack('>H', len(app1) + 2) + app1 +
+        b'\xff\xda\x00\x02'
+    )
+
+
+def make_camera_tiff(order, corrupt=None):
+    return make_tiff(
+        order,
+        [
+            (exif.MAKE_TAG, 2, 'Canon'),
+            (exif.MODEL_TAG, 2, 'EOS 5D'),
+        ],
+        [
+            (exif.EXPOSURE_TIME_TAG, 5, [(1, 250)]),
+            (exif.FNUMBER_TAG, 5, [(8, 1)]),
+            (exif.ISO_TAG, 3, [100]),
+            (exif.EXPOSURE_BIAS_TAG, 10, [(-2, 3)]),
+            (DATETIME_TAG, 2, '2017:01:02 03:04:05'),
+            (SUBSEC_TAG, 2, '25'),
+            (exif.SERIAL_TAG, 2, '1234'),
+        ],
+        corrupt
+    )
+
+
+@pytest.mark.parametrize('order', ['<', '>'])
+@pytest.mark.parametrize('wrap', [bytes, make_jpeg])
+def test_read_exif_bytes(order, wrap):
+    values = exif.read_exif_bytes(wrap(make_camera_tiff(order)))
+
+    assert values == {
+        'make': 'Canon',
+        'model': 'EOS 5D',
+        'serial': '1234',
+        'exposure': pytest.approx(0.004),
+        'aperture': 8.0,
+        'iso': 100,
+        'bias': pytest.approx(-2 / 3.0),
+        'datetime': '2017:01:02 03:04:05',
+        'timestamp': pytest.approx(1483326245.25)
+    }
+
+
+@pytest.mark.parametrize('order', ['<', '>'])
+def test_corrupt_count(order):
+    values = exif.read_exif_bytes(
+        make_camera_tiff(order, corrupt=exif.EXPOSURE_TIME_TAG)
+    )
+
+    assert values['exposure'] is None
+    assert values['make'] == 'Canon'
+    assert values['iso'] == 100
+
+
+@pytest.mark.parametrize('data', [
+    b'',
+    b'not an image',
+    b'\xff\xd8\xff\xda\x00\x02',
+    b'\xff\xd8\xff\xe1\x00\x08Exif\x00\x00',
+    b'II*\x00\xff\xff\x00\x00',
+])
+def test_missing(data):
+    assert exif.read_exif_bytes(data) == exif.empty_exif()
+
+
+def test_zero_denominator():
+    values = exif.read_exif_bytes(make_tiff(
+        '<', [], [(exif.EXPOSURE_TIME_TAG, 5, [(1, 0)])]
+    ))
+
+    assert values['exposure'] is None
+
+
+def test_read_exif_cache(tmp_path, monkeypatch):
+    exif.clear_cache()
+    name = str(tmp_path / 'a.jpg')
+    with open(name, 'wb') as image:
+        image.write(make_jpeg(make_camera_tiff('<')))
+
+    assert exif.read_exif(name)['model'] == 'EOS 5D'
+
+    cache = str(tmp_path / 'exif.json')
+    exif.save_cache(cache)
+    exif.clear_cache()
+    exif.load_cache(cache)
+
+    # Cached files are not read again.
+    def fail(image_file):
+        raise AssertionError('read {0}'.format(image_file))
+
+    monkeypatch.setattr(exif, 'read_tags', fail)
+    assert exif.read_exif_batch([name, name])[1]['model'] == 'EOS 5D'
+
+    # A changed file is read again.
+    monkeypatch.undo()
+    with open(name, 'wb') as image:
+        image.write(make_camera_tiff('>'))
+    assert exif.read_exif(name)['make'] == 'Canon'
+    exif.clear_cache()
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+#
+# hdr: A Python API and CLI for creating HDR images.
+#
+# Copyright (C) 2017 Sean Marlow
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import cv2
+import numpy
+import pytest
+
+from hdr.exceptions import HdrException
+from hdr.fusion import FastMergeMertens, get_levels
+
+from conftest import make_scene, render_frames, run_cli
+
+# PSNR in dB against cv2.MergeMertens, both clipped to [0, 1]. Scale 1
+# only differs by float rounding, larger scales approximate the
+# weights. MIN_PSNR is the default gate of benchmarks/fast_mertens.py.
+EXACT_PSNR = 45.0
+MIN_PSNR = 30.0
+
+
+def get_psnr(result, reference):
+    error = numpy.mean(
+        (numpy.clip(result, 0, 1) - numpy.clip(reference, 0, 1)) ** 2
+    )
+    return 10 * numpy.log10(1 / error)
+
+
+@pytest.fixture(scope='module')
+def frames():
+    return render_frames(make_scene(256, 192))
+
+
+@pytest.mark.parametrize('weights', [(1.0, 1.0, 0.0), (0.5, 2.0, 1.0)])
+@pytest.mark.parametrize('scale', [1, 2, 4, 8])
+def test_fast_mertens(frames, weights, scale):
+    reference = cv2.createMergeMertens(*weights).process(frames)
+    result = FastMergeMertens(*weights, scale=scale).process(frames)
+
+    assert result.shape == reference.shape
+    assert result.dtype == numpy.float32
+    assert get_psnr(result, reference) > (
+        EXACT_PSNR if scale == 1 else MIN_PSNR
+    )
+
+
+def test_black_border(frames):
+    # Borders shifted in by alignment are black and get no weight.
+    shifted = [frame.copy() for frame in frames]
+    shifted[0][:, :16] = 0
+    shifted[2][:8] = 0
+
+    reference = cv2.createMergeMertens().process(shifted)
+    result = FastMergeMertens().process(shifted)
+    assert get_psnr(result, reference) > MIN_PSNR
+
+
+def test_dst(frames):
+    dst = numpy.empty(frames[0].shape, numpy.float32)
+    assert FastMergeMertens().process(frames, dst=dst) is dst
+    numpy.testing.assert_array_equal(dst, FastMergeMertens().process(frames))
+
+
+def test_errors(frames):
+    for scale in (0, 3, 6):
+        with pytest.raises(HdrException):
+            FastMergeMertens(scale=scale)
+
+    with pytest.raises(HdrException):
+        FastMergeMertens().process([])
+
+
+@pytest.mark.parametrize('size, levels', [
+    ((192, 256), 7), ((1, 1), 0), ((3000, 4000), 11)
+])
+def test_get_levels(size, levels):
+    assert get_levels(*size) == levels
+
+
+def test_fast_cli(bracket, tmp_path):
+    exact = str(tmp_path / 'exact.png')
+    fast = str(tmp_path / 'fast.png')
+    run_cli('mertens', '-o', exact, *bracket)
+    run_cli('mertens', '--fast', '-o', fast, *bracket)
+
+    assert cv2.imread(fast).shape == cv2.imread(exact).shape
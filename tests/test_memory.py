@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+#
+# hdr: A Python API and CLI for creating HDR images.
+#
+# Copyright (C) 2017 Sean Marlow
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import struct
+
+import cv2
+import numpy
+import pytest
+
+from hdr import memory
+from hdr.exceptions import HdrException
+from hdr.tiles import DEFAULT_MEMORY_LIMIT
+
+from conftest import make_scene
+
+MB = memory.MB
+WIDTH, HEIGHT = 8000, 6000
+
+
+@pytest.mark.parametrize('ext, params', [
+    ('.jpg', []),
+    ('.png', []),
+    ('.tif', []),
+    ('.webp', [cv2.IMWRITE_WEBP_QUALITY, 80]),
+    ('.webp', [cv2.IMWRITE_WEBP_QUALITY, 101]),
+    ('.hdr', [])
+])
+def test_read_image_size(tmp_path, ext, params):
+    name = str(tmp_path / ('image' + ext))
+    image = make_scene(130, 70)
+    if ext != '.hdr':
+        image = (numpy.clip(image, 0, 1) * 255).astype(numpy.uint8)
+    assert cv2.imwrite(name, image, params)
+
+    assert memory.read_image_size(name) == (130, 70)
+
+
+def test_read_image_size_npy(tmp_path):
+    name = str(tmp_path / 'radiance.npy')
+    numpy.save(name, make_scene(130, 70))
+    assert memory.read_image_size(name) == (130, 70)
+
+
+def test_get_image_size(tmp_path):
+    # Formats without a header reader are decoded at 1/8 scale.
+    name = str(tmp_path / 'image.bmp')
+    cv2.imwrite(name, numpy.zeros((96, 128, 3), numpy.uint8))
+    assert memory.read_image_size(name) is None
+    assert memory.get_image_size(name) == (128, 96)
+
+    for missing in (str(tmp_path / 'missing.png'), __file__):
+        with pytest.raises(HdrException):
+            memory.get_image_size(missing)
+
+
+def test_estimate_memory():
+    pixels = WIDTH * HEIGHT
+    assert memory.estimate_memory(WIDTH, HEIGHT, 3) == pixels * (3 * 6 + 60)
+    assert memory.estimate_memory(
+        WIDTH, HEIGHT, 5, 'mertens', 'linear'
+    ) == pixels * (5 * 24 + 36)
+    assert memory.estimate_memory(
+        WIDTH, HEIGHT, 3, tonemap='mantiuk', preview=2
+    ) == pixels // 4 * (3 * 6 + 60 + 16)
+    assert memory.estimate_memory(
+        WIDTH, HEIGHT, 3, tiled=64 * MB
+    ) == pixels * 6 + 64 * MB
+
+    # Saved maps are loaded whole unless memory mapped.
+    assert memory.estimate_memory(
+        WIDTH, HEIGHT, 0, radiance_ext='.hdr'
+    ) == pixels * (12 + 60)
+    assert memory.estimate_memory(
+        WIDTH, HEIGHT, 0, radiance_ext='.npy'
+    ) == pixels * 60
+
+    with pytest.raises(HdrException):
+        memory.estimate_memory(WIDTH, HEIGHT, 3, 'unknown')
+
+
+@pytest.fixture
+def job(tmp_path):
+    """
+    Return a batch job of 8000x6000 images.
+
+    Only the PNG header is written, which is all that sizing reads.
+    """
+    header = b'\x89PNG\r\n\x1a\n' + struct.pack(
+        '>I4sII', 13, b'IHDR', WIDTH, HEIGHT
+    )
+    images = []
+
+    for index in range(3):
+        name = str(tmp_path / 'frame{0}.png'.format(index))
+        with open(name, 'wb') as image_file:
+            image_file.write(header)
+        images.append(name)
+
+    return {'images': images, 'operator': 'drago'}
+
+
+def test_fit_job(job):
+    estimate = memory.estimate_job(job)
+    assert estimate == WIDTH * HEIGHT * (3 * 6 + 60)
+    assert memory.fit_job(job, estimate) == (job, estimate, None)
+
+
+def test_fit_job_tiled(job):
+    # Tiles get the spare memory, up to the default tile budget.
+    limit = WIDTH * HEIGHT * 6 + memory.MIN_TILE_MEMORY + 10 * MB
+    fitted, estimate, fallback = memory.fit_job(job, limit)
+
+    assert fallback == 'tiled'
+    assert fitted['tiled'] == memory.MIN_TILE_MEMORY + 10 * MB
+    assert estimate == limit
+    assert 'tiled' not in job
+
+    fitted, estimate, fallback = memory.fit_job(job, 2048 * MB)
+    assert fitted['tiled'] == DEFAULT_MEMORY_LIMIT
+    assert estimate <= 2048 * MB
+
+
+def test_fit_job_preview(job):
+    # Too little memory even for tiles at full resolution.
+    limit = WIDTH * HEIGHT * 6
+    fitted, estimate, fallback = memory.fit_job(job, limit)
+
+    assert fallback == 'tiled preview 1/2'
+    assert fitted['preview'] == 2
+    assert estimate <= limit
+
+    # A preview job that fits keeps its scale without a fallback.
+    job['preview'] = 4
+    fitted, estimate, fallback = memory.fit_job(job, 1024 * MB)
+    assert (fitted, fallback) == (job, None)
+
+    with pytest.raises(HdrException, match='1/8 scale'):
+        memory.fit_job(job, memory.MIN_TILE_MEMORY)
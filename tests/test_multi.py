@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+#
+# hdr: A Python API and CLI for creating HDR images.
+#
+# Copyright (C) 2017 Sean Marlow
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import os
+
+import cv2
+import numpy
+import pytest
+
+from conftest import EXPOSURES_OPTION, run_cli
+from hdr import api
+from hdr.exceptions import HdrException
+from hdr.profiling import Profiler
+
+
+def test_parse_tonemap():
+    assert api.parse_tonemap('drago') == ('drago', {})
+    assert api.parse_tonemap(' reinhard:gamma=2.2, light-adapt=0 ') == (
+        'reinhard', {'gamma': 2.2, 'light_adapt': 0.0}
+    )
+
+    for spec in ('drago:gamma', 'drago:gamma=high'):
+        with pytest.raises(HdrException):
+            api.parse_tonemap(spec)
+
+
+def test_multi_hdr(bracket):
+    tonemaps = [('drago', {}), ('reinhard', {'gamma': 2.2}),
+                ('drago', {'gamma': 2.0})]
+
+    with Profiler(memory=False) as profiler:
+        outputs = api.multi_hdr(
+            bracket, tonemaps, exposures=EXPOSURES_OPTION, align=False
+        )
+
+    root = os.path.splitext(bracket[1])[0]
+    assert outputs == [
+        root + '_drago-1_hdr.png',
+        root + '_reinhard_hdr.png',
+        root + '_drago-3_hdr.png'
+    ]
+    names = [item['name'] for item in profiler.stages]
+    assert names.count('merge') == 1
+    assert names.count('tonemap') == 3
+
+    # Each output matches a separate run of its operator.
+    single = api.reinhard_hdr(
+        bracket, exposures=EXPOSURES_OPTION, gamma=2.2, align=False
+    )
+    assert numpy.array_equal(cv2.imread(outputs[1]), cv2.imread(single))
+
+
+def test_multi_outputs(bracket, tmp_path):
+    outputs = [str(tmp_path / 'a.png'), str(tmp_path / 'b.png')]
+
+    with pytest.raises(HdrException):
+        api.multi_hdr(bracket, [('drago', {})], outputs=outputs)
+
+    with pytest.raises(HdrException):
+        api.multi_hdr(bracket, [('unknown', {})])
+
+    assert api.multi_hdr(
+        bracket, [('drago', {}), ('linear', {})], exposures=EXPOSURES_OPTION,
+        outputs=outputs
+    ) == outputs
+    assert all(os.path.isfile(name) for name in outputs)
+
+
+def test_multi_command(bracket, tmp_path):
+    radiance = str(tmp_path / 'radiance.npy')
+    output = run_cli(
+        'multi', '-e', EXPOSURES_OPTION, '-t', 'drago',
+        '-t', 'mantiuk:scale=0.8', '--save-radiance', radiance, *bracket
+    )
+
+    names = output.split()
+    assert [os.path.basename(name) for name in names] == [
+        'frame1_drago_hdr.png', 'frame1_mantiuk_hdr.png'
+    ]
+    assert os.path.isfile(radiance)
+
+    # A saved radiance map is tonemapped without merging again.
+    output = run_cli('multi', '-t', 'linear', radiance)
+    assert output.split() == [str(tmp_path / 'radiance_linear_hdr.jpg')]
+
+    output = run_cli('multi', '-t', 'drago:gamma', *bracket)
+    assert 'Invalid tonemap option' in output
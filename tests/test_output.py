@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+#
+# hdr: A Python API and CLI for creating HDR images.
+#
+# Copyright (C) 2017 Sean Marlow
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import cv2
+import numpy
+import pytest
+
+from hdr import output
+from hdr.exceptions import HdrException
+
+from conftest import EXPOSURES_OPTION, run_cli
+
+
+@pytest.fixture
+def image():
+    """
+    Return a float image with values outside [0, 1] and a NaN.
+    """
+    rng = numpy.random.RandomState(0)
+    image = rng.uniform(-0.2, 1.2, (48, 64, 3)).astype(numpy.float32)
+    image[0, 0, 0] = numpy.nan
+    return image
+
+
+@pytest.mark.parametrize('depth', [8, 16])
+def test_to_ldr(image, depth):
+    dtype = output.DTYPES[depth]
+    maximum = numpy.iinfo(dtype).max
+    expected = numpy.clip(
+        numpy.rint(numpy.nan_to_num(image.astype(numpy.float64)) * maximum),
+        0, maximum
+    ).astype(dtype)
+    original = image.copy()
+
+    ldr = output.to_ldr(image, depth)
+    assert ldr.dtype == dtype
+    # The float32 product can round the other way at 16 bit.
+    assert numpy.abs(ldr.astype(int) - expected).max() <= (depth == 16)
+    numpy.testing.assert_array_equal(image, original)
+
+    out = numpy.empty(image.shape, dtype)
+    assert output.to_ldr(image, depth, out) is out
+
+
+def test_buffer_pool():
+    buffer = output.get_buffer((4, 4, 3), numpy.uint16)
+    output.release_buffer(buffer)
+
+    assert output.get_buffer((4, 4, 3), numpy.uint16) is buffer
+    assert output.get_buffer((4, 4, 3), numpy.uint16) is not buffer
+
+
+@pytest.mark.parametrize('name, encoding, expected', [
+    ('a.jpg', None, (8, [])),
+    ('a.JPEG', {'quality': 80}, (8, [cv2.IMWRITE_JPEG_QUALITY, 80])),
+    ('a.webp', {'quality': 0}, (8, [cv2.IMWRITE_WEBP_QUALITY, 1])),
+    ('a.png', {'depth': 16, 'compression': 9},
+     (16, [cv2.IMWRITE_PNG_COMPRESSION, 9])),
+    ('a.tif', {'depth': 16, 'quality': None}, (16, [])),
+    ('a.bmp', {'depth': 8}, (8, []))
+])
+def test_get_encoding(name, encoding, expected):
+    assert output.get_encoding(name, encoding) == expected
+
+
+@pytest.mark.parametrize('name, encoding', [
+    ('a.jpg', {'depth': 16}),
+    ('a.bmp', {'depth': 16}),
+    ('a.png', {'quality': 90}),
+    ('a.jpg', {'compression': 3}),
+    ('a.jpg', {'level': 3})
+])
+def test_get_encoding_errors(name, encoding):
+    with pytest.raises(HdrException):
+        output.get_encoding(name, encoding)
+
+
+@pytest.mark.parametrize('ext, depth', [
+    ('.png', 8), ('.png', 16), ('.tif', 16)
+])
+def test_write_ldr(image, tmp_path, ext, depth):
+    name = str(tmp_path / ('result' + ext))
+    expected = output.to_ldr(image, depth).copy()
+
+    assert output.write_ldr(image, name, {'depth': depth}) == name
+    numpy.testing.assert_array_equal(
+        cv2.imread(name, cv2.IMREAD_UNCHANGED), expected
+    )
+
+    with output.ImageWriter() as writer:
+        future = output.write_ldr(image, name, {'depth': depth}, writer)
+    assert future.result() == name
+
+
+def test_image_writer_errors(image, tmp_path):
+    missing = str(tmp_path / 'missing' / 'result.png')
+
+    with pytest.raises(HdrException):
+        with output.ImageWriter() as writer:
+            future = output.write_ldr(image, missing, writer=writer)
+
+    with pytest.raises(HdrException):
+        future.result()
+
+    # An error raised in the block wins over write errors.
+    with pytest.raises(KeyError):
+        with output.ImageWriter() as writer:
+            output.write_ldr(image, missing, writer=writer)
+            raise KeyError('block')
+
+
+def test_output_cli(bracket, tmp_path):
+    name = str(tmp_path / 'result.png')
+    run_cli(
+        'reinhard', '-e', EXPOSURES_OPTION, '--depth', 16,
+        '--compression', 9, '-o', name, *bracket
+    )
+    result = cv2.imread(name, cv2.IMREAD_UNCHANGED)
+    assert result.dtype == numpy.uint16
+    assert result.shape == (96, 128, 3)
+
+    assert 'not supported' in run_cli(
+        'reinhard', '-e', EXPOSURES_OPTION, '--depth', 16,
+        '-o', str(tmp_path / 'result.jpg'), *bracket
+    )
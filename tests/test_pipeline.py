@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+#
+# hdr: A Python API and CLI for creating HDR images.
+#
+# Copyright (C) 2017 Sean Marlow
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import cv2
+import numpy
+import pytest
+
+from conftest import EXPOSURES_OPTION
+from hdr import api
+from hdr.exceptions import HdrException
+
+
+def create_pipeline(operator, **options):
+    try:
+        return api.HdrPipeline(operator, align=False, **options)
+    except (AttributeError, cv2.error) as error:
+        pytest.skip('OpenCV has no {0} tonemap: {1}'.format(operator, error))
+
+
+@pytest.mark.parametrize(
+    'operator', ['drago', 'durand', 'linear', 'mantiuk', 'reinhard']
+)
+def test_render_repeat(bracket, operator):
+    pipeline = create_pipeline(operator)
+    first = pipeline.render(bracket, EXPOSURES_OPTION).copy()
+    second = pipeline.render(bracket, EXPOSURES_OPTION)
+
+    # Renders reuse the pipeline buffers and match a new pipeline.
+    assert pipeline.render(bracket, EXPOSURES_OPTION) is second
+    numpy.testing.assert_array_equal(first, second)
+    numpy.testing.assert_array_equal(
+        first, create_pipeline(operator).render(bracket, EXPOSURES_OPTION)
+    )
+
+
+def test_shared_algorithms():
+    assert api.HdrPipeline().merger is api.HdrPipeline().merger
+    assert api.HdrPipeline(algo='mertens').merger is not (
+        api.HdrPipeline(algo='robertson').merger
+    )
+
+
+@pytest.mark.parametrize('options', [
+    {'algo': 'unknown'},
+    {'tonemap': 'unknown'},
+    {'tonemap': 'drago', 'params': {'unknown': 1}},
+])
+def test_invalid(options):
+    with pytest.raises(HdrException):
+        api.HdrPipeline(**options)
+
+
+def test_merge_only(bracket):
+    pipeline = api.HdrPipeline(align=False)
+    radiance = pipeline.merge(bracket, EXPOSURES_OPTION)
+
+    assert radiance.dtype == numpy.float32
+    assert radiance.shape == (96, 128, 3)
+    with pytest.raises(HdrException):
+        pipeline.render(bracket, EXPOSURES_OPTION)
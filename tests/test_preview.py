@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+#
+# hdr: A Python API and CLI for creating HDR images.
+#
+# Copyright (C) 2017 Sean Marlow
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+
+import cv2
+import numpy
+import pytest
+
+from hdr import api
+from hdr.cli import get_preview_scales
+from hdr.exceptions import HdrException
+
+from conftest import EXPOSURES_OPTION, make_scene, render_frames, run_cli
+
+# Mean absolute difference, in 8 bit levels, between a reduced JPEG
+# decode and the full decode shrunk with INTER_AREA.
+JPEG_TOLERANCE = 2.0
+
+
+@pytest.mark.parametrize('preview, flag', [
+    (None, cv2.IMREAD_COLOR),
+    (1, cv2.IMREAD_COLOR),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (8, cv2.IMREAD_REDUCED_COLOR_8)
+])
+def test_get_read_flag(preview, flag):
+    assert api.get_read_flag(preview) == flag
+
+
+def test_get_read_flag_error():
+    with pytest.raises(HdrException):
+        api.get_read_flag(3)
+
+
+@pytest.mark.parametrize('output, preview, expected', [
+    (None, None, 'dir/frame_hdr.jpg'),
+    (None, 2, 'dir/frame_hdr_preview.jpg'),
+    ('out.png', None, 'out.png'),
+    ('out.png', 4, 'out_preview.png')
+])
+def test_get_image_output(output, preview, expected):
+    assert api.get_image_output(
+        'dir/frame.jpg', output, preview=preview
+    ) == expected
+
+
+def test_get_preview_params():
+    params = {'gamma': 2.2}
+    assert api.get_preview_params('reinhard', params, 4) is params
+    assert api.get_preview_params('durand', params) is params
+
+    sigma_space = dict(api.TONEMAPS['durand'][1])['sigma_space']
+    scaled = api.get_preview_params('durand', params, 4)
+    assert scaled == {'gamma': 2.2, 'sigma_space': sigma_space / 4}
+    assert api.get_preview_params(
+        'durand', {'sigma_space': 8.0}, 2
+    ) == {'sigma_space': 4.0}
+
+
+@pytest.mark.parametrize('preview, full, expected', [
+    (None, False, [None]),
+    (None, True, [None]),
+    ('4', False, [4]),
+    ('4', True, [4, None])
+])
+def test_get_preview_scales(preview, full, expected):
+    assert get_preview_scales(preview, full) == expected
+
+
+@pytest.mark.parametrize('preview', [2, 4, 8])
+def test_read_images_jpeg(tmp_path, preview):
+    name = str(tmp_path / 'frame.jpg')
+    cv2.imwrite(name, render_frames(make_scene(256, 192))[1])
+
+    full = api.read_images([name])[0]
+    reduced = api.read_images([name], preview)[0]
+    expected = cv2.resize(
+        full, None, fx=1.0 / preview, fy=1.0 / preview,
+        interpolation=cv2.INTER_AREA
+    )
+
+    assert reduced.shape == expected.shape
+    assert numpy.abs(
+        reduced.astype(float) - expected
+    ).mean() < JPEG_TOLERANCE
+
+
+def test_load_radiance_preview(tmp_path):
+    name = str(tmp_path / 'radiance.npy')
+    numpy.save(name, make_scene(128, 96))
+
+    assert api.load_radiance(name, 2).shape == (48, 64, 3)
+    assert api.load_radiance(name, 1).shape == (96, 128, 3)
+
+
+def test_preview_cli(bracket, tmp_path):
+    output = str(tmp_path / 'result.png')
+    run_cli(
+        'reinhard', '-e', EXPOSURES_OPTION, '-p', 2, '--full', '-o', output,
+        *bracket
+    )
+
+    preview = cv2.imread(str(tmp_path / 'result_preview.png'))
+    assert preview.shape == (48, 64, 3)
+    assert cv2.imread(output).shape == (96, 128, 3)
+
+    # Without --full only the preview is written.
+    os.remove(output)
+    run_cli(
+        'reinhard', '-e', EXPOSURES_OPTION, '-p', 4, '-o', output, *bracket
+    )
+    preview = cv2.imread(str(tmp_path / 'result_preview.png'))
+    assert preview.shape == (24, 32, 3)
+    assert not os.path.exists(output)
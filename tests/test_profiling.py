@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+#
+# hdr: A Python API and CLI for creating HDR images.
+#
+# Copyright (C) 2017 Sean Marlow
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+from hdr import profiling
+
+ALLOCATION = 4 * 1024 * 1024
+
+
+def allocate(size):
+    with profiling.stage('allocate'):
+        return bytearray(size)
+
+
+def test_stages():
+    with profiling.Profiler() as profiler:
+        with profiling.stage('outer'):
+            allocate(ALLOCATION)
+
+    stages = profiler.to_dict()['stages']
+    assert [(item['name'], item['depth']) for item in stages] == [
+        ('outer', 0), ('allocate', 1)
+    ]
+    assert all(item['seconds'] >= 0 for item in stages)
+    assert stages[1]['peak_memory'] >= ALLOCATION
+    assert profiler.peak_memory >= ALLOCATION
+    assert profiling.get_active() is None
+
+
+def test_no_memory():
+    with profiling.Profiler(memory=False) as profiler:
+        allocate(1)
+
+    assert profiler.stages[0]['peak_memory'] is None
+    assert profiler.peak_memory is None
+
+
+def test_nested_profilers():
+    with profiling.Profiler() as outer:
+        with profiling.Profiler() as inner:
+            allocate(1)
+        assert profiling.get_active() is outer
+        allocate(1)
+
+    assert len(inner.stages) == 1
+    assert len(outer.stages) == 1
+
+
+def test_other_threads():
+    with profiling.Profiler() as profiler:
+        thread = threading.Thread(target=allocate, args=(1,))
+        thread.start()
+        thread.join()
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            list(executor.map(profiling.bind(allocate), [1, 2]))
+
+    # Only the bound pool calls are recorded.
+    assert len(profiler.stages) == 2
+
+
+def test_bind_without_profiler():
+    assert profiling.bind(allocate) is allocate
+
+
+def test_hooks():
+    calls = []
+
+    def hook(name, seconds, peak_memory):
+        calls.append((name, peak_memory))
+
+    profiling.add_hook(hook)
+    try:
+        allocate(1)
+    finally:
+        profiling.remove_hook(hook)
+    allocate(1)
+
+    assert calls == [('allocate', None)]
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+#
+# hdr: A Python API and CLI for creating HDR images.
+#
+# Copyright (C) 2017 Sean Marlow
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import os
+
+import cv2
+import numpy
+import pytest
+
+from conftest import EXPOSURES_OPTION, make_scene, run_cli
+from hdr import api
+from hdr.exceptions import HdrException
+
+# Largest error of each format relative to the brightest channel of the
+# pixel. Radiance RGBE keeps an 8 bit mantissa with a shared exponent
+# and OpenEXR a half float per channel.
+TOLERANCES = {'.npy': 0, '.hdr': 1 / 128.0, '.exr': 0.001}
+
+
+@pytest.fixture(scope='module')
+def radiance():
+    return make_scene(64, 48)
+
+
+@pytest.mark.parametrize('ext', sorted(TOLERANCES))
+def test_round_trip(tmp_path, radiance, ext):
+    name = str(tmp_path / ('radiance' + ext))
+
+    try:
+        api.save_radiance(radiance, name)
+    except HdrException as error:
+        pytest.skip(str(error))
+
+    loaded = api.load_radiance(name)
+    assert loaded.dtype == numpy.float32
+    assert loaded.shape == radiance.shape
+    error = numpy.abs(loaded - radiance) / radiance.max(2, keepdims=True)
+    assert error.max() <= TOLERANCES[ext]
+
+    if ext == '.npy':
+        assert isinstance(loaded, numpy.memmap)
+
+
+def test_load_preview(tmp_path, radiance):
+    name = str(tmp_path / 'radiance.npy')
+    api.save_radiance(radiance, name)
+
+    assert api.load_radiance(name, 4).shape == (12, 16, 3)
+    with pytest.raises(HdrException):
+        api.load_radiance(name, 3)
+
+
+def test_invalid(tmp_path, radiance):
+    with pytest.raises(HdrException):
+        api.save_radiance(radiance, str(tmp_path / 'radiance.jpg'))
+
+    name = str(tmp_path / 'radiance.npy')
+    numpy.save(name, radiance[..., 0])
+    for bad in (name, str(tmp_path / 'missing.npy'),
+                str(tmp_path / 'missing.hdr')):
+        with pytest.raises(HdrException):
+            api.load_radiance(bad)
+
+
+def test_merge_hdr(bracket):
+    output = api.merge_hdr(bracket, exposures=EXPOSURES_OPTION, align=False)
+    assert output == os.path.splitext(bracket[1])[0] + '_hdr.hdr'
+
+    # Tonemapping the saved map matches tonemapping the images.
+    npy = api.merge_hdr(
+        bracket, bracket[0] + '.npy', exposures=EXPOSURES_OPTION, align=False
+    )
+    from_images = api.drago_hdr(
+        bracket, exposures=EXPOSURES_OPTION, align=False
+    )
+    from_map = api.drago_hdr([npy], output=npy + '.png')
+    assert numpy.array_equal(cv2.imread(from_images), cv2.imread(from_map))
+
+
+def test_merge_command(bracket, tmp_path):
+    radiance = str(tmp_path / 'merged.npy')
+    output = run_cli(
+        'merge', '-e', EXPOSURES_OPTION, '--align', 'none', '-o', radiance,
+        *bracket
+    )
+    assert output.strip() == radiance
+
+    output = run_cli('reinhard', radiance)
+    assert output.strip() == str(tmp_path / 'merged_hdr.jpg')
+    assert os.path.isfile(output.strip())
+
+    output = run_cli(
+        'merge', '-e', EXPOSURES_OPTION, '-o', str(tmp_path / 'merged.jpg'),
+        *bracket
+    )
+    assert 'Radiance maps must be saved as' in output
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+#
+# hdr: A Python API and CLI for creating HDR images.
+#
+# Copyright (C) 2017 Sean Marlow
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+
+import pytest
+
+from hdr import scan
+from hdr.exceptions import HdrException
+
+from conftest import run_cli
+
+
+def make_exif(exposure, timestamp, model='EOS 5D'):
+    """
+    Return EXIF values for one frame.
+    """
+    return {
+        'make': 'Canon',
+        'model': model,
+        'serial': None,
+        'exposure': exposure,
+        'timestamp': timestamp
+    }
+
+
+SHOOT = {
+    'a1.jpg': make_exif(1.0, 100),
+    'a2.jpg': make_exif(0.25, 100.5),
+    'a3.jpg': make_exif(0.0625, 101),
+    # The same exposure again starts the next sequence.
+    'b1.jpg': make_exif(1.0, 101.5),
+    'b2.jpg': make_exif(0.25, 102),
+    # A long pause starts another set.
+    'c1.jpg': make_exif(1.0, 110),
+    'c2.jpg': make_exif(0.25, 110.5),
+    # A second camera firing at the same time is a separate set.
+    'd1.jpg': make_exif(1.0, 110, 'EOS R'),
+    'd2.jpg': make_exif(0.25, 110.5, 'EOS R'),
+    # Single frames and frames without exposure are not brackets.
+    'e1.jpg': make_exif(1.0, 200),
+    'f1.jpg': make_exif(None, 300),
+    'f2.jpg': make_exif(None, 300.5)
+}
+
+SETS = [
+    ['a1.jpg', 'a2.jpg', 'a3.jpg'],
+    ['b1.jpg', 'b2.jpg'],
+    ['c1.jpg', 'c2.jpg'],
+    ['d1.jpg', 'd2.jpg']
+]
+
+
+@pytest.fixture
+def shoot(tmp_path, monkeypatch):
+    """
+    Write empty image files and serve their EXIF values from SHOOT.
+
+    :return: Returns a list that collects the names of files read.
+    """
+    for name in SHOOT:
+        (tmp_path / name).write_bytes(b'')
+
+    reads = []
+
+    def read_exif_batch(image_names, workers=None):
+        names = [os.path.basename(name) for name in image_names]
+        reads.extend(names)
+        return [dict(SHOOT[name]) for name in names]
+
+    monkeypatch.setattr(scan, 'read_exif_batch', read_exif_batch)
+    return reads
+
+
+def test_group_brackets():
+    assert sorted(scan.group_brackets(SHOOT)) == SETS
+
+
+def test_group_brackets_max_gap():
+    sets = scan.group_brackets(SHOOT, max_gap=0.1)
+    assert sets == []
+
+    # Repeated exposures still split sets within the gap.
+    assert sorted(scan.group_brackets(SHOOT, max_gap=20)) == SETS
+
+
+def test_scan(tmp_path, shoot):
+    directory = str(tmp_path)
+    result = scan.scan(directory)
+
+    assert sorted(bracket['images'] for bracket in result['sets']) == SETS
+    assert result['new'] == len(SHOOT)
+    assert result['root'] == '.'
+    assert os.path.isfile(os.path.join(directory, scan.INDEX_NAME))
+
+    # A rescan only reads files that changed.
+    del shoot[:]
+    os.remove(os.path.join(directory, 'e1.jpg'))
+    (tmp_path / 'a1.jpg').write_bytes(b'changed')
+
+    result = scan.scan(directory)
+    assert shoot == ['a1.jpg']
+    assert result['new'] == 1
+    assert 'e1.jpg' not in result['files']
+    assert len(result['sets']) == len(SETS)
+
+
+def test_scan_recursive(tmp_path, shoot):
+    nested = tmp_path / 'day2'
+    nested.mkdir()
+    (nested / 'a1.jpg').write_bytes(b'')
+    index = str(tmp_path / 'index.json')
+
+    assert 'day2/a1.jpg' not in scan.scan(str(tmp_path), index)['files']
+
+    # Unknown files read no EXIF, SHOOT is keyed by base name.
+    result = scan.scan(str(tmp_path), index, recursive=True)
+    assert 'day2/a1.jpg' in result['files']
+
+
+def test_scan_errors(tmp_path):
+    with pytest.raises(HdrException):
+        scan.scan(str(tmp_path / 'missing'))
+
+    index = tmp_path / 'index.json'
+    index.write_text('{')
+    with pytest.raises(HdrException):
+        scan.read_index(str(index))
+
+    index.write_text('{"version": 0}')
+    assert scan.read_index(str(index))['files'] == {}
+
+
+def test_scan_cli(tmp_path, shoot):
+    output = run_cli('scan', '-g', 1, tmp_path)
+
+    assert 'a1.jpg a2.jpg a3.jpg' in output
+    assert '4 bracket sets from {0} files, {0} new.'.format(
+        len(SHOOT)
+    ) in output
@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+#
+# hdr: A Python API and CLI for creating HDR images.
+#
+# Copyright (C) 2017 Sean Marlow
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import io
+import os
+import shlex
+import sys
+
+import cv2
+import numpy
+import pytest
+
+from hdr import api, sequence
+from hdr.calibration import calibrate_response
+from hdr.exceptions import HdrException
+
+from conftest import (
+    EXPOSURES,
+    EXPOSURES_OPTION,
+    make_scene,
+    render_frames,
+    run_cli
+)
+
+# Scene brightness of each bracket set, the changes are flicker.
+BRIGHTNESS = (1.0, 1.6, 0.7)
+
+
+@pytest.fixture
+def bracket_sets(tmp_path):
+    """
+    Write a sequence of bracket sets as PNG files.
+    """
+    radiance = make_scene(128, 96)
+    sets = []
+
+    for index, scale in enumerate(BRIGHTNESS):
+        names = []
+        for frame, image in enumerate(render_frames(radiance * scale)):
+            name = os.path.join(
+                str(tmp_path), 'set{0}_{1}.png'.format(index, frame)
+            )
+            cv2.imwrite(name, image)
+            names.append(name)
+        sets.append(names)
+
+    return sets
+
+
+def test_group_images():
+    names = ['a', 'b', 'c', 'd']
+    assert list(sequence.group_images(names, 2)) == [['a', 'b'], ['c', 'd']]
+
+    with pytest.raises(HdrException):
+        list(sequence.group_images(names, 3))
+
+
+def test_read_sets():
+    stream = io.StringIO(
+        '# day one\n'
+        'a.jpg b.jpg\n'
+        '\n'
+        '  # skipped\n'
+        '"c d.jpg" e.jpg\n'
+    )
+    assert list(sequence.read_sets(stream)) == [
+        ['a.jpg', 'b.jpg'], ['c d.jpg', 'e.jpg']
+    ]
+
+
+def test_get_frame_output():
+    names = ['dir/a.jpg', 'dir/b.jpg', 'dir/c.jpg']
+    assert sequence.get_frame_output(None, 3, names) == 'dir/b_hdr.jpg'
+    assert sequence.get_frame_output(
+        'out/{0:03d}.png', 7, names
+    ) == 'out/007.png'
+    assert sequence.get_frame_output(
+        'out/{0}.png', 7, names, preview=2
+    ) == 'out/7_preview.png'
+
+    for pattern in ('out/frame.png', 'out/{1}.png', 'out/{name}.png'):
+        with pytest.raises(HdrException):
+            sequence.get_frame_output(pattern, 0, names)
+
+
+def test_process_sequence(bracket_sets, tmp_path, monkeypatch):
+    calls = []
+    get_response = api.get_response
+
+    def count(*args, **kwargs):
+        calls.append(args[0])
+        return get_response(*args, **kwargs)
+
+    monkeypatch.setattr(api, 'get_response', count)
+
+    reported = []
+    pattern = os.path.join(str(tmp_path), 'frame_{0:02d}.png')
+    frames = sequence.process_sequence(
+        iter(bracket_sets), 'reinhard', exposures=EXPOSURES_OPTION,
+        output=pattern, align=False,
+        callback=lambda *args: reported.append(args)
+    )
+
+    assert frames == len(BRIGHTNESS)
+    assert [frame for frame, _, _ in reported] == [0, 1, 2]
+    assert [names for _, names, _ in reported] == bracket_sets
+    for frame, _, name in reported:
+        assert name == pattern.format(frame)
+        assert cv2.imread(name).shape == (96, 128, 3)
+
+    # The response is calibrated on the first set only.
+    assert calls == [bracket_sets[0]]
+
+
+def test_smoothing(bracket_sets):
+    response = calibrate_response(
+        api.read_images(bracket_sets[0]),
+        numpy.array(EXPOSURES, numpy.float32), 'debevec'
+    )
+    pipeline = sequence.SequencePipeline(
+        'reinhard', response=response, align=False, smoothing=0.5
+    )
+    independent = api.HdrPipeline('reinhard', response=response, align=False)
+    expected = None
+
+    for names in bracket_sets:
+        brightness = pipeline.get_brightness(
+            independent.render(names, EXPOSURES)
+        )
+        expected = brightness if expected is None else (
+            0.5 * expected + 0.5 * brightness
+        )
+
+        ldr = pipeline.render(names, EXPOSURES)
+        assert pipeline.get_brightness(ldr) == pytest.approx(
+            expected, rel=1e-3
+        )
+
+    with pytest.raises(HdrException):
+        sequence.SequencePipeline('reinhard', smoothing=1.0)
+
+
+def test_pipe(bracket_sets, tmp_path):
+    raw = str(tmp_path / 'frames')
+    command = '{0} -c {1} {2}_{{width}}x{{height}}.raw'.format(
+        shlex.quote(sys.executable),
+        shlex.quote(
+            'import shutil, sys; '
+            'shutil.copyfileobj(sys.stdin.buffer, open(sys.argv[1], "wb"))'
+        ),
+        shlex.quote(raw)
+    )
+
+    frames = sequence.process_sequence(
+        bracket_sets, 'reinhard', exposures=EXPOSURES_OPTION, pipe=command,
+        align=False
+    )
+
+    data = numpy.fromfile(raw + '_128x96.raw', numpy.uint8)
+    assert data.size == frames * 96 * 128 * 3
+
+    # The piped frames match the written ones.
+    first = sequence.process_sequence(
+        bracket_sets[:1], 'reinhard', exposures=EXPOSURES_OPTION,
+        output=str(tmp_path / 'first_{0}.png'), align=False, smoothing=0
+    )
+    assert first == 1
+    numpy.testing.assert_array_equal(
+        data[:96 * 128 * 3].reshape(96, 128, 3),
+        cv2.imread(str(tmp_path / 'first_0.png'))
+    )
+
+
+def test_pipe_errors(bracket_sets):
+    failing = '{0} -c "import sys; sys.exit(3)"'.format(
+        shlex.quote(sys.executable)
+    )
+    with pytest.raises(HdrException):
+        sequence.process_sequence(
+            bracket_sets, 'reinhard', exposures=EXPOSURES_OPTION,
+            pipe=failing, align=False
+        )
+
+    with pytest.raises(HdrException, match='Unable to start'):
+        sequence.process_sequence(
+            bracket_sets, 'reinhard', exposures=EXPOSURES_OPTION,
+            pipe='no-such-encoder-{width}', align=False
+        )
+
+    with pytest.raises(HdrException, match='not supported'):
+        sequence.process_sequence(bracket_sets, algo='mertens')
+
+
+def test_sequence_cli(bracket_sets, tmp_path):
+    images = [name for names in bracket_sets for name in names]
+    pattern = os.path.join(str(tmp_path), 'out_{0}.jpg')
+    output = run_cli(
+        'sequence', '-e', EXPOSURES_OPTION, '-t', 'reinhard', '--align',
+        'none', '-o', pattern, *images
+    )
+
+    assert '3 frames.' in output
+    for frame in range(3):
+        assert os.path.isfile(pattern.format(frame))
+
+    set_list = tmp_path / 'sets.txt'
+    set_list.write_text('\n'.join(
+        ' '.join(shlex.quote(name) for name in names)
+        for names in bracket_sets[:2]
+    ))
+    output = run_cli(
+        'sequence', '-e', EXPOSURES_OPTION, '--align', 'none', '-l',
+        set_list
+    )
+    assert '2 frames.' in output
+
+    assert 'do not split' in run_cli(
+        'sequence', '-e', EXPOSURES_OPTION, '-b', 2, *images
+    )
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+#
+# hdr: A Python API and CLI for creating HDR images.
+#
+# Copyright (C) 2017 Sean Marlow
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import asyncio
+import json
+import os
+
+import pytest
+
+from hdr import service
+from hdr.exceptions import HdrException
+
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+        asyncio.set_event_loop(None)
+
+
+async def request(port, method, path, payload=None):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    body = json.dumps(payload).encode('utf-8') if payload else b''
+    writer.write(
+        '{0} {1} HTTP/1.1\r\nContent-Length: {2}\r\n\r\n'.format(
+            method, path, len(body)
+        ).encode('latin-1') + body
+    )
+    response = await reader.read()
+    writer.close()
+
+    head, _, body = response.partition(b'\r\n\r\n')
+    return int(head.split(b' ')[1]), json.loads(body.decode('utf-8'))
+
+
+def test_resolve_path(tmp_path):
+    root = tmp_path / 'root'
+    root.mkdir()
+    os.symlink(str(tmp_path), str(root / 'link'))
+    hdr_service = service.HdrService(root=str(root))
+
+    assert hdr_service.resolve_path('a.jpg') == str(root / 'a.jpg')
+    for name in ('../a.jpg', '/etc/passwd', 'link/a.jpg'):
+        with pytest.raises(HdrException):
+            hdr_service.resolve_path(name)
+
+
+def test_prepare_job(tmp_path):
+    hdr_service = service.HdrService(root=str(tmp_path))
+
+    job = hdr_service.prepare_job({'images': ['a.jpg'], 'profile': True})
+    assert job['operator'] == 'drago'
+    assert job['images'] == [str(tmp_path / 'a.jpg')]
+    assert 'profile' not in job
+
+    for data in (None, {'images': []}, {'images': 'a.jpg'},
+                 {'images': ['a.jpg'], 'unknown': 1},
+                 {'images': ['a.jpg'], 'output': '../b.jpg'}):
+        with pytest.raises(HdrException):
+            hdr_service.prepare_job(data)
+
+
+def test_jobs(tmp_path, bracket):
+    hdr_service = service.HdrService(root=str(tmp_path), threads=1)
+    images = [os.path.basename(name) for name in bracket]
+
+    async def submit():
+        server = await hdr_service.start('127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+
+        try:
+            status, record = await request(port, 'POST', '/jobs', {
+                'images': images, 'operator': 'mertens', 'profile': True
+            })
+            assert status == 202
+
+            while record['status'] in ('queued', 'running'):
+                await asyncio.sleep(0.05)
+                status, record = await request(
+                    port, 'GET', '/jobs/' + record['id']
+                )
+
+            bad = await request(port, 'POST', '/jobs', {'images': []})
+            missing = await request(port, 'GET', '/jobs/none')
+            return record, bad[0], missing[0]
+        finally:
+            server.close()
+            await hdr_service.stop()
+
+    record, bad, missing = run(submit())
+
+    assert record['status'] == 'done', record['error']
+    assert os.path.isfile(record['output'])
+    assert record['profile']['stages']
+    assert bad == 400
+    assert missing == 404
+
+
+def test_full_queue(tmp_path):
+    hdr_service = service.HdrService(root=str(tmp_path), queue_size=1)
+
+    async def fill():
+        await hdr_service.start('127.0.0.1', 0)
+        try:
+            hdr_service.queue.put_nowait('waiting')
+            with pytest.raises(service.HttpError) as error:
+                await hdr_service.submit({'images': ['a.jpg']})
+            return error.value
+        finally:
+            await hdr_service.stop()
+
+    error = run(fill())
+    assert error.status == 503
+    assert 'Retry-After' in error.headers
+
+
+def test_serve_socket(tmp_path):
+    socket = str(tmp_path / 'hdr.sock')
+    hdr_service = service.HdrService(root=str(tmp_path))
+    ready = []
+
+    async def serve():
+        task = asyncio.ensure_future(
+            service.serve(hdr_service, socket=socket, callback=ready.append)
+        )
+        while not ready:
+            await asyncio.sleep(0.01)
+
+        assert os.path.exists(socket)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    run(serve())
+    assert ready == [socket]
+    assert not os.path.exists(socket)
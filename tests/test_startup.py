@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+#
+# hdr: A Python API and CLI for creating HDR images.
+#
+# Copyright (C) 2017 Sean Marlow
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from hdr import utils
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+HEAVY_MODULES = ('cv2', 'numpy', 'PIL', 'asyncio')
+
+
+def get_heavy_imports(*args):
+    """
+    Run the CLI in a fresh interpreter and return the heavy modules it
+    loaded.
+    """
+    code = (
+        'import atexit, json, sys\n'
+        'atexit.register(lambda: sys.__stderr__.write(json.dumps(\n'
+        '    [m for m in {0!r} if m in sys.modules])))\n'
+        'from hdr.cli import main\n'
+        'main()\n'
+    ).format(HEAVY_MODULES)
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    result = subprocess.run(
+        [sys.executable, '-c', code] + list(args),
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env
+    )
+    return json.loads(result.stderr.decode('utf-8').splitlines()[-1])
+
+
+@pytest.mark.parametrize('args', [
+    ('--help',),
+    ('--version',),
+    ('drago', '--help'),
+    ('serve', '--help'),
+    ('drago', '--no-such-option')
+])
+def test_no_heavy_imports(args):
+    assert get_heavy_imports(*args) == []
+
+
+def test_heavy_imports_on_use(tmp_path):
+    # Running a command imports the pipeline as it is needed.
+    assert 'cv2' in get_heavy_imports('drago', str(tmp_path / 'missing.jpg'))
+
+
+def test_lazy_module():
+    module = utils.lazy_import('json')
+    assert module.dumps([1]) == '[1]'
+
+    with pytest.raises(AttributeError):
+        module.no_such_function
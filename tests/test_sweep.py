@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+#
+# hdr: A Python API and CLI for creating HDR images.
+#
+# Copyright (C) 2017 Sean Marlow
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+
+import cv2
+import numpy
+import pytest
+
+from hdr import sweep
+from hdr.exceptions import HdrException
+
+from conftest import EXPOSURES_OPTION, run_cli
+
+PARAMS = [('gamma', [1.0, 2.2]), ('intensity', [-1.0, 0.0, 1.0])]
+
+
+def make_radiance(value, size=1000):
+    return numpy.full(size // 4, value, numpy.float32)
+
+
+def test_radiance_cache():
+    cache = sweep.RadianceCache(max_bytes=2500)
+    first, second, third = (make_radiance(value) for value in (1, 2, 3))
+
+    cache.put('first', first)
+    cache.put('second', second)
+    assert cache.get('first') is first
+    assert not first.flags.writeable
+
+    # The least recently used map is evicted.
+    cache.put('third', third)
+    assert cache.get('second') is None
+    assert cache.get('first') is first
+    assert (cache.hits, cache.misses) == (2, 1)
+    assert (len(cache), cache.nbytes) == (2, 2000)
+
+    # Replacing a key does not count it twice.
+    cache.put('third', make_radiance(4))
+    assert cache.nbytes == 2000
+
+    # A map larger than the cache is not stored.
+    cache.put('large', make_radiance(5, 4000))
+    assert cache.get('large') is None
+
+    cache.clear()
+    assert (len(cache), cache.nbytes) == (0, 0)
+
+
+@pytest.mark.parametrize('spec, expected', [
+    ('gamma=1,2.2', ('gamma', [1.0, 2.2])),
+    ('sigma-space=1:2:0.5', ('sigma_space', [1.0, 1.5, 2.0])),
+    ('gamma=0.8:1.4:0.2', ('gamma', [0.8, 1.0, 1.2, 1.4])),
+    ('gamma=1:1.9:0.5', ('gamma', [1.0, 1.5]))
+])
+def test_parse_param(spec, expected):
+    assert sweep.parse_param(spec) == expected
+
+
+@pytest.mark.parametrize('spec', [
+    'gamma', '=1', 'gamma=a', 'gamma=1:2', 'gamma=2:1:0.5', 'gamma=1:2:0'
+])
+def test_parse_param_errors(spec):
+    with pytest.raises(HdrException):
+        sweep.parse_param(spec)
+
+
+def test_expand_grid():
+    grid = sweep.expand_grid('reinhard', PARAMS)
+    assert len(grid) == 6
+    assert grid[0] == {'gamma': 1.0, 'intensity': -1.0}
+    assert grid[-1] == {'gamma': 2.2, 'intensity': 1.0}
+    assert sweep.expand_grid('reinhard', []) == [{}]
+
+    with pytest.raises(HdrException):
+        sweep.expand_grid('unknown', [])
+
+    with pytest.raises(HdrException):
+        sweep.expand_grid('reinhard', [('bias', [1.0])])
+
+    values = [float(value) for value in range(sweep.MAX_COMBINATIONS + 1)]
+    with pytest.raises(HdrException):
+        sweep.expand_grid('reinhard', [('gamma', values)])
+
+
+@pytest.mark.parametrize('params, columns', [
+    ([], 1),
+    ([('gamma', [1.0, 2.0, 3.0, 4.0, 5.0])], 3),
+    (PARAMS, 3)
+])
+def test_get_columns(params, columns):
+    assert sweep.get_columns(params) == columns
+
+
+def test_merge_cached(bracket):
+    cache = sweep.RadianceCache()
+    radiance = sweep.merge_cached(
+        bracket, EXPOSURES_OPTION, align=False, cache=cache
+    )
+    assert radiance.shape == (96, 128, 3)
+    assert sweep.merge_cached(
+        bracket, EXPOSURES_OPTION, align=False, cache=cache
+    ) is radiance
+
+    # Other merge options or changed files merge again.
+    sweep.merge_cached(bracket, EXPOSURES_OPTION, align=False, preview=2,
+                       cache=cache)
+    os.utime(bracket[0], ns=(0, 0))
+    sweep.merge_cached(bracket, EXPOSURES_OPTION, align=False, cache=cache)
+    assert (cache.hits, cache.misses) == (1, 3)
+
+
+def test_sweep(bracket, tmp_path):
+    output_dir = str(tmp_path / 'sweep')
+    written = []
+    names = sweep.sweep(
+        [bracket], 'reinhard', PARAMS, exposures=EXPOSURES_OPTION,
+        align=False, output_dir=output_dir, thumb_width=64,
+        cache=sweep.RadianceCache(), callback=written.append
+    )
+
+    assert names == written
+    assert len(names) == 7
+    assert os.path.join(
+        output_dir, 'frame1_reinhard_gamma2.2_intensity-1.png'
+    ) in names
+
+    # Three columns of 64x48 thumbnails with a label below each.
+    sheet = cv2.imread(names[-1])
+    assert names[-1].endswith('frame1_reinhard_sweep.jpg')
+    assert sheet.shape == (2 * (48 + sweep.LABEL_HEIGHT), 3 * 64, 3)
+
+    # Renders in parallel match the serial ones.
+    parallel_dir = str(tmp_path / 'parallel')
+    parallel = sweep.sweep(
+        [bracket], 'reinhard', PARAMS, exposures=EXPOSURES_OPTION,
+        align=False, output_dir=parallel_dir, contact_sheet=False,
+        workers=3, cache=sweep.RadianceCache()
+    )
+    for serial_name, parallel_name in zip(names, parallel):
+        numpy.testing.assert_array_equal(
+            cv2.imread(serial_name), cv2.imread(parallel_name)
+        )
+
+    with pytest.raises(HdrException):
+        sweep.sweep(
+            [bracket], 'reinhard', PARAMS, images=False, contact_sheet=False
+        )
+
+
+def test_sweep_cli(bracket, tmp_path):
+    output = run_cli(
+        'sweep', '-e', EXPOSURES_OPTION, '--align', 'none', '-t', 'reinhard',
+        '-P', 'gamma=1:2:0.5', '--no-images', '-d', tmp_path, *bracket
+    )
+    sheet = str(tmp_path / 'frame1_reinhard_sweep.jpg')
+    assert output.strip() == sheet
+    assert os.path.isfile(sheet)
+
+    assert 'Invalid sweep parameter' in run_cli(
+        'sweep', '-e', EXPOSURES_OPTION, '-P', 'gamma', *bracket
+    )
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+#
+# hdr: A Python API and CLI for creating HDR images.
+#
+# Copyright (C) 2017 Sean Marlow
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import cv2
+import pytest
+
+from hdr import threads
+from hdr.exceptions import HdrException
+
+MEGAPIXEL = 1000 * 1000
+
+
+def test_get_cores(monkeypatch):
+    monkeypatch.delenv(threads.CORES_ENV, raising=False)
+    assert threads.get_cores() >= 1
+    assert threads.get_cores(3) == 3
+
+    monkeypatch.setenv(threads.CORES_ENV, '2')
+    assert threads.get_cores() == 2
+
+    for value in ('many', '0'):
+        monkeypatch.setenv(threads.CORES_ENV, value)
+        with pytest.raises(HdrException):
+            threads.get_cores()
+
+
+@pytest.mark.parametrize('jobs, pixels, workers, threads_, expected', [
+    # Small images run one job per core on a single thread.
+    (100, MEGAPIXEL, None, None, (8, 1)),
+    (100, None, None, None, (8, 1)),
+    # Larger images trade concurrent jobs for threads per job.
+    (100, 8 * MEGAPIXEL, None, None, (2, 4)),
+    (100, 50 * MEGAPIXEL, None, None, (1, 8)),
+    # Cores left over by fewer jobs go to each job.
+    (2, MEGAPIXEL, None, None, (2, 4)),
+    (0, MEGAPIXEL, None, None, (1, 8)),
+    # A given value is kept and the other fills the budget.
+    (100, MEGAPIXEL, 3, None, (3, 2)),
+    (100, MEGAPIXEL, None, 2, (4, 2)),
+    (100, MEGAPIXEL, None, 0, (8, 0)),
+    (100, MEGAPIXEL, 16, 4, (16, 4))
+])
+def test_plan_threads(jobs, pixels, workers, threads_, expected):
+    assert threads.plan_threads(
+        jobs, pixels, workers, threads_, cores=8
+    ) == expected
+
+
+def test_limit_threads():
+    previous = cv2.getNumThreads()
+    available = threads.get_threads()
+
+    with threads.limit_threads(2):
+        assert cv2.getNumThreads() == 2
+        assert threads.get_threads() == 2
+
+        with threads.limit_threads(None):
+            assert threads.get_threads() == 2
+
+    assert cv2.getNumThreads() == previous
+    assert threads.get_threads() == available
+
+    with pytest.raises(KeyError):
+        with threads.limit_threads(1):
+            raise KeyError('block')
+    assert cv2.getNumThreads() == previous
+
+
+def test_get_image_pixels(bracket, tmp_path):
+    assert threads.get_image_pixels(bracket[0]) == 128 * 96
+    assert threads.get_image_pixels(str(tmp_path / 'missing.jpg')) is None
+
+    text = tmp_path / 'notes.jpg'
+    text.write_text('not an image')
+    assert threads.get_image_pixels(str(text)) is None
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+#
+# hdr: A Python API and CLI for creating HDR images.
+#
+# Copyright (C) 2017 Sean Marlow
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import os
+
+import cv2
+import numpy
+import pytest
+
+from conftest import EXPOSURES_OPTION, make_scene, render_frames, run_cli
+from hdr import api, tiles, tonemap
+from hdr.calibration import calibrate_response
+from hdr.exceptions import HdrException
+
+OPERATORS = ('drago', 'durand', 'linear', 'mantiuk', 'reinhard')
+TILE_SIZE = 96
+
+# 16 bit output rounds to within 8e-6 of the float result.
+TOLERANCE = 1e-4
+
+# Mantiuk tiles take their low frequencies from a contrast solve on a
+# proxy of the whole image.
+MANTIUK_TOLERANCE = 0.001
+
+MAX_SEAM_ERROR = 1e-4
+
+# Tiled Mertens fusion takes the coarse pyramid levels from a fused
+# proxy.
+MERTENS_TOLERANCE = 1e-4
+
+
+@pytest.fixture(scope='module')
+def radiance(tmp_path_factory):
+    name = str(tmp_path_factory.mktemp('radiance') / 'radiance.npy')
+    numpy.save(name, make_scene(320, 240))
+    return numpy.load(name, mmap_mode='r')
+
+
+def tonemap_tiled(radiance, operator, directory):
+    output = tiles.tonemap_tiles(
+        radiance,
+        os.path.join(str(directory), '{0}.png'.format(operator)),
+        operator,
+        tile_size=TILE_SIZE,
+        encoding={'depth': 16}
+    )
+    image = cv2.imread(output, cv2.IMREAD_UNCHANGED)
+    return image.astype(numpy.float32) / 65535
+
+
+def get_regions(radiance):
+    height, width = radiance.shape[:2]
+    return [
+        target for _, _, target in tiles.iter_tiles(height, width, TILE_SIZE)
+    ]
+
+
+def test_iter_tiles():
+    count = numpy.zeros((100, 130), numpy.uint8)
+    for outer, core, target in tiles.iter_tiles(100, 130, 32, halo=5):
+        count[target] += 1
+        assert outer[0].start <= target[0].start
+        assert outer[0].start + core[0].start == target[0].start
+        assert outer[1].start + core[1].stop == target[1].stop
+
+    assert (count == 1).all()
+
+
+@pytest.mark.parametrize('operator', OPERATORS)
+def test_tiles_opencv(radiance, tmp_path, operator):
+    try:
+        reference = api.create_tonemap(operator).process(
+            numpy.array(radiance)
+        )
+    except (AttributeError, cv2.error) as error:
+        pytest.skip('OpenCV has no {0} tonemap: {1}'.format(operator, error))
+
+    result = tonemap_tiled(radiance, operator, tmp_path)
+    reference = numpy.clip(reference, 0, 1)
+
+    # OpenCV leaves NaN where a pixel's luminance underflows.
+    finite = numpy.isfinite(reference)
+    tolerance = MANTIUK_TOLERANCE if operator == 'mantiuk' else TOLERANCE
+    assert finite.mean() > 0.999
+    assert numpy.abs(result - reference)[finite].max() < tolerance
+    assert tonemap.get_seam_error(
+        result, numpy.nan_to_num(reference), get_regions(radiance)
+    ) < MAX_SEAM_ERROR
+
+
+@pytest.mark.parametrize('operator', OPERATORS)
+def test_tiles_seams(radiance, tmp_path, operator):
+    result = tonemap_tiled(radiance, operator, tmp_path)
+    reference = numpy.clip(
+        tonemap.tonemap(operator, numpy.array(radiance)), 0, 1
+    )
+
+    tolerance = MANTIUK_TOLERANCE if operator == 'mantiuk' else TOLERANCE
+    assert numpy.abs(result - reference).max() < tolerance
+    assert tonemap.get_seam_error(
+        result, reference, get_regions(radiance)
+    ) < MAX_SEAM_ERROR
+
+
+@pytest.mark.parametrize('algo', ['debevec', 'robertson'])
+def test_merge_tiles(bracket, tmp_path, algo):
+    images = api.read_images(bracket)
+    times = api.get_exposures(EXPOSURES_OPTION, bracket)
+    response = calibrate_response(images, times, algo)
+    reference = getattr(api, 'process_' + algo)(images, times, response)
+
+    radiance = tiles.merge_tiles(
+        bracket, str(tmp_path / 'radiance.npy'), algo, EXPOSURES_OPTION,
+        response, tile_size=40, align=False
+    )
+
+    # The merge is per pixel, so tiles match exactly.
+    numpy.testing.assert_array_equal(radiance, reference)
+
+
+def test_merge_tiles_mertens(tmp_path):
+    # Larger than the halo, so tiles do not cover the whole image.
+    names = []
+    for index, frame in enumerate(render_frames(make_scene(320, 240))):
+        names.append(str(tmp_path / 'frame{0}.png'.format(index)))
+        cv2.imwrite(names[-1], frame)
+
+    reference = api.process_mertens(api.read_images(names), 1.0, 1.0, 0.0)
+    radiance = tiles.merge_tiles(
+        names, str(tmp_path / 'fused.npy'), 'mertens', tile_size=64,
+        align=False
+    )
+    assert numpy.abs(radiance - reference).max() < MERTENS_TOLERANCE
+
+
+def test_merge_tiles_errors(bracket, tmp_path):
+    with pytest.raises(HdrException):
+        tiles.merge_tiles(bracket, str(tmp_path / 'a.npy'), 'unknown')
+
+    small = str(tmp_path / 'small.png')
+    cv2.imwrite(small, numpy.zeros((10, 10, 3), numpy.uint8))
+    with pytest.raises(HdrException, match='same size'):
+        tiles.merge_tiles(
+            bracket + [small], str(tmp_path / 'a.npy'), 'mertens'
+        )
+
+
+def test_tiled_cli(bracket, tmp_path):
+    output = str(tmp_path / 'tiled.png')
+    saved = str(tmp_path / 'radiance.npy')
+    run_cli(
+        'tiled', '-e', EXPOSURES_OPTION, '-t', 'reinhard', '--tile-size', 48,
+        '--save-radiance', saved, '-p', 2, '--full', '-o', output, *bracket
+    )
+
+    assert cv2.imread(output).shape == (96, 128, 3)
+    assert cv2.imread(
+        str(tmp_path / 'tiled_preview.png')
+    ).shape == (48, 64, 3)
+    assert numpy.load(saved).shape == (96, 128, 3)
+
+    # A saved radiance map is tonemapped without merging again.
+    from_saved = str(tmp_path / 'from_saved.png')
+    run_cli('tiled', '-t', 'reinhard', '-m', 1, '-o', from_saved, saved)
+    numpy.testing.assert_array_equal(
+        cv2.imread(from_saved), cv2.imread(output)
+    )
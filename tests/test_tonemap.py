@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+#
+# hdr: A Python API and CLI for creating HDR images.
+#
+# Copyright (C) 2017 Sean Marlow
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import cv2
+import numpy
+import pytest
+
+from conftest import make_scene
+from hdr import api, tonemap
+from hdr.exceptions import HdrException
+
+TILE_SIZE = 128
+
+# hdr.tonemap filters the durand base layer with cv2.bilateralFilter,
+# which builds its range table from the values of each call, so tiles
+# differ from a single pass of tonemap.tonemap by float rounding.
+DURAND_TOLERANCE = 1e-5
+
+# Maximum difference from the OpenCV operator in [0, 1] output units,
+# mostly from the mantiuk proxy solve.
+OPENCV_TOLERANCE = 0.005
+
+# Mean extra step error across mantiuk seams, as in
+# benchmarks/tonemap_parallel.py.
+MAX_SEAM_ERROR = 0.001
+
+
+def get_regions(height, width):
+    return [
+        target for _, _, target, _ in tonemap.get_blend_tiles(
+            height, width, TILE_SIZE
+        )
+    ]
+
+
+def opencv_tonemap(operator, radiance):
+    """
+    Tonemap with the OpenCV operator, skipping the test if this build
+    of OpenCV lacks it.
+    """
+    try:
+        tonemap_object = api.create_tonemap(operator)
+    except (AttributeError, cv2.error) as error:
+        pytest.skip('OpenCV has no {0} tonemap: {1}'.format(operator, error))
+
+    return tonemap_object.process(radiance.copy())
+
+
+@pytest.fixture(scope='module')
+def radiance():
+    # Large enough for mantiuk to solve on a downscaled proxy.
+    return make_scene(640, 480)
+
+
+def test_durand_parallel(radiance):
+    reference = tonemap.tonemap('durand', radiance)
+    result = tonemap.tonemap_parallel('durand', radiance, 2, TILE_SIZE)
+
+    assert result.shape == reference.shape
+    assert numpy.abs(result - reference).max() < DURAND_TOLERANCE
+
+
+def test_mantiuk_parallel_seams(radiance):
+    reference = tonemap.tonemap('mantiuk', radiance)
+    result = tonemap.tonemap_parallel('mantiuk', radiance, 2, TILE_SIZE)
+
+    assert result.shape == reference.shape
+    assert tonemap.get_seam_error(
+        result, reference, get_regions(*radiance.shape[:2])
+    ) < MAX_SEAM_ERROR
+
+
+@pytest.mark.parametrize('operator', tonemap.PARALLEL_TONEMAPS)
+def test_parallel_opencv(radiance, operator):
+    reference = opencv_tonemap(operator, radiance)
+    result = tonemap.tonemap_parallel(operator, radiance, 2, TILE_SIZE)
+
+    # OpenCV leaves NaN where a pixel's luminance underflows.
+    finite = numpy.isfinite(reference)
+    assert finite.mean() > 0.999
+    assert numpy.abs(result - reference)[finite].max() < OPENCV_TOLERANCE
+    assert tonemap.get_seam_error(
+        result, numpy.nan_to_num(reference), get_regions(*radiance.shape[:2])
+    ) < MAX_SEAM_ERROR
+
+
+@pytest.mark.parametrize('operator', tonemap.PARALLEL_TONEMAPS)
+def test_parallel_workers(radiance, operator):
+    # The tiles depend on the tile size only, not on the worker count.
+    single = tonemap.tonemap_parallel(operator, radiance, 1, TILE_SIZE)
+    result = tonemap.tonemap_parallel(operator, radiance, 3, TILE_SIZE)
+
+    assert numpy.array_equal(single, result)
+
+
+def test_parallel_unsupported(radiance):
+    with pytest.raises(HdrException):
+        tonemap.tonemap_parallel('drago', radiance)
+
+
+def test_seam_error():
+    reference = numpy.zeros((256, 256), numpy.float32)
+    result = reference.copy()
+    regions = get_regions(256, 256)
+    assert tonemap.get_seam_error(result, reference, regions) == 0
+
+    result[TILE_SIZE:] += 0.1
+    assert tonemap.get_seam_error(result, reference, regions) > 0.01
+    assert tonemap.get_seam_error(
+        result, reference, [(slice(0, 256), slice(0, 256))]
+    ) == 0